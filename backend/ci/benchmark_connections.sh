@@ -0,0 +1,4 @@
+#!/usr/bin/env sh
+
+. .venv/bin/activate
+python -m s2_analyzer_backend.benchmarks.connection_scaling "$@"
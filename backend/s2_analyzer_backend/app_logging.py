@@ -1,8 +1,138 @@
+import atexit
+import json
+import logging
 import logging.config
-from typing import Dict
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+# Logger for the logs written for every single message. These are rate limited so that they cannot slow down the
+# message processing when enabled.
+MESSAGES_LOGGER_NAME = "s2_analyzer_backend.messages"
+
+# Attributes of every LogRecord. All other attributes are extra fields given by the caller.
+_RECORD_ATTRIBUTES = set(
+    logging.LogRecord("", 0, "", 0, "", None, None).__dict__
+) | {"message", "asctime", "suppressed"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single line JSON object, including the extra fields given by the caller."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The default formatter, mentioning how many records of the same statement were suppressed by rate limiting."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        result = super().format(record)
+        if getattr(record, "suppressed", 0):
+            result += f" ({record.suppressed} similar messages suppressed)"
+        return result
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `per_second` records per log statement through, with bursts of up to `burst` records.
+    Errors are never suppressed. The number of suppressed records is added to the next record of the
+    statement which passes as `suppressed`.
+    """
+
+    def __init__(self, per_second: float = 10.0, burst: Optional[int] = None) -> None:
+        super().__init__()
+        self.per_second = per_second
+        self.burst = burst if burst is not None else max(1, int(per_second))
+        # (logger name, line number) -> (tokens, last update, suppressed count)
+        self._buckets: dict[tuple[str, int], tuple[float, float, int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR or self.per_second <= 0:
+            return True
+
+        key = (record.name, record.lineno)
+        now = time.monotonic()
+        tokens, updated, suppressed = self._buckets.get(key, (self.burst, now, 0))
+        tokens = min(self.burst, tokens + (now - updated) * self.per_second)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now, suppressed + 1)
+            return False
+
+        record.suppressed = suppressed
+        self._buckets[key] = (tokens - 1, now, 0)
+        return True
+
+
+class QueueStreamHandler(logging.handlers.QueueHandler):
+    """
+    Hands the records to a background thread which formats and writes them to the stream. Logging never blocks the
+    calling thread on I/O, e.g. a slow stdout pipe.
+
+    Unlike the QueueHandler, the message is also formatted in the background thread. Log arguments must therefore
+    not be changed after the log call; pass immutable values like ids and strings instead of objects.
+    """
+
+    def __init__(self, stream=None, formatter: Optional[logging.Formatter] = None):
+        super().__init__(queue.SimpleQueue())
+        stream_handler = logging.StreamHandler(stream)
+        if formatter is not None:
+            stream_handler.setFormatter(formatter)
+        self.listener = logging.handlers.QueueListener(
+            self.queue, stream_handler, respect_handler_level=True
+        )
+        self.listener.start()
+        self._stop_lock = threading.Lock()
+        atexit.register(self.stop_listener)
+
+    def setFormatter(self, fmt: Optional[logging.Formatter]) -> None:
+        # dictConfig sets the formatter on this handler; it is used by the stream handler in the background thread.
+        for handler in self.listener.handlers:
+            handler.setFormatter(fmt)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def stop_listener(self) -> None:
+        """Writes the queued records and stops the background thread."""
+        with self._stop_lock:
+            if self.listener._thread is not None:
+                self.listener.stop()
+
+    def close(self) -> None:
+        self.stop_listener()
+        super().close()
 
 
 def get_log_config() -> Dict:
+    """
+    Log configuration of the backend, tuned by the environment:
+        LOG_LEVEL: DEBUG, INFO, WARNING (default) or ERROR.
+        LOG_FORMAT: text (default) or json. JSON writes one object per line, including the extra fields.
+        LOG_MESSAGES_PER_SECOND: Maximum number of per-message logs per log statement per second. 0 disables the
+            limit. Defaults to 10.
+    """
+    level = os.getenv("LOG_LEVEL", "WARNING").upper()
+    log_format = os.getenv("LOG_FORMAT", "text").lower()
+    messages_per_second = float(os.getenv("LOG_MESSAGES_PER_SECOND", "10"))
+
     config = {
         "version": 1,
         "disable_existing_loggers": False,
@@ -12,20 +142,30 @@ def get_log_config() -> Dict:
                 "fmt": "%(asctime)s - %(name)s:%(lineno)d - %(levelname)s - %(message)s",
             },
             "short": {
-                "()": "logging.Formatter",
+                "()": "s2_analyzer_backend.app_logging.TextFormatter",
                 "fmt": "%(name)s:%(lineno)d - %(levelname)s - %(message)s",
             },
+            "json": {
+                "()": "s2_analyzer_backend.app_logging.JsonFormatter",
+            },
+        },
+        "filters": {
+            "message_rate_limit": {
+                "()": "s2_analyzer_backend.app_logging.RateLimitFilter",
+                "per_second": messages_per_second,
+            },
         },
         "handlers": {
             "console": {
-                "class": "logging.StreamHandler",
-                "formatter": "short",
+                "()": "s2_analyzer_backend.app_logging.QueueStreamHandler",
+                "formatter": "json" if log_format == "json" else "short",
                 "stream": "ext://sys.stdout",
             },
         },
         "loggers": {
-            "": {"handlers": ["console"], "level": "WARNING", "propagate": False},
+            "": {"handlers": ["console"], "level": level, "propagate": False},
+            MESSAGES_LOGGER_NAME: {"filters": ["message_rate_limit"]},
         },
     }
-  
+
     return config
@@ -1,7 +1,9 @@
 import abc
 import asyncio
+from dataclasses import dataclass, field
+import itertools
 import logging
-import threading
+import time
 import traceback
 
 LOGGER = logging.getLogger(__name__)
@@ -13,14 +15,23 @@ class AsyncApplicationNotStoppedException(Exception):
 
 
 class AsyncApplication(abc.ABC):
+    # Applications are stopped in ascending shutdown phase during shutdown. Applications in the same phase are
+    # stopped concurrently. Use a later phase for applications that process work produced by other applications.
+    SHUTDOWN_PHASE = 0
+    # The backend reports ready once all applications which are required for readiness are ready.
+    REQUIRED_FOR_READINESS = False
+
     _main_task: "None | asyncio.Task"
     _loop: "None | asyncio.AbstractEventLoop"
     _running: bool
+    # The unique name under which the application is registered in AsyncApplications.
+    application_name: "None | ApplicationName"
 
     def __init__(self):
         self._main_task = None
         self._loop = None
         self._running = False
+        self.application_name = None
 
     @abc.abstractmethod
     async def main_task(self, loop: asyncio.AbstractEventLoop) -> None:
@@ -37,6 +48,16 @@ class AsyncApplication(abc.ABC):
     def get_main_task(self) -> asyncio.Task:
         return self._main_task
 
+    def is_ready(self) -> bool:
+        """Whether the application is able to do its work, e.g. serve requests."""
+        return self._running
+
+    async def drain(self, timeout: float) -> "None | dict":
+        """Called during shutdown before the application is stopped, to finish or persist the pending work within
+        the timeout. Returns a report of what was flushed and what was dropped, if the application has pending work.
+        """
+        return None
+
     async def execute_main_task(self, loop: asyncio.AbstractEventLoop):
         self._loop = loop
         self._running = True
@@ -53,6 +74,8 @@ class AsyncApplication(abc.ABC):
             LOGGER.error(
                 "".join(traceback.format_exception(None, exc, exc.__traceback__))
             )
+        finally:
+            self._running = False
 
     def create_and_schedule_main_task(
         self, loop: asyncio.AbstractEventLoop
@@ -61,45 +84,11 @@ class AsyncApplication(abc.ABC):
         return self._main_task
 
     def notify_to_stop_asap(self) -> None:
+        """Requests the application to stop. May be called from any thread."""
         LOGGER.debug("Notifying %s to stop", self.get_name())
         self._running = False
         self._loop.call_soon_threadsafe(self.stop)
 
-    def wait_till_done_sync(
-        self,
-        timeout: "None | float",
-        kill_after_timeout: bool = False,
-        raise_on_timeout: bool = False,
-    ) -> None:
-        """Stop the application in the eventloop.
-
-        Must be run from another thread than the asynchronuous thread as it contains blocking waits.
-
-        :param timeout: If a timeout is given, the application is shutdown after the timeout ends.
-        :param kill_after_timeout:
-        :param raise_on_timeout:
-        """
-        event = threading.Event()
-
-        def is_stopped_callback(*args, **kwargs):
-            event.set()
-
-        if self._main_task:
-            self._main_task.add_done_callback(is_stopped_callback)
-
-        if not event.wait(timeout=timeout):
-            if kill_after_timeout:
-                LOGGER.warning(
-                    "Application %s did not shutdown gracefully within the timeout period and was killed.",
-                    self.get_name(),
-                )
-                self._main_task.cancel()
-
-            if raise_on_timeout:
-                raise AsyncApplicationNotStoppedException(
-                    f"{self.get_name()} did not stop."
-                )
-
     async def wait_till_done_async(
         self,
         timeout: "None | float",
@@ -124,65 +113,292 @@ class AsyncApplication(abc.ABC):
                 )
 
 
+@dataclass
+class ShutdownReport:
+    """Result of stopping all applications."""
+
+    duration: float = 0.0
+    stopped_applications: int = 0
+    killed_applications: int = 0
+    # Drain reports by application name.
+    drained: dict[ApplicationName, dict] = field(default_factory=dict)
+
+
+@dataclass
+class LifecycleMetrics:
+    """Counters of the application stops performed by AsyncApplications."""
+
+    stops: int = 0
+    killed: int = 0
+    total_stop_latency: float = 0.0
+    max_stop_latency: float = 0.0
+    # Main tasks of stopped applications which did not finish even after being killed.
+    leaked_tasks: "set[asyncio.Task]" = field(default_factory=set)
+
+    def record_stop(self, latency: float, killed: bool) -> None:
+        self.stops += 1
+        self.killed += int(killed)
+        self.total_stop_latency += latency
+        self.max_stop_latency = max(self.max_stop_latency, latency)
+
+
 class AsyncApplications:
     STOP_TIMEOUT = 20.0  # seconds
+    KILL_GRACE_PERIOD = 1.0  # seconds
+    MAX_CONCURRENT_STOPS = 100
 
     loop: asyncio.AbstractEventLoop
-    applications: dict[str, AsyncApplication]
+    applications: dict[ApplicationName, AsyncApplication]
+    metrics: LifecycleMetrics
+    # Seconds within which all applications must be stopped on shutdown.
+    shutdown_timeout: float = STOP_TIMEOUT
+    READINESS_POLL_INTERVAL = 0.01  # seconds
 
     def __init__(self) -> None:
+        self.created_at = time.monotonic()
+        # Seconds from the creation of the applications until the backend was ready for the first time.
+        self.startup_duration: "None | float" = None
         self.loop = asyncio.new_event_loop()
         self.applications = {}
+        self.metrics = LifecycleMetrics()
+        self._name_sequence = itertools.count(2)
+        self._stop_semaphore = asyncio.Semaphore(AsyncApplications.MAX_CONCURRENT_STOPS)
+        self._stopping = False
+
+    def use_event_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Replaces the event loop of the applications. Must be called before any application is started."""
+        if self.applications:
+            raise RuntimeError(
+                "Cannot replace the event loop while applications are running."
+            )
+        self.loop.close()
+        self.loop = loop
 
-    def add_and_start_application(self, application: AsyncApplication) -> None:
-        self.applications[application.get_name()] = application
-        application.create_and_schedule_main_task(self.loop)
+    def _unique_name(self, name: ApplicationName) -> ApplicationName:
+        """Applications may share a name, e.g. when a device reconnects before its old connection is cleaned up.
+        Those get a sequence number so that they never replace each other in the index.
+        """
+        unique_name = name
+        while unique_name in self.applications:
+            unique_name = f"{name} #{next(self._name_sequence)}"
+        return unique_name
 
-    def stop_and_remove_application(self, application: AsyncApplication):
-        """Stop the application in the eventloop.
+    def add_and_start_application(self, application: AsyncApplication) -> None:
+        name = self._unique_name(application.get_name())
+        application.application_name = name
+        self.applications[name] = application
+        main_task = application.create_and_schedule_main_task(self.loop)
+        # Remove the application as soon as it is done, however it was stopped.
+        main_task.add_done_callback(lambda _: self._remove_application(application))
+
+    def _remove_application(self, application: AsyncApplication) -> None:
+        name = application.application_name
+        if self.applications.get(name) is application:
+            del self.applications[name]
 
-        Must be run from another thread than the asynchronuous thread as it contains blocking waits.
+    async def stop_application(
+        self,
+        application: AsyncApplication,
+        timeout: float = STOP_TIMEOUT,
+        deadline: "None | float" = None,
+    ) -> bool:
+        """Stops the application and waits until it is done. Kills the application if it does not stop within the
+        timeout. At most MAX_CONCURRENT_STOPS applications are stopped at the same time.
+
+        Must be awaited in the event loop of the applications.
+
+        Args:
+            application (AsyncApplication): The application to stop.
+            timeout (float): Seconds the application gets to stop before it is killed.
+            deadline (float, optional): Loop time before which the application must be stopped. Overrides the
+                timeout, so that time spent waiting for a stop slot counts as well.
+
+        Returns:
+            bool: True if the application had to be killed.
         """
-        name = application.get_name()
-        application.notify_to_stop_asap()
+        async with self._stop_semaphore:
+            try:
+                return await self._stop_application(application, timeout, deadline)
+            finally:
+                # Also when stopping failed, otherwise stop_all keeps trying to stop the application.
+                self._remove_application(application)
+
+    async def _stop_application(
+        self,
+        application: AsyncApplication,
+        timeout: float,
+        deadline: "None | float",
+    ) -> bool:
+        main_task = application.get_main_task()
+        if main_task is None or main_task.done():
+            return False
+
+        if deadline is not None:
+            timeout = max(0.0, deadline - self.loop.time())
+
+        start = time.perf_counter()
         LOGGER.debug(
             "Waiting for %s to stop within %s seconds",
-            name,
-            AsyncApplications.STOP_TIMEOUT,
+            application.application_name,
+            timeout,
         )
-        application.wait_till_done_sync(
-            timeout=AsyncApplications.STOP_TIMEOUT,
-            kill_after_timeout=True,
-            raise_on_timeout=False,
+        application._running = False
+        try:
+            application.stop()
+        except Exception:
+            LOGGER.exception(
+                "Application %s failed to stop.", application.application_name
+            )
+
+        _, pending = await asyncio.wait([main_task], timeout=timeout)
+        killed = bool(pending)
+        if killed:
+            LOGGER.warning(
+                "Application %s did not shutdown gracefully within the timeout period and was killed.",
+                application.application_name,
+            )
+            main_task.cancel()
+            _, pending = await asyncio.wait(
+                [main_task], timeout=AsyncApplications.KILL_GRACE_PERIOD
+            )
+            if pending:
+                LOGGER.error(
+                    "Application %s did not finish after being killed.",
+                    application.application_name,
+                )
+                self.metrics.leaked_tasks.add(main_task)
+                main_task.add_done_callback(self.metrics.leaked_tasks.discard)
+
+        self.metrics.record_stop(time.perf_counter() - start, killed)
+        return killed
+
+    def stop_and_remove_application(
+        self, application: AsyncApplication
+    ) -> "asyncio.Future[None]":
+        """Schedules stopping the application in the event loop. May be called from any thread.
+
+        Returns a future which is done once the application is stopped.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self.stop_application(application), self.loop
         )
 
-        if name in self.applications:
-            del self.applications[name]
+    def get_metrics(self) -> dict:
+        return {
+            "running_applications": len(self.applications),
+            "stops": self.metrics.stops,
+            "killed": self.metrics.killed,
+            "average_stop_latency": (
+                self.metrics.total_stop_latency / self.metrics.stops
+                if self.metrics.stops
+                else 0.0
+            ),
+            "max_stop_latency": self.metrics.max_stop_latency,
+            "leaked_tasks": len(self.metrics.leaked_tasks),
+            "loop_tasks": len(asyncio.all_tasks(self.loop)),
+        }
+
+    def readiness(self) -> dict:
+        """Reports whether all applications required for readiness are running and ready to do their work."""
+        required = {
+            name: application.is_ready()
+            for name, application in self.applications.items()
+            if application.REQUIRED_FOR_READINESS
+        }
+        return {
+            "ready": bool(required) and all(required.values()) and not self._stopping,
+            "applications": required,
+            "startup_duration": self.startup_duration,
+        }
+
+    async def _record_startup_duration(self) -> None:
+        while not self.readiness()["ready"]:
+            await asyncio.sleep(AsyncApplications.READINESS_POLL_INTERVAL)
+        self.startup_duration = time.monotonic() - self.created_at
+        LOGGER.info("Ready after %.3f seconds.", self.startup_duration)
 
     def run_all(self):
         asyncio.set_event_loop(self.loop)
+        startup_task = self.loop.create_task(self._record_startup_duration())
         try:
             LOGGER.debug("Starting eventloop %s in async applications.", {self.loop})
             self.loop.run_forever()
         finally:
+            startup_task.cancel()
             LOGGER.debug("Closing eventloop %s in async applications.", self.loop)
             self.loop.close()
         asyncio.set_event_loop(None)
 
-    def stop(self):
-        """Stop all applications in the eventloop.
+    async def stop_all(self, timeout: "None | float" = None) -> ShutdownReport:
+        """Stops all applications within a single global timeout and then stops the event loop.
 
-        Must be run from another thread than the asynchronuous thread as it contains blocking waits.
+        The applications are stopped per shutdown phase. Within a phase they are drained and stopped concurrently.
+        Applications which are still running at the deadline are killed.
         """
-        while (
-            self.applications
-        ):  # Use a while as one application may stop another which updates this list
-            application = list(self.applications.values())[0]
-            self.stop_and_remove_application(application)
-
-        LOGGER.info("Stopped all applications")
-        self.loop.call_soon_threadsafe(self.loop.stop)
-        LOGGER.info("Stopped eventloop")
+        if timeout is None:
+            timeout = self.shutdown_timeout
+        start = self.loop.time()
+        deadline = start + timeout
+        report = ShutdownReport()
+
+        async def drain_and_stop(application: AsyncApplication) -> None:
+            try:
+                drain_report = await application.drain(
+                    max(0.0, deadline - self.loop.time())
+                )
+            except Exception:
+                LOGGER.exception(
+                    "Application %s failed to drain.", application.application_name
+                )
+                drain_report = {"error": "drain failed"}
+            if drain_report is not None:
+                report.drained[application.application_name] = drain_report
+            killed = await self.stop_application(application, deadline=deadline)
+            report.stopped_applications += 1
+            report.killed_applications += int(killed)
+
+        try:
+            # Use a while as one application may start another while stopping.
+            while self.applications:
+                first_phase = min(
+                    app.SHUTDOWN_PHASE for app in self.applications.values()
+                )
+                results = await asyncio.gather(
+                    *(
+                        drain_and_stop(application)
+                        for application in list(self.applications.values())
+                        if application.SHUTDOWN_PHASE == first_phase
+                    ),
+                    return_exceptions=True,
+                )
+                for result in results:
+                    if isinstance(result, BaseException):
+                        LOGGER.error("Failed to stop an application.", exc_info=result)
+
+            report.duration = self.loop.time() - start
+            LOGGER.info(
+                "Stopped all %s applications in %.2f seconds (%s killed). Drained: %s",
+                report.stopped_applications,
+                report.duration,
+                report.killed_applications,
+                report.drained,
+            )
+        finally:
+            self.loop.stop()
+            LOGGER.info("Stopped eventloop")
+        return report
+
+    def stop(self):
+        """Stop all applications in the eventloop. May be called from any thread, e.g. from a signal handler."""
+        if self._stopping:
+            LOGGER.info("Already stopping.")
+            return
+        self._stopping = True
+
+        def schedule_stop_all():
+            self.loop.create_task(self.stop_all())
+
+        self.loop.call_soon_threadsafe(schedule_stop_all)
 
 
 APPLICATIONS = AsyncApplications()
@@ -0,0 +1,160 @@
+"""
+Benchmark of the S2 connection lifecycle with many concurrent CEM/RM sessions.
+
+Connects a number of CEM/RM pairs over in-memory connection adapters, routes a message across every pair and
+disconnects them all again. Reports the memory per connection and the connect, routing and disconnect throughput,
+and checks that every connection was cleaned up.
+
+Usage: python -m s2_analyzer_backend.benchmarks.connection_scaling --pairs 5000
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import time
+import tracemalloc
+
+from s2_analyzer_backend.async_application import APPLICATIONS
+from s2_analyzer_backend.device_connection.connection import S2Connection
+from s2_analyzer_backend.device_connection.connection_adapter import (
+    ConnectionAdapter,
+    ConnectionClosed,
+)
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+from s2_analyzer_backend.device_connection.router import MessageRouter
+from s2_analyzer_backend.message_processor.message_processor import (
+    MessageProcessorHandler,
+)
+
+
+class InMemoryConnectionAdapter(ConnectionAdapter[str]):
+    """Connection adapter without a socket. Messages are fed through `feed` and counted on `send`."""
+
+    def __init__(self) -> None:
+        self._incoming: "asyncio.Queue[str | None]" = asyncio.Queue()
+        self._open = True
+        self.sent = 0
+
+    def feed(self, message: "str | None") -> None:
+        """Makes `receive` return the message. None closes the connection from the remote side."""
+        self._incoming.put_nowait(message)
+
+    async def receive(self) -> str:
+        message = await self._incoming.get()
+        if message is None:
+            self._open = False
+            raise ConnectionClosed("Closed by remote.")
+        return message
+
+    async def send(self, message: str):
+        if not self._open:
+            raise ConnectionClosed("Closed.")
+        self.sent += 1
+
+    @property
+    def open(self) -> bool:
+        return self._open
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self._open = False
+
+
+async def wait_until(condition, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("Condition not reached within the timeout.")
+        await asyncio.sleep(0.01)
+
+
+async def run_benchmark(pairs: int, timeout: float) -> dict:
+    msg_processor_handler = MessageProcessorHandler()
+    APPLICATIONS.add_and_start_application(msg_processor_handler)
+    msg_router = MessageRouter(msg_processor_handler)
+    applications_before = len(APPLICATIONS.applications)
+
+    # The adapters stand in for the websockets, so they are created before measuring the memory.
+    adapters = [
+        (InMemoryConnectionAdapter(), InMemoryConnectionAdapter()) for _ in range(pairs)
+    ]
+
+    gc.collect()
+    tracemalloc.start()
+    memory_before, _ = tracemalloc.get_traced_memory()
+
+    start = time.perf_counter()
+    for i, (cem_adapter, rm_adapter) in enumerate(adapters):
+        for adapter, origin_type, origin_id, dest_id in (
+            (cem_adapter, S2OriginType.CEM, f"cem{i}", f"rm{i}"),
+            (rm_adapter, S2OriginType.RM, f"rm{i}", f"cem{i}"),
+        ):
+            connection = S2Connection(
+                adapter, origin_id, dest_id, origin_type, msg_router
+            )
+            APPLICATIONS.add_and_start_application(connection)
+            await msg_router.receive_new_connection(connection)
+    # Let every connection start its tasks.
+    await asyncio.sleep(0)
+    connect_duration = time.perf_counter() - start
+
+    gc.collect()
+    memory_after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    message = json.dumps(
+        {"message_type": "FRBC.StorageStatus", "present_fill_level": 0}
+    )
+    for cem_adapter, _ in adapters:
+        cem_adapter.feed(message)
+    await wait_until(lambda: all(rm.sent == 1 for _, rm in adapters), timeout)
+    routing_duration = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for cem_adapter, rm_adapter in adapters:
+        cem_adapter.feed(None)
+        rm_adapter.feed(None)
+    await wait_until(
+        lambda: len(msg_router.connections) == 0
+        and len(APPLICATIONS.applications) == applications_before,
+        timeout,
+    )
+    disconnect_duration = time.perf_counter() - start
+
+    msg_processor_handler.stop()
+    await asyncio.sleep(0)
+
+    connections = pairs * 2
+    return {
+        "connections": connections,
+        "memory_per_connection_bytes": round(
+            (memory_after - memory_before) / connections
+        ),
+        "connects_per_second": round(connections / connect_duration),
+        "routed_messages_per_second": round(pairs / routing_duration),
+        "disconnects_per_second": round(connections / disconnect_duration),
+        "leftover_connections": len(msg_router.connections),
+        "leftover_tasks": len(asyncio.all_tasks()) - 1,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--pairs", type=int, default=5000, help="Number of CEM/RM pairs."
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=120.0, help="Timeout in seconds per phase."
+    )
+    args = parser.parse_args()
+
+    result = APPLICATIONS.loop.run_until_complete(
+        run_benchmark(args.pairs, args.timeout)
+    )
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark of the import time and the startup time of the backend.
+
+Starts the backend a number of times in a fresh process on a temporary port and database, measures the time until the
+readiness endpoint reports ready and the time the process needs to exit on SIGTERM. Also measures the import time of
+the heavy subsystems and reports the slowest imported modules.
+
+Usage: python -m s2_analyzer_backend.benchmarks.startup --runs 5
+"""
+
+import argparse
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+SUBSYSTEMS = [
+    "s2_analyzer_backend.main",
+    "s2_analyzer_backend.message_processor.database",
+    "s2_analyzer_backend.message_processor.message_processor",
+    "s2_analyzer_backend.rest_apis.rest_api",
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import_times(top: int) -> tuple[float, list[tuple[str, float]]]:
+    """Imports all subsystems in a fresh process with -X importtime.
+
+    Returns:
+        The total import time and the `top` slowest modules with their cumulative import time, in seconds.
+    """
+    statement = "; ".join(f"import {module}" for module in SUBSYSTEMS)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    duration = time.perf_counter() - start
+
+    modules = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        modules.append((name.strip(), int(cumulative) / 1e6))
+    modules.sort(key=lambda module: module[1], reverse=True)
+    return duration, modules[:top]
+
+
+def measure_startup(directory: str, timeout: float) -> tuple[float, float]:
+    """Starts the backend and waits until it is ready, then stops it.
+
+    Returns:
+        Seconds until ready and seconds until the process exited after SIGTERM.
+    """
+    port = _free_port()
+    config_path = os.path.join(directory, "config.yaml")
+    with open(config_path, "w", encoding="utf-8") as config_file:
+        config_file.write(f"http_listen_address: 127.0.0.1\nhttp_port: {port}\n")
+    database_path = os.path.join(directory, f"database-{port}.db")
+    env = dict(
+        os.environ,
+        S2_ANALYZER_CONF=config_path,
+        DATABASE_URL=f"sqlite:///{database_path}",
+    )
+
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "s2_analyzer_backend.main"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if time.perf_counter() - start > timeout:
+                raise TimeoutError(f"Backend was not ready within {timeout} seconds")
+            if process.poll() is not None:
+                raise RuntimeError(f"Backend exited with code {process.returncode}")
+            try:
+                with urllib.request.urlopen(
+                    f"http://127.0.0.1:{port}/backend/ready/", timeout=1
+                ):
+                    break
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        ready = time.perf_counter() - start
+
+        stop_start = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout)
+        return ready, time.perf_counter() - stop_start
+    finally:
+        if process.poll() is None:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Number of startups.")
+    parser.add_argument(
+        "--top", type=int, default=10, help="Number of slowest imports to list."
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=60.0, help="Timeout in seconds per startup."
+    )
+    args = parser.parse_args()
+
+    import_duration, slowest_imports = measure_import_times(args.top)
+
+    ready_durations = []
+    stop_durations = []
+    with tempfile.TemporaryDirectory() as directory:
+        for _ in range(args.runs):
+            ready, stop = measure_startup(directory, args.timeout)
+            ready_durations.append(ready)
+            stop_durations.append(stop)
+
+    print(f"import_seconds: {import_duration:.3f}")
+    print(f"ready_seconds_median: {statistics.median(ready_durations):.3f}")
+    print(f"ready_seconds_max: {max(ready_durations):.3f}")
+    print(f"stop_seconds_median: {statistics.median(stop_durations):.3f}")
+    print("slowest_imports:")
+    for name, cumulative in slowest_imports:
+        print(f"  {name}: {cumulative:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional
 from dataclass_wizard import YAMLWizard
 from s2_analyzer_backend.device_connection.origin_type import S2OriginType
 
@@ -13,10 +14,224 @@ class ModelConfig:
     model_id: str
 
 
+@dataclass
+class WebsocketConfig:
+    """Tuning of the websocket senders towards debugger frontends."""
+
+    # Maximum number of queued messages combined into a single batched frame.
+    # A value of 1 disables batching for all frontends.
+    max_batch_size: int = 100
+    # Maximum time in seconds the sender waits for more messages to fill a batch.
+    max_batch_delay: float = 0.01
+
+
+@dataclass
+class SlowConsumerConfig:
+    """Policy applied to connections whose peer does not keep up with the messages sent to it."""
+
+    # A connection is lagging when more messages than this are waiting in its queue...
+    max_queue_depth: int = 10000
+    # ...or when the oldest queued message has waited longer than this many seconds.
+    max_lag: float = 30.0
+    # Action for lagging debugger frontends: "sample", "disconnect" or "ignore".
+    frontend_action: str = "sample"
+    # Action for lagging CEM/RM devices: "disconnect" or "ignore". S2 traffic is never sampled.
+    device_action: str = "disconnect"
+    # While sampled only 1 out of every `sample_rate` messages is delivered.
+    sample_rate: int = 10
+
+
+@dataclass
+class BufferConfig:
+    """Buffering of messages for a CEM or RM that has not connected yet."""
+
+    # "memory" or "disk". The disk buffer survives restarts of the analyzer.
+    backend: str = "memory"
+    # Directory of the disk buffer logs.
+    directory: str = "buffer"
+    # Maximum size of the buffered messages per CEM/RM pair. The oldest messages are dropped first.
+    max_bytes_per_pair: int = 16 * 1024 * 1024
+    # Buffered messages older than this many seconds are dropped.
+    ttl: float = 3600.0
+
+
+@dataclass
+class ShutdownConfig:
+    # Seconds within which all connections must be closed and the message processing queue must be drained.
+    timeout: float = 15.0
+    # File to which messages that could not be processed before the timeout are written. They are processed on
+    # the next start. Without a file these messages are dropped.
+    backlog_path: Optional[str] = None
+
+
+@dataclass
+class EventLoopConfig:
+    """Event loop on which the REST API, all connections and the message processing run."""
+
+    # "auto" uses uvloop when it is installed and the default asyncio loop otherwise. "asyncio" or "uvloop" force one.
+    policy: str = "auto"
+    # Number of threads of the default executor. Uses the Python default when null.
+    executor_workers: Optional[int] = None
+    # Enables asyncio debug mode. Reports e.g. never awaited coroutines, but slows down the analyzer.
+    debug: bool = False
+    # Callbacks blocking the event loop for longer than this many seconds are logged with their stack. 0 disables.
+    slow_callback_threshold: float = 0.5
+    # Seconds between the measurements of the event loop lag.
+    monitor_interval: float = 0.1
+
+
+@dataclass
+class IngestConfig:
+    """Import of offline capture files."""
+
+    # Directory with the capture files. Only files inside this directory can be imported.
+    directory: str = "captures"
+    # Number of messages validated and stored per database transaction.
+    batch_size: int = 500
+
+
+@dataclass
+class StatisticsConfig:
+    """Running statistics per session and per device."""
+
+    # Statistics of closed sessions are kept until more than this many sessions are closed.
+    max_closed_sessions: int = 1000
+    # Maximum relative error of the percentiles of the message gaps and the forwarding latency.
+    relative_accuracy: float = 0.01
+    # Seconds between the statistics updates of a session on the session update websocket.
+    push_interval: float = 1.0
+
+
+@dataclass
+class TimeSeriesConfig:
+    """Time series of the numeric values of the S2 messages, e.g. power measurements and fill levels."""
+
+    # Number of unwritten points and rollup buckets after which they are written to the database...
+    flush_size: int = 1000
+    # ...or the number of seconds after the previous write.
+    flush_interval: float = 1.0
+    # Default maximum number of points returned by the time series endpoint.
+    max_points: int = 1000
+
+
+@dataclass
+class ConformanceConfig:
+    """Checks of the S2 protocol rules which span more than one message."""
+
+    # Seconds within which every message must be acknowledged with a ReceptionStatus.
+    reception_status_timeout: float = 5.0
+    # Maximum number of messages per session waiting for their ReceptionStatus that are tracked.
+    max_outstanding: int = 1000
+    # Number of recent violations kept per session.
+    max_violations: int = 100
+    # Conformance results of closed sessions are kept until more than this many sessions are closed.
+    max_closed_sessions: int = 1000
+
+
+@dataclass
+class StorageConfig:
+    """Storage of the S2 messages. Every distinct message body (the message without its message_id) is stored once,
+    compressed."""
+
+    # zlib compression level of the message bodies, from 1 (fastest) to 9 (smallest).
+    compression_level: int = 6
+    # Number of distinct bodies of a message type from which the compression dictionary of the type is made.
+    # 0 disables the dictionaries.
+    dictionary_samples: int = 32
+    # Number of recently stored bodies kept compressed in memory, so they are not compressed again.
+    max_known_bodies: int = 10000
+    # Number of recently used validation error signatures whose id is kept in memory, so they are not looked up.
+    max_known_error_signatures: int = 10000
+    # Maximum number of messages stored per transaction. The pipeline waits when this many messages are waiting to
+    # be stored.
+    batch_size: int = 500
+
+
+@dataclass
+class MessageIndexConfig:
+    """Indexing of values inside the S2 messages, so the message history can be queried on them."""
+
+    # Dotted JSON paths inside the S2 messages, e.g. `subject_message_id` or `operation_modes.id`. Messages stored
+    # before a path was added are indexed in the background after the start. By default the fields which link the
+    # messages to each other, e.g. a ReceptionStatus to the message it acknowledges.
+    paths: list[str] = field(
+        default_factory=lambda: [
+            "message_id",
+            "subject_message_id",
+            "status",
+            "control_type",
+            "id",
+            "instruction_id",
+            "actuator_id",
+            "operation_mode",
+        ]
+    )
+    # Number of stored messages indexed per database transaction by the background indexing.
+    backfill_batch_size: int = 1000
+
+
+@dataclass
+class RetentionConfig:
+    """Deletion of old data from the history database and compaction of the database by the background maintenance."""
+
+    # Seconds between the maintenance runs. With 0 the maintenance only runs when requested.
+    interval: float = 3600.0
+    # Messages older than this many days are deleted, after they are counted in the message summaries. Null keeps
+    # the messages.
+    max_age_days: Optional[float] = None
+    # Retention in days per S2 message type instead of max_age_days, e.g. {"FRBC.StorageStatus": 7}. Messages which
+    # are not S2 messages, e.g. session start and end, are under "".
+    max_age_days_per_type: dict[str, float] = field(default_factory=dict)
+    # Time series points of a resolution of less than a minute are deleted after this many days. The 1-minute and
+    # 15-minute rollups are kept. Null keeps the points.
+    time_series_raw_max_age_days: Optional[float] = None
+    # Rows deleted per transaction, and the pause in seconds between the transactions, so that storing new messages
+    # is never blocked for long.
+    batch_size: int = 500
+    batch_pause: float = 0.05
+    # Free pages returned to the file system per step of the incremental vacuum.
+    vacuum_pages: int = 1000
+
+
+@dataclass
+class SessionUpdatesConfig:
+    """The delta protocol of the session update websocket."""
+
+    # Seconds over which the session changes and the message counters are coalesced into one frame.
+    coalesce_interval: float = 0.25
+    # Frames with session changes kept, to which a reconnecting websocket can resume. Older receive a snapshot.
+    journal_size: int = 10000
+
+
+@dataclass
+class ResponseCacheConfig:
+    """Cache of the responses of the history queries over messages which do not change anymore, e.g. of closed
+    sessions."""
+
+    # Maximum total size in bytes of the cached responses. The least recently used are evicted first. 0 disables.
+    max_bytes: int = 64 * 1024 * 1024
+
+
 @dataclass
 class Config(YAMLWizard):
     http_listen_address: str
     http_port: int
+    # Maximum number of simultaneous CEM and RM connections. New connections are refused above this limit.
+    max_device_connections: int = 20000
+    websocket: WebsocketConfig = field(default_factory=WebsocketConfig)
+    slow_consumer: SlowConsumerConfig = field(default_factory=SlowConsumerConfig)
+    buffer: BufferConfig = field(default_factory=BufferConfig)
+    shutdown: ShutdownConfig = field(default_factory=ShutdownConfig)
+    event_loop: EventLoopConfig = field(default_factory=EventLoopConfig)
+    ingest: IngestConfig = field(default_factory=IngestConfig)
+    statistics: StatisticsConfig = field(default_factory=StatisticsConfig)
+    session_updates: SessionUpdatesConfig = field(default_factory=SessionUpdatesConfig)
+    time_series: TimeSeriesConfig = field(default_factory=TimeSeriesConfig)
+    conformance: ConformanceConfig = field(default_factory=ConformanceConfig)
+    message_index: MessageIndexConfig = field(default_factory=MessageIndexConfig)
+    storage: StorageConfig = field(default_factory=StorageConfig)
+    retention: RetentionConfig = field(default_factory=RetentionConfig)
+    response_cache: ResponseCacheConfig = field(default_factory=ResponseCacheConfig)
 
 
 def read_s2_analyzer_conf() -> Config:
@@ -24,6 +239,3 @@ def read_s2_analyzer_conf() -> Config:
     result = Config.from_yaml_file(S2_ANALYZER_CONF)
 
     return result
-
-
-CONFIG = read_s2_analyzer_conf()
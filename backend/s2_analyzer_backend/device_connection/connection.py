@@ -8,7 +8,6 @@ from enum import Enum
 import asyncio
 import json
 import logging
-import threading
 from uuid import UUID
 import uuid
 
@@ -17,6 +16,11 @@ from fastapi.websockets import WebSocketState
 from pydantic import BaseModel
 from websockets.exceptions import ConnectionClosedOK
 from s2_analyzer_backend.device_connection.session_details import SessionDetails
+from s2_analyzer_backend.device_connection.connection_stats import (
+    SlowConsumerAction,
+    SlowConsumerGuard,
+    ThroughputStats,
+)
 from s2_analyzer_backend.endpoints.history_filter import HistoryFilter
 from s2_analyzer_backend.device_connection.connection_adapter.adapter import (
     ConnectionAdapter,
@@ -24,7 +28,6 @@ from s2_analyzer_backend.device_connection.connection_adapter.adapter import (
     ConnectionProtocolError,
 )
 from s2_analyzer_backend.async_application import AsyncApplication
-from s2_analyzer_backend.async_application import APPLICATIONS
 
 from s2_analyzer_backend.message_processor.message import (
     Message,
@@ -37,16 +40,47 @@ if TYPE_CHECKING:
     from s2_analyzer_backend.device_connection.router import MessageRouter
     from s2_analyzer_backend.device_connection.envelope import Envelope
     from s2_analyzer_backend.async_application import ApplicationName
+    from s2_analyzer_backend.config import SlowConsumerConfig
 
 
 LOGGER = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 
 class ConnectionClosedReason(Enum):
     TIMEOUT = "timeout"
     DISCONNECT = "disconnect"
 
 
+async def next_batch(
+    queue: "asyncio.Queue[T]", max_batch_size: int, max_batch_delay: float
+) -> "list[T]":
+    """Wait for the next item on the queue and drain whatever else is queued up to `max_batch_size` items.
+
+    If the queue runs empty before the batch is full, wait at most `max_batch_delay` seconds for more items.
+    """
+    batch = [await queue.get()]
+    deadline = asyncio.get_running_loop().time() + max_batch_delay
+
+    while len(batch) < max_batch_size:
+        try:
+            batch.append(queue.get_nowait())
+            continue
+        except asyncio.QueueEmpty:
+            pass
+
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), remaining))
+        except TimeoutError:
+            break
+
+    return batch
+
+
 class S2Connection(AsyncApplication):
     conn_adapter: ConnectionAdapter
 
@@ -59,6 +93,9 @@ class S2Connection(AsyncApplication):
 
     _queue: "asyncio.Queue[Envelope]"
 
+    stats: ThroughputStats
+    slow_consumer: SlowConsumerGuard
+
     def __init__(
         self,
         conn_adapter: ConnectionAdapter,
@@ -66,6 +103,8 @@ class S2Connection(AsyncApplication):
         dest_id: str,
         origin_type: "S2OriginType",
         msg_router: "MessageRouter",
+        max_batch_size: int = 1,
+        slow_consumer_config: "SlowConsumerConfig | None" = None,
     ):
         super().__init__()
         self.origin_id = origin_id
@@ -76,8 +115,16 @@ class S2Connection(AsyncApplication):
         self.conn_adapter = conn_adapter
 
         self._queue = asyncio.Queue()
-
-        self._ready_event = asyncio.Event()
+        self.max_batch_size = max(1, max_batch_size)
+        self.stats = ThroughputStats()
+        self.slow_consumer = SlowConsumerGuard(
+            self,
+            slow_consumer_config,
+            SlowConsumerAction(slow_consumer_config.device_action)
+            if slow_consumer_config
+            else SlowConsumerAction.IGNORE,
+            on_disconnect=self.notify_to_stop_asap,
+        )
 
     @property
     def cem_id(self):
@@ -94,7 +141,9 @@ class S2Connection(AsyncApplication):
             return self.origin_id
 
     async def receive_envelope(self, envelope: "Envelope") -> None:
-        await self._queue.put(envelope)
+        if self.slow_consumer.admit():
+            self.slow_consumer.record_enqueue()
+            await self._queue.put(envelope)
 
     def get_name(self) -> "ApplicationName":
         return str(self)
@@ -116,32 +165,33 @@ class S2Connection(AsyncApplication):
         return f"Websocket Connection {self.origin_id}->{self.dest_id} ({self.s2_origin_type.name})"
 
     async def main_task(self, loop: asyncio.AbstractEventLoop) -> None:
+        # The receiver runs in the main task itself and only the sender gets a task of its own,
+        # which keeps the per connection overhead low when there are many connections.
+        sender_task = loop.create_task(self.sender())
+        sender_task.add_done_callback(self._sender_done)
         try:
-            async with asyncio.TaskGroup() as task_group:
-                task_group.create_task(self.receiver())
-                task_group.create_task(self.sender())
-        except ExceptionGroup as exc_group:
-            for exc in exc_group.exceptions:
-
-                if isinstance(exc, WebSocketDisconnect):
-                    threading.Thread(
-                        target=APPLICATIONS.stop_and_remove_application, args=(self,)
-                    ).start()
-                    # loop.run_in_executor(None, APPLICATIONS.stop_and_remove_application, self)
-                    self.msg_router.connection_has_closed(self)
-                    LOGGER.info(
-                        "%s %s disconnected.", self.s2_origin_type.name, self.origin_id
-                    )
-                else:
-                    raise exc from exc_group
+            await self.receiver()
+            LOGGER.info("%s %s disconnected.", self.s2_origin_type.name, self.origin_id)
         finally:
             # self.msg_history.notify_terminated_conn(self)
             LOGGER.info("Exiting main task.")
-            await self.conn_adapter.close()
+            self._running = False
+            sender_task.cancel()
             self.msg_router.connection_has_closed(self)
-            pass
+            await self.conn_adapter.close()
+
+    def _sender_done(self, sender_task: asyncio.Task) -> None:
+        if not sender_task.cancelled() and sender_task.exception() is not None:
+            exc = sender_task.exception()
+            LOGGER.error(
+                "Sender of %s crashed with exception!\n%s",
+                self,
+                "".join(traceback.format_exception(None, exc, exc.__traceback__)),
+            )
+            self.stop()
 
     async def receiver(self) -> None:
+        """Receives messages until the connection closes. Returning ends the main task which cleans up the connection."""
         while self._running:
             message_str = None
             try:
@@ -149,36 +199,51 @@ class S2Connection(AsyncApplication):
 
                 # self.msg_history.receive_line(f"[Message received][Sender: {self.s2_origin_type.value} {self.origin_id}][Receiver: {self.destination_type.value} {self.dest_id}] Message: {message_str}")
                 message = json.loads(message_str)
-                await self.msg_router.route_s2_message(self, message)
+                # Only non-ASCII frames need to be encoded to know their size.
+                size = (
+                    len(message_str)
+                    if message_str.isascii()
+                    else len(message_str.encode())
+                )
+                await self.msg_router.route_s2_message(self, message, size)
             except ConnectionProtocolError:
-                self.stop()
+                LOGGER.exception(
+                    "Connection to %s %s had a protocol error while receiving.",
+                    self.s2_origin_type.name,
+                    self.origin_id,
+                )
                 return
             except ConnectionClosed as e:
-                LOGGER.exception(
-                    "Connection to %s %s had an exception while receiving: %s",
+                LOGGER.info(
+                    "Connection to %s %s closed while receiving: %s",
                     self.s2_origin_type.name,
                     self.origin_id,
                     e,
                 )
-                # Stop the connection once the connection adapter closes.
-                self.stop()
                 return
             except json.JSONDecodeError:
                 LOGGER.exception("Error decoding message: %s", message_str)
 
     async def sender(self) -> None:
         while self._running:
-            envelope = await self._queue.get()
+            # S2 requires one message per websocket frame, so envelopes are drained together
+            # to save event loop wakeups but are still sent one by one.
+            envelopes = await next_batch(self._queue, self.max_batch_size, 0.0)
+            self.slow_consumer.record_dequeue(len(envelopes))
 
             try:
-                LOGGER.debug(
-                    "%s sent message across websocket to %s: %s",
-                    self.dest_id,
-                    self.origin_id,
-                    envelope,
-                )
-                await self.conn_adapter.send(json.dumps(envelope.msg))
-                self._queue.task_done()
+                for envelope in envelopes:
+                    LOGGER.debug(
+                        "%s sent message across websocket to %s: %s",
+                        self.dest_id,
+                        self.origin_id,
+                        envelope,
+                    )
+                    message_str = json.dumps(envelope.msg)
+                    await self.conn_adapter.send(message_str)
+                    self.stats.record_frame(1, len(message_str))
+                    self.msg_router.record_forwarded(self, envelope)
+                    self._queue.task_done()
             except ConnectionProtocolError:
                 self.stop()
                 return
@@ -201,25 +266,54 @@ class DebuggerMessageFilter(BaseModel):
     cem_id: Optional[str] = None
 
 
-T = TypeVar("T")
-
-
 class WebsocketConnection(Generic[T], AsyncApplication):
     _queue: "asyncio.Queue[T]"
 
     connected = True
 
+    stats: ThroughputStats
+    slow_consumer: SlowConsumerGuard
+
     def __init__(
         self,
         websocket: "WebSocket",
+        max_batch_size: int = 1,
+        max_batch_delay: float = 0.0,
+        slow_consumer_config: "SlowConsumerConfig | None" = None,
     ):
+        """
+        Args:
+            websocket (WebSocket): The accepted websocket of the frontend.
+            max_batch_size (int): Maximum number of queued messages sent together as a single JSON array frame.
+                When 1, every message is sent as its own frame.
+            max_batch_delay (float): Maximum time in seconds to wait for more messages to fill up a batch.
+            slow_consumer_config (SlowConsumerConfig | None): Policy for when the frontend does not keep up.
+        """
         super().__init__()
         self.websocket = websocket
         self._queue = asyncio.Queue()
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_delay = max_batch_delay
+        self.stats = ThroughputStats()
+        self.slow_consumer = SlowConsumerGuard(
+            self,
+            slow_consumer_config,
+            SlowConsumerAction(slow_consumer_config.frontend_action)
+            if slow_consumer_config
+            else SlowConsumerAction.IGNORE,
+            on_disconnect=self.notify_to_stop_asap,
+        )
+
+    @property
+    def batching(self) -> bool:
+        return self.max_batch_size > 1
 
     def get_name(self) -> "ApplicationName":
         return str(self)
 
+    def __str__(self):
+        return f"{type(self).__name__} {self.websocket.client}"
+
     def create_tasks(self, task_group: asyncio.TaskGroup):
         task_group.create_task(self.receiver())
         task_group.create_task(self.sender())
@@ -230,14 +324,8 @@ class WebsocketConnection(Generic[T], AsyncApplication):
                 self.create_tasks(task_group)
         except ExceptionGroup as exc_group:
             for exc in exc_group.exceptions:
-                if isinstance(exc, WebSocketDisconnect):
-                    threading.Thread(
-                        target=APPLICATIONS.stop_and_remove_application, args=(self,)
-                    ).start()
-                    loop.run_in_executor(
-                        None, APPLICATIONS.stop_and_remove_application, self
-                    )
-                else:
+                # A disconnect ends the main task, after which the application is removed automatically.
+                if not isinstance(exc, WebSocketDisconnect):
                     raise exc from exc_group
             if self.websocket.client_state != WebSocketState.DISCONNECTED:
                 await self.websocket.close()
@@ -247,8 +335,12 @@ class WebsocketConnection(Generic[T], AsyncApplication):
         return True
 
     async def enqueue_message(self, message: T) -> None:
-        if self.include_message(message):
-            await self._queue.put(message)
+        if self.include_message(message) and self.slow_consumer.admit():
+            await self._put(message)
+
+    async def _put(self, message: T) -> None:
+        self.slow_consumer.record_enqueue()
+        await self._queue.put(message)
 
     async def handle_incoming(self, message_str: str):
         if message_str == "ping":
@@ -282,18 +374,33 @@ class WebsocketConnection(Generic[T], AsyncApplication):
     async def serialize_message(self, message: T) -> str:
         return message
 
+    async def serialize_batch(self, messages: list[T]) -> str:
+        """Serializes a batch of messages as a JSON array so it can be sent as a single frame."""
+        serialized_messages = [
+            await self.serialize_message(message) for message in messages
+        ]
+        return "[" + ",".join(serialized_messages) + "]"
+
     async def sender(self) -> None:
         while self._running:
-            message: T = await self._queue.get()
+            messages: list[T] = await next_batch(
+                self._queue, self.max_batch_size, self.max_batch_delay
+            )
+            self.slow_consumer.record_dequeue(len(messages))
 
             try:
-                serialized_message = await self.serialize_message(message)
+                if self.batching:
+                    serialized_message = await self.serialize_batch(messages)
+                else:
+                    serialized_message = await self.serialize_message(messages[0])
 
                 await self.websocket.send_text(serialized_message)
+                self.stats.record_frame(len(messages), len(serialized_message))
                 LOGGER.debug(
-                    "Sent message across websocket to frontend",
+                    "Sent %s message(s) across websocket to frontend", len(messages)
                 )
-                self._queue.task_done()
+                for _ in messages:
+                    self._queue.task_done()
             except ConnectionClosedOK:
                 LOGGER.warning(
                     "Could not send message to debugger frontend as connection was already closed."
@@ -304,6 +411,7 @@ class WebsocketConnection(Generic[T], AsyncApplication):
                     "Connection to debugger frontend had an exception while sending."
                 )
         LOGGER.warning("SENDER DONE")
+        LOGGER.info("Sender statistics of %s: %s", self, self.stats.as_dict())
 
     def stop(self) -> None:
         LOGGER.warning("EXITING Websocket connection")
@@ -326,8 +434,13 @@ class DebuggerFrontendWebsocketConnection(WebsocketConnection[Message]):
         websocket: "WebSocket",
         history_filter: HistoryFilter,
         filters: DebuggerMessageFilter,
+        max_batch_size: int = 1,
+        max_batch_delay: float = 0.0,
+        slow_consumer_config: "SlowConsumerConfig | None" = None,
     ):
-        super().__init__(websocket)
+        super().__init__(
+            websocket, max_batch_size, max_batch_delay, slow_consumer_config
+        )
 
         self.history_filter = history_filter
         self.filters = filters
@@ -378,7 +491,7 @@ class DebuggerFrontendWebsocketConnection(WebsocketConnection[Message]):
                     timestamp=communication.timestamp,
                     s2_validation_error=validation_error,
                 )
-                await self._queue.put(message)
+                await self._put(message)
 
     def create_tasks(self, task_group):
         if self.filters is not None and self.filters.include_session_history:
@@ -411,9 +524,33 @@ class SessionUpdatesWebsocketConnection(WebsocketConnection[SessionDetails]):
     def __init__(
         self,
         websocket: "WebSocket",
+        slow_consumer_config: "SlowConsumerConfig | None" = None,
+        delta: bool = False,
     ):
-        super().__init__(websocket)
+        """
+        Args:
+            delta (bool): Receives coalesced SessionUpdateFrames instead of a SessionDetails per session change.
+        """
+        super().__init__(websocket, slow_consumer_config=slow_consumer_config)
         self.websocket = websocket
+        self.delta = delta
+        self._disconnecting = False
+
+    async def enqueue_message(self, message) -> None:
+        if not self.delta:
+            await super().enqueue_message(message)
+        elif self._disconnecting:
+            return
+        elif (
+            self.slow_consumer.action is not SlowConsumerAction.IGNORE
+            and self.slow_consumer.threshold_exceeded()
+        ):
+            # A skipped frame would leave the client with the wrong sessions. It resumes after a reconnect instead.
+            LOGGER.warning("Disconnecting %s, which does not keep up.", self)
+            self._disconnecting = True
+            self.notify_to_stop_asap()
+        else:
+            await self._put(message)
 
     async def serialize_message(self, message) -> str:
         return message.model_dump_json()
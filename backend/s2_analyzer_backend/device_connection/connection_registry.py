@@ -0,0 +1,157 @@
+from dataclasses import dataclass
+import logging
+from typing import TYPE_CHECKING, Iterator, Optional
+import uuid
+
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from s2_analyzer_backend.device_connection.connection import S2Connection
+
+LOGGER = logging.getLogger(__name__)
+
+# (origin_id, dest_id) of a connection.
+ConnectionKey = tuple[str, str]
+
+
+@dataclass(frozen=True)
+class ConnectionEntry:
+    connection: "S2Connection"
+    session_id: uuid.UUID
+
+    @property
+    def key(self) -> ConnectionKey:
+        return (self.connection.origin_id, self.connection.dest_id)
+
+
+class ConnectionDetails(BaseModel):
+    """Pydantic model used to serialize a live connection for the admin endpoints."""
+
+    origin_id: str
+    dest_id: str
+    origin_type: str
+    cem_id: str
+    rm_id: str
+    session_id: uuid.UUID
+    queue_depth: int
+    messages_sent: int
+
+
+class ConnectionRegistry:
+    """Lookup table of the live S2 connections.
+
+    Connections are indexed by their (origin_id, dest_id) pair, session id, CEM id and RM id. All indexes are updated
+    together on `add` and `remove`, so every lookup is a dictionary access instead of a scan over all connections.
+    """
+
+    _by_key: dict[ConnectionKey, ConnectionEntry]
+    # Secondary indexes. The inner dicts are used as insertion ordered sets.
+    _by_session_id: dict[uuid.UUID, dict[ConnectionKey, ConnectionEntry]]
+    _by_cem_id: dict[str, dict[ConnectionKey, ConnectionEntry]]
+    _by_rm_id: dict[str, dict[ConnectionKey, ConnectionEntry]]
+
+    def __init__(self) -> None:
+        self._by_key = {}
+        self._by_session_id = {}
+        self._by_cem_id = {}
+        self._by_rm_id = {}
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def __contains__(self, key: ConnectionKey) -> bool:
+        return key in self._by_key
+
+    def __iter__(self) -> Iterator[ConnectionEntry]:
+        return iter(list(self._by_key.values()))
+
+    def add(self, connection: "S2Connection", session_id: uuid.UUID) -> ConnectionEntry:
+        """Registers the connection. A connection which was registered for the same pair is replaced."""
+        entry = ConnectionEntry(connection, session_id)
+        if entry.key in self._by_key:
+            LOGGER.warning("Replacing registered connection %s->%s.", *entry.key)
+            self.remove(entry.key)
+
+        self._by_key[entry.key] = entry
+        self._by_session_id.setdefault(session_id, {})[entry.key] = entry
+        self._by_cem_id.setdefault(connection.cem_id, {})[entry.key] = entry
+        self._by_rm_id.setdefault(connection.rm_id, {})[entry.key] = entry
+        return entry
+
+    def remove(
+        self, key: ConnectionKey, connection: "Optional[S2Connection]" = None
+    ) -> Optional[ConnectionEntry]:
+        """Unregisters the connection of the pair.
+
+        Args:
+            key (ConnectionKey): (origin_id, dest_id) of the connection.
+            connection (S2Connection, optional): Only remove the entry if it still belongs to this connection,
+                so that a stale connection can not remove the connection that replaced it.
+        """
+        entry = self._by_key.get(key)
+        if entry is None or (
+            connection is not None and entry.connection is not connection
+        ):
+            return None
+
+        del self._by_key[key]
+        self._discard(self._by_session_id, entry.session_id, key)
+        self._discard(self._by_cem_id, entry.connection.cem_id, key)
+        self._discard(self._by_rm_id, entry.connection.rm_id, key)
+        return entry
+
+    @staticmethod
+    def _discard(index: dict, index_key, key: ConnectionKey) -> None:
+        entries = index.get(index_key)
+        if entries is None:
+            return
+        entries.pop(key, None)
+        if not entries:
+            del index[index_key]
+
+    def get(self, origin_id: str, dest_id: str) -> Optional[ConnectionEntry]:
+        return self._by_key.get((origin_id, dest_id))
+
+    def by_session_id(self, session_id: uuid.UUID) -> list[ConnectionEntry]:
+        return list(self._by_session_id.get(session_id, {}).values())
+
+    def by_cem_id(self, cem_id: str) -> list[ConnectionEntry]:
+        return list(self._by_cem_id.get(cem_id, {}).values())
+
+    def by_rm_id(self, rm_id: str) -> list[ConnectionEntry]:
+        return list(self._by_rm_id.get(rm_id, {}).values())
+
+    def session_ids(self) -> list[uuid.UUID]:
+        return list(self._by_session_id.keys())
+
+    def snapshot(
+        self,
+        session_id: Optional[uuid.UUID] = None,
+        cem_id: Optional[str] = None,
+        rm_id: Optional[str] = None,
+    ) -> list[ConnectionDetails]:
+        """Returns the details of the live connections, optionally narrowed down by one of the indexes."""
+        if session_id is not None:
+            entries = self.by_session_id(session_id)
+        elif cem_id is not None:
+            entries = self.by_cem_id(cem_id)
+        elif rm_id is not None:
+            entries = self.by_rm_id(rm_id)
+        else:
+            entries = list(self._by_key.values())
+
+        return [
+            ConnectionDetails(
+                origin_id=entry.connection.origin_id,
+                dest_id=entry.connection.dest_id,
+                origin_type=entry.connection.s2_origin_type.name,
+                cem_id=entry.connection.cem_id,
+                rm_id=entry.connection.rm_id,
+                session_id=entry.session_id,
+                queue_depth=entry.connection.slow_consumer.queue_depth,
+                messages_sent=entry.connection.stats.messages_sent,
+            )
+            for entry in entries
+            if (cem_id is None or entry.connection.cem_id == cem_id)
+            and (rm_id is None or entry.connection.rm_id == rm_id)
+        ]
@@ -0,0 +1,179 @@
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum
+import logging
+import math
+import time
+from typing import TYPE_CHECKING, Callable
+
+if TYPE_CHECKING:
+    from s2_analyzer_backend.config import SlowConsumerConfig
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class ThroughputStats:
+    """Running throughput counters of a single connection's sender."""
+
+    messages_sent: int = 0
+    frames_sent: int = 0
+    bytes_sent: int = 0
+    largest_batch: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def record_frame(self, message_count: int, byte_count: int) -> None:
+        self.messages_sent += message_count
+        self.frames_sent += 1
+        self.bytes_sent += byte_count
+        self.largest_batch = max(self.largest_batch, message_count)
+
+    @property
+    def messages_per_second(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return self.messages_sent / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def average_batch_size(self) -> float:
+        return self.messages_sent / self.frames_sent if self.frames_sent else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "messages_sent": self.messages_sent,
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+            "largest_batch": self.largest_batch,
+            "average_batch_size": round(self.average_batch_size, 2),
+            "messages_per_second": round(self.messages_per_second, 2),
+        }
+
+
+class SlowConsumerAction(str, Enum):
+    IGNORE = "ignore"
+    SAMPLE = "sample"
+    DISCONNECT = "disconnect"
+
+
+@dataclass
+class SlowConsumerEvent:
+    connection: str
+    action: SlowConsumerAction
+    queue_depth: int
+    oldest_age: float
+    timestamp: datetime = field(default_factory=datetime.now)
+
+
+# The most recent slow consumer events of all connections, newest last.
+SLOW_CONSUMER_EVENTS: "deque[SlowConsumerEvent]" = deque(maxlen=100)
+
+
+class SlowConsumerGuard:
+    """Tracks how far behind the consumer of a connection's queue is and applies the slow consumer policy.
+
+    Every message put on the queue must be registered with `record_enqueue` and every message taken from it with
+    `record_dequeue`, so that the age of the oldest queued message is known without inspecting the queue.
+    Without a config the lag is only tracked and no action is ever taken.
+    """
+
+    def __init__(
+        self,
+        connection: object,
+        config: "SlowConsumerConfig | None",
+        action: SlowConsumerAction,
+        on_disconnect: Callable[[], None],
+    ):
+        self.connection = connection
+        self.on_disconnect = on_disconnect
+
+        if config is None:
+            self.max_queue_depth = math.inf
+            self.max_lag = math.inf
+            self.sample_rate = 1
+            self.action = SlowConsumerAction.IGNORE
+        else:
+            self.max_queue_depth = config.max_queue_depth
+            self.max_lag = config.max_lag
+            self.sample_rate = max(1, config.sample_rate)
+            self.action = action
+
+        self.lagging = False
+        self.dropped = 0
+        self._enqueued_at: "deque[float]" = deque()
+        self._sample_counter = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._enqueued_at)
+
+    @property
+    def oldest_age(self) -> float:
+        if not self._enqueued_at:
+            return 0.0
+        return time.monotonic() - self._enqueued_at[0]
+
+    def record_enqueue(self) -> None:
+        self._enqueued_at.append(time.monotonic())
+
+    def record_dequeue(self, count: int = 1) -> None:
+        for _ in range(min(count, len(self._enqueued_at))):
+            self._enqueued_at.popleft()
+
+    def threshold_exceeded(self) -> bool:
+        return self.queue_depth > self.max_queue_depth or self.oldest_age > self.max_lag
+
+    def recovered(self) -> bool:
+        return (
+            self.queue_depth <= self.max_queue_depth // 2
+            and self.oldest_age <= self.max_lag / 2
+        )
+
+    def admit(self) -> bool:
+        """Decides whether the next message should be queued for the consumer."""
+        if self.lagging:
+            if self.recovered():
+                LOGGER.info(
+                    "%s caught up again. Resuming full delivery.", self.connection
+                )
+                self.lagging = False
+            elif self.action is SlowConsumerAction.SAMPLE:
+                self._sample_counter += 1
+                if self._sample_counter % self.sample_rate == 0:
+                    return True
+                self.dropped += 1
+                return False
+            else:
+                return self.action is not SlowConsumerAction.DISCONNECT
+
+        if self.threshold_exceeded():
+            self.lagging = True
+            self._report()
+            if self.action is SlowConsumerAction.DISCONNECT:
+                self.on_disconnect()
+                return False
+
+        return True
+
+    def _report(self) -> None:
+        event = SlowConsumerEvent(
+            connection=str(self.connection),
+            action=self.action,
+            queue_depth=self.queue_depth,
+            oldest_age=self.oldest_age,
+        )
+        SLOW_CONSUMER_EVENTS.append(event)
+        LOGGER.warning(
+            "%s is a slow consumer (%s queued messages, oldest waiting %.1fs). Action: %s.",
+            event.connection,
+            event.queue_depth,
+            event.oldest_age,
+            event.action.value,
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "oldest_age": round(self.oldest_age, 3),
+            "lagging": self.lagging,
+            "dropped": self.dropped,
+        }
@@ -1,6 +1,6 @@
 import uuid
 from dataclasses import dataclass
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 from uuid import uuid1
 
 if TYPE_CHECKING:
@@ -13,17 +13,22 @@ class Envelope:
     """
 
     envelope_id: uuid.UUID
-    origin: "S2Connection"
+    # The sending connection. None when it is already gone, e.g. for messages buffered before a restart.
+    origin: "S2Connection | None"
     dest: "S2Connection | None"
     msg: dict
+    # time.monotonic() at which the message was received from the origin. None for buffered and injected messages.
+    received_at: Optional[float]
 
     def __init__(
         self,
-        origin: "S2Connection",
+        origin: "S2Connection | None",
         dest: "S2Connection | None",
         msg: dict,
+        received_at: Optional[float] = None,
     ) -> None:
         self.envelope_id = uuid1()
         self.origin = origin
         self.dest = dest
         self.msg = msg
+        self.received_at = received_at
@@ -0,0 +1,299 @@
+import abc
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import mmap
+import os
+from pathlib import Path
+import threading
+import time
+from typing import TYPE_CHECKING, Iterator
+
+if TYPE_CHECKING:
+    from s2_analyzer_backend.config import BufferConfig
+
+LOGGER = logging.getLogger(__name__)
+
+# (origin_id, dest_id) of the connection the buffered messages are destined for.
+BufferKey = tuple[str, str]
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+DEFAULT_TTL = 3600.0  # seconds
+
+
+class EnvelopeBuffer(abc.ABC):
+    """
+    Holds the S2 messages for a connection that has not connected yet. Once the connection arrives the messages are
+    consumed in the order they were appended.
+    Messages older than `ttl` seconds are never delivered and a pair never holds more than `max_bytes` of messages,
+    the oldest messages are dropped first.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl: float = DEFAULT_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    @abc.abstractmethod
+    def append(self, key: BufferKey, msg: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Waits until the appended messages are written."""
+        pass
+
+    @abc.abstractmethod
+    async def consume(self, key: BufferKey) -> list[dict]:
+        """Returns the buffered, unexpired messages for the key in order and removes them from the buffer."""
+        pass
+
+    @abc.abstractmethod
+    def session_ended(self, key: BufferKey) -> None:
+        """Called when the session of the key ended before the messages could be delivered."""
+        pass
+
+    def _expired(self, appended_at: float) -> bool:
+        return appended_at < time.time() - self.ttl
+
+
+class MemoryEnvelopeBuffer(EnvelopeBuffer):
+    """Keeps the buffered messages in memory. They are lost when the session ends or the analyzer restarts."""
+
+    _buffers: dict[BufferKey, "deque[tuple[float, int, dict]]"]
+    _sizes: dict[BufferKey, int]
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl: float = DEFAULT_TTL):
+        super().__init__(max_bytes, ttl)
+        self._buffers = {}
+        self._sizes = {}
+
+    def append(self, key: BufferKey, msg: dict) -> None:
+        size = len(json.dumps(msg))
+        buffer = self._buffers.setdefault(key, deque())
+        buffer.append((time.time(), size, msg))
+        self._sizes[key] = self._sizes.get(key, 0) + size
+
+        while self._sizes[key] > self.max_bytes and buffer:
+            _, dropped_size, _ = buffer.popleft()
+            self._sizes[key] -= dropped_size
+            LOGGER.warning(
+                "Buffer for %s->%s is full. Dropped the oldest message.", *key
+            )
+
+    async def consume(self, key: BufferKey) -> list[dict]:
+        buffer = self._buffers.pop(key, deque())
+        self._sizes.pop(key, None)
+
+        return [msg for appended_at, _, msg in buffer if not self._expired(appended_at)]
+
+    def session_ended(self, key: BufferKey) -> None:
+        self._buffers.pop(key, None)
+        self._sizes.pop(key, None)
+
+
+class DiskEnvelopeBuffer(EnvelopeBuffer):
+    """
+    Appends the buffered messages to a log file per pair in `directory`, so they survive restarts of the analyzer
+    and bursts are not kept in memory. Every line of a log is a JSON record `{"t": <append time>, "m": <message>}`.
+    Logs are memory-mapped when they are replayed. Messages are kept when the session ends so that a peer which
+    connects later, even after a restart, still receives them as long as they have not expired.
+
+    The records are written by a background thread, in order, and fsynced once per log for all the records appended
+    meanwhile, so an append does not block the event loop and written records also survive a crash of the host.
+    All reads and changes of the logs are made by that thread. Malformed records, e.g. a record which was torn by a
+    crash while it was written, are skipped and counted in `malformed_records`.
+    """
+
+    _sizes: dict[BufferKey, int]
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttl: float = DEFAULT_TTL,
+    ):
+        super().__init__(max_bytes, ttl)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._sizes = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="envelope-buffer"
+        )
+        self._lock = threading.Lock()
+        # The records which are appended, but not written yet.
+        self._pending: list[tuple[BufferKey, bytes]] = []
+        self._write_scheduled = False
+        self.malformed_records = 0
+        self._remove_expired_logs()
+
+    def _path(self, key: BufferKey) -> Path:
+        digest = hashlib.sha256("\0".join(key).encode("utf-8")).hexdigest()[:32]
+        return self.directory / f"{digest}.log"
+
+    def _remove_expired_logs(self) -> None:
+        for path in self.directory.glob("*.log"):
+            if self._expired(path.stat().st_mtime):
+                LOGGER.info("Removing expired buffer %s.", path)
+                path.unlink(missing_ok=True)
+
+    def _size(self, key: BufferKey) -> int:
+        if key not in self._sizes:
+            path = self._path(key)
+            size = path.stat().st_size if path.exists() else 0
+            if size:
+                with open(path, "rb+") as log:
+                    log.seek(-1, os.SEEK_END)
+                    if log.read(1) != b"\n":
+                        # Ends a record torn by a crash, so the next record starts on its own line.
+                        log.write(b"\n")
+                        size += 1
+            self._sizes[key] = size
+        return self._sizes[key]
+
+    def append(self, key: BufferKey, msg: dict) -> None:
+        record = (json.dumps({"t": time.time(), "m": msg}) + "\n").encode("utf-8")
+        with self._lock:
+            self._pending.append((key, record))
+            if not self._write_scheduled:
+                self._write_scheduled = True
+                self._executor.submit(self._write_pending)
+
+    async def flush(self) -> None:
+        # The writes submitted before are done first.
+        await asyncio.wrap_future(self._executor.submit(lambda: None))
+
+    def _write_pending(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._write_scheduled = False
+
+        records: dict[BufferKey, list[bytes]] = {}
+        for key, record in pending:
+            records.setdefault(key, []).append(record)
+        for key, key_records in records.items():
+            try:
+                self._write(key, key_records)
+            except OSError:
+                LOGGER.exception(
+                    "Could not buffer %s messages for %s->%s.", len(key_records), *key
+                )
+
+    def _write(self, key: BufferKey, records: list[bytes]) -> None:
+        log = None
+        try:
+            for record in records:
+                if self._size(key) + len(record) > self.max_bytes:
+                    if log is not None:
+                        log.close()
+                        log = None
+                    self._compact(key, len(record))
+                if log is None:
+                    log = open(self._path(key), "ab")
+                log.write(record)
+                self._sizes[key] = self._size(key) + len(record)
+            log.flush()
+            os.fsync(log.fileno())
+        finally:
+            if log is not None:
+                log.close()
+
+    def _read_records(self, key: BufferKey) -> Iterator[bytes]:
+        path = self._path(key)
+        if not path.exists() or path.stat().st_size == 0:
+            return
+
+        with open(path, "rb") as log, mmap.mmap(
+            log.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mapped:
+            while line := mapped.readline():
+                yield line
+
+    def _parse_records(self, key: BufferKey) -> Iterator[tuple[bytes, dict]]:
+        """Yields the lines of the log with their parsed record, skipping the malformed lines."""
+        malformed = 0
+        for line in self._read_records(key):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if (
+                not isinstance(record, dict)
+                or not isinstance(record.get("t"), (int, float))
+                or "m" not in record
+            ):
+                malformed += 1
+                continue
+            yield line, record
+
+        if malformed:
+            self.malformed_records += malformed
+            LOGGER.warning(
+                "Skipped %s malformed records in the buffer for %s->%s.",
+                malformed,
+                *key,
+            )
+
+    def _compact(self, key: BufferKey, space_needed: int) -> None:
+        """Rewrites the log without expired records and drops the oldest records until `space_needed` bytes fit.
+        Some headroom is freed as well, so that the log is not rewritten on every append while it is full.
+        """
+        records = [
+            line
+            for line, record in self._parse_records(key)
+            if not self._expired(record["t"])
+        ]
+        size = sum(len(line) for line in records)
+        dropped = 0
+        while records and size + space_needed > self.max_bytes * 0.75:
+            size -= len(records.pop(0))
+            dropped += 1
+
+        if dropped:
+            LOGGER.warning(
+                "Buffer for %s->%s is full. Dropped the %s oldest messages.",
+                *key,
+                dropped,
+            )
+
+        path = self._path(key)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as log:
+            log.writelines(records)
+            log.flush()
+            os.fsync(log.fileno())
+        os.replace(tmp_path, path)
+        self._sizes[key] = size
+
+    async def consume(self, key: BufferKey) -> list[dict]:
+        # After the writes of the messages which were appended before.
+        return await asyncio.wrap_future(self._executor.submit(self._consume, key))
+
+    def _consume(self, key: BufferKey) -> list[dict]:
+        try:
+            return [
+                record["m"]
+                for _, record in self._parse_records(key)
+                if not self._expired(record["t"])
+            ]
+        finally:
+            self._remove(key)
+
+    def _remove(self, key: BufferKey) -> None:
+        self._path(key).unlink(missing_ok=True)
+        self._sizes.pop(key, None)
+
+    def session_ended(self, key: BufferKey) -> None:
+        # Undelivered messages are kept until they expire.
+        pass
+
+
+def create_envelope_buffer(config: "BufferConfig") -> EnvelopeBuffer:
+    if config.backend == "disk":
+        return DiskEnvelopeBuffer(
+            config.directory, config.max_bytes_per_pair, config.ttl
+        )
+    if config.backend == "memory":
+        return MemoryEnvelopeBuffer(config.max_bytes_per_pair, config.ttl)
+    raise ValueError(f"Unknown buffer backend: {config.backend}")
@@ -1,5 +1,5 @@
-import asyncio
 from datetime import datetime
+import time
 from typing import TYPE_CHECKING
 import logging
 import uuid
@@ -14,9 +14,20 @@ from s2_analyzer_backend.message_processor.message_processor import (
     MessageProcessorHandler,
 )
 from s2_analyzer_backend.device_connection.envelope import Envelope
+from s2_analyzer_backend.device_connection.connection_registry import (
+    ConnectionEntry,
+    ConnectionRegistry,
+)
+from s2_analyzer_backend.device_connection.envelope_buffer import (
+    EnvelopeBuffer,
+    MemoryEnvelopeBuffer,
+)
 
 if TYPE_CHECKING:
     from s2_analyzer_backend.device_connection.connection import S2Connection
+    from s2_analyzer_backend.message_processor.session_statistics import (
+        SessionStatisticsProcessor,
+    )
 
 
 LOGGER = logging.getLogger(__name__)
@@ -26,47 +37,52 @@ class MessageRouter:
     """Routes messages received from a CEM or RM device to the destination
     device based on the connection information."""
 
-    connections: dict[tuple[str, str], tuple["S2Connection", uuid.UUID]]
-    _buffer_queue_by_origin_dest_id: dict[tuple[str, str], asyncio.Queue]
+    connections: ConnectionRegistry
+    _buffer: EnvelopeBuffer
+
+    def __init__(
+        self,
+        msg_processor_handler: MessageProcessorHandler,
+        envelope_buffer: "EnvelopeBuffer | None" = None,
+        session_statistics: "SessionStatisticsProcessor | None" = None,
+    ) -> None:
+        self.connections = ConnectionRegistry()
 
-    def __init__(self, msg_processor_handler: MessageProcessorHandler) -> None:
-        self.connections = {}
-        self._buffer_queue_by_origin_dest_id = {}
+        # Holds the messages for connections that have not connected yet.
+        if envelope_buffer is None:
+            envelope_buffer = MemoryEnvelopeBuffer()
+        self._buffer = envelope_buffer
 
         # Dependency injection of message processor handler
         self._msg_processor_handler = msg_processor_handler
 
-    def _get_buffer_queue(self, origin_id: str, dest_id: str) -> asyncio.Queue:
-        return self._buffer_queue_by_origin_dest_id.setdefault(
-            (origin_id, dest_id), asyncio.Queue()
-        )
-
-    def _consume_buffer_queue(self, origin_id: str, dest_id: str) -> list[Envelope]:
-        buffer_queue = self._get_buffer_queue(origin_id, dest_id)
-        del self._buffer_queue_by_origin_dest_id[(origin_id, dest_id)]
-
-        buffered_messages = []
-        while not buffer_queue.empty():
-            buffered_messages.append(buffer_queue.get_nowait())
-            buffer_queue.task_done()
+        # Receives the forwarding latencies of the messages.
+        self._session_statistics = session_statistics
 
-        return buffered_messages
+    @property
+    def msg_processor_handler(self) -> MessageProcessorHandler:
+        return self._msg_processor_handler
 
     def get_reverse_connection(
         self, origin_id: str, dest_id: str
     ) -> "tuple[S2Connection | None, uuid.UUID | None]":
-        return self.connections.get((dest_id, origin_id), (None, None))
+        entry = self.connections.get(dest_id, origin_id)
+        if entry is None:
+            return None, None
+        return entry.connection, entry.session_id
 
     def get_session_id(self, connection: "S2Connection") -> uuid.UUID:
-        _, session_id = self.connections.get(
-            (connection.origin_id, connection.dest_id), (None, None)
-        )
-        return session_id
+        entry = self.connections.get(connection.origin_id, connection.dest_id)
+        return entry.session_id if entry is not None else None
 
-    async def route_s2_message(self, origin: "S2Connection", s2_json_msg: dict) -> None:
+    async def route_s2_message(
+        self, origin: "S2Connection", s2_json_msg: dict, size: "int | None" = None
+    ) -> None:
         """Performs the routing of the message. Also passes the received message to the
         MessageProcessorHandler so that the processing pipeline can be executed on the message.
+        The size is that of the frame the message was received in, if it was received from the device.
         """
+        received_at = time.monotonic()
 
         # Find destination
         dest_id = origin.dest_id
@@ -80,14 +96,12 @@ class MessageRouter:
             rm_id=origin.rm_id,
             origin=origin.s2_origin_type,
             msg=s2_json_msg,
+            size=size,
         )
 
         # Add the message to the processor handler's queue so that it can be processed when possible.
         self._msg_processor_handler.add_message_to_process(message)
 
-        # Prepare envelope to forward message to destination
-        envelope = Envelope(origin, dest, s2_json_msg)
-
         # Send message to destination.
         # If the receiving connection is not yet open, then buffer the message so it can be sent when the device connects.
         # IF the receiving connection is open then send the message.
@@ -97,10 +111,12 @@ class MessageRouter:
                 dest_id,
                 origin.origin_id,
             )
-            queue = self._get_buffer_queue(dest_id, origin.origin_id)
-            await queue.put(envelope)
+            self._buffer.append((dest_id, origin.origin_id), s2_json_msg)
         else:
-            await self.route_envelope(envelope)
+            # Prepare envelope to forward message to destination
+            await self.route_envelope(
+                Envelope(origin, dest, s2_json_msg, received_at=received_at)
+            )
 
     async def _forward_envelope_to_connect(
         self, envelope: Envelope, conn: "S2Connection"
@@ -118,6 +134,16 @@ class MessageRouter:
 
         await self._forward_envelope_to_connect(envelope, conn)
 
+    def record_forwarded(self, dest: "S2Connection", envelope: Envelope) -> None:
+        """Called by the destination connection once it sent the message of the envelope to its device."""
+        if self._session_statistics is None or envelope.received_at is None:
+            return
+        session_id = self.get_session_id(dest)
+        if session_id is not None:
+            self._session_statistics.record_forwarding_latency(
+                session_id, time.monotonic() - envelope.received_at
+            )
+
     async def receive_new_connection(self, conn: "S2Connection") -> uuid.UUID:
         """Stores a new connection in the lookup table to be used for routing messages."""
 
@@ -125,8 +151,9 @@ class MessageRouter:
         complete = False
         session_id = None
         # Check if the reverse connection exists to get the session id
-        if (conn.dest_id, conn.origin_id) in self.connections:
-            _, session_id = self.connections.get((conn.dest_id, conn.origin_id))
+        reverse_entry = self.connections.get(conn.dest_id, conn.origin_id)
+        if reverse_entry is not None:
+            session_id = reverse_entry.session_id
             complete = True
         else:
             # Create a new id if this is the first device to connect
@@ -144,21 +171,25 @@ class MessageRouter:
                 )
             )
 
-        # Add the connection to the connections dict
-        self.connections[(conn.origin_id, conn.dest_id)] = (conn, session_id)
+        # Add the connection to the connection registry
+        self.connections.add(conn, session_id)
 
-        buffered_messages = self._consume_buffer_queue(conn.origin_id, conn.dest_id)
+        # The sending side may be gone already, e.g. when the messages were buffered before a restart.
+        reverse_conn, _ = self.get_reverse_connection(conn.origin_id, conn.dest_id)
+        buffered_count = 0
+        for msg in await self._buffer.consume((conn.origin_id, conn.dest_id)):
+            await self._forward_envelope_to_connect(
+                Envelope(reverse_conn, conn, msg), conn
+            )
+            buffered_count += 1
 
-        if buffered_messages:
+        if buffered_count:
             LOGGER.info(
-                "[%s] connection receives %s buffered messages.",
+                "[%s] connection received %s buffered messages.",
                 conn,
-                len(buffered_messages),
+                buffered_count,
             )
 
-        for message in buffered_messages:
-            await self._forward_envelope_to_connect(message, conn)
-
         return session_id
 
     def connection_has_closed(self, conn: "S2Connection") -> None:
@@ -167,28 +198,25 @@ class MessageRouter:
         reverse_conn_key = (conn.dest_id, conn.origin_id)
 
         session_id = None
-        # Cleanup the connection
-        if conn_key in self.connections:
-            connection, session_id = self.connections.get(conn_key)
+        # Cleanup the connection. Only if it was not replaced by a newer connection for the same pair.
+        entry = self.connections.remove(conn_key, conn)
+        if entry is not None:
+            session_id = entry.session_id
             LOGGER.info(session_id)
-            if connection._running:
-                connection.stop()
-            del self.connections[conn_key]
+            if entry.connection._running:
+                entry.connection.stop()
 
         # Cleanup the connection going in the reverse dir
-        if reverse_conn_key in self.connections:
-            reverse_connection, session_id = self.connections.get(reverse_conn_key)
+        reverse_entry = self.connections.remove(reverse_conn_key)
+        if reverse_entry is not None:
+            session_id = reverse_entry.session_id
             LOGGER.info(session_id)
-            if reverse_connection._running:
-                reverse_connection.stop()
-            del self.connections[reverse_conn_key]
+            if reverse_entry.connection._running:
+                reverse_entry.connection.stop()
 
         # Remove the buffers
-        if conn_key in self._buffer_queue_by_origin_dest_id:
-            del self._buffer_queue_by_origin_dest_id[conn_key]
-
-        if reverse_conn_key in self._buffer_queue_by_origin_dest_id:
-            del self._buffer_queue_by_origin_dest_id[reverse_conn_key]
+        self._buffer.session_ended(conn_key)
+        self._buffer.session_ended(reverse_conn_key)
 
         if session_id is not None:
             self._msg_processor_handler.add_message_to_process(
@@ -203,7 +231,16 @@ class MessageRouter:
 
     async def inject_message(self, origin_id, dest_id, message: dict):
         """Injects a message into the communication between two devices. At least one of the devices must be connected for this to work."""
-        origin, session_id = self.connections.get((origin_id, dest_id))
+        entry = self.connections.get(origin_id, dest_id)
+        if entry is None:
+            dest_entry = self.connections.get(dest_id, origin_id)
+            if dest_entry is None:
+                raise ValueError(
+                    f"There is no connection from {origin_id} to {dest_id}."
+                )
+            await self._inject_into_destination(dest_entry, message)
+            return
+        origin, session_id = entry.connection, entry.session_id
 
         self._msg_processor_handler.add_message_to_process(
             Message(
@@ -216,3 +253,28 @@ class MessageRouter:
         )
 
         await self.route_s2_message(origin, message)
+
+    async def _inject_into_destination(
+        self, dest_entry: "ConnectionEntry", message: dict
+    ) -> None:
+        """Injects a message on behalf of a device that is not connected, directly into the connection of the other
+        device. E.g. to replay recorded RM messages into a CEM without an RM."""
+        dest, session_id = dest_entry.connection, dest_entry.session_id
+        origin_type = dest.s2_origin_type.reverse()
+
+        for message_type, msg in (
+            (MessageType.MSG_INJECTED, None),
+            (MessageType.S2, message),
+        ):
+            self._msg_processor_handler.add_message_to_process(
+                Message(
+                    session_id=session_id,
+                    cem_id=dest.cem_id,
+                    rm_id=dest.rm_id,
+                    origin=origin_type,
+                    message_type=message_type,
+                    msg=msg,
+                )
+            )
+
+        await self.route_envelope(Envelope(None, dest, message))
@@ -16,3 +16,21 @@ class SessionDetails(BaseModel):
     end_timestamp: Optional[datetime] = None
 
     state: Literal["closed", "open"]
+
+    # Running statistics of the session, when pushed by the session statistics.
+    statistics: Optional[dict] = None
+
+
+class SessionUpdateFrame(BaseModel):
+    """A frame of the delta session update protocol. `sessions` holds the sessions which opened or closed since the
+    previous frame, or all open sessions when `snapshot` is set, and `counters` the live message counters of the
+    sessions which received messages since then, by session id.
+
+    `seq` counts the changes of the sessions within the `epoch` of the analyzer run, so a client which reconnects
+    with its last epoch and seq only receives the changes it missed."""
+
+    epoch: str
+    seq: int
+    snapshot: bool = False
+    sessions: list[SessionDetails] = []
+    counters: dict[uuid.UUID, dict] = {}
@@ -0,0 +1,242 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+import hashlib
+import logging
+import threading
+from typing import Hashable, Iterable, Iterator, Optional
+import uuid
+
+from s2_analyzer_backend.message_processor.message import Message
+from s2_analyzer_backend.message_processor.message_type import MessageType
+
+LOGGER = logging.getLogger(__name__)
+
+
+def local_naive(timestamp: datetime) -> datetime:
+    """The stored timestamps are naive local times, as those of the messages."""
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone().replace(tzinfo=None)
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether the If-None-Match header of a request names the ETag, i.e. the client has the response already."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+@dataclass(frozen=True)
+class CacheScope:
+    """The stored messages a cached response is made of: those of a session, or of all sessions when None, within
+    [start, end], unbounded when None. Filters on other columns only narrow it further.
+    """
+
+    session_id: Optional[uuid.UUID] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+    def affected_by(
+        self, session_ids: Optional[set[uuid.UUID]], start: datetime, end: datetime
+    ) -> bool:
+        """Whether storing or deleting messages of the sessions (all sessions when None) between start and end
+        changes the response."""
+        if (
+            session_ids is not None
+            and self.session_id is not None
+            and self.session_id not in session_ids
+        ):
+            return False
+        if self.start is not None and end < self.start:
+            return False
+        if self.end is not None and start > self.end:
+            return False
+        return True
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    body: bytes
+    etag: str
+    scope: CacheScope
+
+
+class Computation:
+    """A response which is being computed. It is only cached if no messages in its scope were stored or deleted
+    meanwhile."""
+
+    def __init__(self, scope: CacheScope):
+        self.scope = scope
+        self.invalidated = False
+
+
+class HistoryResponseCache:
+    """
+    Least recently used cache of the serialized responses of history queries which do not change anymore, e.g. the
+    messages of a closed session or of a time window in the past, bounded by the total size of the responses.
+
+    The storage stage reports every stored transaction with `stored`, and the history maintenance every deletion with
+    `invalidate`, which evict the responses whose scope the messages fall in, e.g. of a capture imported into the
+    past. The responses are indexed by session, so only the responses of the stored sessions and those over all
+    sessions are checked. A response is computed within `computing`, and is not cached when messages in its scope
+    were stored meanwhile. Thread safe, as the messages are stored from other threads.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[Hashable, CachedResponse] = OrderedDict()
+        # The keys of the entries of a single session, by session, and of the entries over all sessions.
+        self._by_session: dict[uuid.UUID, set[Hashable]] = {}
+        self._all_sessions: set[Hashable] = set()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._computations: set[Computation] = set()
+        # Sessions with stored messages, but no stored end, since the start of the analyzer.
+        self._open_sessions: set[uuid.UUID] = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def is_closed(self, session_id: uuid.UUID) -> bool:
+        """Whether no more messages are expected for the session. Sessions of earlier runs of the analyzer are."""
+        with self._lock:
+            return session_id not in self._open_sessions
+
+    def has_open_sessions(self) -> bool:
+        with self._lock:
+            return bool(self._open_sessions)
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        with self._lock:
+            response = self._entries.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    @contextmanager
+    def computing(self, scope: CacheScope) -> Iterator[Computation]:
+        """Tracks the stored and deleted messages while the response of the scope is computed, e.g.
+        `with cache.computing(scope) as computation: cache.put(key, produce(), computation)`.
+        """
+        computation = Computation(scope)
+        with self._lock:
+            self._computations.add(computation)
+        try:
+            yield computation
+        finally:
+            with self._lock:
+                self._computations.discard(computation)
+
+    def put(
+        self, key: Hashable, body: bytes, computation: Computation
+    ) -> CachedResponse:
+        """Caches the response, unless messages in its scope were stored or deleted while it was computed."""
+        scope = computation.scope
+        response = CachedResponse(body=body, etag=make_etag(body), scope=scope)
+        if len(body) > self.max_bytes:
+            return response
+        with self._lock:
+            if computation.invalidated:
+                return response
+            self._remove(key)
+            self._entries[key] = response
+            if scope.session_id is None:
+                self._all_sessions.add(key)
+            else:
+                self._by_session.setdefault(scope.session_id, set()).add(key)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return response
+
+    def _remove(self, key: Hashable) -> bool:
+        response = self._entries.pop(key, None)
+        if response is None:
+            return False
+        self._bytes -= len(response.body)
+        session_id = response.scope.session_id
+        if session_id is None:
+            self._all_sessions.discard(key)
+        else:
+            keys = self._by_session[session_id]
+            keys.discard(key)
+            if not keys:
+                del self._by_session[session_id]
+        return True
+
+    def stored(self, messages: Iterable[Message]) -> None:
+        """Called by the storage stage after a transaction of messages is committed."""
+        session_ids = set()
+        start = end = None
+        ended = set()
+        for message in messages:
+            session_ids.add(message.session_id)
+            timestamp = (
+                local_naive(message.timestamp)
+                if message.timestamp is not None
+                else datetime.now()
+            )
+            start = timestamp if start is None else min(start, timestamp)
+            end = timestamp if end is None else max(end, timestamp)
+            if message.message_type == MessageType.SESSION_ENDED:
+                ended.add(message.session_id)
+        if not session_ids:
+            return
+        with self._lock:
+            self._open_sessions.update(session_ids - ended)
+            self._open_sessions.difference_update(ended)
+            self._invalidate(session_ids, start, end)
+
+    def invalidate(
+        self,
+        session_ids: Optional[set[uuid.UUID]],
+        start: datetime,
+        end: datetime,
+    ) -> None:
+        """Evicts the responses which change by storing or deleting messages of the sessions, or of all sessions
+        when None, between start and end."""
+        with self._lock:
+            self._invalidate(session_ids, local_naive(start), local_naive(end))
+
+    def _invalidate(
+        self, session_ids: Optional[set[uuid.UUID]], start: datetime, end: datetime
+    ) -> None:
+        for computation in self._computations:
+            if computation.scope.affected_by(session_ids, start, end):
+                computation.invalidated = True
+
+        if session_ids is None:
+            keys = list(self._entries)
+        else:
+            keys = list(self._all_sessions)
+            for session_id in session_ids:
+                keys.extend(self._by_session.get(session_id, ()))
+        for key in keys:
+            if self._entries[key].scope.affected_by(session_ids, start, end):
+                self._remove(key)
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "open_sessions": len(self._open_sessions),
+            }
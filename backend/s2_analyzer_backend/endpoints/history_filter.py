@@ -1,18 +1,76 @@
+import json
+import re
 import uuid
 from fastapi import HTTPException, Depends
-from typing import Optional, List
+from typing import Literal, Optional, List
 from datetime import datetime
 import logging
+from sqlalchemy import literal_column, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import selectinload
 from sqlmodel import Session, select, func
 from s2_analyzer_backend.device_connection.session_details import SessionDetails
 from s2_analyzer_backend.message_processor.database import (
     Communication,
+    CommunicationWithValidationErrors,
+    MessageBody,
+    MessageField,
+    MessageIndexPath,
+    MESSAGE_SEARCH_TABLE,
+    ValidationErrorCount,
+    ValidationErrorSignature,
+    message_search,
+    search_errors_text,
     get_session,
+    load_validation_errors,
     serialize_communication_with_validation_errors,
 )
 
 LOGGER = logging.getLogger(__name__)
 
+HISTORY_BATCH_SIZE = 500
+
+SearchColumn = Literal["message", "errors"]
+FTS_OPERATORS = {"AND", "OR", "NOT", "NEAR"}
+
+
+def _load_message_body():
+    return selectinload(Communication.body).selectinload(MessageBody.dictionary)
+
+
+def search_snippet(text: str, words: List[str], width: int = 60) -> str:
+    """The text around the first occurrence of one of the words, with the word between brackets."""
+    lowered = text.lower()
+    occurrences = [
+        (position, len(word))
+        for word in words
+        if (position := lowered.find(word.lower())) >= 0
+    ]
+    if not occurrences:
+        return text[: 2 * width]
+    position, length = min(occurrences)
+    start = max(0, position - width)
+    end = min(len(text), position + length + width)
+    return (
+        ("..." if start > 0 else "")
+        + text[start:position]
+        + "["
+        + text[position : position + length]
+        + "]"
+        + text[position + length : end]
+        + ("..." if end < len(text) else "")
+    )
+
+
+def build_search_query(query: str, column: Optional[SearchColumn] = None) -> str:
+    """Turns plain text into an FTS5 query which matches the messages containing all words of the text. Every word
+    is quoted, so punctuation inside a word, as in ids and field names, matches literally.
+    """
+    phrases = ['"' + word.replace('"', '""') + '"' for word in query.split()]
+    if column is not None:
+        phrases = [f"{column} : {phrase}" for phrase in phrases]
+    return " AND ".join(phrases)
+
 
 class HistoryFilter:
     """Utility class used to perform queries on the Communication database table."""
@@ -29,7 +87,11 @@ class HistoryFilter:
         s2_msg_type: Optional[str] = None,
         start_date: Optional[datetime] = None,
         end_date: Optional[datetime] = None,
+        fields: Optional[List[tuple[str, str]]] = None,
     ) -> List[Communication]:
+        """Returns the messages which match all given filters. `fields` filters on (path, value) pairs of values
+        inside the S2 messages, which are looked up in the message index, so the paths must be indexed.
+        """
         try:
             query = select(Communication)
 
@@ -53,6 +115,16 @@ class HistoryFilter:
             if end_date:
                 query = query.where(Communication.timestamp <= end_date)
 
+            for path, value in fields or []:
+                query = query.where(
+                    Communication.id.in_(
+                        select(MessageField.communication_id)
+                        .where(MessageField.path == path)
+                        .where(MessageField.value == value)
+                    )
+                )
+
+            query = query.options(load_validation_errors(), _load_message_body())
             results = []
             for comm in self.session.exec(query).all():
                 results.append(
@@ -65,57 +137,234 @@ class HistoryFilter:
             LOGGER.error(f"Error in get_filtered_records: {str(e)}")
             raise HTTPException(status_code=500, detail="Internal Server Error")
 
-    def get_s2_session_history(self, session_id: uuid.UUID):
-        query = select(Communication).where(Communication.session_id == session_id)
+    def get_s2_session_history(
+        self, session_id: uuid.UUID, batch_size: int = HISTORY_BATCH_SIZE
+    ):
+        """Streams the messages of a session in the order they were stored.
 
-        for comm in self.session.exec(query).all():
-            data = serialize_communication_with_validation_errors(comm)
-            yield data
+        The messages are read in batches by id, so that a long session is never loaded at once and no read
+        transaction is held open between the batches, which would block the storage of new messages.
+        """
+        after_id: Optional[int] = 0
+        while after_id is not None:
+            batch, after_id = self.get_s2_session_history_batch(
+                session_id, after_id, batch_size
+            )
+            yield from batch
 
-    def get_unique_sessions(self) -> List[SessionDetails]:
+    def get_s2_session_history_batch(
+        self,
+        session_id: uuid.UUID,
+        after_id: int = 0,
+        batch_size: int = HISTORY_BATCH_SIZE,
+    ) -> tuple[List[CommunicationWithValidationErrors], Optional[int]]:
+        """Reads the next batch of the messages of a session, those stored after the message with id `after_id`.
+
+        Returns the messages and the id to read the following batch after, which is None after the last batch. A
+        single batch can be read in an executor, so that neither the query nor the decompression of the message
+        bodies blocks the event loop.
         """
-        Retrieves unique sessions with start and end timestamps,
-        ordered by end timestamp.
+        query = (
+            select(Communication)
+            .where(Communication.session_id == session_id)
+            .where(Communication.id > after_id)
+            .order_by(Communication.id)
+            .limit(batch_size)
+            .options(load_validation_errors(), _load_message_body())
+        )
+        batch = self.session.exec(query).all()
+        messages = [
+            serialize_communication_with_validation_errors(comm) for comm in batch
+        ]
+        if len(batch) < batch_size:
+            return messages, None
+        return messages, batch[-1].id
+
+    def search(
+        self,
+        query: str,
+        column: Optional[SearchColumn] = None,
+        session_id: Optional[uuid.UUID] = None,
+        limit: int = 50,
+        offset: int = 0,
+        fts_syntax: bool = False,
+    ) -> dict:
+        """Searches the full-text index of the messages and their validation errors. The results are ranked by
+        relevance (BM25), best first, and each has a snippet of the matching text.
+
+        The query holds words which must all occur, or is an FTS5 query when `fts_syntax` is set. With a column only
+        the messages or only their validation errors are searched.
         """
-        statement = select(Communication.session_id).distinct()
-        unique_session_ids: List[uuid.UUID] = self.session.exec(statement).all()
-
-        session_details: List[SessionDetails] = []
-        for session_id in unique_session_ids:
-            # Get start and end timestamps
-            start_statement = select(func.min(Communication.timestamp)).where(
-                Communication.session_id == session_id
-            )
-            start_timestamp: datetime = self.session.exec(start_statement).first()
+        match = query if fts_syntax else build_search_query(query, column)
+        if fts_syntax and column is not None:
+            match = f"{column} : ({query})"
+        if not match.strip():
+            raise HTTPException(status_code=400, detail="Empty search query.")
 
-            end_statement = select(func.max(Communication.timestamp)).where(
-                Communication.session_id == session_id
+        matches = (
+            select(
+                message_search.c.rowid,
+                literal_column(f"bm25({MESSAGE_SEARCH_TABLE})").label("rank"),
             )
-            end_timestamp: datetime = self.session.exec(end_statement).first()
+            .select_from(message_search)
+            .where(text(f"{MESSAGE_SEARCH_TABLE} MATCH :match").bindparams(match=match))
+        )
+        if session_id is not None:
+            matches = matches.join(
+                Communication, Communication.id == message_search.c.rowid
+            ).where(Communication.session_id == session_id)
 
-            communication_statement = (
+        try:
+            total = self.session.exec(
+                select(func.count()).select_from(matches.subquery())
+            ).one()
+            page = self.session.exec(
+                matches.order_by(literal_column("rank"), message_search.c.rowid.desc())
+                .limit(limit)
+                .offset(offset)
+            ).all()
+        except OperationalError as e:
+            # Malformed FTS5 queries are only detected by SQLite.
+            raise HTTPException(
+                status_code=400, detail=f"Invalid search query: {e.orig}"
+            ) from e
+
+        communications = {
+            comm.id: comm
+            for comm in self.session.exec(
                 select(Communication)
-                .where(Communication.session_id == session_id)
-                .limit(1)
+                .where(Communication.id.in_([row.rowid for row in page]))
+                .options(load_validation_errors(), _load_message_body())
             )
-            communication = self.session.exec(communication_statement).first()
-
-            if (
-                communication
-                and start_timestamp
-                and end_timestamp
-            ):
-                session_details.append(
-                    SessionDetails(
-                        session_id=communication.session_id,
-                        cem_id=communication.cem_id,
-                        rm_id=communication.rm_id,
-                        start_timestamp=start_timestamp,
-                        end_timestamp=end_timestamp,
-                        state="closed",
-                    )
-                )
+        }
+        # The index holds no copy of the messages, so the snippets are made from the messages themselves.
+        if fts_syntax:
+            words = [
+                word
+                for word in re.findall(r"[\w-]+", query)
+                if word not in FTS_OPERATORS
+            ]
+        else:
+            words = query.split()
+
+        def snippet(comm: Communication) -> str:
+            texts = []
+            if column in (None, "message"):
+                texts.append(json.dumps(comm.get_s2_msg()))
+            if column in (None, "errors"):
+                texts.append(search_errors_text(comm.get_validation_errors()))
+            return search_snippet("\n".join(texts), words)
+
+        return {
+            "query": match,
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "results": [
+                {
+                    "id": row.rowid,
+                    "score": -row.rank,
+                    "snippet": snippet(communications[row.rowid]),
+                    "message": serialize_communication_with_validation_errors(
+                        communications[row.rowid]
+                    ).model_dump(),
+                }
+                for row in page
+                if row.rowid in communications
+            ],
+        }
 
-        # Sort by end_timestamp
-        session_details.sort(key=lambda x: x.end_timestamp, reverse=True)
-        return session_details
\ No newline at end of file
+    def get_indexed_paths(self) -> List[MessageIndexPath]:
+        """Lists the indexed paths inside the S2 messages with the progress of indexing the older messages."""
+        return list(self.session.exec(select(MessageIndexPath)))
+
+    def get_validation_error_counts(
+        self,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        session_id: Optional[uuid.UUID] = None,
+        limit: int = 20,
+    ) -> dict:
+        """The validation error signatures which occurred most often, with the number of errors and of sessions.
+        Counted from the hourly counters, so the range is extended to whole hours.
+        """
+        count = func.sum(ValidationErrorCount.count).label("count")
+        query = select(
+            ValidationErrorSignature,
+            count,
+            func.count(func.distinct(ValidationErrorCount.session_id)).label(
+                "sessions"
+            ),
+            func.min(ValidationErrorCount.hour).label("first_hour"),
+            func.max(ValidationErrorCount.hour).label("last_hour"),
+        ).join(
+            ValidationErrorCount,
+            ValidationErrorCount.signature_id == ValidationErrorSignature.id,
+        )
+        total_query = select(func.sum(ValidationErrorCount.count))
+        conditions = []
+        if start_date is not None:
+            conditions.append(
+                ValidationErrorCount.hour
+                >= start_date.replace(minute=0, second=0, microsecond=0)
+            )
+        if end_date is not None:
+            conditions.append(ValidationErrorCount.hour <= end_date)
+        if session_id is not None:
+            conditions.append(ValidationErrorCount.session_id == session_id)
+        for condition in conditions:
+            query = query.where(condition)
+            total_query = total_query.where(condition)
+
+        rows = self.session.exec(
+            query.group_by(ValidationErrorSignature.id)
+            .order_by(count.desc(), ValidationErrorSignature.id)
+            .limit(limit)
+        ).all()
+        return {
+            "total": self.session.exec(total_query).one() or 0,
+            "signatures": [
+                {
+                    "signature_id": signature.id,
+                    "type": signature.type,
+                    "loc": signature.loc,
+                    "msg": signature.msg,
+                    "count": row_count,
+                    "sessions": sessions,
+                    "first_hour": first_hour,
+                    "last_hour": last_hour,
+                }
+                for signature, row_count, sessions, first_hour, last_hour in rows
+            ],
+        }
+
+    def get_unique_sessions(self) -> List[SessionDetails]:
+        """
+        Retrieves unique sessions with start and end timestamps,
+        ordered by end timestamp.
+        """
+        end_timestamp = func.max(Communication.timestamp)
+        statement = (
+            select(
+                Communication.session_id,
+                func.min(Communication.cem_id),
+                func.min(Communication.rm_id),
+                func.min(Communication.timestamp),
+                end_timestamp,
+            )
+            .group_by(Communication.session_id)
+            .order_by(end_timestamp.desc())
+        )
+        return [
+            SessionDetails(
+                session_id=session_id,
+                cem_id=cem_id,
+                rm_id=rm_id,
+                start_timestamp=start_timestamp,
+                end_timestamp=end_timestamp,
+                state="closed",
+            )
+            for session_id, cem_id, rm_id, start_timestamp, end_timestamp in self.session.exec(
+                statement
+            )
+        ]
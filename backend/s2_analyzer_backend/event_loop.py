@@ -0,0 +1,174 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from enum import Enum
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from s2_analyzer_backend.config import EventLoopConfig
+
+# uvloop is optional and not available on every platform.
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+LOGGER = logging.getLogger(__name__)
+
+
+class LoopPolicy(str, Enum):
+    # uvloop when it is installed, the default asyncio loop otherwise.
+    AUTO = "auto"
+    ASYNCIO = "asyncio"
+    UVLOOP = "uvloop"
+
+
+def create_event_loop(config: "EventLoopConfig") -> asyncio.AbstractEventLoop:
+    """Creates the event loop for all applications according to the configured policy and tuning."""
+    policy = LoopPolicy(config.policy)
+    if policy == LoopPolicy.UVLOOP and uvloop is None:
+        raise RuntimeError("Event loop policy is uvloop but uvloop is not installed.")
+
+    if policy != LoopPolicy.ASYNCIO and uvloop is not None:
+        loop = uvloop.new_event_loop()
+    else:
+        loop = asyncio.new_event_loop()
+
+    if config.executor_workers is not None:
+        loop.set_default_executor(
+            ThreadPoolExecutor(
+                max_workers=config.executor_workers,
+                thread_name_prefix="s2-analyzer-executor",
+            )
+        )
+
+    loop.set_debug(config.debug)
+    if config.slow_callback_threshold > 0:
+        # Only used by asyncio in debug mode, which then logs each slow callback next to the monitor's stacks.
+        loop.slow_callback_duration = config.slow_callback_threshold
+
+    LOGGER.info(
+        "Created event loop %s (debug: %s, executor workers: %s)",
+        type(loop).__module__,
+        config.debug,
+        config.executor_workers or "default",
+    )
+    return loop
+
+
+@dataclass
+class StallSample:
+    """Stack of the loop thread taken while the event loop was blocked."""
+
+    detected_at: datetime
+    blocked_for: float
+    stack: list[str]
+
+
+class EventLoopMonitor:
+    """
+    Continuously measures the lag of the event loop and takes a stack sample of the loop thread when it stalls.
+
+    A heartbeat is scheduled on the loop every `interval` seconds. The lag is how much later than scheduled the
+    heartbeat runs. A separate thread checks the heartbeat and takes the stack of the loop thread if it is late by
+    more than the stall threshold. Each stall is logged and sampled once.
+    """
+
+    RECENT_STALLS = 20
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        interval: float = 0.1,
+        stall_threshold: float = 0.5,
+    ) -> None:
+        self.loop = loop
+        self.interval = interval
+        # Stacks are only sampled when larger than 0.
+        self.stall_threshold = stall_threshold
+        self.current_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.beats = 0
+        self.stalls = 0
+        self.recent_stalls: deque[StallSample] = deque(maxlen=self.RECENT_STALLS)
+        self._last_beat = time.monotonic()
+        self._reported_beat: Optional[float] = None
+        self.loop_thread_id: Optional[int] = None
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(
+            target=self._watch, name="s2-analyzer-loop-monitor", daemon=True
+        )
+
+    def start(self) -> None:
+        """Starts monitoring. May be called before the loop runs."""
+        self.loop.call_soon_threadsafe(self._first_beat)
+        if self.stall_threshold > 0:
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stops monitoring. The pending heartbeat is dropped when the loop closes."""
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    @property
+    def average_lag(self) -> float:
+        return self.total_lag / self.beats if self.beats else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "current_lag": self.current_lag,
+            "average_lag": self.average_lag,
+            "max_lag": self.max_lag,
+            "stall_threshold": self.stall_threshold,
+            "stalls": self.stalls,
+            "recent_stalls": [asdict(stall) for stall in self.recent_stalls],
+        }
+
+    def _first_beat(self) -> None:
+        self.loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self.loop.call_later(self.interval, self._beat)
+
+    def _beat(self) -> None:
+        now = time.monotonic()
+        lag = max(0.0, now - self._last_beat - self.interval)
+        self._last_beat = now
+        self.current_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.total_lag += lag
+        self.beats += 1
+        if not self._stop_event.is_set():
+            self.loop.call_later(self.interval, self._beat)
+
+    def _watch(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            last_beat = self._last_beat
+            blocked_for = time.monotonic() - last_beat - self.interval
+            if (
+                blocked_for > self.stall_threshold
+                and last_beat != self._reported_beat
+                and self.loop_thread_id is not None
+                and self.loop.is_running()
+            ):
+                self._reported_beat = last_beat
+                self._sample_stall(blocked_for)
+
+    def _sample_stall(self, blocked_for: float) -> None:
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = traceback.format_stack(frame) if frame else []
+        self.stalls += 1
+        self.recent_stalls.append(StallSample(datetime.now(), blocked_for, stack))
+        LOGGER.warning(
+            "Event loop is blocked for more than %.3f seconds. Stack of the blocking callback:\n%s",
+            blocked_for,
+            "".join(stack),
+        )
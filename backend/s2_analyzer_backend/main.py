@@ -1,79 +1,189 @@
-import argparse
+from datetime import timedelta
 import logging
 import logging.config
-import os
 import signal
-import threading
-
-from s2_analyzer_backend.message_processor.database import create_db_and_tables, engine
-from s2_analyzer_backend.message_processor.message_processor import (
-    DebuggerFrontendMessageProcessor,
-    MessageLoggerProcessor,
-    MessageProcessorHandler,
-    MessageParserProcessor,
-    MessageProcessorHandlerBuilder,
-    MessageStorageProcessor,
-    SessionUpdateMessageProcessor,
-)
-from s2_analyzer_backend.rest_apis.rest_api import RestAPI
+
 from s2_analyzer_backend.async_application import APPLICATIONS
 from s2_analyzer_backend.app_logging import get_log_config
-from s2_analyzer_backend.device_connection.router import MessageRouter
-from s2_analyzer_backend.config import CONFIG
+from s2_analyzer_backend.config import read_s2_analyzer_conf
+from s2_analyzer_backend.event_loop import EventLoopMonitor, create_event_loop
 
 LOGGER = logging.getLogger(__name__)
 
-log_config = get_log_config()
-logging.config.dictConfig(get_log_config())
-
 
 def main():
+    logging.config.dictConfig(get_log_config())
+    config = read_s2_analyzer_conf()
+
+    # The subsystems are imported here instead of at the top of the module, so that importing this module stays
+    # cheap and the startup cost of each subsystem is paid explicitly in startup order.
+    from s2_analyzer_backend.message_processor.database import (
+        create_db_and_tables,
+        get_engine,
+    )
+    from s2_analyzer_backend.message_processor.message_processor import (
+        DebuggerFrontendMessageProcessor,
+        MessageLoggerProcessor,
+        MessageParserProcessor,
+        MessageProcessorHandlerBuilder,
+        MessageStorageProcessor,
+        SessionUpdateMessageProcessor,
+    )
+    from s2_analyzer_backend.message_processor.session_statistics import (
+        SessionStatisticsProcessor,
+    )
+    from s2_analyzer_backend.message_processor.time_series import TimeSeriesProcessor
+    from s2_analyzer_backend.message_processor.conformance import ConformanceProcessor
+    from s2_analyzer_backend.message_processor.message_body import MessageBodyStore
+    from s2_analyzer_backend.message_processor.validation_errors import (
+        ValidationErrorStore,
+    )
+    from s2_analyzer_backend.message_processor.message_index import (
+        MessageIndex,
+        MessageIndexBackfill,
+    )
+    from s2_analyzer_backend.message_processor.history_maintenance import (
+        HistoryMaintenance,
+    )
+    from s2_analyzer_backend.device_connection.router import MessageRouter
+    from s2_analyzer_backend.device_connection.envelope_buffer import (
+        create_envelope_buffer,
+    )
+    from s2_analyzer_backend.endpoints.history_cache import HistoryResponseCache
+    from s2_analyzer_backend.rest_apis.rest_api import RestAPI
+    from s2_analyzer_backend.message_processor.s2_validators import S2_VALIDATORS
+
+    APPLICATIONS.use_event_loop(create_event_loop(config.event_loop))
+    # Measures the event loop lag and samples the stack of whatever blocks the loop.
+    loop_monitor = EventLoopMonitor(
+        APPLICATIONS.loop,
+        config.event_loop.monitor_interval,
+        config.event_loop.slow_callback_threshold,
+    )
 
     # Initialise and create the database tables in an SQLite db
     create_db_and_tables()
+    message_index = MessageIndex(config.message_index.paths)
+    message_index.register(get_engine())
+
+    # Run every S2 validator once, so the first messages after a restart are not slower.
+    S2_VALIDATORS.warm_up()
 
     debugger_frontend_msg_processor = DebuggerFrontendMessageProcessor()
-    session_update_msg_processor = SessionUpdateMessageProcessor()
+    session_statistics = SessionStatisticsProcessor(
+        config.statistics.max_closed_sessions,
+        config.statistics.relative_accuracy,
+    )
+    time_series = TimeSeriesProcessor(
+        get_engine(),
+        config.time_series.flush_size,
+        config.time_series.flush_interval,
+        (
+            timedelta(days=config.retention.time_series_raw_max_age_days)
+            if config.retention.time_series_raw_max_age_days is not None
+            else None
+        ),
+    )
+    conformance = ConformanceProcessor(
+        config.conformance.reception_status_timeout,
+        config.conformance.max_outstanding,
+        config.conformance.max_violations,
+        config.conformance.max_closed_sessions,
+    )
+    session_update_msg_processor = SessionUpdateMessageProcessor(
+        session_statistics,
+        config.statistics.push_interval,
+        config.session_updates.coalesce_interval,
+        config.session_updates.journal_size,
+    )
+    body_store = MessageBodyStore(
+        config.storage.compression_level,
+        config.storage.dictionary_samples,
+        config.storage.max_known_bodies,
+    )
+    # Responses of history queries which do not change anymore, evicted when messages are stored or deleted.
+    response_cache = HistoryResponseCache(config.response_cache.max_bytes)
+    # Deletes the expired history and compacts the database in the background.
+    maintenance = HistoryMaintenance(get_engine(), config.retention, response_cache)
     builder = MessageProcessorHandlerBuilder()
 
     # ! Order of the processors matters!
     msg_processor_handler = (
         builder.with_message_processor(MessageLoggerProcessor())
         .with_message_processor(MessageParserProcessor())
-        .with_message_processor(MessageStorageProcessor(engine))
+        .with_message_processor(session_statistics)
+        .with_message_processor(conformance)
+        .with_message_processor(
+            MessageStorageProcessor(
+                get_engine(),
+                message_index,
+                body_store,
+                ValidationErrorStore(config.storage.max_known_error_signatures),
+                response_cache,
+                config.storage.batch_size,
+            )
+        )
+        .with_message_processor(time_series)
         .with_message_processor(debugger_frontend_msg_processor)
         .with_message_processor(session_update_msg_processor)
+        .with_shutdown_backlog(config.shutdown.backlog_path)
         .build()
     )
 
     # Routes received from a CEM or RM device to the destination device.
-    msg_router = MessageRouter(msg_processor_handler=msg_processor_handler)
+    msg_router = MessageRouter(
+        msg_processor_handler=msg_processor_handler,
+        envelope_buffer=create_envelope_buffer(config.buffer),
+        session_statistics=session_statistics,
+    )
 
     # Start the RestAPI server. This will receive the websocket connections from the CEM and RM devices.
     # It also handles the debugger frontend connections and the RestAPI endpoints
     APPLICATIONS.add_and_start_application(
         RestAPI(
-            CONFIG.http_listen_address,
-            CONFIG.http_port,
+            config.http_listen_address,
+            config.http_port,
             msg_router,
             debugger_frontend_msg_processor,
             session_update_msg_processor,
+            session_statistics,
+            time_series,
+            conformance,
+            maintenance,
+            response_cache,
+            config,
+            loop_monitor,
         )
     )
 
+    # Index the content of the messages stored before their paths were indexed.
+    APPLICATIONS.add_and_start_application(
+        MessageIndexBackfill(
+            get_engine(), message_index, config.message_index.backfill_batch_size
+        )
+    )
+
+    APPLICATIONS.add_and_start_application(maintenance)
+
     # MEssage Processor Handler Runs on it's own thread so that it doesn't block the routing of messages.
     APPLICATIONS.add_and_start_application(msg_processor_handler)
 
-    # Handle exit conditions.
+    # Handle exit conditions. All applications are stopped and the message processing is drained within this time.
+    APPLICATIONS.shutdown_timeout = config.shutdown.timeout
+
     def handle_exit(sig, frame):
         LOGGER.info("Received stop from signal to stop.")
-        threading.Thread(target=APPLICATIONS.stop).start()
+        APPLICATIONS.stop()
 
     signal.signal(signal.SIGINT, handle_exit)
     signal.signal(signal.SIGTERM, handle_exit)
     signal.signal(signal.SIGQUIT, handle_exit)
 
-    APPLICATIONS.run_all()
+    loop_monitor.start()
+    try:
+        APPLICATIONS.run_all()
+    finally:
+        loop_monitor.stop()
 
 
 if __name__ == "__main__":
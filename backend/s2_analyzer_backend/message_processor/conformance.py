@@ -0,0 +1,464 @@
+import asyncio
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from enum import Enum
+import logging
+from typing import Optional
+import uuid
+
+from s2_analyzer_backend.app_logging import MESSAGES_LOGGER_NAME
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+from s2_analyzer_backend.message_processor.message import Message
+from s2_analyzer_backend.message_processor.message_processor import MessageProcessor
+from s2_analyzer_backend.message_processor.message_type import MessageType
+
+LOGGER = logging.getLogger(__name__)
+MESSAGES_LOGGER = logging.getLogger(MESSAGES_LOGGER_NAME)
+
+
+class ConformanceRule(str, Enum):
+    # A device sent another message before its Handshake.
+    HANDSHAKE_FIRST = "handshake_first"
+    # A message type which is only sent by the other role, e.g. an instruction sent by the RM.
+    WRONG_DIRECTION = "wrong_direction"
+    # A message_id that is still waiting for its ReceptionStatus was used again.
+    DUPLICATE_MESSAGE_ID = "duplicate_message_id"
+    # No ReceptionStatus within the timeout or before the session ended.
+    RECEPTION_STATUS_MISSING = "reception_status_missing"
+    # A ReceptionStatus for a message that was not sent or was already acknowledged.
+    RECEPTION_STATUS_UNKNOWN_SUBJECT = "reception_status_unknown_subject"
+    # A message was rejected by the receiving device.
+    RECEPTION_STATUS_NOT_OK = "reception_status_not_ok"
+    # The CEM selected a control type the RM does not offer.
+    CONTROL_TYPE_NOT_AVAILABLE = "control_type_not_available"
+    # A message of a control type that is not selected.
+    CONTROL_TYPE_NOT_SELECTED = "control_type_not_selected"
+    # An actuator or operation mode which is not in the system description.
+    UNKNOWN_SYSTEM_DESCRIPTION_REFERENCE = "unknown_system_description_reference"
+    # An InstructionStatusUpdate of an instruction that was not sent.
+    UNKNOWN_INSTRUCTION = "unknown_instruction"
+    # More messages waiting for their ReceptionStatus than tracked per session. Later messages are not tracked.
+    TOO_MANY_OUTSTANDING = "too_many_outstanding"
+
+
+# The role which sends the message types that are not sent by both.
+SENT_BY = {
+    "HandshakeResponse": S2OriginType.CEM,
+    "SelectControlType": S2OriginType.CEM,
+    "RevokeObject": S2OriginType.CEM,
+    "FRBC.Instruction": S2OriginType.CEM,
+    "PPBC.ScheduleInstruction": S2OriginType.CEM,
+    "ResourceManagerDetails": S2OriginType.RM,
+    "PowerMeasurement": S2OriginType.RM,
+    "PowerForecast": S2OriginType.RM,
+    "InstructionStatusUpdate": S2OriginType.RM,
+    "FRBC.ActuatorStatus": S2OriginType.RM,
+    "FRBC.FillLevelTargetProfile": S2OriginType.RM,
+    "FRBC.LeakageBehaviour": S2OriginType.RM,
+    "FRBC.StorageStatus": S2OriginType.RM,
+    "FRBC.SystemDescription": S2OriginType.RM,
+    "FRBC.TimerStatus": S2OriginType.RM,
+    "FRBC.UsageForecast": S2OriginType.RM,
+}
+
+# The control type of the message types of a control type, by message type prefix.
+CONTROL_TYPE_PREFIXES = {
+    "FRBC": "FILL_RATE_BASED_CONTROL",
+    "PPBC": "POWER_PROFILE_BASED_CONTROL",
+    "OMBC": "OPERATION_MODE_BASED_CONTROL",
+    "PEBC": "POWER_ENVELOPE_BASED_CONTROL",
+    "DDBC": "DEMAND_DRIVEN_BASED_CONTROL",
+}
+
+# Message types which are allowed before the Handshake of the sender.
+BEFORE_HANDSHAKE = ("Handshake", "ReceptionStatus")
+
+
+@dataclass
+class ConformanceViolation:
+    session_id: uuid.UUID
+    rule: ConformanceRule
+    origin: S2OriginType
+    message_type: Optional[str]
+    message_id: Optional[str]
+    detail: str
+    timestamp: datetime
+
+    def as_dict(self) -> dict:
+        return {
+            "session_id": str(self.session_id),
+            "rule": self.rule.value,
+            "origin": self.origin.value,
+            "message_type": self.message_type,
+            "message_id": self.message_id,
+            "detail": self.detail,
+            "timestamp": self.timestamp,
+        }
+
+
+@dataclass
+class _Outstanding:
+    """A message waiting for its ReceptionStatus."""
+
+    session: "SessionConformance"
+    origin: S2OriginType
+    message_type: Optional[str]
+    message_id: str
+    deadline: datetime
+
+
+@dataclass
+class SessionConformance:
+    """Protocol state of a single session. The tracked ids are bounded, so it uses bounded memory."""
+
+    session_id: uuid.UUID
+    cem_id: str
+    rm_id: str
+    state: str = "open"
+    handshakes: set[S2OriginType] = field(default_factory=set)
+    available_control_types: Optional[list[str]] = None
+    selected_control_type: Optional[str] = None
+    # Operation mode ids per actuator id of the last FRBC.SystemDescription.
+    actuators: Optional[dict[str, set[str]]] = None
+    # The ids of the most recent instructions, as an ordered set.
+    instructions: OrderedDict = field(default_factory=OrderedDict)
+    # The message_ids waiting for their ReceptionStatus.
+    outstanding: set[str] = field(default_factory=set)
+    # Set when more messages waited than tracked, until the outstanding messages are acknowledged.
+    overflowed: bool = False
+    messages: int = 0
+    violation_counts: dict[str, int] = field(default_factory=dict)
+    violations: deque = field(default_factory=deque)
+
+    def as_dict(self, include_violations: bool = False) -> dict:
+        result = {
+            "session_id": str(self.session_id),
+            "cem_id": self.cem_id,
+            "rm_id": self.rm_id,
+            "state": self.state,
+            "messages": self.messages,
+            "violations": sum(self.violation_counts.values()),
+            "violation_counts": dict(self.violation_counts),
+            "outstanding_reception_statuses": len(self.outstanding),
+            "handshakes": sorted(origin.value for origin in self.handshakes),
+            "available_control_types": self.available_control_types,
+            "selected_control_type": self.selected_control_type,
+        }
+        if include_violations:
+            result["recent_violations"] = [
+                violation.as_dict() for violation in self.violations
+            ]
+        return result
+
+
+def _normalize_id(value) -> Optional[str]:
+    return str(value).lower() if value is not None else None
+
+
+class ConformanceProcessor(MessageProcessor):
+    """
+    A MessageProcessor which checks the S2 protocol rules that span more than one message, e.g. that every message
+    is acknowledged with a ReceptionStatus and that instructions reference the system description. Checks the raw
+    messages, so invalid messages count as well. Violations are logged and kept per session.
+
+    Every message is checked against the protocol state of its session in constant time. The messages waiting for
+    their ReceptionStatus are kept in a single ordered dict in the order of their deadlines, so expired messages are
+    found at its front. Time is the timestamp of the processed messages, so replays and processing delays do not
+    cause false timeouts. A missing ReceptionStatus is therefore flagged once a later message of any session is
+    processed, or when the session ends.
+    """
+
+    # Number of recent violations of all sessions that are kept.
+    MAX_RECENT_VIOLATIONS = 1000
+    # Number of recent instruction ids per session to which status updates may refer.
+    MAX_INSTRUCTIONS = 1000
+
+    def __init__(
+        self,
+        reception_status_timeout: float = 5.0,
+        max_outstanding: int = 1000,
+        max_violations: int = 100,
+        max_closed_sessions: int = 1000,
+    ):
+        self.reception_status_timeout = timedelta(seconds=reception_status_timeout)
+        self.max_outstanding = max_outstanding
+        self.max_violations = max_violations
+        self.max_closed_sessions = max_closed_sessions
+        self.sessions: dict[uuid.UUID, SessionConformance] = {}
+        # The most recent violations of all sessions, newest last.
+        self.recent_violations: deque[ConformanceViolation] = deque(
+            maxlen=ConformanceProcessor.MAX_RECENT_VIOLATIONS
+        )
+        self._outstanding: OrderedDict[tuple[uuid.UUID, str], _Outstanding] = (
+            OrderedDict()
+        )
+        self._closed_sessions: deque[uuid.UUID] = deque()
+
+    def _get_session(self, message: Message) -> SessionConformance:
+        session = self.sessions.get(message.session_id)
+        if session is None:
+            session = SessionConformance(
+                message.session_id,
+                message.cem_id,
+                message.rm_id,
+                violations=deque(maxlen=self.max_violations),
+            )
+            self.sessions[message.session_id] = session
+        return session
+
+    def _flag(
+        self,
+        session: SessionConformance,
+        rule: ConformanceRule,
+        origin: S2OriginType,
+        message_type: Optional[str],
+        message_id: Optional[str],
+        detail: str,
+        timestamp: datetime,
+    ) -> None:
+        violation = ConformanceViolation(
+            session.session_id,
+            rule,
+            origin,
+            message_type,
+            message_id,
+            detail,
+            timestamp,
+        )
+        session.violation_counts[rule.value] = (
+            session.violation_counts.get(rule.value, 0) + 1
+        )
+        session.violations.append(violation)
+        self.recent_violations.append(violation)
+        MESSAGES_LOGGER.warning(
+            "S2 protocol violation %s in session %s by %s: %s",
+            rule.value,
+            session.session_id,
+            origin.value,
+            detail,
+        )
+
+    async def process_message(
+        self, message: Message, loop: asyncio.AbstractEventLoop
+    ) -> Message:
+        timestamp = message.timestamp or datetime.now()
+        self._expire(timestamp)
+
+        if message.message_type == MessageType.SESSION_STARTED:
+            self._get_session(message)
+        elif message.message_type == MessageType.SESSION_ENDED:
+            self._close_session(message.session_id, timestamp)
+        elif message.message_type == MessageType.S2 and isinstance(message.msg, dict):
+            self._check(self._get_session(message), message, timestamp)
+        return message
+
+    def _check(
+        self, session: SessionConformance, message: Message, timestamp: datetime
+    ) -> None:
+        msg = message.msg
+        origin = message.origin
+        message_type = msg.get("message_type")
+        message_id = _normalize_id(msg.get("message_id"))
+        session.messages += 1
+
+        def flag(rule: ConformanceRule, detail: str) -> None:
+            self._flag(
+                session, rule, origin, message_type, message_id, detail, timestamp
+            )
+
+        if message_type == "Handshake":
+            session.handshakes.add(origin)
+        elif origin not in session.handshakes and message_type not in BEFORE_HANDSHAKE:
+            # Only flagged once per device, all its messages would be flagged otherwise.
+            session.handshakes.add(origin)
+            flag(
+                ConformanceRule.HANDSHAKE_FIRST,
+                f"{message_type} sent before the Handshake of the {origin.value}.",
+            )
+
+        sender = SENT_BY.get(message_type)
+        if sender is not None and sender != origin:
+            flag(
+                ConformanceRule.WRONG_DIRECTION,
+                f"{message_type} is only sent by the {sender.value}.",
+            )
+
+        control_type = CONTROL_TYPE_PREFIXES.get(str(message_type).split(".")[0])
+        if control_type is not None and session.selected_control_type != control_type:
+            flag(
+                ConformanceRule.CONTROL_TYPE_NOT_SELECTED,
+                f"{message_type} while the selected control type is {session.selected_control_type}.",
+            )
+
+        if message_type == "ReceptionStatus":
+            self._check_reception_status(session, msg, flag)
+        elif message_id is not None:
+            self._track(session, origin, message_type, message_id, timestamp, flag)
+
+        if message_type == "ResourceManagerDetails":
+            session.available_control_types = list(
+                msg.get("available_control_types") or []
+            )
+        elif message_type == "SelectControlType":
+            session.selected_control_type = msg.get("control_type")
+            if (
+                session.available_control_types is not None
+                and session.selected_control_type
+                not in session.available_control_types + ["NO_SELECTION"]
+            ):
+                flag(
+                    ConformanceRule.CONTROL_TYPE_NOT_AVAILABLE,
+                    f"{session.selected_control_type} is not one of the available control types "
+                    f"{session.available_control_types}.",
+                )
+        elif message_type == "FRBC.SystemDescription":
+            session.actuators = {
+                _normalize_id(actuator.get("id")): {
+                    _normalize_id(operation_mode.get("id"))
+                    for operation_mode in actuator.get("operation_modes") or []
+                }
+                for actuator in msg.get("actuators") or []
+            }
+        elif message_type in ("FRBC.Instruction", "FRBC.ActuatorStatus"):
+            self._check_references(session, message_type, msg, flag)
+        elif message_type == "InstructionStatusUpdate":
+            instruction_id = _normalize_id(msg.get("instruction_id"))
+            if instruction_id not in session.instructions:
+                flag(
+                    ConformanceRule.UNKNOWN_INSTRUCTION,
+                    f"Status update of unknown instruction {instruction_id}.",
+                )
+
+    def _track(
+        self,
+        session: SessionConformance,
+        origin: S2OriginType,
+        message_type: Optional[str],
+        message_id: str,
+        timestamp: datetime,
+        flag,
+    ) -> None:
+        key = (session.session_id, message_id)
+        if key in self._outstanding:
+            flag(
+                ConformanceRule.DUPLICATE_MESSAGE_ID,
+                f"message_id {message_id} is still waiting for its ReceptionStatus.",
+            )
+            return
+        if len(session.outstanding) >= self.max_outstanding:
+            if not session.overflowed:
+                session.overflowed = True
+                flag(
+                    ConformanceRule.TOO_MANY_OUTSTANDING,
+                    f"More than {self.max_outstanding} messages wait for their ReceptionStatus.",
+                )
+            return
+
+        session.outstanding.add(message_id)
+        self._outstanding[key] = _Outstanding(
+            session,
+            origin,
+            message_type,
+            message_id,
+            timestamp + self.reception_status_timeout,
+        )
+
+    def _check_reception_status(
+        self, session: SessionConformance, msg: dict, flag
+    ) -> None:
+        subject_id = _normalize_id(msg.get("subject_message_id"))
+        outstanding = self._outstanding.pop((session.session_id, subject_id), None)
+        if outstanding is None and not session.overflowed:
+            flag(
+                ConformanceRule.RECEPTION_STATUS_UNKNOWN_SUBJECT,
+                f"ReceptionStatus of {subject_id}, which is not waiting for one.",
+            )
+        elif outstanding is not None:
+            self._acknowledged(session, subject_id)
+
+        if msg.get("status") not in (None, "OK"):
+            flag(
+                ConformanceRule.RECEPTION_STATUS_NOT_OK,
+                f"{outstanding.message_type if outstanding else 'Message'} {subject_id} was rejected with "
+                f"{msg.get('status')}: {msg.get('diagnostic_label')}",
+            )
+
+    def _check_references(
+        self, session: SessionConformance, message_type: str, msg: dict, flag
+    ) -> None:
+        actuator_id = _normalize_id(msg.get("actuator_id"))
+        if message_type == "FRBC.Instruction":
+            operation_mode_id = _normalize_id(msg.get("operation_mode"))
+            session.instructions[_normalize_id(msg.get("id"))] = None
+            if len(session.instructions) > ConformanceProcessor.MAX_INSTRUCTIONS:
+                session.instructions.popitem(last=False)
+        else:
+            operation_mode_id = _normalize_id(msg.get("active_operation_mode_id"))
+
+        if session.actuators is None:
+            flag(
+                ConformanceRule.UNKNOWN_SYSTEM_DESCRIPTION_REFERENCE,
+                f"{message_type} before any FRBC.SystemDescription.",
+            )
+        elif actuator_id not in session.actuators:
+            flag(
+                ConformanceRule.UNKNOWN_SYSTEM_DESCRIPTION_REFERENCE,
+                f"Actuator {actuator_id} is not in the FRBC.SystemDescription.",
+            )
+        elif operation_mode_id not in session.actuators[actuator_id]:
+            flag(
+                ConformanceRule.UNKNOWN_SYSTEM_DESCRIPTION_REFERENCE,
+                f"Operation mode {operation_mode_id} is not an operation mode of actuator {actuator_id}.",
+            )
+
+    def _expire(self, now: datetime) -> None:
+        """Flags the messages whose ReceptionStatus deadline passed. Amortized constant time per message, as
+        the outstanding messages are ordered by deadline."""
+        while self._outstanding:
+            key, outstanding = next(iter(self._outstanding.items()))
+            if outstanding.deadline > now:
+                return
+            del self._outstanding[key]
+            self._missing(
+                outstanding,
+                f"No ReceptionStatus within {self.reception_status_timeout.total_seconds()} seconds.",
+                outstanding.deadline,
+            )
+
+    def _acknowledged(self, session: SessionConformance, message_id: str) -> None:
+        session.outstanding.discard(message_id)
+        if not session.outstanding:
+            session.overflowed = False
+
+    def _missing(self, outstanding: _Outstanding, detail: str, timestamp: datetime):
+        session = outstanding.session
+        self._acknowledged(session, outstanding.message_id)
+        self._flag(
+            session,
+            ConformanceRule.RECEPTION_STATUS_MISSING,
+            outstanding.origin,
+            outstanding.message_type,
+            outstanding.message_id,
+            detail,
+            timestamp,
+        )
+
+    def _close_session(self, session_id: uuid.UUID, timestamp: datetime) -> None:
+        session = self.sessions.get(session_id)
+        if session is None or session.state == "closed":
+            return
+        session.state = "closed"
+        for message_id in list(session.outstanding):
+            self._missing(
+                self._outstanding.pop((session_id, message_id)),
+                "No ReceptionStatus before the session ended.",
+                timestamp,
+            )
+        # Only the summary and the violations are kept of closed sessions.
+        session.actuators = None
+        session.instructions = OrderedDict()
+
+        self._closed_sessions.append(session_id)
+        while len(self._closed_sessions) > self.max_closed_sessions:
+            self.sessions.pop(self._closed_sessions.popleft(), None)
@@ -1,9 +1,13 @@
-from datetime import datetime
+from datetime import date, datetime
+import functools
 import json
 import logging
 import os
 import uuid
-from sqlmodel import Field, Relationship, SQLModel, create_engine, Session
+import zlib
+from sqlalchemy import Engine, Index, column, event, inspect, table, text
+from sqlalchemy.orm import selectinload
+from sqlmodel import Field, Relationship, SQLModel, create_engine, Session, select
 from typing import Any, List, Optional, Dict
 
 from s2_analyzer_backend.message_processor.message_type import MessageType
@@ -27,28 +31,87 @@ class CommunicationBase(SQLModel):
     timestamp: datetime
 
 
+class MessageBodyDictionary(SQLModel, table=True):
+    """A zlib preset dictionary, made of sample bodies of a message type, with which the bodies of that message type
+    are compressed."""
+
+    id: int = Field(default=None, primary_key=True)
+    s2_msg_type: str
+    data: bytes
+
+
+class MessageBody(SQLModel, table=True):
+    """The zlib compressed canonical JSON of an S2 message without its message_id. Every distinct body is stored
+    once, the Communications refer to it by its hash."""
+
+    hash: str = Field(primary_key=True)
+    dictionary_id: Optional[int] = Field(
+        default=None, foreign_key="messagebodydictionary.id"
+    )
+    data: bytes
+
+    dictionary: Optional[MessageBodyDictionary] = Relationship()
+
+    def decode(self) -> Any:
+        if self.dictionary is None:
+            decompressor = zlib.decompressobj()
+        else:
+            decompressor = zlib.decompressobj(zdict=self.dictionary.data)
+        return json.loads(decompressor.decompress(self.data) + decompressor.flush())
+
+
 class Communication(CommunicationBase, table=True):
+    __table_args__ = (
+        # The messages of a session are read in id order, e.g. to send the history of a session.
+        Index("ix_communication_session", "session_id", "id"),
+        # The history maintenance deletes the messages by type and age, and the bodies no message refers to.
+        Index("ix_communication_type_time", "s2_msg_type", "timestamp"),
+        Index("ix_communication_body", "body_hash"),
+    )
+
     id: int = Field(default=None, primary_key=True)
 
+    # The JSON of the S2 message, when it is not stored as a MessageBody, e.g. for messages stored by older versions.
     s2_msg: Optional[str] = None
+    # The body of the S2 message and its message_id, which is not part of the body so equal messages share a body.
+    body_hash: Optional[str] = Field(default=None, foreign_key="messagebody.hash")
+    s2_message_id: Optional[str] = None
 
+    body: Optional[MessageBody] = Relationship()
     validation_errors: List["ValidationError"] = Relationship(
-        back_populates="communication"
+        back_populates="communication",
+        sa_relationship_kwargs={"order_by": "ValidationError.id"},
     )
+    fields: List["MessageField"] = Relationship(back_populates="communication")
+
+    def get_s2_msg(self) -> Any:
+        """The S2 message, decompressed from its body or parsed from its JSON."""
+        if self.body is None:
+            return None if self.s2_msg is None else json.loads(self.s2_msg)
+        msg = self.body.decode()
+        if self.s2_message_id is not None:
+            msg["message_id"] = self.s2_message_id
+        return msg
+
+    def get_validation_errors(self) -> List["ValidationErrorSignature"]:
+        """The signatures of the validation errors of the message, in the order they were stored."""
+        return [error.signature for error in self.validation_errors]
 
     def model_dump(self, *args, **kwargs):
         result = super().model_dump(*args, **kwargs)
 
-        # Convert the s2_msg from a string to a dictionary
+        # Convert the s2_msg from a string or the compressed body to a dictionary
         # so that the frontend can work with it more easily
-        if result.get("s2_msg") is not None:
-            result["s2_msg"] = json.loads(result["s2_msg"])
+        if "s2_msg" in result:
+            result["s2_msg"] = self.get_s2_msg()
+        result.pop("body_hash", None)
+        result.pop("s2_message_id", None)
 
         return result
 
 
 class CommunicationWithValidationErrors(CommunicationBase):
-    validation_errors: List["ValidationError"]
+    validation_errors: List["PublicValidationError"]
 
 
 class BaseValidationError(SQLModel):
@@ -59,24 +122,350 @@ class BaseValidationError(SQLModel):
     msg: str
 
 
-class ValidationError(BaseValidationError, table=True):
+class ValidationErrorSignature(BaseValidationError, table=True):
+    """A distinct validation error: its type, location and message. The validation errors of the messages refer to
+    their signature, so an error which many messages have is only stored once."""
+
+    __table_args__ = (
+        Index("ix_validationerrorsignature_key", "type", "loc", "msg", unique=True),
+    )
+
+    id: int = Field(default=None, primary_key=True)
+
+
+class ValidationError(SQLModel, table=True):
+    """A validation error of the S2 message of a Communication."""
+
+    __table_args__ = (Index("ix_validationerror_communication", "communication_id"),)
+
     id: int = Field(default=None, primary_key=True)
 
     # Back-reference to Message
     communication_id: Optional[int] = Field(
         default=None, foreign_key="communication.id"
     )
+    signature_id: int = Field(foreign_key="validationerrorsignature.id")
+
     communication: Communication | None = Relationship(
         back_populates="validation_errors"
     )
+    signature: ValidationErrorSignature = Relationship()
+
+
+class ValidationErrorCount(SQLModel, table=True):
+    """The number of validation errors with a signature in a session per hour. The error analytics are made of these
+    counters instead of the validation errors themselves."""
+
+    __table_args__ = (
+        Index(
+            "ix_validationerrorcount_key",
+            "hour",
+            "signature_id",
+            "session_id",
+            unique=True,
+        ),
+        Index("ix_validationerrorcount_session", "session_id", "signature_id"),
+    )
+
+    id: int = Field(default=None, primary_key=True)
+    signature_id: int = Field(foreign_key="validationerrorsignature.id")
+    session_id: uuid.UUID
+    hour: datetime
+    count: int
 
 
 class PublicValidationError(BaseValidationError):
     id: int
+    signature_id: Optional[int] = None
+
+
+class MessageField(SQLModel, table=True):
+    """A value inside the S2 message of a Communication at one of the indexed JSON paths, e.g. the
+    `subject_message_id` of a ReceptionStatus, so that messages can be queried on their content. A message has a row
+    per value, so none or more than one for a path.
+    """
+
+    __table_args__ = (
+        Index("ix_messagefield_lookup", "path", "value", "communication_id"),
+    )
+
+    id: int = Field(default=None, primary_key=True)
+    communication_id: int = Field(foreign_key="communication.id", index=True)
+    path: str
+    value: str
 
+    communication: Communication | None = Relationship(back_populates="fields")
 
-# Relationship Back-population
-ValidationError.communication_id = Relationship(back_populates="validation_errors")
+
+class MessageIndexPath(SQLModel, table=True):
+    """An indexed JSON path and the progress of indexing the messages stored before the path was indexed."""
+
+    path: str = Field(primary_key=True)
+    # Messages with an id up to and including `backfilled_up_to` are indexed...
+    backfilled_up_to: int = 0
+    # ...and the messages with a higher id than `backfill_until` are indexed when they are stored.
+    backfill_until: int = 0
+
+
+class MessageSummary(SQLModel, table=True):
+    """The number of messages of a type per session, origin and day, kept when the history maintenance deletes the
+    messages themselves."""
+
+    __table_args__ = (
+        Index(
+            "ix_messagesummary_key",
+            "session_id",
+            "origin",
+            "message_type",
+            "s2_msg_type",
+            "day",
+            unique=True,
+        ),
+    )
+
+    id: int = Field(default=None, primary_key=True)
+    session_id: uuid.UUID
+    cem_id: str
+    rm_id: str
+    origin: str
+    message_type: MessageType
+    # Empty for the messages which are not S2 messages or could not be parsed.
+    s2_msg_type: str
+    day: date
+    count: int
+    # Messages with validation errors.
+    invalid_count: int
+    first_timestamp: datetime
+    last_timestamp: datetime
+
+
+class TimeSeriesPoint(SQLModel, table=True):
+    """A numeric value extracted from an S2 message (resolution 0), or the aggregate of the values of a series in a
+    bucket of `resolution` seconds. A bucket may be stored in more than one row, e.g. for late values.
+    """
+
+    __table_args__ = (
+        Index(
+            "ix_timeseriespoint_lookup",
+            "session_id",
+            "series",
+            "resolution",
+            "bucket_start",
+        ),
+        # The history maintenance deletes the old points of the fine resolutions.
+        Index("ix_timeseriespoint_age", "resolution", "bucket_start"),
+    )
+
+    id: int = Field(default=None, primary_key=True)
+    session_id: uuid.UUID
+    series: str
+    resolution: int
+    bucket_start: datetime
+    value_count: int
+    value_min: float
+    value_max: float
+    value_sum: float
+
+
+# Full-text index of the stored messages and their validation errors. An FTS5 virtual table, which SQLModel can not
+# create, so it is declared as a plain table for querying. The rowid is the id of the Communication. The table is
+# contentless: it only holds the index, not another copy of the messages.
+MESSAGE_SEARCH_TABLE = "message_search"
+message_search = table(
+    MESSAGE_SEARCH_TABLE, column("rowid"), column("message"), column("errors")
+)
+
+
+def search_errors_text(errors: List[Any]) -> str:
+    """The indexed text of the validation errors of a message, which have a `loc` and `msg`, e.g. their
+    ValidationErrorSignatures."""
+    return "\n".join(f"{error.loc} {error.msg}" for error in errors)
+
+
+def search_message_text(msg: Any) -> str:
+    """The indexed text of an S2 message. Independent of the order of the keys, as a contentless index can only
+    remove a message given exactly the text with which it was added."""
+    return json.dumps(msg, sort_keys=True)
+
+
+def _search_rows(entries: List[tuple[Communication, Any, List[Any]]]) -> List[dict]:
+    return [
+        {
+            "id": communication.id,
+            "message": search_message_text(msg),
+            "errors": search_errors_text(errors),
+        }
+        for communication, msg, errors in entries
+    ]
+
+
+def search_index_entry(
+    communication: Communication,
+) -> tuple[Communication, Any, List[ValidationErrorSignature]]:
+    """The S2 message and validation errors of a stored message, as indexed. Its body and validation errors must be
+    loaded, see `load_validation_errors`."""
+    return (
+        communication,
+        communication.get_s2_msg(),
+        communication.get_validation_errors(),
+    )
+
+
+def add_to_search_index(
+    session: Session, entries: List[tuple[Communication, Any, List[Any]]]
+) -> None:
+    """Adds stored messages, with their S2 message and validation errors, to the full-text index. The messages must
+    have been flushed, so they have an id."""
+    if entries:
+        session.execute(
+            text(
+                f"INSERT INTO {MESSAGE_SEARCH_TABLE}(rowid, message, errors) VALUES (:id, :message, :errors)"
+            ),
+            _search_rows(entries),
+        )
+
+
+def remove_from_search_index(
+    session: Session, entries: List[tuple[Communication, Any, List[Any]]]
+) -> None:
+    """Removes messages, with their S2 message and validation errors, from the full-text index."""
+    if entries:
+        session.execute(
+            text(
+                f"INSERT INTO {MESSAGE_SEARCH_TABLE}({MESSAGE_SEARCH_TABLE}, rowid, message, errors) "
+                "VALUES ('delete', :id, :message, :errors)"
+            ),
+            _search_rows(entries),
+        )
+
+
+def _create_search_index(engine: Engine) -> None:
+    """Creates the full-text index. The messages stored before it existed are indexed once, when it is created."""
+    with engine.begin() as connection:
+        if connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+            {"name": MESSAGE_SEARCH_TABLE},
+        ).first():
+            return
+        # Contentless, the messages are not copied into the index.
+        connection.execute(
+            text(
+                f"CREATE VIRTUAL TABLE {MESSAGE_SEARCH_TABLE} USING fts5(message, errors, content='')"
+            )
+        )
+
+    indexed = 0
+    last_id = 0
+    while True:
+        with Session(engine) as session:
+            batch = session.exec(
+                select(Communication)
+                .where(Communication.id > last_id)
+                .order_by(Communication.id)
+                .limit(1000)
+                .options(
+                    load_validation_errors(),
+                    selectinload(Communication.body).selectinload(
+                        MessageBody.dictionary
+                    ),
+                )
+            ).all()
+            if not batch:
+                break
+            add_to_search_index(session, [search_index_entry(comm) for comm in batch])
+            session.commit()
+            indexed += len(batch)
+            last_id = batch[-1].id
+    if indexed:
+        LOGGER.info("Added %s stored messages to the search index.", indexed)
+
+
+LEGACY_VALIDATION_ERROR_TABLE = "validationerror_legacy"
+
+
+def _rename_legacy_validation_errors(engine: Engine) -> None:
+    """Earlier versions stored the type, location and message in every validation error. Moves that table aside, so
+    the validation errors are created as references to their signature and moved by _migrate_validation_errors.
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table(ValidationError.__tablename__):
+        return
+    columns = {
+        db_column["name"]
+        for db_column in inspector.get_columns(ValidationError.__tablename__)
+    }
+    if "signature_id" not in columns:
+        with engine.begin() as connection:
+            connection.execute(
+                text(
+                    f"ALTER TABLE {ValidationError.__tablename__} RENAME TO {LEGACY_VALIDATION_ERROR_TABLE}"
+                )
+            )
+
+
+def _migrate_validation_errors(engine: Engine) -> None:
+    """Interns the validation errors stored by earlier versions into signatures and counts them, in a single
+    transaction. The ids of the errors are kept, so the search index still matches."""
+    if not inspect(engine).has_table(LEGACY_VALIDATION_ERROR_TABLE):
+        return
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "INSERT OR IGNORE INTO validationerrorsignature (type, loc, msg) "
+                f"SELECT type, loc, msg FROM {LEGACY_VALIDATION_ERROR_TABLE} GROUP BY type, loc, msg"
+            )
+        )
+        migrated = connection.execute(
+            text(
+                "INSERT INTO validationerror (id, communication_id, signature_id) "
+                "SELECT legacy.id, legacy.communication_id, signature.id "
+                f"FROM {LEGACY_VALIDATION_ERROR_TABLE} AS legacy JOIN validationerrorsignature AS signature "
+                "ON signature.type = legacy.type AND signature.loc = legacy.loc AND signature.msg = legacy.msg"
+            )
+        ).rowcount
+        # The timestamps are stored as text, so the hour is the text up to the minutes.
+        connection.execute(
+            text(
+                "INSERT INTO validationerrorcount (signature_id, session_id, hour, count) "
+                "SELECT validationerror.signature_id, communication.session_id, "
+                "substr(communication.timestamp, 1, 13) || ':00:00.000000' AS hour, count(*) "
+                "FROM validationerror JOIN communication ON communication.id = validationerror.communication_id "
+                "GROUP BY validationerror.signature_id, communication.session_id, hour"
+            )
+        )
+        connection.execute(text(f"DROP TABLE {LEGACY_VALIDATION_ERROR_TABLE}"))
+    LOGGER.info("Moved %s stored validation errors to their signatures.", migrated)
+
+
+def _add_missing_columns(engine: Engine) -> None:
+    """create_all does not alter existing tables. Adds the nullable columns which are new to existing tables."""
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for db_table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(db_table.name):
+                continue
+            existing = {
+                db_column["name"] for db_column in inspector.get_columns(db_table.name)
+            }
+            for db_column in db_table.columns:
+                if db_column.name in existing or not db_column.nullable:
+                    continue
+                LOGGER.info(
+                    "Adding column %s to table %s.", db_column.name, db_table.name
+                )
+                connection.execute(
+                    text(
+                        f"ALTER TABLE {db_table.name} ADD COLUMN {db_column.name} "
+                        f"{db_column.type.compile(engine.dialect)}"
+                    )
+                )
+
+
+def load_validation_errors():
+    """Loads the validation errors of the queried messages with their signatures, each signature once."""
+    return selectinload(Communication.validation_errors).selectinload(
+        ValidationError.signature
+    )
 
 
 def serialize_communication_with_validation_errors(
@@ -87,10 +476,11 @@ def serialize_communication_with_validation_errors(
         validation_errors = [
             PublicValidationError(
                 id=ve.id,
-                error_details=ve.error_details,
-                type=ve.type,
-                loc=ve.loc,
-                msg=ve.msg,
+                signature_id=ve.signature_id,
+                error_details=ve.signature.error_details,
+                type=ve.signature.type,
+                loc=ve.signature.loc,
+                msg=ve.signature.msg,
             )
             for ve in comm.validation_errors
         ]
@@ -103,7 +493,7 @@ def serialize_communication_with_validation_errors(
         cem_id=comm.cem_id,
         origin=comm.origin,
         message_type=comm.message_type,
-        s2_msg=json.loads(comm.s2_msg),
+        s2_msg=comm.get_s2_msg(),
         s2_msg_type=comm.s2_msg_type,
         timestamp=comm.timestamp,
         validation_errors=validation_errors,
@@ -111,19 +501,57 @@ def serialize_communication_with_validation_errors(
     return comm_with_errors
 
 
-DATABASE_URL = os.environ.get("DATABASE_URL", None)
-# Database setup
-if DATABASE_URL is None:
-    file_path = os.path.abspath(os.getcwd()) + "/database.db"
-    DATABASE_URL = f"sqlite:///{file_path}"  # Replace with your database URL
-engine = create_engine(DATABASE_URL)
+def get_database_url() -> str:
+    database_url = os.environ.get("DATABASE_URL", None)
+    # Database setup
+    if database_url is None:
+        file_path = os.path.abspath(os.getcwd()) + "/database.db"
+        database_url = f"sqlite:///{file_path}"  # Replace with your database URL
+    return database_url
+
+
+# Milliseconds a connection waits for the write lock held by another connection before its statement fails.
+SQLITE_BUSY_TIMEOUT = 5000
+
+
+def _configure_sqlite_connection(dbapi_connection, connection_record) -> None:
+    """With the write-ahead log the history queries and the writers do not block each other. The writers, i.e. the
+    storage, the time series, the imports and the history maintenance, still wait for each other.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        # Lets the history maintenance return the space of deleted messages to the file system in small steps. Only
+        # takes effect on a new database, before the write-ahead log is enabled.
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}")
+    finally:
+        cursor.close()
+
+
+@functools.cache
+def get_engine() -> Engine:
+    """Creates the engine on first use instead of on import."""
+    engine = create_engine(get_database_url())
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _configure_sqlite_connection)
+    return engine
 
 
-def create_db_and_tables():
+def create_db_and_tables(engine: Optional[Engine] = None):
     """SQLModel creates the SQLite DB and creates the tables."""
+    engine = engine or get_engine()
+    _rename_legacy_validation_errors(engine)
+    _add_missing_columns(engine)
     SQLModel.metadata.create_all(engine)
+    # create_all only creates the indexes of new tables. Add the indexes which are new to existing tables.
+    for db_table in SQLModel.metadata.sorted_tables:
+        for index in db_table.indexes:
+            index.create(engine, checkfirst=True)
+    _migrate_validation_errors(engine)
+    _create_search_index(engine)
 
 
 def get_session():
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         yield session
@@ -0,0 +1,404 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import logging
+import time
+from typing import TYPE_CHECKING, Optional
+import uuid
+
+from pydantic import BaseModel
+from sqlalchemy import Engine, delete, exists, func, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, select
+
+from s2_analyzer_backend.async_application import ApplicationName, AsyncApplication
+from s2_analyzer_backend.message_processor.database import (
+    Communication,
+    MessageBody,
+    MessageField,
+    MessageSummary,
+    TimeSeriesPoint,
+    ValidationError,
+    load_validation_errors,
+    remove_from_search_index,
+    search_index_entry,
+)
+from s2_analyzer_backend.message_processor.time_series import MIN_RETAINED_RESOLUTION
+
+if TYPE_CHECKING:
+    from s2_analyzer_backend.config import RetentionConfig
+    from s2_analyzer_backend.endpoints.history_cache import HistoryResponseCache
+
+LOGGER = logging.getLogger(__name__)
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+
+class MaintenanceReport(BaseModel):
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    duration: Optional[float] = None
+    # Deleted messages per S2 message type. Messages without a type, e.g. session start and end, are under "".
+    deleted_messages: dict[str, int] = {}
+    deleted_validation_errors: int = 0
+    deleted_message_bodies: int = 0
+    deleted_time_series_points: int = 0
+    # Space of the deleted data which SQLite reuses for new data...
+    free_bytes: int = 0
+    # ...and which was returned to the file system by the incremental vacuum.
+    reclaimed_bytes: int = 0
+    database_bytes: int = 0
+    auto_vacuum: Optional[str] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class _DeletedBatch:
+    messages: int = 0
+    validation_errors: int = 0
+    message_bodies: int = 0
+
+
+class HistoryMaintenance(AsyncApplication):
+    """
+    Background maintenance of the history database. Every `interval` seconds, or when requested, it:
+
+    1. deletes the messages which are older than the retention of their S2 message type, after adding them to the
+       MessageSummary counts per session, origin, type and day, with their validation errors, indexed fields, search
+       index entries and the message bodies no other message refers to;
+    2. deletes the time series points of less than a minute which are older than their retention, the 1-minute and
+       15-minute rollups remain;
+    3. returns the free pages to the file system with the incremental vacuum, when the database supports it.
+
+    Every step is a short transaction in the executor, with a pause in between. As the database uses the write-ahead
+    log, the history queries are not blocked by them. The storage of new messages, which also writes in the
+    executor, waits for at most one batch.
+    """
+
+    MAX_REPORTS = 20
+
+    def __init__(
+        self,
+        engine: Engine,
+        config: "RetentionConfig",
+        response_cache: "Optional[HistoryResponseCache]" = None,
+    ) -> None:
+        super().__init__()
+        self.engine = engine
+        self.config = config
+        self.response_cache = response_cache
+        self.current: Optional[MaintenanceReport] = None
+        self.reports: deque[MaintenanceReport] = deque(maxlen=self.MAX_REPORTS)
+        self.next_run_at: Optional[datetime] = None
+        self._run_requested = asyncio.Event()
+
+    def get_name(self) -> ApplicationName:
+        return "History maintenance"
+
+    def stop(self) -> None:
+        if self._main_task is not None and not self._main_task.done():
+            self._main_task.cancel("Request to stop")
+
+    def request_run(self) -> bool:
+        """Starts a run now. Returns False if a run is in progress."""
+        if self.current is not None:
+            return False
+        self._run_requested.set()
+        return True
+
+    async def main_task(self, loop: asyncio.AbstractEventLoop) -> None:
+        interval = self.config.interval if self.config.interval > 0 else None
+        while True:
+            self.next_run_at = (
+                datetime.now() + timedelta(seconds=interval) if interval else None
+            )
+            try:
+                await asyncio.wait_for(self._run_requested.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self._run_requested.clear()
+            self.next_run_at = None
+            await self.run(loop)
+
+    async def run(self, loop: asyncio.AbstractEventLoop) -> MaintenanceReport:
+        report = MaintenanceReport(started_at=datetime.now())
+        self.current = report
+        start = time.monotonic()
+        try:
+            for s2_msg_type, cutoff in await loop.run_in_executor(
+                None, self._message_cutoffs, report.started_at
+            ):
+                await self._delete_messages(loop, report, s2_msg_type, cutoff)
+
+            if self.config.time_series_raw_max_age_days is not None:
+                cutoff = report.started_at - timedelta(
+                    days=self.config.time_series_raw_max_age_days
+                )
+                while True:
+                    deleted = await loop.run_in_executor(
+                        None, self._delete_time_series_points, cutoff
+                    )
+                    report.deleted_time_series_points += deleted
+                    if deleted < self.config.batch_size:
+                        break
+                    await asyncio.sleep(self.config.batch_pause)
+
+            await self._vacuum(loop, report)
+        except Exception as exc:  # pylint: disable=broad-except
+            LOGGER.exception("History maintenance failed.")
+            report.error = str(exc)
+        finally:
+            report.finished_at = datetime.now()
+            report.duration = time.monotonic() - start
+            self.reports.append(report)
+            self.current = None
+
+        LOGGER.info(
+            "History maintenance deleted %s messages, %s validation errors, %s message bodies and %s time series "
+            "points, and reclaimed %s bytes in %.1f seconds. %s bytes are free for reuse in the database of %s bytes.",
+            sum(report.deleted_messages.values()),
+            report.deleted_validation_errors,
+            report.deleted_message_bodies,
+            report.deleted_time_series_points,
+            report.reclaimed_bytes,
+            report.duration,
+            report.free_bytes,
+            report.database_bytes,
+        )
+        return report
+
+    def _message_cutoffs(self, now: datetime) -> list[tuple[Optional[str], datetime]]:
+        """The time before which the messages of each stored S2 message type are deleted."""
+        with Session(self.engine) as session:
+            s2_msg_types = session.exec(
+                select(Communication.s2_msg_type).distinct()
+            ).all()
+
+        cutoffs = []
+        for s2_msg_type in s2_msg_types:
+            max_age = self.config.max_age_days_per_type.get(
+                s2_msg_type or "", self.config.max_age_days
+            )
+            if max_age is not None:
+                cutoffs.append((s2_msg_type, now - timedelta(days=max_age)))
+        return cutoffs
+
+    async def _delete_messages(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        report: MaintenanceReport,
+        s2_msg_type: Optional[str],
+        cutoff: datetime,
+    ) -> None:
+        key = s2_msg_type or ""
+        while True:
+            deleted = await loop.run_in_executor(
+                None, self._delete_message_batch, s2_msg_type, cutoff
+            )
+            report.deleted_messages[key] = (
+                report.deleted_messages.get(key, 0) + deleted.messages
+            )
+            report.deleted_validation_errors += deleted.validation_errors
+            report.deleted_message_bodies += deleted.message_bodies
+            if deleted.messages < self.config.batch_size:
+                return
+            await asyncio.sleep(self.config.batch_pause)
+
+    def _delete_message_batch(
+        self, s2_msg_type: Optional[str], cutoff: datetime
+    ) -> _DeletedBatch:
+        with Session(self.engine) as session:
+            batch = session.exec(
+                select(Communication)
+                .where(
+                    Communication.s2_msg_type == s2_msg_type
+                    if s2_msg_type is not None
+                    else Communication.s2_msg_type.is_(None)
+                )
+                .where(Communication.timestamp < cutoff)
+                .order_by(Communication.timestamp)
+                .limit(self.config.batch_size)
+                .options(
+                    load_validation_errors(),
+                    selectinload(Communication.body).selectinload(
+                        MessageBody.dictionary
+                    ),
+                )
+            ).all()
+            if not batch:
+                return _DeletedBatch()
+
+            self._summarize(session, batch)
+            remove_from_search_index(
+                session, [search_index_entry(comm) for comm in batch]
+            )
+
+            ids = [comm.id for comm in batch]
+            body_hashes = {comm.body_hash for comm in batch if comm.body_hash}
+            deleted = _DeletedBatch(messages=len(batch))
+            deleted.validation_errors = session.execute(
+                delete(ValidationError)
+                .where(ValidationError.communication_id.in_(ids))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            session.execute(
+                delete(MessageField)
+                .where(MessageField.communication_id.in_(ids))
+                .execution_options(synchronize_session=False)
+            )
+            session.execute(
+                delete(Communication)
+                .where(Communication.id.in_(ids))
+                .execution_options(synchronize_session=False)
+            )
+            # A body which is stored again concurrently is written again by that transaction.
+            deleted.message_bodies = session.execute(
+                delete(MessageBody)
+                .where(MessageBody.hash.in_(body_hashes))
+                .where(~exists().where(Communication.body_hash == MessageBody.hash))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            session.commit()
+
+        if self.response_cache is not None:
+            self.response_cache.invalidate(
+                {comm.session_id for comm in batch},
+                min(comm.timestamp for comm in batch),
+                max(comm.timestamp for comm in batch),
+            )
+        return deleted
+
+    def _summarize(self, session: Session, batch: list[Communication]) -> None:
+        summaries: dict[tuple, dict] = {}
+        for comm in batch:
+            key = (
+                comm.session_id,
+                comm.origin,
+                comm.message_type,
+                comm.s2_msg_type or "",
+                comm.timestamp.date(),
+            )
+            summary = summaries.get(key)
+            if summary is None:
+                summary = summaries[key] = {
+                    "session_id": comm.session_id,
+                    "cem_id": comm.cem_id,
+                    "rm_id": comm.rm_id,
+                    "origin": comm.origin,
+                    "message_type": comm.message_type,
+                    "s2_msg_type": comm.s2_msg_type or "",
+                    "day": comm.timestamp.date(),
+                    "count": 0,
+                    "invalid_count": 0,
+                    "first_timestamp": comm.timestamp,
+                    "last_timestamp": comm.timestamp,
+                }
+            summary["count"] += 1
+            summary["invalid_count"] += bool(comm.validation_errors)
+            summary["first_timestamp"] = min(summary["first_timestamp"], comm.timestamp)
+            summary["last_timestamp"] = max(summary["last_timestamp"], comm.timestamp)
+
+        insert = sqlite_insert(MessageSummary)
+        session.execute(
+            insert.on_conflict_do_update(
+                index_elements=[
+                    "session_id",
+                    "origin",
+                    "message_type",
+                    "s2_msg_type",
+                    "day",
+                ],
+                set_={
+                    "count": MessageSummary.count + insert.excluded.count,
+                    "invalid_count": MessageSummary.invalid_count
+                    + insert.excluded.invalid_count,
+                    "first_timestamp": func.min(
+                        MessageSummary.first_timestamp, insert.excluded.first_timestamp
+                    ),
+                    "last_timestamp": func.max(
+                        MessageSummary.last_timestamp, insert.excluded.last_timestamp
+                    ),
+                },
+            ),
+            list(summaries.values()),
+        )
+
+    def _delete_time_series_points(self, cutoff: datetime) -> int:
+        with Session(self.engine) as session:
+            ids = session.exec(
+                select(TimeSeriesPoint.id)
+                .where(TimeSeriesPoint.resolution < MIN_RETAINED_RESOLUTION)
+                .where(TimeSeriesPoint.bucket_start < cutoff)
+                .limit(self.config.batch_size)
+            ).all()
+            if ids:
+                session.execute(
+                    delete(TimeSeriesPoint)
+                    .where(TimeSeriesPoint.id.in_(ids))
+                    .execution_options(synchronize_session=False)
+                )
+                session.commit()
+            return len(ids)
+
+    async def _vacuum(
+        self, loop: asyncio.AbstractEventLoop, report: MaintenanceReport
+    ) -> None:
+        auto_vacuum, page_size, page_count, free_pages = await loop.run_in_executor(
+            None, self._database_pages
+        )
+        report.auto_vacuum = AUTO_VACUUM_MODES.get(auto_vacuum, str(auto_vacuum))
+        pages_before = page_count
+
+        while auto_vacuum == 2 and free_pages > 0:
+            await loop.run_in_executor(None, self._incremental_vacuum_step)
+            _, page_size, page_count, remaining = await loop.run_in_executor(
+                None, self._database_pages
+            )
+            if remaining >= free_pages:
+                break
+            free_pages = remaining
+            await asyncio.sleep(self.config.batch_pause)
+
+        report.free_bytes = free_pages * page_size
+        report.reclaimed_bytes = max(0, pages_before - page_count) * page_size
+        report.database_bytes = page_count * page_size
+
+    def _database_pages(self) -> tuple[int, int, int, int]:
+        with self.engine.connect() as connection:
+            return tuple(
+                connection.execute(text(f"PRAGMA {pragma}")).scalar()
+                for pragma in (
+                    "auto_vacuum",
+                    "page_size",
+                    "page_count",
+                    "freelist_count",
+                )
+            )
+
+    def _incremental_vacuum_step(self) -> None:
+        connection = self.engine.raw_connection()
+        try:
+            # Through execute, sqlite3 only runs the first step of the statement, which frees a single page.
+            # executescript runs it to completion.
+            connection.driver_connection.executescript(
+                f"PRAGMA incremental_vacuum({int(self.config.vacuum_pages)})"
+            )
+        finally:
+            connection.close()
+
+    def get_summaries(
+        self, session_id: Optional[uuid.UUID] = None, s2_msg_type: Optional[str] = None
+    ) -> list[MessageSummary]:
+        with Session(self.engine) as session:
+            query = select(MessageSummary).order_by(
+                MessageSummary.day,
+                MessageSummary.session_id,
+                MessageSummary.s2_msg_type,
+            )
+            if session_id is not None:
+                query = query.where(MessageSummary.session_id == session_id)
+            if s2_msg_type is not None:
+                query = query.where(MessageSummary.s2_msg_type == s2_msg_type)
+            return list(session.exec(query))
@@ -2,7 +2,7 @@ from datetime import datetime
 import enum
 import uuid
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from s2python.message import S2Message
 from s2_analyzer_backend.message_processor.message_type import MessageType
@@ -20,13 +20,16 @@ class Message(BaseModel):
     cem_id: str
     rm_id: str
 
-    timestamp: datetime | None = datetime.now()
+    timestamp: datetime | None = Field(default_factory=datetime.now)
 
     message_type: MessageType = MessageType.S2
 
     # S2 Message Fields
     origin: S2OriginType
     msg: dict | None = None
+    # Size in bytes of the websocket frame the message was received in. None when the message was not received from
+    # a device, e.g. when it was injected.
+    size: int | None = None
     s2_msg: S2Message | None = None
     s2_msg_type: str | None = None
     s2_validation_error: MessageValidationDetails | None = None
@@ -0,0 +1,159 @@
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+from typing import Optional
+import zlib
+
+from sqlalchemy import insert
+from sqlmodel import Session, select
+
+from s2_analyzer_backend.message_processor.database import (
+    MessageBody,
+    MessageBodyDictionary,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+# zlib only uses the last 32 KiB of a preset dictionary.
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+
+def canonical_body(msg: dict) -> tuple[bytes, Optional[str]]:
+    """Splits an S2 message into its canonical JSON body without the message_id, and the message_id. Messages which
+    only differ in their message_id, e.g. a repeated FRBC.StorageStatus, have the same body.
+    """
+    message_id = msg.get("message_id")
+    if isinstance(message_id, str):
+        msg = {key: value for key, value in msg.items() if key != "message_id"}
+    else:
+        message_id = None
+    body = json.dumps(msg, sort_keys=True, separators=(",", ":")).encode()
+    return body, message_id
+
+
+class MessageBodyStore:
+    """
+    Stores the bodies of the S2 messages content-addressed: every distinct body is stored once, zlib compressed, and
+    the messages refer to it by the hash of the body. Must be used from a single thread.
+
+    The recently stored bodies are kept compressed in memory, so they are not compressed again. They are still
+    written (and ignored) with every transaction which refers to them, so a body which the history maintenance
+    deleted meanwhile is stored again.
+
+    Once `dictionary_samples` distinct bodies of a message type are stored, they are combined into a preset
+    dictionary for that message type, with which the following bodies of the type are compressed. As the bodies of a
+    type mostly share their keys and enum values, this compresses the small bodies much better than zlib on its own.
+    """
+
+    def __init__(
+        self,
+        compression_level: int = 6,
+        dictionary_samples: int = 32,
+        max_known_bodies: int = 10000,
+    ):
+        self.compression_level = compression_level
+        self.dictionary_samples = dictionary_samples
+        self.max_known_bodies = max_known_bodies
+        # The rows of the bodies which are stored, by hash, most recently used last.
+        self._known: OrderedDict[str, dict] = OrderedDict()
+        # The id and data of the preset dictionary per message type, None while there are too few samples.
+        self._dictionaries: dict[str, Optional[tuple[int, bytes]]] = {}
+        self._samples: dict[str, list[bytes]] = {}
+        # The bodies and dictionaries of the transaction which is not committed yet.
+        self._pending_bodies: dict[str, dict] = {}
+        self._pending_dictionaries: dict[str, tuple[int, bytes]] = {}
+
+    def add(
+        self, session: Session, msg: dict, s2_msg_type: Optional[str]
+    ) -> tuple[str, Optional[str]]:
+        """Adds the body of the message to the transaction. It is only compressed when it is not known yet.
+
+        Returns:
+            The hash of the body and the message_id of the message.
+        """
+        body, message_id = canonical_body(msg)
+        body_hash = hashlib.blake2b(body, digest_size=16).hexdigest()
+        if body_hash in self._pending_bodies:
+            return body_hash, message_id
+
+        if body_hash in self._known:
+            self._known.move_to_end(body_hash)
+            self._pending_bodies[body_hash] = self._known[body_hash]
+        else:
+            dictionary = self._dictionary(session, s2_msg_type, body)
+            if dictionary is None:
+                dictionary_id = None
+                compressor = zlib.compressobj(self.compression_level)
+            else:
+                dictionary_id, zdict = dictionary
+                compressor = zlib.compressobj(self.compression_level, zdict=zdict)
+            self._pending_bodies[body_hash] = {
+                "hash": body_hash,
+                "dictionary_id": dictionary_id,
+                "data": compressor.compress(body) + compressor.flush(),
+            }
+        return body_hash, message_id
+
+    def write(self, session: Session) -> None:
+        """Writes the bodies of the transaction. Bodies which are stored already, e.g. also by a concurrent import,
+        are kept."""
+        if self._pending_bodies:
+            session.execute(
+                insert(MessageBody).prefix_with("OR IGNORE"),
+                list(self._pending_bodies.values()),
+            )
+
+    def committed(self) -> None:
+        for body_hash, row in self._pending_bodies.items():
+            self._known[body_hash] = row
+            self._known.move_to_end(body_hash)
+        while len(self._known) > self.max_known_bodies:
+            self._known.popitem(last=False)
+        self._dictionaries.update(self._pending_dictionaries)
+        self._pending_bodies.clear()
+        self._pending_dictionaries.clear()
+
+    def rolled_back(self) -> None:
+        for s2_msg_type in self._pending_dictionaries:
+            self._dictionaries.pop(s2_msg_type, None)
+        self._pending_bodies.clear()
+        self._pending_dictionaries.clear()
+
+    def _dictionary(
+        self, session: Session, s2_msg_type: Optional[str], body: bytes
+    ) -> Optional[tuple[int, bytes]]:
+        if s2_msg_type is None or self.dictionary_samples <= 0:
+            return None
+        if s2_msg_type in self._pending_dictionaries:
+            return self._pending_dictionaries[s2_msg_type]
+        if s2_msg_type not in self._dictionaries:
+            # The dictionary stored by an earlier run, if any.
+            stored = session.exec(
+                select(MessageBodyDictionary.id, MessageBodyDictionary.data)
+                .where(MessageBodyDictionary.s2_msg_type == s2_msg_type)
+                .order_by(MessageBodyDictionary.id.desc())
+                .limit(1)
+            ).first()
+            self._dictionaries[s2_msg_type] = None if stored is None else tuple(stored)
+        dictionary = self._dictionaries[s2_msg_type]
+        if dictionary is not None:
+            return dictionary
+
+        samples = self._samples.setdefault(s2_msg_type, [])
+        samples.append(body)
+        if len(samples) < self.dictionary_samples:
+            return None
+
+        data = b"".join(samples)[-MAX_DICTIONARY_SIZE:]
+        dictionary = MessageBodyDictionary(s2_msg_type=s2_msg_type, data=data)
+        session.add(dictionary)
+        session.flush()
+        del self._samples[s2_msg_type]
+        self._pending_dictionaries[s2_msg_type] = (dictionary.id, data)
+        LOGGER.info(
+            "Compressing the %s messages with a dictionary of %s bytes.",
+            s2_msg_type,
+            len(data),
+        )
+        return self._pending_dictionaries[s2_msg_type]
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+from typing import Any, Iterator
+
+from sqlalchemy import Engine, delete
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, func, select
+
+from s2_analyzer_backend.async_application import ApplicationName, AsyncApplication
+from s2_analyzer_backend.message_processor.database import (
+    Communication,
+    MessageBody,
+    MessageField,
+    MessageIndexPath,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _as_text(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _values_at(value: Any, keys: tuple[str, ...]) -> Iterator[str]:
+    for position, key in enumerate(keys):
+        if isinstance(value, list):
+            for item in value:
+                yield from _values_at(item, keys[position:])
+            return
+        if not isinstance(value, dict) or key not in value:
+            return
+        value = value[key]
+
+    if isinstance(value, list):
+        for item in value:
+            yield from _values_at(item, ())
+    elif value is not None and not isinstance(value, dict):
+        yield _as_text(value)
+
+
+class MessageIndex:
+    """
+    The JSON paths inside the S2 messages whose values are stored in the MessageField table when a message is
+    stored, so the messages can be queried on them.
+
+    A path is a dotted list of keys, e.g. `subject_message_id` or `operation_modes.id`. A path through a list, or
+    ending at a list, yields the value of every element. Objects are not indexed, only the values inside them.
+    """
+
+    def __init__(self, paths: list[str]):
+        self.paths = list(dict.fromkeys(paths))
+        self._keys = [(path, tuple(path.split("."))) for path in self.paths]
+
+    def extract(self, msg: Any) -> list[tuple[str, str]]:
+        """Returns the (path, value) pairs of the indexed paths in the message."""
+        if not isinstance(msg, dict):
+            return []
+        return [
+            (path, value)
+            for path, keys in self._keys
+            for value in dict.fromkeys(_values_at(msg, keys))
+        ]
+
+    def register(self, engine: Engine) -> None:
+        """Records the paths which are new since the previous start, so the messages stored before are indexed by
+        the MessageIndexBackfill. Drops the index of the paths which are no longer indexed.
+        """
+        with Session(engine) as session:
+            known = {state.path for state in session.exec(select(MessageIndexPath))}
+            removed = known - set(self.paths)
+            if removed:
+                LOGGER.info("Dropping the message index of %s.", sorted(removed))
+                session.execute(
+                    delete(MessageField).where(MessageField.path.in_(removed))
+                )
+                session.execute(
+                    delete(MessageIndexPath).where(MessageIndexPath.path.in_(removed))
+                )
+
+            last_id = session.exec(select(func.max(Communication.id))).one() or 0
+            for path in self.paths:
+                if path not in known:
+                    session.add(
+                        MessageIndexPath(
+                            path=path, backfilled_up_to=0, backfill_until=last_id
+                        )
+                    )
+            session.commit()
+
+
+class MessageIndexBackfill(AsyncApplication):
+    """
+    Indexes the messages which were stored before their paths were indexed, oldest first, in batches in the
+    executor. The progress is stored with each batch, so a restart continues where the backfill stopped.
+    """
+
+    def __init__(
+        self, engine: Engine, message_index: MessageIndex, batch_size: int = 1000
+    ):
+        super().__init__()
+        self.engine = engine
+        self.message_index = message_index
+        self.batch_size = batch_size
+
+    def get_name(self) -> ApplicationName:
+        return "Message index backfill"
+
+    async def main_task(self, loop: asyncio.AbstractEventLoop) -> None:
+        indexed = 0
+        while True:
+            count = await loop.run_in_executor(None, self._backfill_batch)
+            if count is None:
+                break
+            indexed += count
+        if indexed:
+            LOGGER.info("Indexed the content of %s stored messages.", indexed)
+
+    def stop(self) -> None:
+        if self._main_task is not None and not self._main_task.done():
+            self._main_task.cancel("Request to stop")
+
+    def _backfill_batch(self) -> "int | None":
+        """Indexes the next batch of messages. Returns the number of messages, or None when all are indexed."""
+        with Session(self.engine) as session:
+            states = session.exec(
+                select(MessageIndexPath)
+                .where(MessageIndexPath.path.in_(self.message_index.paths))
+                .where(
+                    MessageIndexPath.backfilled_up_to < MessageIndexPath.backfill_until
+                )
+            ).all()
+            if not states:
+                return None
+
+            until = max(state.backfill_until for state in states)
+            rows = session.exec(
+                select(Communication)
+                .where(
+                    Communication.id > min(state.backfilled_up_to for state in states)
+                )
+                .where(Communication.id <= until)
+                .order_by(Communication.id)
+                .limit(self.batch_size)
+                .options(
+                    selectinload(Communication.body).selectinload(
+                        MessageBody.dictionary
+                    )
+                )
+            ).all()
+
+            paths = {state.path: state for state in states}
+            index = MessageIndex(list(paths))
+            for communication in rows:
+                communication_id = communication.id
+                for path, value in index.extract(communication.get_s2_msg()):
+                    state = paths[path]
+                    if (
+                        state.backfilled_up_to
+                        < communication_id
+                        <= state.backfill_until
+                    ):
+                        session.add(
+                            MessageField(
+                                communication_id=communication_id,
+                                path=path,
+                                value=value,
+                            )
+                        )
+
+            last_id = rows[-1].id if len(rows) == self.batch_size else until
+            for state in states:
+                state.backfilled_up_to = max(
+                    state.backfilled_up_to, min(last_id, state.backfill_until)
+                )
+                session.add(state)
+            session.commit()
+            return len(rows)
@@ -1,12 +1,17 @@
 import abc
 import asyncio
+from collections import deque
 from datetime import datetime
 import json
-from typing import Any, Literal
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Any, Literal
 import uuid
 
 from pydantic import BaseModel
 from sqlalchemy import Engine
+from sqlalchemy.exc import OperationalError
 from sqlmodel import Session
 from s2_analyzer_backend.device_connection.connection import (
     DebuggerFrontendWebsocketConnection,
@@ -15,19 +20,43 @@ from s2_analyzer_backend.device_connection.connection import (
 )
 from s2_analyzer_backend.message_processor.database import (
     Communication,
-    ValidationError,
+    MessageField,
+    add_to_search_index,
 )
+from s2_analyzer_backend.message_processor.message_body import MessageBodyStore
+from s2_analyzer_backend.message_processor.validation_errors import (
+    ValidationErrorKey,
+    ValidationErrorStore,
+)
+from s2_analyzer_backend.message_processor.message_index import MessageIndex
 from s2_analyzer_backend.device_connection.origin_type import S2OriginType
 from s2_analyzer_backend.async_application import LOGGER, AsyncApplication
+from s2_analyzer_backend.app_logging import MESSAGES_LOGGER_NAME
 
-from s2_analyzer_backend.device_connection.session_details import SessionDetails
-from s2python.s2_parser import S2Parser, S2Message
+from s2_analyzer_backend.device_connection.session_details import (
+    SessionDetails,
+    SessionUpdateFrame,
+)
+from s2python.s2_parser import S2Message
 from s2python.s2_validation_error import S2ValidationError
 from s2_analyzer_backend.message_processor.message import (
     Message,
     MessageValidationDetails,
 )
 from s2_analyzer_backend.message_processor.message_type import MessageType
+from s2_analyzer_backend.message_processor.s2_validators import (
+    S2_VALIDATORS,
+    S2ValidatorRegistry,
+)
+
+if TYPE_CHECKING:
+    from s2_analyzer_backend.endpoints.history_cache import HistoryResponseCache
+    from s2_analyzer_backend.message_processor.session_statistics import (
+        SessionStatisticsProcessor,
+    )
+
+# Logs per processed message, rate limited by the logging configuration.
+MESSAGES_LOGGER = logging.getLogger(MESSAGES_LOGGER_NAME)
 
 
 class MessageProcessor(abc.ABC):
@@ -43,6 +72,16 @@ class MessageProcessor(abc.ABC):
     async def process_message(self, message, loop: asyncio.AbstractEventLoop) -> str:
         pass
 
+    async def flush(self):
+        """Method called when the message processor handler is drained on shutdown.
+        Processors which buffer work, e.g. write-behind, must finish it here."""
+        pass
+
+    def unflushed(self) -> list[Message]:
+        """The messages whose work was not finished when the flush was cut off by the shutdown deadline. These are
+        persisted to the backlog, so they are processed again on the next start."""
+        return []
+
     def close(self):
         """Method called when the message processor handler is stopped. Used for cleanup."""
         pass
@@ -54,22 +93,30 @@ class MessageLoggerProcessor(MessageProcessor):
     async def process_message(
         self, message: dict, loop: asyncio.AbstractEventLoop
     ) -> Any:
-        LOGGER.info(f"Message received: {message}")
+        MESSAGES_LOGGER.info(
+            "Message received in session %s from %s: %s",
+            message.session_id,
+            message.origin,
+            message.msg,
+        )
         return message
 
 
 class MessageParserProcessor(MessageProcessor):
     """A MessageProcessor implementation that uses the S2 Python package to validate a message that it receives."""
 
-    s2_parser: S2Parser
+    validators: S2ValidatorRegistry
 
-    def __init__(self):
-        self.s2_parser = S2Parser()
+    def __init__(self, validators: "S2ValidatorRegistry | None" = None):
+        self.validators = S2_VALIDATORS if validators is None else validators
 
     async def process_message(
         self, message: Message, loop: asyncio.AbstractEventLoop
     ) -> Message:
-        """Validates an S2 message
+        return self.parse(message)
+
+    def parse(self, message: Message) -> Message:
+        """Validates an S2 message. Synchronous, so that batches of messages can be validated in an executor.
 
         Args:
             message (Message): Raw message data to be parsed and validated.
@@ -91,20 +138,19 @@ class MessageParserProcessor(MessageProcessor):
             return message
 
         try:
-            s2_message_type = self.s2_parser.parse_message_type(message.msg)
-            s2_message = self.s2_parser.parse_as_any_message(message.msg)
+            s2_message_type = self.validators.parse_message_type(message.msg)
+            s2_message = self.validators.validate(message.msg)
         except S2ValidationError as e:
             errors = None
 
             if e.pydantic_validation_error is not None:
                 errors = e.pydantic_validation_error.errors()  # type: ignore
-                LOGGER.warning(e.pydantic_validation_error.errors())
             # elif e.msg is not None:
             #     errors = [{"type": "validation_error", "loc": [], "msg": e.msg}]
             #     LOGGER.warning(f"Validation error: {e.msg}")
 
             if s2_message_type is None and message.msg is not None:
-                s2_message_type = json.loads(message.msg).get("message_type", "Unknown")  # type: ignore
+                s2_message_type = message.msg.get("message_type", "Unknown")
 
             validation_error = MessageValidationDetails(msg=e.msg, errors=errors)  # type: ignore
             # LOGGER.warning(
@@ -118,8 +164,16 @@ class MessageParserProcessor(MessageProcessor):
         message.s2_msg_type = s2_message_type
 
         if validation_error is not None:
-            LOGGER.warning(
-                f"Validation error for message {message.msg} in session {message.session_id}: {validation_error}"
+            MESSAGES_LOGGER.warning(
+                "Validation error for %s message in session %s: %s",
+                s2_message_type,
+                message.session_id,
+                validation_error.msg,
+            )
+            MESSAGES_LOGGER.debug(
+                "Invalid message in session %s: %s",
+                message.session_id,
+                message.msg,
             )
         message.s2_validation_error = validation_error
 
@@ -128,20 +182,56 @@ class MessageParserProcessor(MessageProcessor):
 
 class MessageStorageProcessor(MessageProcessor):
     """
-    A MessageProcessor implementation for storing messages in the database.
+    A MessageProcessor implementation for storing messages in the database. The messages and their validation
+    errors are added to the full-text search index in the same transaction.
+
+    The messages are written behind in the executor, in transactions of at most `batch_size` messages. The messages
+    which arrive while a transaction is written are queued for the next one. When `batch_size` messages are queued
+    the pipeline waits for the transaction. As a single writer task stores the batches one after another, the body
+    and error stores are only used by one thread at a time. A batch is retried while the database is locked, and
+    dropped after MAX_ATTEMPTS.
 
     Attributes:
         engine (Engine): The database engine used for creating sessions.
+        message_index (MessageIndex): The paths inside the S2 messages whose values are stored for querying.
+        body_store (MessageBodyStore): Stores the S2 messages compressed, every distinct message body once.
+        error_store (ValidationErrorStore): Stores the validation errors as references to their signature, and
+            counts them.
+        response_cache (HistoryResponseCache): Cached history responses, from which the responses the stored
+            messages change are evicted.
+        batch_size (int): Maximum number of messages stored per transaction.
     """
 
-    def __init__(self, engine: "Engine"):
+    MAX_ATTEMPTS = 5
+    # Seconds between the attempts to store a batch while the database is locked.
+    RETRY_PAUSE = 1.0
+
+    def __init__(
+        self,
+        engine: "Engine",
+        message_index: "MessageIndex | None" = None,
+        body_store: "MessageBodyStore | None" = None,
+        error_store: "ValidationErrorStore | None" = None,
+        response_cache: "HistoryResponseCache | None" = None,
+        batch_size: int = 500,
+    ):
         super().__init__()
         self.engine = engine
+        self.message_index = message_index or MessageIndex([])
+        self.body_store = body_store or MessageBodyStore()
+        self.error_store = error_store or ValidationErrorStore()
+        self.response_cache = response_cache
+        self.batch_size = batch_size
+        self._pending: list[Message] = []
+        # The batch which is being stored.
+        self._storing: list[Message] = []
+        self._writer: "asyncio.Task | None" = None
+        self._batch_written = asyncio.Event()
 
     async def process_message(
         self, message: Message, loop: asyncio.AbstractEventLoop
     ) -> Message:
-        """Stores the given message data in the SQLite database using SQLModel.
+        """Queues the given message to be stored in the SQLite database using SQLModel.
         If the message contains validation errors then they are also stored.
 
         Args:
@@ -151,50 +241,134 @@ class MessageStorageProcessor(MessageProcessor):
         Returns:
             Message: Same message that was received as input. Nothing changed by this node.
         """
-        with Session(self.engine) as session:
-            validation_error = None
-            if message.timestamp is not None:
-                timestamp = message.timestamp
-            else:
-                timestamp = datetime.now()
+        while len(self._pending) >= self.batch_size:
+            await self._batch_written.wait()
+        self._pending.append(message)
+        if self._writer is None:
+            self._writer = loop.create_task(self._write_pending(loop))
+        return message
 
-            db_message = Communication(
-                session_id=message.session_id,
-                cem_id=message.cem_id,
-                rm_id=message.rm_id,
-                origin=message.origin.name,
-                message_type=message.message_type,
-                s2_msg=json.dumps(message.msg),
-                s2_msg_type=message.s2_msg_type,
-                timestamp=timestamp,
-                validation_errors=validation_error if validation_error else [],
+    async def flush(self):
+        """Waits until the queued messages are stored."""
+        while self._writer is not None:
+            await asyncio.shield(self._writer)
+
+    async def _write_pending(self, loop: asyncio.AbstractEventLoop) -> None:
+        try:
+            while self._pending:
+                batch = self._pending[: self.batch_size]
+                del self._pending[: len(batch)]
+                self._storing = batch
+                await self._store_batch(loop, batch)
+                self._storing = []
+                # Wakes the pipeline if it waits for room in the queue.
+                self._batch_written.set()
+                self._batch_written.clear()
+        finally:
+            self._writer = None
+
+    async def _store_batch(
+        self, loop: asyncio.AbstractEventLoop, batch: list[Message]
+    ) -> None:
+        for attempt in range(1, MessageStorageProcessor.MAX_ATTEMPTS + 1):
+            try:
+                await loop.run_in_executor(None, self.store, batch)
+                return
+            except OperationalError as e:
+                # E.g. the database is locked by a long transaction of another writer.
+                if attempt < MessageStorageProcessor.MAX_ATTEMPTS:
+                    LOGGER.warning(
+                        "Could not store %s messages, retrying: %s", len(batch), e
+                    )
+                    await asyncio.sleep(MessageStorageProcessor.RETRY_PAUSE)
+                    continue
+                LOGGER.exception("Could not store %s messages.", len(batch))
+            except Exception:
+                LOGGER.exception("Could not store %s messages.", len(batch))
+            break
+        LOGGER.error("Dropped %s messages which could not be stored.", len(batch))
+
+    def unflushed(self) -> list[Message]:
+        return self._storing + self._pending
+
+    def close(self):
+        """Stops retrying. A transaction which is running in the executor is still committed."""
+        if self._writer is not None:
+            self._writer.cancel()
+
+    def store(self, messages: list[Message]) -> None:
+        """Stores the messages in a single transaction. Synchronous, so that batches of messages can be stored in an
+        executor."""
+        try:
+            with Session(self.engine) as session:
+                entries = []
+                for message in messages:
+                    communication, errors = self._add_message(session, message)
+                    entries.append((communication, message.msg, errors))
+                self.body_store.write(session)
+                self.error_store.write(session)
+                session.flush()
+                add_to_search_index(session, entries)
+                session.commit()
+        except BaseException:
+            self.body_store.rolled_back()
+            self.error_store.rolled_back()
+            raise
+        self.body_store.committed()
+        self.error_store.committed()
+        if self.response_cache is not None:
+            self.response_cache.stored(messages)
+
+    def _add_message(
+        self, session: Session, message: Message
+    ) -> tuple[Communication, list[ValidationErrorKey]]:
+        if message.timestamp is not None:
+            timestamp = message.timestamp
+        else:
+            timestamp = datetime.now()
+
+        db_message = Communication(
+            session_id=message.session_id,
+            cem_id=message.cem_id,
+            rm_id=message.rm_id,
+            origin=message.origin.name,
+            message_type=message.message_type,
+            s2_msg_type=message.s2_msg_type,
+            timestamp=timestamp,
+            validation_errors=[],
+        )
+        if isinstance(message.msg, dict):
+            db_message.body_hash, db_message.s2_message_id = self.body_store.add(
+                session, message.msg, message.s2_msg_type
             )
-            session.add(db_message)
-
-            if message.s2_validation_error:
-                if (
-                    message.s2_validation_error.errors
-                    and len(message.s2_validation_error.errors) > 0
-                ):
-                    for error in message.s2_validation_error.errors:
-                        validation_error = ValidationError(
-                            type=error["type"],
-                            loc=str(error["loc"]),
-                            msg=error["msg"],
-                            communication=db_message,
-                        )
-                        session.add(validation_error)
-                else:
-                    validation_error = ValidationError(
+        else:
+            db_message.s2_msg = json.dumps(message.msg)
+        session.add(db_message)
+        for path, value in self.message_index.extract(message.msg):
+            session.add(MessageField(path=path, value=value, communication=db_message))
+
+        errors = []
+        if message.s2_validation_error:
+            if (
+                message.s2_validation_error.errors
+                and len(message.s2_validation_error.errors) > 0
+            ):
+                errors = [
+                    ValidationErrorKey(
+                        type=error["type"], loc=str(error["loc"]), msg=error["msg"]
+                    )
+                    for error in message.s2_validation_error.errors
+                ]
+            else:
+                errors = [
+                    ValidationErrorKey(
                         type="validation_error",
                         loc="",
                         msg=message.s2_validation_error.msg,
-                        communication=db_message,
                     )
-                    session.add(validation_error)
-            session.commit()
-
-            return message
+                ]
+        self.error_store.add(session, db_message, errors)
+        return db_message, errors
 
 
 class WebSocketMessageProcessor(MessageProcessor):
@@ -206,7 +380,7 @@ class WebSocketMessageProcessor(MessageProcessor):
 
     async def add_connection(self, connection: WebsocketConnection):
         """Adds a new websocket connection instance to the list of connections. Will receive any new messages."""
-        LOGGER.info(f"Adding connection: {connection}")
+        LOGGER.info("Adding connection: %s", connection)
         self.connections.append(connection)
 
     async def process_message(
@@ -230,9 +404,9 @@ class WebSocketMessageProcessor(MessageProcessor):
         for i in range(len(self.connections) - 1, -1, -1):
             if not self.connections[i]._running:
                 self.connections.pop(i)
-                LOGGER.info(f"Removed closed connection at index {i}")
+                LOGGER.info("Removed closed connection at index %s", i)
 
-    async def close(self):
+    def close(self):
         """Stop all of the websocket connections. Closes the websockets."""
         for connection in self.connections:
             connection.stop()
@@ -261,30 +435,189 @@ class DebuggerFrontendMessageProcessor(WebSocketMessageProcessor):
     async def process_message(
         self, message: Message, loop: asyncio.AbstractEventLoop
     ) -> Message:
-        LOGGER.debug(
-            f"Sending message to {len(self.connections)} debugger frontends for session {message.session_id}: {message.s2_msg_type}"
+        MESSAGES_LOGGER.debug(
+            "Sending message to %s debugger frontends for session %s: %s",
+            len(self.connections),
+            message.session_id,
+            message.s2_msg_type,
         )
         return await super().process_message(message, loop)
 
 
 class SessionUpdateMessageProcessor(WebSocketMessageProcessor):
+    """
+    Sends the opened and closed sessions to all connected session update websockets.
+
+    With session statistics the updates include the running statistics of the session. These are also pushed while
+    messages arrive, at most once per `push_interval` seconds per session. Must come after the statistics processor.
+
+    Websockets using the delta protocol instead receive a SessionUpdateFrame at most every `coalesce_interval` seconds,
+    with the sessions which opened or closed in that interval and the message counters of the sessions which received
+    messages. Every frame with session changes gets the next sequence number and is kept in a journal of
+    `journal_size` frames, so a websocket which reconnects only receives the changes since its last frame, or all open
+    sessions when those changes are no longer in the journal.
+    """
 
     connections: list[SessionUpdatesWebsocketConnection]
 
     sessions: dict[uuid.UUID, SessionDetails]
 
-    def __init__(self):
+    def __init__(
+        self,
+        statistics: "SessionStatisticsProcessor | None" = None,
+        push_interval: float = 1.0,
+        coalesce_interval: float = 0.25,
+        journal_size: int = 10000,
+    ):
         super().__init__()
 
         self.sessions = {}
+        self.statistics = statistics
+        self.push_interval = push_interval
+        self.coalesce_interval = coalesce_interval
+
+        # Identifies this run of the analyzer, as the sequence numbers start again after a restart.
+        self.epoch = uuid.uuid4().hex
+        self.sequence = 0
+        self._journal: deque[tuple[int, list[SessionDetails]]] = deque(
+            maxlen=journal_size
+        )
+        # The sequence number of the last frame which is no longer in the journal.
+        self._forgotten_sequence = 0
+        # The session changes and the sessions with new messages since the previous frame.
+        self._changed: dict[uuid.UUID, SessionDetails] = {}
+        self._counted: set[uuid.UUID] = set()
+        self._flush_task: "asyncio.Task | None" = None
+
+    def _with_statistics(self, session_details: SessionDetails) -> SessionDetails:
+        if self.statistics is None:
+            return session_details
+        session_statistics = self.statistics.get_session(session_details.session_id)
+        if session_statistics is None:
+            return session_details
+        session_statistics.pushed_at = time.monotonic()
+        return session_details.model_copy(
+            update={"statistics": session_statistics.as_dict()}
+        )
+
+    def _statistics_push_due(self, session_id: uuid.UUID) -> bool:
+        if self.statistics is None:
+            return False
+        session_statistics = self.statistics.get_session(session_id)
+        return (
+            session_statistics is not None
+            and time.monotonic() - session_statistics.pushed_at >= self.push_interval
+        )
+
+    def _counters(self, session_ids) -> dict[uuid.UUID, dict]:
+        if self.statistics is None:
+            return {}
+        counters = {}
+        for session_id in session_ids:
+            session_statistics = self.statistics.get_session(session_id)
+            if session_statistics is not None:
+                counters[session_id] = {
+                    "messages": session_statistics.messages,
+                    "invalid": session_statistics.invalid,
+                    "recent_messages_per_second": session_statistics.recent_rate(),
+                }
+        return counters
+
+    def _resume_frame(
+        self, epoch: "str | None", since: "int | None"
+    ) -> SessionUpdateFrame:
+        """The changes since the frame `since` of the `epoch`, or a snapshot of the open sessions when they are not
+        all in the journal."""
+        if (
+            epoch == self.epoch
+            and since is not None
+            and self._forgotten_sequence <= since <= self.sequence
+        ):
+            sessions: dict[uuid.UUID, SessionDetails] = {}
+            for sequence, changed in self._journal:
+                if sequence > since:
+                    sessions.update(
+                        (session.session_id, session) for session in changed
+                    )
+            return SessionUpdateFrame(
+                epoch=self.epoch,
+                seq=self.sequence,
+                sessions=list(sessions.values()),
+                counters=self._counters(sessions),
+            )
+
+        open_sessions = [
+            session for session in self.sessions.values() if session.state == "open"
+        ]
+        return SessionUpdateFrame(
+            epoch=self.epoch,
+            seq=self.sequence,
+            snapshot=True,
+            sessions=open_sessions,
+            counters=self._counters(session.session_id for session in open_sessions),
+        )
 
-    async def add_connection(self, connection):
+    async def add_connection(
+        self, connection, epoch: "str | None" = None, since: "int | None" = None
+    ):
+        """Adds a session update websocket. A delta websocket which reconnects passes the epoch and seq of the last
+        frame it received, to resume from there."""
         await super().add_connection(connection)
         LOGGER.debug("Session Update Processor Receiving connection.")
 
+        if connection.delta:
+            await connection.enqueue_message(self._resume_frame(epoch, since))
+            return
+
         for session in self.sessions.values():
             if session.state == "open":
-                await connection.enqueue_message(session)
+                await connection.enqueue_message(self._with_statistics(session))
+
+    def _record_update(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        session_id: uuid.UUID,
+        session_details: "SessionDetails | None" = None,
+    ) -> None:
+        """Adds a session change, or the new messages of a session, to the next frame of the delta protocol."""
+        if session_details is not None:
+            self._changed[session_id] = session_details.model_copy()
+        else:
+            self._counted.add(session_id)
+        if self._flush_task is None:
+            self._flush_task = loop.create_task(self._flush_after_interval())
+
+    async def _flush_after_interval(self) -> None:
+        await asyncio.sleep(self.coalesce_interval)
+        self._flush_task = None
+        changed = list(self._changed.values())
+        counted = self._counted | self._changed.keys()
+        self._changed = {}
+        self._counted = set()
+
+        if changed:
+            self.sequence += 1
+            if len(self._journal) == self._journal.maxlen:
+                self._forgotten_sequence = self._journal[0][0]
+            self._journal.append((self.sequence, changed))
+
+        delta_connections = [
+            connection
+            for connection in self.connections
+            if connection.delta and connection._running
+        ]
+        if not delta_connections:
+            return
+        frame = SessionUpdateFrame(
+            epoch=self.epoch,
+            seq=self.sequence,
+            sessions=changed,
+            counters=self._counters(counted),
+        )
+        for connection in delta_connections:
+            await connection.enqueue_message(frame)
+
+        self.cleanup_closed_connections()
 
     async def add_or_update_session(
         self, message: Message, state: Literal["open", "closed"]
@@ -316,11 +649,13 @@ class SessionUpdateMessageProcessor(WebSocketMessageProcessor):
                 message=message,
                 state="open",
             )
+            self._record_update(loop, message.session_id, session_details)
         elif message.message_type == MessageType.SESSION_ENDED:
             session_details = await self.add_or_update_session(
                 message=message,
                 state="closed",
             )
+            self._record_update(loop, message.session_id, session_details)
         elif (
             message.message_type == MessageType.S2
             and message.session_id not in self.sessions
@@ -330,11 +665,20 @@ class SessionUpdateMessageProcessor(WebSocketMessageProcessor):
                 message=message,
                 state="open",
             )
+            self._record_update(loop, message.session_id, session_details)
+        elif message.message_type == MessageType.S2:
+            self._record_update(loop, message.session_id)
+            if not self._statistics_push_due(message.session_id):
+                return message
+            session_details = self.sessions[message.session_id]
         else:
             return message
 
+        session_details = self._with_statistics(session_details)
         closed_connections = []
         for i, connection in enumerate(self.connections):
+            if connection.delta:
+                continue
             if connection._running:
                 await connection.enqueue_message(session_details)
             else:
@@ -348,15 +692,41 @@ class SessionUpdateMessageProcessor(WebSocketMessageProcessor):
 class MessageProcessorHandler(AsyncApplication):
     """An async application instance which processes messages by passing them through each of the MessageProcessor instances that has been added to it.
     Uses a blocking queue to buffer messages.
+
+    On shutdown the queue is drained after the connections are stopped. Messages which could not be processed before
+    the shutdown deadline are written to the backlog file, if one is configured, and processed first on the next start.
+    This includes the message which was being processed at the deadline, so it may be processed twice.
     """
 
+    # Stopped after the connections, which still produce messages while they are closing.
+    SHUTDOWN_PHASE = 1
+    REQUIRED_FOR_READINESS = True
+    # Seconds the message being processed gets to finish its cancellation when the drain times out.
+    STOP_GRACE_PERIOD = 1.0
+
     message_processors: list[MessageProcessor]
     _queue: "asyncio.Queue[Message]"
+    backlog_path: "str | None"
+    processed_messages: int
 
-    def __init__(self):
+    def __init__(self, backlog_path: "str | None" = None):
         super().__init__()
         self._queue = asyncio.Queue()
         self.message_processors = []
+        self.backlog_path = backlog_path
+        self.processed_messages = 0
+        self._backlog_loaded = False
+        self._processors_closed = False
+        # The message passing through the processors, if any.
+        self._in_flight: "Message | None" = None
+
+    def is_ready(self) -> bool:
+        return self._running and self._backlog_loaded
+
+    @property
+    def pending_messages(self) -> int:
+        """Number of messages waiting to be processed."""
+        return self._queue.qsize()
 
     def get_name(self):
         """Required by AsyncApplication"""
@@ -369,7 +739,10 @@ class MessageProcessorHandler(AsyncApplication):
         """Added a new message to the queue to be processed when the previous messages are done.
         Should be called by other async applications which need to have a message processed.
         """
-        LOGGER.info("Message Processor Handler Receiving Message: %s", message)
+        MESSAGES_LOGGER.debug(
+            "Message Processor Handler Receiving Message in session %s",
+            message.session_id,
+        )
         self._queue.put_nowait(message)
 
     async def process_message(self, message: Message, loop: asyncio.AbstractEventLoop):
@@ -385,18 +758,137 @@ class MessageProcessorHandler(AsyncApplication):
             result = await message_processor.process_message(result, loop)
 
     async def main_task(self, loop: asyncio.AbstractEventLoop):
+        self._load_backlog()
+        self._backlog_loaded = True
+
         while self._running:
             message = await self._queue.get()
-            await self.process_message(message, loop)
+            self._in_flight = message
+            try:
+                await self.process_message(message, loop)
+                self.processed_messages += 1
+                # Only cleared when processed, so a cancelled message is persisted by drain.
+                self._in_flight = None
+            finally:
+                self._queue.task_done()
+
+    def _load_backlog(self) -> None:
+        """Queues the messages which were left unprocessed by the previous shutdown."""
+        if self.backlog_path is None or not os.path.exists(self.backlog_path):
+            return
+
+        with open(self.backlog_path, encoding="utf-8") as backlog:
+            messages = [
+                Message.model_validate_json(line) for line in backlog if line.strip()
+            ]
+        os.remove(self.backlog_path)
+
+        for message in messages:
+            self._queue.put_nowait(message)
+        LOGGER.info(
+            "Loaded %s unprocessed messages from backlog %s.",
+            len(messages),
+            self.backlog_path,
+        )
+
+    def _persist_backlog(self, messages: list[Message]) -> int:
+        if self.backlog_path is None or not messages:
+            return 0
+
+        with open(self.backlog_path, "a", encoding="utf-8") as backlog:
+            for message in messages:
+                backlog.write(message.model_dump_json() + "\n")
+        return len(messages)
+
+    async def drain(self, timeout: float) -> dict:
+        """Processes the queued messages and flushes the processors until the timeout expires. The messages that are
+        still queued after the timeout, and those which the processors could not flush in time, are persisted to the
+        backlog, or dropped without one. The processors are closed afterwards.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        processed_before = self.processed_messages
+        in_flight = []
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except TimeoutError:
+            LOGGER.warning(
+                "Message Processor Handler could not process all messages within %.1f seconds.",
+                timeout,
+            )
+            # Stop now, rather than when the application is stopped, so the message being processed is known. The
+            # processors are only closed after they are flushed.
+            self._running = False
+            main_task = self._main_task
+            self._cancel_main_task()
+            if main_task is not None:
+                await asyncio.wait(
+                    [main_task], timeout=MessageProcessorHandler.STOP_GRACE_PERIOD
+                )
+            if self._in_flight is not None:
+                in_flight.append(self._in_flight)
+                self._in_flight = None
+
+        unflushed: dict[int, Message] = {}
+        for processor in self.message_processors:
+            flush = asyncio.ensure_future(processor.flush())
+            # Past the deadline a flush without pending work still completes, as it finishes in its first step.
+            done, _ = await asyncio.wait(
+                [flush], timeout=max(0.0, deadline - loop.time())
+            )
+            if not done:
+                flush.cancel()
+                LOGGER.warning(
+                    "Could not flush %s before the shutdown deadline.",
+                    type(processor).__name__,
+                )
+                # A message may be unflushed by several processors.
+                unflushed.update(
+                    (id(message), message) for message in processor.unflushed()
+                )
+            elif flush.exception() is not None:
+                LOGGER.error(
+                    "Failed to flush %s.",
+                    type(processor).__name__,
+                    exc_info=flush.exception(),
+                )
+        self._close_processors()
+
+        # In the order in which they were queued. The message in flight may have passed a processor already.
+        unflushed.update((id(message), message) for message in in_flight)
+        remaining = list(unflushed.values())
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+            self._queue.task_done()
+
+        persisted = self._persist_backlog(remaining)
+        report = {
+            "processed": self.processed_messages - processed_before,
+            "persisted": persisted,
+            "dropped": len(remaining) - persisted,
+        }
+        if report["dropped"]:
+            LOGGER.warning(
+                "Dropped %s unprocessed messages on shutdown.", report["dropped"]
+            )
+        return report
+
+    def _close_processors(self) -> None:
+        if self._processors_closed:
+            return
+        self._processors_closed = True
+        for processor in self.message_processors:
+            processor.close()
 
     def stop(self):
         self._running = False
         # self._loop.call_soon_threadsafe(self.stop, loop)
 
         # Cleanup the message processors.
-        for processor in self.message_processors:
-            processor.close()
+        self._close_processors()
+        self._cancel_main_task()
 
+    def _cancel_main_task(self) -> None:
         if (
             self._main_task
             and not self._main_task.done()
@@ -417,5 +909,10 @@ class MessageProcessorHandlerBuilder:
         self.processor_handler.add_message_processor(message_processor)
         return self
 
+    def with_shutdown_backlog(self, backlog_path: "str | None"):
+        """Persist the messages that are not processed on shutdown to this file and process them on the next start."""
+        self.processor_handler.backlog_path = backlog_path
+        return self
+
     def build(self):
         return self.processor_handler
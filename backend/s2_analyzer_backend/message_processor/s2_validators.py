@@ -0,0 +1,125 @@
+from dataclasses import dataclass
+import json
+import logging
+import time
+from typing import Optional, Type, Union
+import uuid
+
+from s2python.message import S2Message
+from s2python.s2_parser import TYPE_TO_MESSAGE_CLASS
+from s2python.s2_validation_error import S2ValidationError
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class ValidationTimings:
+    """Validation counters of a single S2 message type."""
+
+    validations: int = 0
+    invalid: int = 0
+    total_duration: float = 0.0
+    max_duration: float = 0.0
+
+    def record(self, duration: float, valid: bool) -> None:
+        self.validations += 1
+        self.invalid += int(not valid)
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+
+    def as_dict(self) -> dict:
+        return {
+            "validations": self.validations,
+            "invalid": self.invalid,
+            "average_duration": (
+                self.total_duration / self.validations if self.validations else 0.0
+            ),
+            "max_duration": self.max_duration,
+        }
+
+
+class S2ValidatorRegistry:
+    """
+    Validators of all S2 message types, shared by the message processing pipeline and the REST endpoints.
+
+    The pydantic validators of the S2 message classes are compiled once when s2python is imported. `warm_up` runs
+    every validator, including the path that builds the validation errors, so the first messages after a restart do
+    not pay for the first use. Keeps the validation timings per message type.
+    """
+
+    def __init__(
+        self, message_classes: Optional[dict[str, Type[S2Message]]] = None
+    ) -> None:
+        self.message_classes = dict(
+            TYPE_TO_MESSAGE_CLASS if message_classes is None else message_classes
+        )
+        self.timings = {
+            message_type: ValidationTimings() for message_type in self.message_classes
+        }
+        self.warm_up_duration: Optional[float] = None
+
+    @staticmethod
+    def parse_message_type(message: Union[dict, str, bytes]) -> Optional[str]:
+        if isinstance(message, (str, bytes)):
+            message = json.loads(message)
+        return message.get("message_type")
+
+    def validate(self, message: Union[dict, str, bytes]) -> S2Message:
+        """Validates the message as the S2 message class of its message type.
+
+        Raises:
+            S2ValidationError: If the message type is unknown or the message is invalid.
+            json.JSONDecodeError: If the message is not valid JSON.
+        """
+        if isinstance(message, (str, bytes)):
+            message = json.loads(message)
+        message_type = message.get("message_type")
+        message_class = self.message_classes.get(message_type)
+        if message_class is None:
+            raise S2ValidationError(
+                None,
+                message,
+                f"Unable to parse {message_type} as an S2 message. Type unknown.",
+                None,
+            )
+
+        start = time.perf_counter()
+        valid = False
+        try:
+            result = message_class.model_validate(message)
+            valid = True
+            return result
+        finally:
+            self.timings[message_type].record(time.perf_counter() - start, valid)
+
+    def warm_up(self) -> float:
+        """Runs the validator of every message type once. Returns the duration in seconds."""
+        start = time.perf_counter()
+        for message_type, message_class in self.message_classes.items():
+            try:
+                message_class.model_validate(
+                    {"message_type": message_type, "message_id": str(uuid.uuid4())}
+                )
+            except S2ValidationError as e:
+                if e.pydantic_validation_error is not None:
+                    e.pydantic_validation_error.errors()
+        self.warm_up_duration = time.perf_counter() - start
+        LOGGER.info(
+            "Warmed up the validators of %s S2 message types in %.3f seconds.",
+            len(self.message_classes),
+            self.warm_up_duration,
+        )
+        return self.warm_up_duration
+
+    def as_dict(self) -> dict:
+        return {
+            "warm_up_duration": self.warm_up_duration,
+            "message_types": {
+                message_type: timings.as_dict()
+                for message_type, timings in self.timings.items()
+            },
+        }
+
+
+# Shared by all users of the validators in the backend.
+S2_VALIDATORS = S2ValidatorRegistry()
@@ -0,0 +1,348 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+import logging
+import math
+from typing import Optional
+import uuid
+
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+from s2_analyzer_backend.message_processor.message import Message
+from s2_analyzer_backend.message_processor.message_processor import MessageProcessor
+from s2_analyzer_backend.message_processor.message_type import MessageType
+
+LOGGER = logging.getLogger(__name__)
+
+
+class QuantileSketch:
+    """
+    Streaming quantiles of positive values with a bounded relative error and a bounded number of buckets.
+
+    Values are counted in logarithmic buckets, so every reported quantile is within `relative_accuracy` of the true
+    value (DDSketch). When more than `max_buckets` buckets are in use the lowest buckets are merged, which only loses
+    accuracy for the smallest values.
+    """
+
+    # Values below this are counted as zero, e.g. messages with the same timestamp.
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 512):
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.max_buckets = max_buckets
+        self.buckets: dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if value < QuantileSketch.MIN_VALUE:
+            self.zero_count += 1
+            return
+
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self) -> None:
+        # Merge a quarter of the buckets at once, so the sorting is not repeated for every added value.
+        keys = sorted(self.buckets)
+        merged = len(keys) - self.max_buckets * 3 // 4
+        target = keys[merged]
+        for key in keys[:merged]:
+            self.buckets[target] += self.buckets.pop(key)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                # The middle of the bucket, in the relative sense.
+                value = 2 * self._gamma**key / (self._gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.max if self.count else None,
+        }
+
+
+@dataclass
+class DirectionStatistics:
+    """Counters of the messages sent in one direction of a session."""
+
+    messages: int = 0
+    bytes: int = 0
+    invalid: int = 0
+    injected: int = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "messages": self.messages,
+            "bytes": self.bytes,
+            "invalid": self.invalid,
+            "injected": self.injected,
+        }
+
+
+class SessionStatistics:
+    """Running statistics of a single session. Uses constant memory, whatever the number of messages."""
+
+    # Time constant in seconds of the recent message rate.
+    RECENT_RATE_WINDOW = 60.0
+
+    def __init__(
+        self,
+        session_id: uuid.UUID,
+        cem_id: str,
+        rm_id: str,
+        relative_accuracy: float,
+    ):
+        self.session_id = session_id
+        self.cem_id = cem_id
+        self.rm_id = rm_id
+        self.state = "open"
+        self.started_at: Optional[datetime] = None
+        self.ended_at: Optional[datetime] = None
+        self.first_message_at: Optional[datetime] = None
+        self.last_message_at: Optional[datetime] = None
+        self.directions = {
+            S2OriginType.CEM: DirectionStatistics(),
+            S2OriginType.RM: DirectionStatistics(),
+        }
+        # Bounded by the number of S2 message types.
+        self.message_types: dict[str, int] = {}
+        # Seconds between consecutive S2 messages of the session.
+        self.gaps = QuantileSketch(relative_accuracy)
+        # Seconds between receiving a message and sending it to the other device.
+        self.forwarding_latency = QuantileSketch(relative_accuracy)
+        self._recent_rate = 0.0
+        # Time of the last push of these statistics to the session update websockets.
+        self.pushed_at = -math.inf
+
+    @property
+    def messages(self) -> int:
+        return sum(direction.messages for direction in self.directions.values())
+
+    @property
+    def invalid(self) -> int:
+        return sum(direction.invalid for direction in self.directions.values())
+
+    def record_message(self, message: Message, size: int) -> None:
+        timestamp = message.timestamp or datetime.now()
+        direction = self.directions[message.origin]
+        direction.messages += 1
+        direction.bytes += size
+        if message.s2_validation_error is not None:
+            direction.invalid += 1
+        message_type = message.s2_msg_type or "Unknown"
+        self.message_types[message_type] = self.message_types.get(message_type, 0) + 1
+
+        if self.last_message_at is None:
+            self.first_message_at = timestamp
+            self._recent_rate = 0.0
+        else:
+            gap = max((timestamp - self.last_message_at).total_seconds(), 0.0)
+            self.gaps.add(gap)
+            self._recent_rate *= math.exp(-gap / SessionStatistics.RECENT_RATE_WINDOW)
+        self._recent_rate += 1 / SessionStatistics.RECENT_RATE_WINDOW
+        self.last_message_at = timestamp
+
+    def recent_rate(self) -> float:
+        """Messages per second, exponentially weighted over the last RECENT_RATE_WINDOW seconds."""
+        if self.state != "open" or self.last_message_at is None:
+            return self._recent_rate
+        idle = max((datetime.now() - self.last_message_at).total_seconds(), 0.0)
+        return self._recent_rate * math.exp(
+            -idle / SessionStatistics.RECENT_RATE_WINDOW
+        )
+
+    def as_dict(self) -> dict:
+        messages = self.messages
+        duration = (
+            (self.last_message_at - self.first_message_at).total_seconds()
+            if self.first_message_at is not None
+            else 0.0
+        )
+        return {
+            "session_id": str(self.session_id),
+            "cem_id": self.cem_id,
+            "rm_id": self.rm_id,
+            "state": self.state,
+            "started_at": self.started_at,
+            "ended_at": self.ended_at,
+            "first_message_at": self.first_message_at,
+            "last_message_at": self.last_message_at,
+            "messages": messages,
+            "invalid": self.invalid,
+            "error_rate": self.invalid / messages if messages else 0.0,
+            "messages_per_second": messages / duration if duration > 0 else None,
+            "recent_messages_per_second": self.recent_rate(),
+            "directions": {
+                origin.value: direction.as_dict()
+                for origin, direction in self.directions.items()
+            },
+            "message_types": dict(self.message_types),
+            "gaps": self.gaps.as_dict(),
+            "forwarding_latency": self.forwarding_latency.as_dict(),
+        }
+
+
+@dataclass
+class DeviceStatistics:
+    """Running statistics of a CEM or RM over all its sessions."""
+
+    device_id: str
+    device_type: S2OriginType
+    sessions: int = 0
+    messages_sent: int = 0
+    bytes_sent: int = 0
+    invalid_sent: int = 0
+    messages_received: int = 0
+    last_message_at: Optional[datetime] = None
+    message_types: dict[str, int] = field(default_factory=dict)
+
+    def as_dict(self) -> dict:
+        return {
+            "device_id": self.device_id,
+            "device_type": self.device_type.value,
+            "sessions": self.sessions,
+            "messages_sent": self.messages_sent,
+            "bytes_sent": self.bytes_sent,
+            "invalid_sent": self.invalid_sent,
+            "error_rate": (
+                self.invalid_sent / self.messages_sent if self.messages_sent else 0.0
+            ),
+            "messages_received": self.messages_received,
+            "last_message_at": self.last_message_at,
+            "message_types": dict(self.message_types),
+        }
+
+
+class SessionStatisticsProcessor(MessageProcessor):
+    """
+    A MessageProcessor which keeps running statistics per session and per device, so that dashboards do not need to
+    query the database. Must come after the MessageParserProcessor, as it counts the validation results.
+
+    The statistics of the closed sessions are kept until more than `max_closed_sessions` sessions are closed.
+
+    Attributes:
+        sessions (dict[uuid.UUID, SessionStatistics]): Statistics of the open and the most recently closed sessions.
+        devices (dict[tuple[S2OriginType, str], DeviceStatistics]): Statistics per CEM and RM.
+    """
+
+    def __init__(
+        self, max_closed_sessions: int = 1000, relative_accuracy: float = 0.01
+    ):
+        self.max_closed_sessions = max_closed_sessions
+        self.relative_accuracy = relative_accuracy
+        self.sessions: dict[uuid.UUID, SessionStatistics] = {}
+        self.devices: dict[tuple[S2OriginType, str], DeviceStatistics] = {}
+        self._closed_sessions: deque[uuid.UUID] = deque()
+
+    def _get_session(self, message: Message) -> SessionStatistics:
+        session = self.sessions.get(message.session_id)
+        if session is None:
+            session = SessionStatistics(
+                message.session_id,
+                message.cem_id,
+                message.rm_id,
+                self.relative_accuracy,
+            )
+            self.sessions[message.session_id] = session
+            for device in self._get_devices(message):
+                device.sessions += 1
+        return session
+
+    def _get_device(
+        self, device_type: S2OriginType, device_id: str
+    ) -> DeviceStatistics:
+        device = self.devices.get((device_type, device_id))
+        if device is None:
+            device = DeviceStatistics(device_id, device_type)
+            self.devices[(device_type, device_id)] = device
+        return device
+
+    def _get_devices(
+        self, message: Message
+    ) -> tuple[DeviceStatistics, DeviceStatistics]:
+        """Returns the statistics of the sending and of the receiving device of the message."""
+        cem = self._get_device(S2OriginType.CEM, message.cem_id)
+        rm = self._get_device(S2OriginType.RM, message.rm_id)
+        return (cem, rm) if message.origin.is_cem() else (rm, cem)
+
+    async def process_message(
+        self, message: Message, loop: asyncio.AbstractEventLoop
+    ) -> Message:
+        if message.message_type == MessageType.SESSION_STARTED:
+            self._get_session(message).started_at = message.timestamp
+        elif message.message_type == MessageType.SESSION_ENDED:
+            self._close_session(message)
+        elif message.message_type == MessageType.MSG_INJECTED:
+            self._get_session(message).directions[message.origin].injected += 1
+        elif message.message_type == MessageType.S2 and message.msg is not None:
+            self._record_message(message)
+        return message
+
+    def _record_message(self, message: Message) -> None:
+        # Injected messages were not received in a frame, they are counted without bytes.
+        size = message.size or 0
+        self._get_session(message).record_message(message, size)
+
+        sender, receiver = self._get_devices(message)
+        sender.messages_sent += 1
+        sender.bytes_sent += size
+        sender.invalid_sent += int(message.s2_validation_error is not None)
+        message_type = message.s2_msg_type or "Unknown"
+        sender.message_types[message_type] = (
+            sender.message_types.get(message_type, 0) + 1
+        )
+        sender.last_message_at = message.timestamp
+        receiver.messages_received += 1
+
+    def _close_session(self, message: Message) -> None:
+        session = self.sessions.get(message.session_id)
+        if session is None or session.state == "closed":
+            return
+        session.state = "closed"
+        session.ended_at = message.timestamp
+
+        self._closed_sessions.append(message.session_id)
+        while len(self._closed_sessions) > self.max_closed_sessions:
+            self.sessions.pop(self._closed_sessions.popleft(), None)
+
+    def record_forwarding_latency(self, session_id: uuid.UUID, latency: float) -> None:
+        """Records the time between receiving a message and sending it to the other device. Ignored until the
+        session start is processed, the forwarding does not wait for the message processing.
+        """
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.forwarding_latency.add(latency)
+
+    def get_session(self, session_id: uuid.UUID) -> Optional[SessionStatistics]:
+        return self.sessions.get(session_id)
+
+    def get_device(
+        self, device_type: S2OriginType, device_id: str
+    ) -> Optional[DeviceStatistics]:
+        return self.devices.get((device_type, device_id))
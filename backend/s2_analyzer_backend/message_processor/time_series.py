@@ -0,0 +1,415 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import logging
+import math
+import threading
+import time
+from typing import Optional
+import uuid
+
+from s2python.common import PowerMeasurement
+from s2python.frbc import FRBCActuatorStatus, FRBCInstruction, FRBCStorageStatus
+from s2python.message import S2Message
+from sqlalchemy import Engine, insert
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, func, select
+
+from s2_analyzer_backend.endpoints.history_cache import local_naive
+from s2_analyzer_backend.message_processor.database import TimeSeriesPoint
+from s2_analyzer_backend.message_processor.message import Message
+from s2_analyzer_backend.message_processor.message_processor import (
+    MessageProcessor,
+    MessageStorageProcessor,
+)
+from s2_analyzer_backend.message_processor.message_type import MessageType
+
+LOGGER = logging.getLogger(__name__)
+
+# Resolution of the points which hold a single value.
+RAW = 0
+# Resolutions in seconds of the rollups, finest first.
+ROLLUP_RESOLUTIONS = (1, 60, 900)
+# The history maintenance deletes the old points of a finer resolution than this.
+MIN_RETAINED_RESOLUTION = 60
+
+
+def _bucket_start(timestamp: datetime, resolution: int) -> datetime:
+    if resolution == RAW:
+        return timestamp
+    return datetime.fromtimestamp(
+        math.floor(timestamp.timestamp() / resolution) * resolution
+    )
+
+
+def extract_points(
+    s2_msg: S2Message, received_at: datetime
+) -> list[tuple[str, datetime, float]]:
+    """Extracts the numeric values of an S2 message as (series, timestamp, value).
+
+    Values without a timestamp of their own in the message get the time at which the message was received.
+    """
+    if isinstance(s2_msg, PowerMeasurement):
+        timestamp = local_naive(s2_msg.measurement_timestamp)
+        return [
+            (
+                f"power.{power_value.commodity_quantity.value}",
+                timestamp,
+                power_value.value,
+            )
+            for power_value in s2_msg.values
+        ]
+    if isinstance(s2_msg, FRBCStorageStatus):
+        return [("frbc.fill_level", received_at, s2_msg.present_fill_level)]
+    if isinstance(s2_msg, FRBCActuatorStatus):
+        return [
+            (
+                f"frbc.actuator.{s2_msg.actuator_id}.operation_mode_factor",
+                received_at,
+                s2_msg.operation_mode_factor,
+            )
+        ]
+    if isinstance(s2_msg, FRBCInstruction):
+        return [
+            (
+                f"frbc.instruction.{s2_msg.actuator_id}.operation_mode_factor",
+                local_naive(s2_msg.execution_time),
+                s2_msg.operation_mode_factor,
+            )
+        ]
+    return []
+
+
+@dataclass
+class _Bucket:
+    session_id: uuid.UUID
+    series: str
+    resolution: int
+    bucket_start: datetime
+    value_count: int
+    value_min: float
+    value_max: float
+    value_sum: float
+
+    @classmethod
+    def of_value(
+        cls,
+        session_id: uuid.UUID,
+        series: str,
+        resolution: int,
+        timestamp: datetime,
+        value: float,
+    ) -> "_Bucket":
+        return cls(
+            session_id,
+            series,
+            resolution,
+            _bucket_start(timestamp, resolution),
+            1,
+            value,
+            value,
+            value,
+        )
+
+    def add(self, value: float) -> None:
+        self.value_count += 1
+        self.value_min = min(self.value_min, value)
+        self.value_max = max(self.value_max, value)
+        self.value_sum += value
+
+    def merge(self, other: "_Bucket") -> None:
+        self.value_count += other.value_count
+        self.value_min = min(self.value_min, other.value_min)
+        self.value_max = max(self.value_max, other.value_max)
+        self.value_sum += other.value_sum
+
+    def as_row(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "series": self.series,
+            "resolution": self.resolution,
+            "bucket_start": self.bucket_start,
+            "value_count": self.value_count,
+            "value_min": self.value_min,
+            "value_max": self.value_max,
+            "value_sum": self.value_sum,
+        }
+
+    def as_point(self) -> dict:
+        return {
+            "timestamp": self.bucket_start,
+            "min": self.value_min,
+            "max": self.value_max,
+            "avg": self.value_sum / self.value_count,
+            "count": self.value_count,
+        }
+
+
+class TimeSeriesProcessor(MessageProcessor):
+    """
+    A MessageProcessor which extracts the numeric values of the S2 messages, e.g. the power measurements and the
+    FRBC fill levels, into time series. Must come after the MessageParserProcessor, as it reads the parsed messages.
+
+    Every value is stored as a raw point and added to the rollups of 1 second, 1 minute and 15 minutes, which keep
+    the minimum, maximum and average per bucket. The bucket of each rollup that is being filled is kept in memory
+    and stored once a value of a later bucket arrives or the session ends. The rows are written behind in batches in
+    the executor, every `flush_size` rows or `flush_interval` seconds. Rows which could not be written are written
+    again with the next batch, and dropped after MessageStorageProcessor.MAX_ATTEMPTS attempts.
+
+    With a `raw_max_age` only the rollups of at least MIN_RETAINED_RESOLUTION are queried for points older than that,
+    as the history maintenance deletes the finer points.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        flush_size: int = 1000,
+        flush_interval: float = 1.0,
+        raw_max_age: Optional[timedelta] = None,
+    ):
+        self.engine = engine
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.raw_max_age = raw_max_age
+        # The buckets being filled, per rollup resolution, by session and series.
+        self._open: dict[tuple[uuid.UUID, str], dict[int, _Bucket]] = {}
+        # Finished buckets and raw points which are not written yet.
+        self._pending: list[_Bucket] = []
+        self._writing: list[_Bucket] = []
+        # Held while the written rows are committed and while querying, so the rows are counted either in the
+        # database or in memory.
+        self._lock = threading.Lock()
+        self._failed_attempts = 0
+        self._flushed_at = time.monotonic()
+
+    async def process_message(
+        self, message: Message, loop: asyncio.AbstractEventLoop
+    ) -> Message:
+        if message.message_type == MessageType.SESSION_ENDED:
+            self._close_session(message.session_id)
+        elif message.message_type == MessageType.S2 and message.s2_msg is not None:
+            received_at = message.timestamp or datetime.now()
+            for series, timestamp, value in extract_points(message.s2_msg, received_at):
+                self._add(message.session_id, series, timestamp, value)
+
+        if self._pending and (
+            time.monotonic() - self._flushed_at >= self.flush_interval
+            # After a failed write the next attempt waits for the interval.
+            or (len(self._pending) >= self.flush_size and not self._failed_attempts)
+        ):
+            await self._write_pending(loop)
+        return message
+
+    def _add(
+        self, session_id: uuid.UUID, series: str, timestamp: datetime, value: float
+    ) -> None:
+        self._pending.append(
+            _Bucket.of_value(session_id, series, RAW, timestamp, value)
+        )
+        open_buckets = self._open.setdefault((session_id, series), {})
+        for resolution in ROLLUP_RESOLUTIONS:
+            bucket_start = _bucket_start(timestamp, resolution)
+            bucket = open_buckets.get(resolution)
+            if bucket is not None and bucket.bucket_start == bucket_start:
+                bucket.add(value)
+            elif bucket is not None and bucket_start < bucket.bucket_start:
+                # A late value is stored as a separate row of its bucket, the rows are merged when queried.
+                self._pending.append(
+                    _Bucket.of_value(session_id, series, resolution, timestamp, value)
+                )
+            else:
+                if bucket is not None:
+                    self._pending.append(bucket)
+                open_buckets[resolution] = _Bucket.of_value(
+                    session_id, series, resolution, timestamp, value
+                )
+
+    def _close_session(self, session_id: uuid.UUID) -> None:
+        for key in [key for key in self._open if key[0] == session_id]:
+            self._pending.extend(self._open.pop(key).values())
+
+    async def _write_pending(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._writing, self._pending = self._pending, []
+        self._flushed_at = time.monotonic()
+        rows = len(self._writing)
+        try:
+            await loop.run_in_executor(None, self._write, self._writing)
+            self._failed_attempts = 0
+            return
+        except OperationalError as e:
+            # E.g. the database is locked by a long transaction of another writer.
+            self._failed_attempts += 1
+            if self._failed_attempts < MessageStorageProcessor.MAX_ATTEMPTS:
+                LOGGER.warning(
+                    "Could not store %s time series rows, retrying: %s", rows, e
+                )
+                self._pending[:0] = self._writing
+                return
+            LOGGER.exception("Could not store %s time series rows.", rows)
+        except Exception:
+            LOGGER.exception("Could not store %s time series rows.", rows)
+        finally:
+            self._writing = []
+        self._failed_attempts = 0
+        LOGGER.error("Dropped %s time series rows which could not be stored.", rows)
+
+    def _write(self, buckets: list[_Bucket]) -> None:
+        with Session(self.engine) as session:
+            session.execute(
+                insert(TimeSeriesPoint), [bucket.as_row() for bucket in buckets]
+            )
+            with self._lock:
+                session.commit()
+                self._writing = []
+
+    async def flush(self):
+        """Stores the buckets being filled and all pending rows."""
+        for key in list(self._open):
+            self._pending.extend(self._open.pop(key).values())
+        while self._pending:
+            if self._failed_attempts:
+                await asyncio.sleep(MessageStorageProcessor.RETRY_PAUSE)
+            await self._write_pending(asyncio.get_running_loop())
+
+    def _unwritten(self, session_id: uuid.UUID, series: str, resolution: int):
+        """The rows of the series which are not (yet) in the database."""
+        for bucket in self._writing + self._pending:
+            if (
+                bucket.session_id == session_id
+                and bucket.series == series
+                and bucket.resolution == resolution
+            ):
+                yield bucket
+        bucket = self._open.get((session_id, series), {}).get(resolution)
+        if bucket is not None:
+            yield bucket
+
+    def get_series(self, session_id: uuid.UUID) -> list[dict]:
+        """Lists the series of a session with the number of values and the time of the first and the last value."""
+        series: dict[str, dict] = {}
+
+        def add(name: str, count: int, first: datetime, last: datetime) -> None:
+            entry = series.setdefault(
+                name, {"series": name, "count": 0, "first": first, "last": last}
+            )
+            entry["count"] += count
+            entry["first"] = min(entry["first"], first)
+            entry["last"] = max(entry["last"], last)
+
+        with self._lock, Session(self.engine) as session:
+            rows = session.exec(
+                select(
+                    TimeSeriesPoint.series,
+                    func.count(),
+                    func.min(TimeSeriesPoint.bucket_start),
+                    func.max(TimeSeriesPoint.bucket_start),
+                )
+                .where(TimeSeriesPoint.session_id == session_id)
+                .where(TimeSeriesPoint.resolution == RAW)
+                .group_by(TimeSeriesPoint.series)
+            )
+            for name, count, first, last in rows:
+                add(name, count, first, last)
+            for bucket in self._writing + self._pending:
+                if bucket.session_id == session_id and bucket.resolution == RAW:
+                    add(bucket.series, 1, bucket.bucket_start, bucket.bucket_start)
+        return sorted(series.values(), key=lambda entry: entry["series"])
+
+    def _count_raw(
+        self, session: Session, session_id: uuid.UUID, series: str, start, end
+    ) -> int:
+        count = session.exec(
+            select(func.count())
+            .select_from(TimeSeriesPoint)
+            .where(TimeSeriesPoint.session_id == session_id)
+            .where(TimeSeriesPoint.series == series)
+            .where(TimeSeriesPoint.resolution == RAW)
+            .where(TimeSeriesPoint.bucket_start >= start)
+            .where(TimeSeriesPoint.bucket_start < end)
+        ).one()
+        return count + sum(
+            start <= bucket.bucket_start < end
+            for bucket in self._unwritten(session_id, series, RAW)
+        )
+
+    def get_points(
+        self,
+        session_id: uuid.UUID,
+        series: str,
+        start: datetime,
+        end: datetime,
+        max_points: int,
+    ) -> dict:
+        """Returns the points of the series in [start, end) at the finest resolution which returns at most
+        `max_points` points. The coarsest rollup is used when even that has more buckets. Raw values with the same
+        timestamp are returned as a single point."""
+        start, end = local_naive(start), local_naive(end)
+        retained = (
+            self.raw_max_age is None or start >= datetime.now() - self.raw_max_age
+        )
+        rollup_resolutions = [
+            rollup_resolution
+            for rollup_resolution in ROLLUP_RESOLUTIONS
+            if retained or rollup_resolution >= MIN_RETAINED_RESOLUTION
+        ]
+        with self._lock, Session(self.engine) as session:
+            resolution = rollup_resolutions[-1]
+            if (
+                retained
+                and self._count_raw(session, session_id, series, start, end)
+                <= max_points
+            ):
+                resolution = RAW
+            else:
+                for rollup_resolution in rollup_resolutions:
+                    buckets = (end - start) / timedelta(seconds=rollup_resolution)
+                    if math.ceil(buckets) <= max_points:
+                        resolution = rollup_resolution
+                        break
+
+            query_start = _bucket_start(start, resolution)
+            rows = session.exec(
+                select(
+                    TimeSeriesPoint.bucket_start,
+                    func.sum(TimeSeriesPoint.value_count),
+                    func.min(TimeSeriesPoint.value_min),
+                    func.max(TimeSeriesPoint.value_max),
+                    func.sum(TimeSeriesPoint.value_sum),
+                )
+                .where(TimeSeriesPoint.session_id == session_id)
+                .where(TimeSeriesPoint.series == series)
+                .where(TimeSeriesPoint.resolution == resolution)
+                .where(TimeSeriesPoint.bucket_start >= query_start)
+                .where(TimeSeriesPoint.bucket_start < end)
+                .group_by(TimeSeriesPoint.bucket_start)
+            )
+            buckets = {
+                bucket_start: _Bucket(
+                    session_id,
+                    series,
+                    resolution,
+                    bucket_start,
+                    count,
+                    low,
+                    high,
+                    total,
+                )
+                for bucket_start, count, low, high, total in rows
+            }
+
+            for bucket in self._unwritten(session_id, series, resolution):
+                if not query_start <= bucket.bucket_start < end:
+                    continue
+                if bucket.bucket_start in buckets:
+                    buckets[bucket.bucket_start].merge(bucket)
+                else:
+                    buckets[bucket.bucket_start] = _Bucket(**bucket.__dict__)
+
+        points = sorted(buckets.values(), key=lambda bucket: bucket.bucket_start)
+        return {
+            "series": series,
+            "resolution": resolution,
+            "start": start,
+            "end": end,
+            "points": [bucket.as_point() for bucket in points],
+        }
@@ -0,0 +1,116 @@
+from collections import OrderedDict
+from datetime import datetime
+import logging
+from typing import NamedTuple
+import uuid
+
+from sqlalchemy import insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, select
+
+from s2_analyzer_backend.message_processor.database import (
+    Communication,
+    ValidationError,
+    ValidationErrorCount,
+    ValidationErrorSignature,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ValidationErrorKey(NamedTuple):
+    type: str
+    loc: str
+    msg: str
+
+
+class ValidationErrorStore:
+    """
+    Stores the validation errors of the S2 messages as references to their ValidationErrorSignature, so an error which
+    a misbehaving device repeats in every message is stored once, and counts them per signature, session and hour in
+    ValidationErrorCount. Must be used from a single thread.
+
+    The ids of the recently used signatures are kept in memory, so a known error is stored without a lookup.
+    """
+
+    def __init__(self, max_known_signatures: int = 10000):
+        self.max_known_signatures = max_known_signatures
+        # The ids of the stored signatures, most recently used last.
+        self._known: OrderedDict[ValidationErrorKey, int] = OrderedDict()
+        # The signatures and counts of the transaction which is not committed yet.
+        self._pending_signatures: dict[ValidationErrorKey, int] = {}
+        self._pending_counts: dict[tuple[int, uuid.UUID, datetime], int] = {}
+
+    def add(
+        self,
+        session: Session,
+        communication: Communication,
+        errors: list[ValidationErrorKey],
+    ) -> None:
+        """Adds the validation errors of the message to the transaction."""
+        hour = communication.timestamp.replace(minute=0, second=0, microsecond=0)
+        for error in errors:
+            signature_id = self._signature_id(session, error)
+            session.add(
+                ValidationError(signature_id=signature_id, communication=communication)
+            )
+            key = (signature_id, communication.session_id, hour)
+            self._pending_counts[key] = self._pending_counts.get(key, 0) + 1
+
+    def write(self, session: Session) -> None:
+        """Adds the counts of the transaction to the counters."""
+        if not self._pending_counts:
+            return
+        statement = sqlite_insert(ValidationErrorCount)
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["hour", "signature_id", "session_id"],
+                set_={"count": ValidationErrorCount.count + statement.excluded.count},
+            ),
+            [
+                {
+                    "signature_id": signature_id,
+                    "session_id": session_id,
+                    "hour": hour,
+                    "count": count,
+                }
+                for (
+                    signature_id,
+                    session_id,
+                    hour,
+                ), count in self._pending_counts.items()
+            ],
+        )
+
+    def committed(self) -> None:
+        self._known.update(self._pending_signatures)
+        while len(self._known) > self.max_known_signatures:
+            self._known.popitem(last=False)
+        self._pending_signatures.clear()
+        self._pending_counts.clear()
+
+    def rolled_back(self) -> None:
+        self._pending_signatures.clear()
+        self._pending_counts.clear()
+
+    def _signature_id(self, session: Session, error: ValidationErrorKey) -> int:
+        if error in self._pending_signatures:
+            return self._pending_signatures[error]
+        if error in self._known:
+            self._known.move_to_end(error)
+            return self._known[error]
+
+        # Signatures are never deleted, an import running concurrently may have stored it already.
+        session.execute(
+            insert(ValidationErrorSignature)
+            .prefix_with("OR IGNORE")
+            .values(type=error.type, loc=error.loc, msg=error.msg)
+        )
+        signature_id = session.exec(
+            select(ValidationErrorSignature.id)
+            .where(ValidationErrorSignature.type == error.type)
+            .where(ValidationErrorSignature.loc == error.loc)
+            .where(ValidationErrorSignature.msg == error.msg)
+        ).one()
+        self._pending_signatures[error] = signature_id
+        return signature_id
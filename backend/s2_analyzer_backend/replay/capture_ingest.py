@@ -0,0 +1,429 @@
+import asyncio
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from enum import Enum
+import json
+import logging
+import os
+from pathlib import Path
+import time
+from typing import TYPE_CHECKING, BinaryIO, Optional
+import uuid
+
+import pydantic
+from pydantic import BaseModel, Field
+
+from s2_analyzer_backend.async_application import AsyncApplication
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+from s2_analyzer_backend.message_processor.message import Message
+from s2_analyzer_backend.message_processor.message_processor import (
+    MessageParserProcessor,
+    MessageStorageProcessor,
+)
+from s2_analyzer_backend.message_processor.message_type import MessageType
+
+if TYPE_CHECKING:
+    from s2_analyzer_backend.async_application import ApplicationName
+    from s2_analyzer_backend.config import IngestConfig
+
+LOGGER = logging.getLogger(__name__)
+
+CHECKPOINT_SUFFIX = ".progress"
+
+
+class IngestState(str, Enum):
+    RUNNING = "running"
+    FINISHED = "finished"
+    STOPPED = "stopped"
+    FAILED = "failed"
+
+
+class CaptureIngestRequest(BaseModel):
+    """Pydantic model of a request to import a capture file."""
+
+    # Path of the capture file, relative to the configured capture directory.
+    path: str
+    # Session, CEM and RM of the lines which do not specify them. A new session id is used when not given.
+    session_id: Optional[uuid.UUID] = None
+    cem_id: str = "capture"
+    rm_id: str = "capture"
+    # Continue after the last stored batch of an earlier import of the same file.
+    resume: bool = True
+    # Messages per batch. Defaults to the configured batch size.
+    batch_size: Optional[int] = Field(None, gt=0)
+
+
+class CaptureIngestStatus(BaseModel):
+    import_id: uuid.UUID
+    request: CaptureIngestRequest
+    state: IngestState
+    session_id: uuid.UUID
+    total_bytes: int
+    # Bytes of the file of which the messages are stored, including an earlier import that was resumed.
+    stored_bytes: int
+    resumed_from: int
+    progress: float
+    lines: int
+    stored: int
+    invalid: int
+    malformed: int
+    messages_per_second: float
+    started_at: datetime
+    duration: float
+    error: Optional[str] = None
+
+
+class CaptureLine(BaseModel):
+    """A single line of a capture file."""
+
+    origin: S2OriginType
+    message: dict
+    # ISO 8601 or seconds since the epoch. The time of the import is used when missing.
+    timestamp: Optional[datetime] = None
+    session_id: Optional[uuid.UUID] = None
+    cem_id: Optional[str] = None
+    rm_id: Optional[str] = None
+
+
+@dataclass
+class _CaptureSession:
+    """The devices of a session in the capture and the time of its last message, with which the session is ended."""
+
+    cem_id: str
+    rm_id: str
+    last_timestamp: datetime
+
+    def as_dict(self) -> dict:
+        return {
+            "cem_id": self.cem_id,
+            "rm_id": self.rm_id,
+            "last_timestamp": self.last_timestamp.isoformat(),
+        }
+
+    @staticmethod
+    def from_dict(value: dict) -> "_CaptureSession":
+        return _CaptureSession(
+            value["cem_id"],
+            value["rm_id"],
+            datetime.fromisoformat(value["last_timestamp"]),
+        )
+
+
+@dataclass
+class _Batch:
+    messages: list[Message] = field(default_factory=list)
+    # Byte offset in the file directly after the last line of the batch.
+    end_offset: int = 0
+    lines: int = 0
+    invalid: int = 0
+    malformed: int = 0
+    # The sessions of the messages of the batch, by session id, as of the end of the batch.
+    sessions: dict[str, _CaptureSession] = field(default_factory=dict)
+    finished: bool = False
+
+
+def resolve_capture_path(directory: str, path: str) -> Path:
+    """Resolves the path of a capture file inside the capture directory.
+
+    Raises:
+        ValueError: If the path points outside the capture directory.
+        FileNotFoundError: If the capture file does not exist.
+    """
+    base = Path(directory).resolve()
+    capture_path = (base / path).resolve()
+    if not capture_path.is_relative_to(base):
+        raise ValueError("Capture file must be inside the capture directory.")
+    if not capture_path.is_file():
+        raise FileNotFoundError(f"Capture file {path} does not exist.")
+    return capture_path
+
+
+class CaptureIngest(AsyncApplication):
+    """
+    Imports a capture file with one S2 message per line (NDJSON) through the validation and the storage of the
+    message processing pipeline.
+
+    The file is streamed in batches, so files larger than the memory can be imported. The next batch is read and
+    validated in the executor while the previous batch is stored, and every batch is stored in a single transaction.
+    The validation of a batch is not split over more workers: it is cheaper than sending the messages to another
+    process and much cheaper than storing them, which is the bottleneck.
+    After every stored batch the byte offset and the counters are written to a checkpoint file next to the capture,
+    from which a stopped or crashed import resumes. A crash between storing a batch and writing the checkpoint stores
+    that batch again on resume.
+    """
+
+    def __init__(
+        self,
+        request: CaptureIngestRequest,
+        config: "IngestConfig",
+        storage: MessageStorageProcessor,
+    ) -> None:
+        super().__init__()
+        self.import_id = uuid.uuid4()
+        self.request = request
+        self.path = resolve_capture_path(config.directory, request.path)
+        self.checkpoint_path = self.path.with_name(self.path.name + CHECKPOINT_SUFFIX)
+        self.batch_size = request.batch_size or config.batch_size
+        self.parser = MessageParserProcessor()
+        self.storage = storage
+
+        self.state = IngestState.RUNNING
+        self.session_id = request.session_id or uuid.uuid4()
+        self.total_bytes = self.path.stat().st_size
+        self.stored_bytes = 0
+        self.resumed_from = 0
+        self.lines = 0
+        self.stored = 0
+        self.invalid = 0
+        self.malformed = 0
+        self.error: Optional[str] = None
+        self.started_at = datetime.now()
+        self._stored_at_start = 0
+        self._start = time.monotonic()
+        self._duration: Optional[float] = None
+        # The sessions of the stored batches. Only accessed by the executor job which stores the batches.
+        self._stored_sessions: dict[str, _CaptureSession] = {}
+        # The sessions of the read batches. Only accessed by the executor job which reads the batches.
+        self._read_sessions: dict[str, _CaptureSession] = {}
+        self._read_lines = 0
+
+        if request.resume:
+            self._load_checkpoint()
+
+    def get_name(self) -> "ApplicationName":
+        return f"Capture import {self.import_id}"
+
+    def status(self) -> CaptureIngestStatus:
+        duration = (
+            self._duration
+            if self._duration is not None
+            else time.monotonic() - self._start
+        )
+        return CaptureIngestStatus(
+            import_id=self.import_id,
+            request=self.request,
+            state=self.state,
+            session_id=self.session_id,
+            total_bytes=self.total_bytes,
+            stored_bytes=self.stored_bytes,
+            resumed_from=self.resumed_from,
+            progress=(
+                self.stored_bytes / self.total_bytes if self.total_bytes else 1.0
+            ),
+            lines=self.lines,
+            stored=self.stored,
+            invalid=self.invalid,
+            malformed=self.malformed,
+            messages_per_second=(
+                (self.stored - self._stored_at_start) / duration if duration else 0.0
+            ),
+            started_at=self.started_at,
+            duration=duration,
+            error=self.error,
+        )
+
+    def _load_checkpoint(self) -> None:
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except FileNotFoundError:
+            return
+        if checkpoint["offset"] > self.total_bytes:
+            LOGGER.warning(
+                "Ignoring checkpoint %s: the capture file is smaller than the checkpoint offset.",
+                self.checkpoint_path,
+            )
+            return
+
+        self.session_id = uuid.UUID(checkpoint["session_id"])
+        self.stored_bytes = self.resumed_from = checkpoint["offset"]
+        self.lines = checkpoint["lines"]
+        self.stored = self._stored_at_start = checkpoint["stored"]
+        self.invalid = checkpoint["invalid"]
+        self.malformed = checkpoint["malformed"]
+        self._stored_sessions = {
+            session_key: _CaptureSession.from_dict(session)
+            for session_key, session in checkpoint["sessions"].items()
+        }
+        self._read_sessions = {
+            session_key: replace(session)
+            for session_key, session in self._stored_sessions.items()
+        }
+        self._read_lines = self.lines
+        if checkpoint["finished"]:
+            self.state = IngestState.FINISHED
+
+    def _write_checkpoint(self, finished: bool) -> None:
+        checkpoint = {
+            "session_id": str(self.session_id),
+            "offset": self.stored_bytes,
+            "lines": self.lines,
+            "stored": self.stored,
+            "invalid": self.invalid,
+            "malformed": self.malformed,
+            "sessions": {
+                session_key: session.as_dict()
+                for session_key, session in self._stored_sessions.items()
+            },
+            "finished": finished,
+        }
+        temporary_path = self.checkpoint_path.with_name(
+            self.checkpoint_path.name + ".tmp"
+        )
+        with open(temporary_path, "w", encoding="utf-8") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(temporary_path, self.checkpoint_path)
+
+    async def main_task(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self.state == IngestState.FINISHED:
+            LOGGER.info(
+                "Capture %s was already imported. Import again without resume to store it again.",
+                self.path,
+            )
+            self._duration = 0.0
+            return
+
+        try:
+            await self._ingest(loop)
+            self.state = IngestState.FINISHED
+        except asyncio.CancelledError:
+            self.state = IngestState.STOPPED
+            raise
+        except Exception as exc:
+            self.state = IngestState.FAILED
+            self.error = str(exc)
+            raise
+        finally:
+            self._duration = time.monotonic() - self._start
+            LOGGER.info(
+                "Import %s of capture %s %s: %s lines, %s stored, %s invalid, %s malformed.",
+                self.import_id,
+                self.path,
+                self.state.value,
+                self.lines,
+                self.stored,
+                self.invalid,
+                self.malformed,
+            )
+
+    async def _ingest(self, loop: asyncio.AbstractEventLoop) -> None:
+        jobs: list[asyncio.Future] = []
+        with open(self.path, "rb") as capture:
+            capture.seek(self.stored_bytes)
+            try:
+                pending_store: Optional[asyncio.Future] = None
+                while True:
+                    # Read and validate the next batch while the previous batch is stored.
+                    read = loop.run_in_executor(None, self._read_batch, capture)
+                    jobs = [read] if pending_store is None else [read, pending_store]
+                    batch = await asyncio.shield(read)
+                    if pending_store is not None:
+                        await asyncio.shield(pending_store)
+                    if not batch.lines:
+                        break
+                    pending_store = loop.run_in_executor(None, self._store_batch, batch)
+            except asyncio.CancelledError:
+                # The executor jobs can not be interrupted. Wait for them, so the checkpoint is up to date when the
+                # import is stopped.
+                await asyncio.gather(*jobs, return_exceptions=True)
+                raise
+
+        await loop.run_in_executor(None, self._store_batch, self._end_sessions())
+
+    def _read_batch(self, capture: BinaryIO) -> _Batch:
+        batch = _Batch()
+        while len(batch.messages) < self.batch_size:
+            line = capture.readline()
+            if not line:
+                break
+            batch.lines += 1
+            self._read_lines += 1
+            if not line.strip():
+                continue
+
+            try:
+                capture_line = CaptureLine.model_validate_json(line)
+            except pydantic.ValidationError as e:
+                batch.malformed += 1
+                LOGGER.warning(
+                    "Skipping malformed line %s of capture %s: %s",
+                    self._read_lines,
+                    self.path,
+                    e.errors(include_url=False)[0]["msg"],
+                )
+                continue
+
+            message = self._to_message(capture_line)
+            session_key = str(message.session_id)
+            session = self._read_sessions.get(session_key)
+            if session is None:
+                session = self._read_sessions[session_key] = _CaptureSession(
+                    message.cem_id, message.rm_id, message.timestamp
+                )
+                batch.messages.append(
+                    message.model_copy(
+                        update={
+                            "message_type": MessageType.SESSION_STARTED,
+                            "msg": None,
+                        }
+                    )
+                )
+            self.parser.parse(message)
+            batch.invalid += int(message.s2_validation_error is not None)
+            batch.messages.append(message)
+            session.last_timestamp = message.timestamp
+            batch.sessions[session_key] = session
+
+        # A copy, as the next batch is read while this one is stored.
+        batch.sessions = {
+            session_key: replace(session)
+            for session_key, session in batch.sessions.items()
+        }
+        batch.end_offset = capture.tell()
+        return batch
+
+    def _to_message(self, capture_line: CaptureLine) -> Message:
+        fields = {}
+        if capture_line.timestamp is not None:
+            fields["timestamp"] = capture_line.timestamp
+        return Message(
+            session_id=capture_line.session_id or self.session_id,
+            cem_id=capture_line.cem_id or self.request.cem_id,
+            rm_id=capture_line.rm_id or self.request.rm_id,
+            origin=capture_line.origin,
+            message_type=MessageType.S2,
+            msg=capture_line.message,
+            **fields,
+        )
+
+    def _end_sessions(self) -> _Batch:
+        batch = _Batch(end_offset=self.stored_bytes, finished=True)
+        for session_key, session in sorted(self._stored_sessions.items()):
+            batch.messages.append(
+                Message(
+                    session_id=uuid.UUID(session_key),
+                    cem_id=session.cem_id,
+                    rm_id=session.rm_id,
+                    origin=S2OriginType.CEM,
+                    message_type=MessageType.SESSION_ENDED,
+                    timestamp=session.last_timestamp,
+                )
+            )
+        return batch
+
+    def _store_batch(self, batch: _Batch) -> None:
+        """Stores the batch in a single transaction and records the progress in the checkpoint."""
+        self.storage.store(batch.messages)
+        self._stored_sessions.update(batch.sessions)
+        self.stored_bytes = batch.end_offset
+        self.lines += batch.lines
+        self.stored += sum(
+            message.message_type == MessageType.S2 for message in batch.messages
+        )
+        self.invalid += batch.invalid
+        self.malformed += batch.malformed
+        self._write_checkpoint(batch.finished)
+
+    def stop(self) -> None:
+        if self._main_task is not None and not self._main_task.done():
+            self._main_task.cancel("Request to stop")
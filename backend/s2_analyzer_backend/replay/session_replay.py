@@ -0,0 +1,260 @@
+import asyncio
+from datetime import datetime
+from enum import Enum
+import logging
+import time
+from typing import TYPE_CHECKING, Optional
+import uuid
+
+from pydantic import BaseModel, Field
+from sqlalchemy import Engine
+from sqlmodel import Session
+
+from s2_analyzer_backend.async_application import AsyncApplication
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+from s2_analyzer_backend.endpoints.history_filter import HistoryFilter
+from s2_analyzer_backend.message_processor.database import (
+    CommunicationWithValidationErrors,
+)
+from s2_analyzer_backend.message_processor.message import Message
+from s2_analyzer_backend.message_processor.message_type import MessageType
+
+if TYPE_CHECKING:
+    from s2_analyzer_backend.async_application import ApplicationName
+    from s2_analyzer_backend.device_connection.router import MessageRouter
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ReplayTarget(str, Enum):
+    # Inject the messages into the live connections of the CEM and/or RM.
+    LIVE = "live"
+    # Only pass the messages through the message processing pipeline, as a new session.
+    PIPELINE = "pipeline"
+
+
+class ReplayPacing(str, Enum):
+    # Keep the recorded time between the messages, divided by the speed.
+    TIMED = "timed"
+    # Replay as fast as possible.
+    FAST = "fast"
+
+
+class ReplayState(str, Enum):
+    RUNNING = "running"
+    FINISHED = "finished"
+    STOPPED = "stopped"
+    FAILED = "failed"
+
+
+class SessionReplayRequest(BaseModel):
+    """Pydantic model of a request to replay a recorded session."""
+
+    session_id: uuid.UUID
+    target: ReplayTarget = ReplayTarget.PIPELINE
+    pacing: ReplayPacing = ReplayPacing.FAST
+    # With timed pacing: 1.0 replays in real time, 10.0 ten times faster.
+    speed: float = Field(1.0, gt=0)
+    # The recorded directions to replay. E.g. only the RM messages to test a live CEM against recorded traffic.
+    origins: list[S2OriginType] = [S2OriginType.CEM, S2OriginType.RM]
+    # Live target: the CEM and RM to inject into. Defaults to the ids of the recorded session.
+    cem_id: Optional[str] = None
+    rm_id: Optional[str] = None
+
+
+class SessionReplayStatus(BaseModel):
+    replay_id: uuid.UUID
+    request: SessionReplayRequest
+    state: ReplayState
+    # Session of the replayed messages in the pipeline target.
+    replay_session_id: Optional[uuid.UUID]
+    replayed: int
+    skipped: int
+    failed: int
+    started_at: datetime
+    duration: float
+    error: Optional[str] = None
+
+
+class SessionReplay(AsyncApplication):
+    """
+    Re-drives a recorded session from the stored history into the live connections or into the message processing
+    pipeline. The messages are streamed from the database in the order they were stored, so the order per direction
+    is preserved.
+    """
+
+    # Pause the replay while the message processor handler has this many messages waiting.
+    MAX_PENDING_MESSAGES = 10000
+    BACKPRESSURE_DELAY = 0.01  # seconds
+
+    def __init__(
+        self,
+        request: SessionReplayRequest,
+        msg_router: "MessageRouter",
+        engine: Engine,
+    ) -> None:
+        super().__init__()
+        self.replay_id = uuid.uuid4()
+        self.request = request
+        self.msg_router = msg_router
+        self.engine = engine
+
+        self.state = ReplayState.RUNNING
+        self.replay_session_id: Optional[uuid.UUID] = None
+        if request.target == ReplayTarget.PIPELINE:
+            self.replay_session_id = uuid.uuid4()
+        self.replayed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.error: Optional[str] = None
+        self.started_at = datetime.now()
+        self._start = time.monotonic()
+        self._duration: Optional[float] = None
+
+    def get_name(self) -> "ApplicationName":
+        return f"Session replay {self.replay_id}"
+
+    def status(self) -> SessionReplayStatus:
+        return SessionReplayStatus(
+            replay_id=self.replay_id,
+            request=self.request,
+            state=self.state,
+            replay_session_id=self.replay_session_id,
+            replayed=self.replayed,
+            skipped=self.skipped,
+            failed=self.failed,
+            started_at=self.started_at,
+            duration=(
+                self._duration
+                if self._duration is not None
+                else time.monotonic() - self._start
+            ),
+            error=self.error,
+        )
+
+    async def main_task(self, loop: asyncio.AbstractEventLoop) -> None:
+        try:
+            await self._replay(loop)
+            self.state = ReplayState.FINISHED
+        except asyncio.CancelledError:
+            self.state = ReplayState.STOPPED
+            raise
+        except Exception as exc:
+            self.state = ReplayState.FAILED
+            self.error = str(exc)
+            raise
+        finally:
+            self._duration = time.monotonic() - self._start
+            LOGGER.info(
+                "Replay %s of session %s %s: %s replayed, %s skipped, %s failed.",
+                self.replay_id,
+                self.request.session_id,
+                self.state.value,
+                self.replayed,
+                self.skipped,
+                self.failed,
+            )
+
+    def _read_batch(
+        self, after_id: int
+    ) -> tuple[list[CommunicationWithValidationErrors], Optional[int]]:
+        with Session(self.engine) as db_session:
+            return HistoryFilter(db_session).get_s2_session_history_batch(
+                self.request.session_id, after_id
+            )
+
+    async def _replay(self, loop: asyncio.AbstractEventLoop) -> None:
+        first_timestamp: Optional[datetime] = None
+        replay_start = time.monotonic()
+        session_started = False
+        cem_id = rm_id = None
+
+        # Every batch is read in the executor, so the queries and the decompression of the messages do not hold up
+        # the connections.
+        after_id: Optional[int] = 0
+        while after_id is not None:
+            batch, after_id = await loop.run_in_executor(
+                None, self._read_batch, after_id
+            )
+            for communication in batch:
+                cem_id = self.request.cem_id or communication.cem_id
+                rm_id = self.request.rm_id or communication.rm_id
+                origin = S2OriginType(communication.origin)
+                if (
+                    communication.message_type != MessageType.S2
+                    or communication.s2_msg is None
+                    or origin not in self.request.origins
+                ):
+                    self.skipped += 1
+                    continue
+
+                if self.request.pacing == ReplayPacing.TIMED:
+                    if first_timestamp is None:
+                        first_timestamp = communication.timestamp
+                    offset = (
+                        communication.timestamp - first_timestamp
+                    ).total_seconds() / self.request.speed
+                    delay = replay_start + offset - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                elif self.replayed % 100 == 0:
+                    # Let the connections and the pipeline work while replaying as fast as possible.
+                    await asyncio.sleep(0)
+
+                # Injected messages are processed by the pipeline as well.
+                await self._wait_for_pipeline()
+                if self.request.target == ReplayTarget.LIVE:
+                    await self._inject(origin, cem_id, rm_id, communication.s2_msg)
+                else:
+                    if not session_started:
+                        self._process(
+                            cem_id, rm_id, origin, MessageType.SESSION_STARTED
+                        )
+                        session_started = True
+                    self._process(
+                        cem_id, rm_id, origin, MessageType.S2, communication.s2_msg
+                    )
+                    self.replayed += 1
+
+        if session_started:
+            self._process(cem_id, rm_id, S2OriginType.CEM, MessageType.SESSION_ENDED)
+
+    async def _inject(
+        self, origin: S2OriginType, cem_id: str, rm_id: str, msg: dict
+    ) -> None:
+        origin_id, dest_id = (cem_id, rm_id) if origin.is_cem() else (rm_id, cem_id)
+        try:
+            await self.msg_router.inject_message(origin_id, dest_id, msg)
+            self.replayed += 1
+        except ValueError as e:
+            self.failed += 1
+            if self.failed == 1:
+                LOGGER.warning("Replay %s failed to inject: %s", self.replay_id, e)
+
+    def _process(
+        self,
+        cem_id: str,
+        rm_id: str,
+        origin: S2OriginType,
+        message_type: MessageType,
+        msg: Optional[dict] = None,
+    ) -> None:
+        self.msg_router.msg_processor_handler.add_message_to_process(
+            Message(
+                session_id=self.replay_session_id,
+                cem_id=cem_id,
+                rm_id=rm_id,
+                origin=origin,
+                message_type=message_type,
+                msg=msg,
+            )
+        )
+
+    async def _wait_for_pipeline(self) -> None:
+        handler = self.msg_router.msg_processor_handler
+        while handler.pending_messages >= SessionReplay.MAX_PENDING_MESSAGES:
+            await asyncio.sleep(SessionReplay.BACKPRESSURE_DELAY)
+
+    def stop(self) -> None:
+        if self._main_task is not None and not self._main_task.done():
+            self._main_task.cancel("Request to stop")
@@ -0,0 +1,147 @@
+import logging
+import threading
+from typing import TYPE_CHECKING, Optional
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from s2_analyzer_backend.async_application import APPLICATIONS
+from s2_analyzer_backend.message_processor.s2_validators import S2_VALIDATORS
+from s2_analyzer_backend.sampling_profiler import DEFAULT_INTERVAL, SamplingProfiler
+
+if TYPE_CHECKING:
+    from s2_analyzer_backend.event_loop import EventLoopMonitor
+
+LOGGER = logging.getLogger(__name__)
+
+
+class AdminAPI:
+    """
+    AdminAPI has endpoints exposing the runtime diagnostics of the S2 Analyzer backend.
+
+    Attributes:
+        router (APIRouter): The FastAPI router for handling API routes.
+        loop_monitor (EventLoopMonitor, optional): Measures the lag and stalls of the event loop.
+        profiler (SamplingProfiler): In-process profiler which can be started and stopped at runtime.
+    """
+
+    router: APIRouter
+
+    def __init__(self, loop_monitor: "Optional[EventLoopMonitor]" = None) -> None:
+        super().__init__()
+
+        self.router = APIRouter()
+        self.loop_monitor = loop_monitor
+        self.profiler = SamplingProfiler()
+
+        self.router.add_api_route(
+            "/backend/admin/applications/",
+            self.get_applications,
+            methods=["GET"],
+            summary="Running applications and lifecycle metrics",
+            description="Lists the running async applications with the stop latency and leaked task counters.",
+            tags=["admin"],
+        )
+
+        self.router.add_api_route(
+            "/backend/ready/",
+            self.get_readiness,
+            methods=["GET"],
+            summary="Readiness of the backend",
+            description="Responds with 200 once the REST API serves and the message processing runs, i.e. the "
+            "backend is ready to ingest S2 messages, and with 503 otherwise.",
+            tags=["admin"],
+        )
+
+        self.router.add_api_route(
+            "/backend/admin/validators/",
+            self.get_validators,
+            methods=["GET"],
+            summary="S2 message validation timings",
+            description="Returns the warm-up duration and the validation count and duration per S2 message type.",
+            tags=["admin"],
+        )
+
+        self.router.add_api_route(
+            "/backend/admin/event-loop/",
+            self.get_event_loop,
+            methods=["GET"],
+            summary="Event loop lag and stalls",
+            description="Returns the current, average and maximum event loop lag and the stacks of recent stalls.",
+            tags=["admin"],
+        )
+
+        self.router.add_api_route(
+            "/backend/admin/profiler/",
+            self.get_profiler,
+            methods=["GET"],
+            summary="Status of the sampling profiler",
+            tags=["admin"],
+        )
+
+        self.router.add_api_route(
+            "/backend/admin/profiler/start/",
+            self.start_profiler,
+            methods=["POST"],
+            summary="Start the sampling profiler",
+            description="Samples the stacks every `interval` seconds. By default only the event loop thread is "
+            "sampled, with `all_threads` every thread of the backend is.",
+            tags=["admin"],
+        )
+
+        self.router.add_api_route(
+            "/backend/admin/profiler/stop/",
+            self.stop_profiler,
+            methods=["POST"],
+            summary="Stop the sampling profiler",
+            description="Returns the sampled stacks in the folded format, which can be rendered by flamegraph.pl or "
+            "speedscope.",
+            response_class=PlainTextResponse,
+            tags=["admin"],
+        )
+
+    async def get_applications(self):
+        """Endpoint listing the running async applications and the lifecycle metrics."""
+        return {
+            "metrics": APPLICATIONS.get_metrics(),
+            "applications": list(APPLICATIONS.applications.keys()),
+        }
+
+    async def get_readiness(self):
+        """Endpoint for the readiness probe of container orchestration."""
+        readiness = APPLICATIONS.readiness()
+        return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+    async def get_validators(self):
+        return S2_VALIDATORS.as_dict()
+
+    async def get_event_loop(self):
+        """Endpoint returning the event loop lag measurements."""
+        if self.loop_monitor is None:
+            raise HTTPException(
+                status_code=404, detail="The event loop is not monitored."
+            )
+        return self.loop_monitor.as_dict()
+
+    async def get_profiler(self):
+        return self.profiler.as_dict()
+
+    async def start_profiler(
+        self, interval: float = DEFAULT_INTERVAL, all_threads: bool = False
+    ):
+        if self.profiler.running:
+            raise HTTPException(status_code=409, detail="The profiler is running.")
+        if interval <= 0:
+            raise HTTPException(status_code=400, detail="Interval must be positive.")
+
+        thread_ids = None
+        if not all_threads:
+            thread_ids = {threading.get_ident()}
+        self.profiler.start(interval, thread_ids)
+        return self.profiler.as_dict()
+
+    async def stop_profiler(self):
+        try:
+            return PlainTextResponse(self.profiler.stop())
+        except RuntimeError as exc:
+            raise HTTPException(status_code=409, detail=str(exc)) from exc
@@ -0,0 +1,87 @@
+"""
+Helpers of the bulk endpoints, which accept a JSON array or an NDJSON stream of items in the request body.
+"""
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Optional
+
+from fastapi import HTTPException, Request
+from s2python.s2_validation_error import S2ValidationError
+
+from s2_analyzer_backend.message_processor.s2_validators import S2_VALIDATORS
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl")
+# Number of items validated per executor job and after which the bulk endpoints yield to the event loop.
+CHUNK_SIZE = 500
+
+
+def is_ndjson(request: Request) -> bool:
+    content_type = request.headers.get("content-type", "")
+    return content_type.split(";")[0].strip() in NDJSON_CONTENT_TYPES
+
+
+async def _read_ndjson(request: Request) -> AsyncIterator[Any]:
+    remainder = b""
+    async for chunk in request.stream():
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if remainder.strip():
+        yield json.loads(remainder)
+
+
+async def read_chunks(request: Request) -> AsyncIterator[list[Any]]:
+    """Reads the items of the request body in chunks of at most CHUNK_SIZE items.
+
+    The body is either a JSON array, or NDJSON (one JSON item per line) when sent with an NDJSON content type.
+    NDJSON is parsed while it is received, so the first chunks are handled before the whole body arrived.
+
+    Raises:
+        HTTPException: 400 if the body is not a JSON array or not valid (ND)JSON.
+    """
+    try:
+        if is_ndjson(request):
+            chunk = []
+            async for item in _read_ndjson(request):
+                chunk.append(item)
+                if len(chunk) == CHUNK_SIZE:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+            return
+
+        items = json.loads(await request.body())
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}") from e
+
+    if not isinstance(items, list):
+        raise HTTPException(
+            status_code=400, detail="Body must be a JSON array or NDJSON."
+        )
+    for start in range(0, len(items), CHUNK_SIZE):
+        yield items[start : start + CHUNK_SIZE]
+
+
+def validation_errors(message: Any) -> Optional[list]:
+    """Validates a single S2 message. Returns None if the message is valid, otherwise the validation errors."""
+    if not isinstance(message, dict):
+        return [{"type": "validation_error", "loc": [], "msg": "Not a JSON object."}]
+    try:
+        S2_VALIDATORS.validate(message)
+    except S2ValidationError as e:
+        if e.pydantic_validation_error:
+            return e.pydantic_validation_error.errors(include_url=False)
+        return [{"type": "validation_error", "loc": [], "msg": e.msg}]
+    return None
+
+
+async def validate_chunk(messages: list[Any]) -> list[Optional[list]]:
+    """Validates the messages in the default executor, so that large batches do not block the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, lambda: [validation_errors(message) for message in messages]
+    )
@@ -0,0 +1,86 @@
+import logging
+from typing import TYPE_CHECKING, Literal, Optional
+import uuid
+
+from fastapi import APIRouter, HTTPException, Query
+
+from s2_analyzer_backend.message_processor.conformance import ConformanceRule
+
+if TYPE_CHECKING:
+    from s2_analyzer_backend.message_processor.conformance import (
+        ConformanceProcessor,
+    )
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ConformanceAPI:
+    """
+    ConformanceAPI serves the S2 protocol violations found by the conformance checks of the message processing.
+
+    Attributes:
+        router (APIRouter): The FastAPI router for handling API routes.
+        conformance (ConformanceProcessor): The message processor which checks the protocol rules.
+    """
+
+    router: APIRouter
+
+    def __init__(self, conformance: "ConformanceProcessor") -> None:
+        super().__init__()
+
+        self.router = APIRouter()
+        self.conformance = conformance
+
+        self.router.add_api_route(
+            "/backend/conformance/sessions/",
+            self.get_sessions,
+            methods=["GET"],
+            summary="Protocol conformance of the open and recently closed sessions",
+            tags=["conformance"],
+        )
+        self.router.add_api_route(
+            "/backend/conformance/sessions/{session_id}/",
+            self.get_session,
+            methods=["GET"],
+            summary="Protocol state and recent violations of a session",
+            tags=["conformance"],
+        )
+        self.router.add_api_route(
+            "/backend/conformance/violations/",
+            self.get_violations,
+            methods=["GET"],
+            summary="Most recent protocol violations of all sessions",
+            tags=["conformance"],
+        )
+
+    async def get_sessions(
+        self,
+        state: Optional[Literal["open", "closed"]] = Query(
+            None, description="Session state filter"
+        ),
+        with_violations: bool = Query(
+            False, description="Only the sessions with violations"
+        ),
+    ) -> list[dict]:
+        return [
+            session.as_dict()
+            for session in list(self.conformance.sessions.values())
+            if (state is None or session.state == state)
+            and (not with_violations or session.violation_counts)
+        ]
+
+    async def get_session(self, session_id: uuid.UUID) -> dict:
+        session = self.conformance.sessions.get(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Unknown session.")
+        return session.as_dict(include_violations=True)
+
+    async def get_violations(
+        self,
+        rule: Optional[ConformanceRule] = Query(None, description="Rule filter"),
+    ) -> list[dict]:
+        return [
+            violation.as_dict()
+            for violation in list(self.conformance.recent_violations)
+            if rule is None or violation.rule == rule
+        ]
@@ -1,6 +1,8 @@
+import asyncio
 import json
 import logging
-from typing import List, Optional, TYPE_CHECKING
+from typing import Any, Callable, Hashable, List, Optional, TYPE_CHECKING
+import uuid
 
 from fastapi import (
     Response,
@@ -10,7 +12,10 @@ from fastapi import (
     Depends,
     Query,
     HTTPException,
+    Request,
 )
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from s2_analyzer_backend.message_processor.message_processor import (
     DebuggerFrontendMessageProcessor,
@@ -22,17 +27,29 @@ from s2_analyzer_backend.device_connection.connection import (
     SessionUpdatesWebsocketConnection,
 )
 
-from s2_analyzer_backend.endpoints.history_filter import HistoryFilter
+from s2_analyzer_backend.device_connection.connection_stats import SLOW_CONSUMER_EVENTS
+from s2_analyzer_backend.endpoints.history_cache import (
+    CacheScope,
+    HistoryResponseCache,
+    etag_matches,
+    local_naive,
+    make_etag,
+)
+from s2_analyzer_backend.endpoints.history_filter import HistoryFilter, SearchColumn
 from datetime import datetime
 
 
 from s2_analyzer_backend.async_application import APPLICATIONS
-from s2python.s2_parser import S2Parser
+from s2_analyzer_backend.message_processor.s2_validators import S2_VALIDATORS
+from s2_analyzer_backend.rest_apis import bulk
 from s2python.s2_validation_error import S2ValidationError
 
 from s2_analyzer_backend.device_connection.session_details import SessionDetails
 from s2_analyzer_backend.endpoints.history_filter import HistoryFilter
 
+if TYPE_CHECKING:
+    from s2_analyzer_backend.config import Config
+
 LOGGER = logging.getLogger(__name__)
 
 
@@ -51,6 +68,8 @@ class DebuggerAPI:
         router (APIRouter): The FastAPI router for handling API routes.
         debugger_frontend_msg_processor (DebuggerFrontendMessageProcessor): The message
             processor instance which all of the frontend websocket connections must be added to.
+        config (Config): Analyzer configuration, e.g. the frontend websocket sender settings.
+        response_cache (HistoryResponseCache): The responses of the history queries which do not change anymore.
     """
 
     router: APIRouter
@@ -59,6 +78,8 @@ class DebuggerAPI:
         self,
         debugger_frontend_msg_processor: "DebuggerFrontendMessageProcessor",
         session_update_msg_processor: "SessionUpdateMessageProcessor",
+        config: "Config",
+        response_cache: "Optional[HistoryResponseCache]" = None,
     ) -> None:
         super().__init__()
         self.uvicorn_server = None
@@ -66,6 +87,8 @@ class DebuggerAPI:
         self.router = APIRouter()
         self.debugger_frontend_msg_processor = debugger_frontend_msg_processor
         self.session_update_msg_processor = session_update_msg_processor
+        self.config = config
+        self.response_cache = response_cache or HistoryResponseCache(0)
 
         self.router.add_api_route("/", self.get_root)
         self.router.add_api_websocket_route(
@@ -75,6 +98,20 @@ class DebuggerAPI:
             "/backend/session-updates/",
             self.receive_new_session_update_frontend_connection,
         )
+        self.router.add_api_route(
+            "/backend/debugger/stats/",
+            self.get_debugger_connection_stats,
+            methods=["GET"],
+            summary="Throughput statistics of the debugger websockets",
+            tags=["debugger"],
+        )
+        self.router.add_api_route(
+            "/backend/debugger/slow-consumers/",
+            self.get_slow_consumer_events,
+            methods=["GET"],
+            summary="Recent slow consumer events of frontend and device connections",
+            tags=["debugger"],
+        )
         self.router.add_api_route(
             "/backend/history-filter/",
             self.get_filtered_history,
@@ -83,6 +120,40 @@ class DebuggerAPI:
             description="Query historical data filtered by criteria such as CEM ID, RM ID, origin, message type, and timestamp.",
             tags=["debugger"],
         )
+        self.router.add_api_route(
+            "/backend/history-filter/cache/",
+            self.get_response_cache_stats,
+            methods=["GET"],
+            summary="Statistics of the history response cache",
+            tags=["debugger"],
+        )
+        self.router.add_api_route(
+            "/backend/history-filter/search/",
+            self.search_history,
+            methods=["GET"],
+            summary="Full-text search of the message history",
+            description="Searches the stored messages and their validation errors for words, e.g. an id or a field "
+            "name mentioned in a validation error. Returns the matches ranked by relevance, one page at a time.",
+            tags=["debugger"],
+        )
+        self.router.add_api_route(
+            "/backend/history-filter/fields/",
+            self.get_indexed_fields,
+            methods=["GET"],
+            summary="Indexed fields inside the S2 messages",
+            description="Lists the JSON paths inside the S2 messages which the history can be filtered on, with "
+            "the progress of indexing the messages stored before the path was indexed.",
+            tags=["debugger"],
+        )
+        self.router.add_api_route(
+            "/backend/history-filter/validation-errors/",
+            self.get_validation_error_counts,
+            methods=["GET"],
+            summary="Most frequent validation errors",
+            description="Lists the distinct validation errors which occurred most often in a time range, optionally "
+            "in one session, with the number of occurrences and sessions. Counted per hour.",
+            tags=["debugger"],
+        )
         self.router.add_api_route(
             "/backend/validate-message/",
             self.validate_s2_message,
@@ -91,6 +162,15 @@ class DebuggerAPI:
             description="Validate an S2 message against the schema.",
             tags=["debugger"],
         )
+        self.router.add_api_route(
+            "/backend/validate-message/bulk/",
+            self.validate_s2_messages,
+            methods=["POST"],
+            summary="Validate many S2 messages",
+            description="Validate a JSON array or an NDJSON stream (Content-Type: application/x-ndjson) of S2 "
+            "messages against the schema. Returns the errors per message, in the order of the messages.",
+            tags=["debugger"],
+        )
         self.router.add_api_route(
             "/backend/connections/",
             self.get_connections,
@@ -110,6 +190,10 @@ class DebuggerAPI:
         include_session_history: Optional[bool] = Query(
             True, description="Send past messages on connection."
         ),
+        batch: bool = Query(
+            False,
+            description="Send queued messages together as JSON arrays instead of one message per frame.",
+        ),
         history_filter: HistoryFilter = Depends(),  # Dependency injected history filter which queries database
     ) -> None:
         """Accepts an incoming websocket connection from the debugger frontend.
@@ -132,7 +216,14 @@ class DebuggerAPI:
             include_session_history=include_session_history,
         )
 
-        conn = DebuggerFrontendWebsocketConnection(websocket, history_filter, filters)
+        conn = DebuggerFrontendWebsocketConnection(
+            websocket,
+            history_filter,
+            filters,
+            max_batch_size=self.config.websocket.max_batch_size if batch else 1,
+            max_batch_delay=self.config.websocket.max_batch_delay,
+            slow_consumer_config=self.config.slow_consumer,
+        )
 
         APPLICATIONS.add_and_start_application(conn)
         LOGGER.info("Degugger frontend connection added to applications.")
@@ -147,6 +238,15 @@ class DebuggerAPI:
     async def receive_new_session_update_frontend_connection(
         self,
         websocket: WebSocket,
+        delta: bool = Query(
+            False, description="Receive coalesced frames of the session changes."
+        ),
+        epoch: Optional[str] = Query(
+            None, description="Epoch of the last frame received, to resume from."
+        ),
+        since: Optional[int] = Query(
+            None, description="Seq of the last frame received, to resume from."
+        ),
     ):
         LOGGER.info("Received new session update connection from debugger frontend.")
 
@@ -157,10 +257,14 @@ class DebuggerAPI:
                 "Debugger frontend session update WS connection had an exception while accepting."
             )
 
-        conn = SessionUpdatesWebsocketConnection(websocket)
+        conn = SessionUpdatesWebsocketConnection(
+            websocket, slow_consumer_config=self.config.slow_consumer, delta=delta
+        )
 
         APPLICATIONS.add_and_start_application(conn)
-        await self.session_update_msg_processor.add_connection(conn)
+        await self.session_update_msg_processor.add_connection(
+            conn, epoch=epoch, since=since
+        )
 
         await conn.wait_till_done_async(
             timeout=None, kill_after_timeout=False, raise_on_timeout=False
@@ -168,57 +272,225 @@ class DebuggerAPI:
 
         LOGGER.warning("Exiting session frontend connection.")
 
+    async def get_debugger_connection_stats(self):
+        """Endpoint listing the sender throughput statistics of every open debugger frontend websocket."""
+        return [
+            {
+                "connection": str(connection),
+                **connection.stats.as_dict(),
+                **connection.slow_consumer.as_dict(),
+            }
+            for connection in self.debugger_frontend_msg_processor.connections
+            if connection._running
+        ]
+
+    async def get_slow_consumer_events(self):
+        """Endpoint listing the most recent slow consumer events, newest last."""
+        return list(SLOW_CONSUMER_EVENTS)
+
     async def get_filtered_history(
         self,
+        request: Request,
+        session_id: Optional[uuid.UUID] = Query(None, description="Session ID filter"),
         cem_id: Optional[str] = Query(None, description="CEM ID filter"),
         rm_id: Optional[str] = Query(None, description="RM ID filter"),
         origin: Optional[str] = Query(None, description="Origin filter"),
         s2_msg_type: Optional[str] = Query(None, description="S2 message type filter"),
         start_date: Optional[datetime] = Query(None, description="Start date filter"),
         end_date: Optional[datetime] = Query(None, description="End date filter"),
+        field: List[str] = Query(
+            [],
+            description="Filter on a value inside the S2 message as path:value, e.g. subject_message_id:<id>. "
+            "The path must be indexed. Can be repeated, all must match.",
+        ),
         history_filter: HistoryFilter = Depends(),  # Dependency injected history filter which queries database
     ):
         """GET Endpoint that filters and returns the query of message history.
         Args:
+            session_id (Optional[uuid.UUID]): Session ID filter.
             cem_id (Optional[str]): CEM ID filter.
             rm_id (Optional[str]): RM ID filter.
             origin (Optional[str]): Origin filter.
             s2_msg_type (Optional[str]): S2 message type filter.
             start_date (Optional[datetime]): Start date filter.
             end_date (Optional[datetime]): End date filter.
+            field (List[str]): Filters on indexed values inside the S2 messages, as path:value.
             history_filter (HistoryFilter): Dependency injected history filter which queries the database.
         Returns:
-            List[Dict]: A list of filtered message history records.
+            Response: A list of filtered message history records, with an ETag. Served from the cache when the
+            session is closed or the end date has passed, and 304 Not Modified if the ETag is in If-None-Match.
         Raises:
-            HTTPException: If an error occurs during the filtering process.
+            HTTPException: If a field filter is malformed or not indexed, or an error occurs during the filtering.
         """
         LOGGER.info(
-            f"Received history filter request: cem_id={cem_id}, rm_id={rm_id}, origin={origin}, s2_msg_type={s2_msg_type}, start_date={start_date}, end_date={end_date}"
+            "Received history filter request: session_id=%s, cem_id=%s, rm_id=%s, origin=%s, s2_msg_type=%s, start_date=%s, end_date=%s, fields=%s",
+            session_id,
+            cem_id,
+            rm_id,
+            origin,
+            s2_msg_type,
+            start_date,
+            end_date,
+            field,
         )
 
-        try:
-            # Fetch filtered records
-            results = history_filter.get_filtered_records(
-                cem_id, rm_id, origin, s2_msg_type, start_date, end_date
-            )
+        fields = []
+        for field_filter in field:
+            path, separator, value = field_filter.partition(":")
+            if not separator:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Field filter {field_filter} is not of the form path:value.",
+                )
+            if path not in self.config.message_index.paths:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Field {path} is not indexed. Indexed are: {', '.join(self.config.message_index.paths)}.",
+                )
+            fields.append((path, value))
+
+        scope = CacheScope(
+            session_id=session_id,
+            start=None if start_date is None else local_naive(start_date),
+            end=None if end_date is None else local_naive(end_date),
+        )
+        cacheable = (
+            session_id is not None and self.response_cache.is_closed(session_id)
+        ) or (scope.end is not None and scope.end < datetime.now())
+        key = (
+            "history-filter",
+            session_id,
+            cem_id,
+            rm_id,
+            origin,
+            s2_msg_type,
+            scope.start,
+            scope.end,
+            tuple(fields),
+        )
+
+        def filter_history():
+            try:
+                # Fetch filtered records
+                results = history_filter.get_filtered_records(
+                    session_id=session_id,
+                    cem_id=cem_id,
+                    rm_id=rm_id,
+                    origin=origin,
+                    s2_msg_type=s2_msg_type,
+                    start_date=start_date,
+                    end_date=end_date,
+                    fields=fields,
+                )
+
+                LOGGER.info("Found %s matching records.", len(results))
+                return results
+            except Exception as e:
+                LOGGER.error("Error in get_filtered_history: %s", e)
+                raise HTTPException(status_code=500, detail="Internal Server Error")
+
+        return self._cached_response(
+            request, key, scope if cacheable else None, filter_history
+        )
+
+    async def get_response_cache_stats(self):
+        return self.response_cache.stats()
+
+    def _cached_response(
+        self,
+        request: Request,
+        key: Hashable,
+        scope: Optional[CacheScope],
+        produce: Callable[[], Any],
+    ) -> Response:
+        """Responds with the JSON of `produce`, from the cache if it has a scope, i.e. the messages it is made of do
+        not change anymore. The response has an ETag, so a client which has it already gets a 304 Not Modified.
+        """
+        cached = None if scope is None else self.response_cache.get(key)
+        if cached is not None:
+            etag = cached.etag
+            body = cached.body
+        elif scope is None:
+            body = JSONResponse(jsonable_encoder(produce())).body
+            etag = make_etag(body)
+        else:
+            with self.response_cache.computing(scope) as computation:
+                body = JSONResponse(jsonable_encoder(produce())).body
+                etag = self.response_cache.put(key, body, computation).etag
+
+        # Clients must revalidate, the response changes while a session is running.
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    async def search_history(
+        self,
+        q: str = Query(..., description="Words which must all occur in the message"),
+        column: Optional[SearchColumn] = Query(
+            None, description="Only search the message or only its validation errors"
+        ),
+        session_id: Optional[uuid.UUID] = Query(None, description="Session ID filter"),
+        fts_syntax: bool = Query(
+            False,
+            description="Interpret q as an SQLite FTS5 query, e.g. power* OR ranges",
+        ),
+        limit: int = Query(50, gt=0, le=1000, description="Results per page"),
+        offset: int = Query(0, ge=0, description="Number of results to skip"),
+        history_filter: HistoryFilter = Depends(),  # Dependency injected history filter which queries database
+    ):
+        """Endpoint searching the full-text index of the stored messages and validation errors."""
+        return history_filter.search(
+            q,
+            column=column,
+            session_id=session_id,
+            limit=limit,
+            offset=offset,
+            fts_syntax=fts_syntax,
+        )
 
-            LOGGER.info(f"Found {len(results)} matching records.")
-            return results
-        except Exception as e:
-            LOGGER.error(f"Error in get_filtered_history: {str(e)}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+    async def get_indexed_fields(
+        self,
+        history_filter: HistoryFilter = Depends(),  # Dependency injected history filter which queries database
+    ):
+        """Endpoint listing the indexed paths inside the S2 messages and whether the older messages are indexed."""
+        progress = {state.path: state for state in history_filter.get_indexed_paths()}
+        return [
+            {
+                "path": path,
+                "backfilled": path in progress
+                and progress[path].backfilled_up_to >= progress[path].backfill_until,
+            }
+            for path in self.config.message_index.paths
+        ]
+
+    async def get_validation_error_counts(
+        self,
+        start_date: Optional[datetime] = Query(None, description="Start date filter"),
+        end_date: Optional[datetime] = Query(None, description="End date filter"),
+        session_id: Optional[uuid.UUID] = Query(None, description="Session ID filter"),
+        limit: int = Query(
+            20, gt=0, le=1000, description="Number of validation errors"
+        ),
+        history_filter: HistoryFilter = Depends(),  # Dependency injected history filter which queries database
+    ):
+        """Endpoint listing the most frequent validation errors from the hourly counters."""
+        return history_filter.get_validation_error_counts(
+            start_date=start_date,
+            end_date=end_date,
+            session_id=session_id,
+            limit=limit,
+        )
 
     async def validate_s2_message(self, body: ValidateS2Message):
         """
         Receives an S2 message and validates it against the schema.
         Returns the validated message and any errors that occurred during validation.
         """
-        s2_parser = S2Parser()
         errors = []
 
         try:
-            LOGGER.info(body.message)
-            s2_message = s2_parser.parse_as_any_message(body.message)
+            s2_message = S2_VALIDATORS.validate(body.message)
         except S2ValidationError as e:
             s2_message = body.message
             errors = []
@@ -227,17 +499,63 @@ class DebuggerAPI:
             else:
                 errors = [e.__dict__]
 
-            LOGGER.warning(f"Error parsing message: {e}")
+            LOGGER.warning("Error parsing message: %s", e)
 
-        LOGGER.info(f"Validated S2 message: {s2_message}")
+        LOGGER.debug("Validated S2 message: %s", s2_message)
         return {"message": s2_message, "errors": errors}
 
+    async def validate_s2_messages(self, request: Request):
+        """
+        Receives a JSON array or NDJSON stream of S2 messages and validates them against the schema.
+        The chunks of messages are validated concurrently in the executor while the rest of the body is received.
+        """
+        validations = []
+        results = []
+        try:
+            async for chunk in bulk.read_chunks(request):
+                validations.append(
+                    (chunk, asyncio.ensure_future(bulk.validate_chunk(chunk)))
+                )
+
+            for chunk, validation in validations:
+                for message, errors in zip(chunk, await validation):
+                    results.append(
+                        {
+                            "index": len(results),
+                            "message_type": (
+                                message.get("message_type")
+                                if isinstance(message, dict)
+                                else None
+                            ),
+                            "valid": errors is None,
+                            "errors": errors or [],
+                        }
+                    )
+        finally:
+            # The validations are not awaited when the body turns out to be invalid, e.g. at a malformed line later
+            # in the NDJSON, or when the request is cancelled.
+            pending = [validation for _, validation in validations]
+            for validation in pending:
+                validation.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        invalid = sum(not result["valid"] for result in results)
+        return {
+            "valid": len(results) - invalid,
+            "invalid": invalid,
+            "results": results,
+        }
+
     async def get_connections(
         self,
+        request: Request,
         history_filter: HistoryFilter = Depends(),  # Dependency injected history filter which queries database
     ):
-        """Endpoint to view all open connections to the S2 Analyzer."""
-
-        history_sessions = history_filter.get_unique_sessions()
-
-        return history_sessions
+        """Endpoint to view all open connections to the S2 Analyzer. Served from the cache while no session is
+        running."""
+        return self._cached_response(
+            request,
+            ("connections",),
+            None if self.response_cache.has_open_sessions() else CacheScope(),
+            history_filter.get_unique_sessions,
+        )
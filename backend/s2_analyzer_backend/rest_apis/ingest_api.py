@@ -0,0 +1,150 @@
+from collections import OrderedDict
+import logging
+from typing import TYPE_CHECKING, Optional
+import uuid
+
+from fastapi import APIRouter, HTTPException
+
+from s2_analyzer_backend.async_application import APPLICATIONS
+from s2_analyzer_backend.message_processor.database import get_engine
+from s2_analyzer_backend.message_processor.message_body import MessageBodyStore
+from s2_analyzer_backend.message_processor.message_index import MessageIndex
+from s2_analyzer_backend.message_processor.validation_errors import (
+    ValidationErrorStore,
+)
+from s2_analyzer_backend.message_processor.message_processor import (
+    MessageStorageProcessor,
+)
+from s2_analyzer_backend.replay.capture_ingest import (
+    CaptureIngest,
+    CaptureIngestRequest,
+    CaptureIngestStatus,
+    IngestState,
+)
+
+if TYPE_CHECKING:
+    from s2_analyzer_backend.config import Config
+    from s2_analyzer_backend.endpoints.history_cache import HistoryResponseCache
+
+LOGGER = logging.getLogger(__name__)
+
+
+class IngestAPI:
+    """
+    IngestAPI starts, lists and stops imports of offline capture files.
+
+    Attributes:
+        router (APIRouter): The FastAPI router for handling API routes.
+        config (IngestConfig): The capture directory and the default batch size.
+        message_index (MessageIndex): The paths inside the imported messages whose values are indexed.
+        storage_config (StorageConfig): The compression of the imported messages.
+        response_cache (HistoryResponseCache): Cached history responses, which the imported messages may change.
+        imports (OrderedDict): The most recent imports by id, including the finished ones.
+    """
+
+    MAX_IMPORTS = 100
+
+    router: APIRouter
+
+    def __init__(
+        self,
+        config: "Config",
+        response_cache: "Optional[HistoryResponseCache]" = None,
+    ) -> None:
+        super().__init__()
+
+        self.router = APIRouter()
+        self.config = config.ingest
+        self.message_index = MessageIndex(config.message_index.paths)
+        self.storage_config = config.storage
+        self.response_cache = response_cache
+        self.imports: OrderedDict[uuid.UUID, CaptureIngest] = OrderedDict()
+
+        self.router.add_api_route(
+            "/backend/imports/",
+            self.start_import,
+            methods=["POST"],
+            summary="Import a capture file",
+            description="Streams an NDJSON capture file from the capture directory through the S2 validation and "
+            "the storage, in batches. Each line holds an S2 message with its origin and optionally its timestamp, "
+            "session, CEM and RM. Resumes after the last stored batch of an earlier import of the same file.",
+            tags=["import"],
+        )
+        self.router.add_api_route(
+            "/backend/imports/",
+            self.get_imports,
+            methods=["GET"],
+            summary="List the recent imports",
+            tags=["import"],
+        )
+        self.router.add_api_route(
+            "/backend/imports/{import_id}/",
+            self.get_import,
+            methods=["GET"],
+            summary="Progress of an import",
+            tags=["import"],
+        )
+        self.router.add_api_route(
+            "/backend/imports/{import_id}/",
+            self.stop_import,
+            methods=["DELETE"],
+            summary="Stop an import",
+            tags=["import"],
+        )
+
+    def _get(self, import_id: uuid.UUID) -> CaptureIngest:
+        capture_import = self.imports.get(import_id)
+        if capture_import is None:
+            raise HTTPException(status_code=404, detail="Unknown import.")
+        return capture_import
+
+    def _storage(self) -> MessageStorageProcessor:
+        """Every import stores its batches in the executor with a storage of its own."""
+        return MessageStorageProcessor(
+            get_engine(),
+            self.message_index,
+            MessageBodyStore(
+                self.storage_config.compression_level,
+                self.storage_config.dictionary_samples,
+                self.storage_config.max_known_bodies,
+            ),
+            ValidationErrorStore(self.storage_config.max_known_error_signatures),
+            self.response_cache,
+        )
+
+    async def start_import(self, request: CaptureIngestRequest) -> CaptureIngestStatus:
+        try:
+            capture_import = CaptureIngest(request, self.config, self._storage())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e)) from e
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e)) from e
+
+        for other in self.imports.values():
+            if other.path == capture_import.path and other.state == IngestState.RUNNING:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Capture file is already being imported by {other.import_id}.",
+                )
+
+        self.imports[capture_import.import_id] = capture_import
+        # Forget the oldest imports which are done.
+        for import_id in list(self.imports):
+            if len(self.imports) <= IngestAPI.MAX_IMPORTS:
+                break
+            if self.imports[import_id].state != IngestState.RUNNING:
+                del self.imports[import_id]
+
+        APPLICATIONS.add_and_start_application(capture_import)
+        return capture_import.status()
+
+    async def get_imports(self) -> list[CaptureIngestStatus]:
+        return [capture_import.status() for capture_import in self.imports.values()]
+
+    async def get_import(self, import_id: uuid.UUID) -> CaptureIngestStatus:
+        return self._get(import_id).status()
+
+    async def stop_import(self, import_id: uuid.UUID) -> CaptureIngestStatus:
+        capture_import = self._get(import_id)
+        await APPLICATIONS.stop_application(capture_import)
+        return capture_import.status()
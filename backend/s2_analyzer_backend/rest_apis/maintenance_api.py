@@ -0,0 +1,80 @@
+import logging
+from typing import TYPE_CHECKING, Optional
+import uuid
+
+from fastapi import APIRouter, HTTPException, Query
+
+from s2_analyzer_backend.message_processor.database import MessageSummary
+
+if TYPE_CHECKING:
+    from s2_analyzer_backend.message_processor.history_maintenance import (
+        HistoryMaintenance,
+    )
+
+LOGGER = logging.getLogger(__name__)
+
+
+class MaintenanceAPI:
+    """
+    MaintenanceAPI reports on and starts the background maintenance of the history database, and serves the
+    summaries of the messages it deleted.
+
+    Attributes:
+        router (APIRouter): The FastAPI router for handling API routes.
+        maintenance (HistoryMaintenance): The application which applies the retention and compacts the database.
+    """
+
+    router: APIRouter
+
+    def __init__(self, maintenance: "HistoryMaintenance") -> None:
+        super().__init__()
+
+        self.router = APIRouter()
+        self.maintenance = maintenance
+
+        self.router.add_api_route(
+            "/backend/admin/maintenance/",
+            self.get_status,
+            methods=["GET"],
+            summary="Status and recent runs of the history maintenance",
+            description="Returns the run in progress, the time of the next run and the reports of the recent runs, "
+            "with the deleted rows and the reclaimed space.",
+            tags=["admin"],
+        )
+        self.router.add_api_route(
+            "/backend/admin/maintenance/runs/",
+            self.start_run,
+            methods=["POST"],
+            status_code=202,
+            summary="Run the history maintenance now",
+            tags=["admin"],
+        )
+        self.router.add_api_route(
+            "/backend/admin/maintenance/summaries/",
+            self.get_summaries,
+            methods=["GET"],
+            summary="Summaries of the deleted messages",
+            description="The number of deleted messages per session, origin, S2 message type and day.",
+            tags=["admin"],
+        )
+
+    async def get_status(self) -> dict:
+        return {
+            "current": self.maintenance.current,
+            "next_run_at": self.maintenance.next_run_at,
+            "reports": list(self.maintenance.reports),
+        }
+
+    async def start_run(self) -> dict:
+        if not self.maintenance.request_run():
+            raise HTTPException(
+                status_code=409, detail="The history maintenance is running."
+            )
+        return {"started": True}
+
+    async def get_summaries(
+        self,
+        session_id: Optional[uuid.UUID] = Query(None, description="Session ID filter"),
+        s2_msg_type: Optional[str] = Query(None, description="S2 message type filter"),
+    ) -> list[MessageSummary]:
+        return self.maintenance.get_summaries(session_id, s2_msg_type)
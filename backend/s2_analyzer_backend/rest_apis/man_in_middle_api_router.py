@@ -1,5 +1,7 @@
+import asyncio
 import json
 import logging
+import time
 from typing import TYPE_CHECKING, Literal, Optional, Self
 import uuid
 
@@ -9,25 +11,32 @@ from fastapi import (
     Response,
     WebSocket,
     APIRouter,
+    Query,
+    Request,
     WebSocketException,
 )
-from pydantic import BaseModel, model_validator
+from pydantic import BaseModel, ValidationError, model_validator
 from s2_analyzer_backend.device_connection.connection_adapter import (
     FastAPIWebSocketAdapter,
     ConnectionAdapter,
     WebSocketConnectionAdapter,
 )
 from s2_analyzer_backend.device_connection.connection import S2Connection
+from s2_analyzer_backend.device_connection.connection_registry import (
+    ConnectionDetails,
+)
 
 from s2_analyzer_backend.async_application import APPLICATIONS
 from s2_analyzer_backend.device_connection.origin_type import S2OriginType
-from s2python.s2_parser import S2Parser
+from s2_analyzer_backend.message_processor.s2_validators import S2_VALIDATORS
+from s2_analyzer_backend.rest_apis import bulk
 from s2python.s2_validation_error import S2ValidationError
 
 from websockets import connect
 
 if TYPE_CHECKING:
     from s2_analyzer_backend.device_connection.router import MessageRouter
+    from s2_analyzer_backend.config import Config
 
 
 LOGGER = logging.getLogger(__name__)
@@ -65,6 +74,7 @@ class ManInTheMiddleAPI:
     Attributes:
         router (APIRouter): The FastAPI router for handling API routes.
         msg_router (MessageRouter): The message router instance used to route messages between the CEM and RM devices.
+        config (Config): Analyzer configuration, e.g. the device websocket sender settings.
     """
 
     router: APIRouter
@@ -73,11 +83,13 @@ class ManInTheMiddleAPI:
     def __init__(
         self,
         msg_router: "MessageRouter",  # Received by dependency injection
+        config: "Config",
     ) -> None:
         super().__init__()
 
         self.router = APIRouter()
         self.msg_router = msg_router
+        self.config = config
 
         # Adding the routes to the FastAPI router.
         self.router.add_api_websocket_route(
@@ -92,12 +104,28 @@ class ManInTheMiddleAPI:
             methods=["POST"],
             tags=["inject"],
         )
+        self.router.add_api_route(
+            "/backend/inject/bulk/",
+            self.inject_messages,
+            methods=["POST"],
+            summary="Inject many messages",
+            description="Injects a JSON array or an NDJSON stream (Content-Type: application/x-ndjson) of inject "
+            "bodies in order. Optionally paced at `rate` messages per second. Returns the result per message.",
+            tags=["inject"],
+        )
         self.router.add_api_route(
             "/backend/connections/",
             self.create_new_connections,
             methods=["POST"],
             tags=["connections"],
         )
+        self.router.add_api_route(
+            "/backend/connections/live/",
+            self.get_live_connections,
+            methods=["GET"],
+            summary="List the live CEM and RM connections",
+            tags=["connections"],
+        )
 
     async def create_connection(
         self,
@@ -116,7 +144,13 @@ class ManInTheMiddleAPI:
             dest_id (_type_): Identifier of the receiving device.
         """
         conn = S2Connection(
-            conn_adapter, origin_id, dest_id, connection_type, self.msg_router
+            conn_adapter,
+            origin_id,
+            dest_id,
+            connection_type,
+            self.msg_router,
+            max_batch_size=self.config.websocket.max_batch_size,
+            slow_consumer_config=self.config.slow_consumer,
         )
 
         APPLICATIONS.add_and_start_application(conn)
@@ -125,10 +159,24 @@ class ManInTheMiddleAPI:
 
         return conn, session_id
 
+    def connection_limit_reached(self) -> bool:
+        if len(self.msg_router.connections) >= self.config.max_device_connections:
+            LOGGER.warning(
+                "Refusing new connection. The maximum of %s connections is reached.",
+                self.config.max_device_connections,
+            )
+            return True
+        return False
+
     async def receive_new_rm_connection(
         self, websocket: WebSocket, rm_id: str, cem_id: str
     ) -> None:
         """Handles the new incoming RM connection"""
+        if self.connection_limit_reached():
+            # 1013: Try again later
+            await websocket.close(code=1013)
+            return
+
         try:
             await websocket.accept()
             LOGGER.info("Received connection from rm %s to cem %s.", rm_id, cem_id)
@@ -154,6 +202,11 @@ class ManInTheMiddleAPI:
         self, websocket: WebSocket, cem_id: str, rm_id: str
     ) -> None:
         """Handles the new incoming CEM connection."""
+        if self.connection_limit_reached():
+            # 1013: Try again later
+            await websocket.close(code=1013)
+            return
+
         try:
             await websocket.accept()
             LOGGER.info("Received connection from cem %s to rm %s.", cem_id, rm_id)
@@ -178,6 +231,10 @@ class ManInTheMiddleAPI:
     async def create_outgoing_connection(
         self, uri, connection_type: S2OriginType, source_id, dest_id
     ) -> tuple[S2Connection, uuid.UUID]:
+        if self.connection_limit_reached():
+            raise HTTPException(
+                status_code=503, detail="Maximum number of connections reached."
+            )
         try:
             websocket = await connect(uri)
         except:
@@ -223,6 +280,17 @@ class ManInTheMiddleAPI:
 
         return {"session_id": session_id}
 
+    async def get_live_connections(
+        self,
+        session_id: Optional[uuid.UUID] = Query(None, description="Session ID filter"),
+        cem_id: Optional[str] = Query(None, description="CEM ID filter"),
+        rm_id: Optional[str] = Query(None, description="RM ID filter"),
+    ) -> list[ConnectionDetails]:
+        """Endpoint listing the live CEM and RM connections, looked up through the connection registry indexes."""
+        return self.msg_router.connections.snapshot(
+            session_id=session_id, cem_id=cem_id, rm_id=rm_id
+        )
+
     async def inject_message(self, body: InjectMessage, validate: bool = True):
         """
         Injects a message into the message router between a CEM and RM device.
@@ -234,13 +302,9 @@ class ManInTheMiddleAPI:
             400: If the message is validated and is found to be invalid or the message injection failed.
         """
 
-        LOGGER.info(validate)
         if validate:
             try:
-                LOGGER.info(body.message)
-
-                s2_parser = S2Parser()
-                s2_parser.parse_as_any_message(body.message)
+                S2_VALIDATORS.validate(body.message)
             except S2ValidationError as e:
                 errors = []
                 if e.pydantic_validation_error:
@@ -259,3 +323,77 @@ class ManInTheMiddleAPI:
                 "Unable to inject message. Probably because there's no connection to inject into.",
                 400,
             )
+
+    async def inject_messages(
+        self,
+        request: Request,
+        validate: bool = True,
+        rate: Optional[float] = Query(
+            None, gt=0, description="Messages per second. Unpaced when omitted."
+        ),
+    ):
+        """
+        Injects many messages in order, e.g. to replay a recorded scenario. Invalid messages and messages without a
+        connection to inject into are skipped and reported, the other messages are still injected.
+        Args:
+            request (Request): JSON array or NDJSON stream of InjectMessage bodies.
+            validate (bool, optional): Validate the messages before injection. Defaults to True.
+            rate (float, optional): Inject at most this many messages per second.
+        """
+        results = []
+        injected = 0
+        start = time.monotonic()
+
+        async for chunk in bulk.read_chunks(request):
+            bodies = []
+            for item in chunk:
+                try:
+                    bodies.append(InjectMessage.model_validate(item))
+                except ValidationError as e:
+                    bodies.append(e.errors(include_url=False))
+
+            errors = [None] * len(chunk)
+            if validate:
+                errors = await bulk.validate_chunk(
+                    [
+                        body.message if isinstance(body, InjectMessage) else None
+                        for body in bodies
+                    ]
+                )
+
+            for body, validation_errors in zip(bodies, errors):
+                result = {"index": len(results), "injected": False, "errors": []}
+                results.append(result)
+                if not isinstance(body, InjectMessage):
+                    result["errors"] = body
+                    continue
+                if validate and validation_errors is not None:
+                    result["errors"] = validation_errors
+                    continue
+
+                if rate is not None:
+                    # Pace against the start, so that slow injections do not slow down the overall rate.
+                    delay = start + injected / rate - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                try:
+                    await self.msg_router.inject_message(
+                        body.origin_id, body.dest_id, body.message
+                    )
+                except ValueError as e:
+                    result["errors"] = [
+                        {"type": "injection_error", "loc": [], "msg": str(e)}
+                    ]
+                    continue
+                result["injected"] = True
+                injected += 1
+
+            # Let the connections send the injected messages between chunks.
+            await asyncio.sleep(0)
+
+        return {
+            "injected": injected,
+            "failed": len(results) - injected,
+            "duration": time.monotonic() - start,
+            "results": results,
+        }
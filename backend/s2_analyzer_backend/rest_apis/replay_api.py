@@ -0,0 +1,103 @@
+from collections import OrderedDict
+import logging
+from typing import TYPE_CHECKING
+import uuid
+
+from fastapi import APIRouter, HTTPException
+
+from s2_analyzer_backend.async_application import APPLICATIONS
+from s2_analyzer_backend.message_processor.database import get_engine
+from s2_analyzer_backend.replay.session_replay import (
+    ReplayState,
+    SessionReplay,
+    SessionReplayRequest,
+    SessionReplayStatus,
+)
+
+if TYPE_CHECKING:
+    from s2_analyzer_backend.device_connection.router import MessageRouter
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ReplayAPI:
+    """
+    ReplayAPI starts, lists and stops replays of recorded sessions.
+
+    Attributes:
+        router (APIRouter): The FastAPI router for handling API routes.
+        msg_router (MessageRouter): The message router into which the live replays inject.
+        replays (OrderedDict): The most recent replays by id, including the finished ones.
+    """
+
+    MAX_REPLAYS = 100
+
+    router: APIRouter
+
+    def __init__(self, msg_router: "MessageRouter") -> None:
+        super().__init__()
+
+        self.router = APIRouter()
+        self.msg_router = msg_router
+        self.replays: OrderedDict[uuid.UUID, SessionReplay] = OrderedDict()
+
+        self.router.add_api_route(
+            "/backend/replays/",
+            self.start_replay,
+            methods=["POST"],
+            summary="Replay a recorded session",
+            description="Re-drives a stored session into the live CEM/RM connections or into the message processing "
+            "pipeline only, in real time, accelerated or as fast as possible.",
+            tags=["replay"],
+        )
+        self.router.add_api_route(
+            "/backend/replays/",
+            self.get_replays,
+            methods=["GET"],
+            summary="List the recent replays",
+            tags=["replay"],
+        )
+        self.router.add_api_route(
+            "/backend/replays/{replay_id}/",
+            self.get_replay,
+            methods=["GET"],
+            summary="Progress of a replay",
+            tags=["replay"],
+        )
+        self.router.add_api_route(
+            "/backend/replays/{replay_id}/",
+            self.stop_replay,
+            methods=["DELETE"],
+            summary="Stop a replay",
+            tags=["replay"],
+        )
+
+    def _get(self, replay_id: uuid.UUID) -> SessionReplay:
+        replay = self.replays.get(replay_id)
+        if replay is None:
+            raise HTTPException(status_code=404, detail="Unknown replay.")
+        return replay
+
+    async def start_replay(self, request: SessionReplayRequest) -> SessionReplayStatus:
+        replay = SessionReplay(request, self.msg_router, get_engine())
+        self.replays[replay.replay_id] = replay
+        # Forget the oldest replays which are done.
+        for replay_id in list(self.replays):
+            if len(self.replays) <= ReplayAPI.MAX_REPLAYS:
+                break
+            if self.replays[replay_id].state != ReplayState.RUNNING:
+                del self.replays[replay_id]
+
+        APPLICATIONS.add_and_start_application(replay)
+        return replay.status()
+
+    async def get_replays(self) -> list[SessionReplayStatus]:
+        return [replay.status() for replay in self.replays.values()]
+
+    async def get_replay(self, replay_id: uuid.UUID) -> SessionReplayStatus:
+        return self._get(replay_id).status()
+
+    async def stop_replay(self, replay_id: uuid.UUID) -> SessionReplayStatus:
+        replay = self._get(replay_id)
+        await APPLICATIONS.stop_application(replay)
+        return replay.status()
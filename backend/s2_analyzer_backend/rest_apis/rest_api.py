@@ -17,16 +17,33 @@ from .man_in_middle_api_router import (
     ManInTheMiddleAPI,
 )
 from .debugger_api import DebuggerAPI
+from .admin_api import AdminAPI
+from .replay_api import ReplayAPI
+from .ingest_api import IngestAPI
+from .statistics_api import StatisticsAPI
+from .time_series_api import TimeSeriesAPI
+from .conformance_api import ConformanceAPI
+from .maintenance_api import MaintenanceAPI
 from s2_analyzer_backend.message_processor.message_processor import (
     DebuggerFrontendMessageProcessor,
     SessionUpdateMessageProcessor,
 )
 
 from s2_analyzer_backend.async_application import AsyncApplication
-import s2_analyzer_backend.app_logging
 
 if TYPE_CHECKING:
     from s2_analyzer_backend.device_connection.router import MessageRouter
+    from s2_analyzer_backend.config import Config
+    from s2_analyzer_backend.message_processor.session_statistics import (
+        SessionStatisticsProcessor,
+    )
+    from s2_analyzer_backend.message_processor.time_series import TimeSeriesProcessor
+    from s2_analyzer_backend.message_processor.conformance import ConformanceProcessor
+    from s2_analyzer_backend.message_processor.history_maintenance import (
+        HistoryMaintenance,
+    )
+    from s2_analyzer_backend.endpoints.history_cache import HistoryResponseCache
+    from s2_analyzer_backend.event_loop import EventLoopMonitor
     from s2_analyzer_backend.async_application import ApplicationName
 
 
@@ -40,6 +57,8 @@ specific routes and middleware for the S2 Analyzer application.
 
 
 class RestAPI(AsyncApplication):
+    REQUIRED_FOR_READINESS = True
+
     uvicorn_server: Optional[uvicorn.Server]
     fastapi_router: APIRouter
 
@@ -50,6 +69,13 @@ class RestAPI(AsyncApplication):
         msg_router: "MessageRouter",
         debugger_frontend_msg_processor: "DebuggerFrontendMessageProcessor",
         session_update_msg_processor: "SessionUpdateMessageProcessor",
+        session_statistics: "SessionStatisticsProcessor",
+        time_series: "TimeSeriesProcessor",
+        conformance: "ConformanceProcessor",
+        maintenance: "HistoryMaintenance",
+        response_cache: "HistoryResponseCache",
+        config: "Config",
+        loop_monitor: "Optional[EventLoopMonitor]" = None,
     ) -> None:
         super().__init__()
         self.listen_address = listen_address
@@ -64,13 +90,46 @@ class RestAPI(AsyncApplication):
         self.session_update_msg_processor = session_update_msg_processor
 
         # Setup the sub-routers which handle specific tasks.
-        debugger_api = DebuggerAPI(debugger_frontend_msg_processor, session_update_msg_processor)
+        debugger_api = DebuggerAPI(
+            debugger_frontend_msg_processor,
+            session_update_msg_processor,
+            config,
+            response_cache,
+        )
         self.fastapi_router.include_router(debugger_api.router)
 
         # Handles the CEM and RM man in the middle communication. Also has the message injection functionality.
-        mitm_api = ManInTheMiddleAPI(msg_router)
+        mitm_api = ManInTheMiddleAPI(msg_router, config)
         self.fastapi_router.include_router(mitm_api.router)
 
+        # Replays of recorded sessions.
+        replay_api = ReplayAPI(msg_router)
+        self.fastapi_router.include_router(replay_api.router)
+
+        # Imports of offline capture files.
+        ingest_api = IngestAPI(config, response_cache)
+        self.fastapi_router.include_router(ingest_api.router)
+
+        # Running statistics per session and per device.
+        statistics_api = StatisticsAPI(session_statistics)
+        self.fastapi_router.include_router(statistics_api.router)
+
+        # Downsampled time series of the numeric values of the S2 messages.
+        time_series_api = TimeSeriesAPI(time_series, config)
+        self.fastapi_router.include_router(time_series_api.router)
+
+        # S2 protocol conformance per session.
+        conformance_api = ConformanceAPI(conformance)
+        self.fastapi_router.include_router(conformance_api.router)
+
+        # Retention and compaction of the history database.
+        maintenance_api = MaintenanceAPI(maintenance)
+        self.fastapi_router.include_router(maintenance_api.router)
+
+        # Runtime diagnostics of the backend itself.
+        admin_api = AdminAPI(loop_monitor)
+        self.fastapi_router.include_router(admin_api.router)
+
     async def main_task(self, loop: asyncio.AbstractEventLoop) -> None:
         app = FastAPI(title="S2 Analyzer", description="", version="v0.0.1")
 
@@ -90,13 +149,17 @@ class RestAPI(AsyncApplication):
             host=self.listen_address,
             port=self.listen_port,
             loop="none",
-            # log_level="WARN",
+            # Keep the logging configuration of the backend, so uvicorn logs are written off the event loop too.
+            log_config=None,
         )
         self.uvicorn_server = uvicorn.Server(config)
         # Prevent uvicorn from overwriting any signal handlers. Uvicorn does not yet has a nice way to do this.
         uvicorn.server.HANDLED_SIGNALS = ()
         await self.uvicorn_server.serve()
 
+    def is_ready(self) -> bool:
+        return self.uvicorn_server is not None and self.uvicorn_server.started
+
     def get_name(self) -> "ApplicationName":
         return "S2 REST API Server"
 
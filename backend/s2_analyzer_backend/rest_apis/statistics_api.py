@@ -0,0 +1,101 @@
+import logging
+from typing import TYPE_CHECKING, Literal, Optional
+import uuid
+
+from fastapi import APIRouter, HTTPException, Query
+
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+
+if TYPE_CHECKING:
+    from s2_analyzer_backend.message_processor.session_statistics import (
+        SessionStatisticsProcessor,
+    )
+
+LOGGER = logging.getLogger(__name__)
+
+
+class StatisticsAPI:
+    """
+    StatisticsAPI serves the running statistics per session and per device, without querying the database.
+
+    Attributes:
+        router (APIRouter): The FastAPI router for handling API routes.
+        session_statistics (SessionStatisticsProcessor): The message processor which keeps the statistics.
+    """
+
+    router: APIRouter
+
+    def __init__(self, session_statistics: "SessionStatisticsProcessor") -> None:
+        super().__init__()
+
+        self.router = APIRouter()
+        self.session_statistics = session_statistics
+
+        self.router.add_api_route(
+            "/backend/statistics/sessions/",
+            self.get_sessions,
+            methods=["GET"],
+            summary="Running statistics of the open and recently closed sessions",
+            tags=["statistics"],
+        )
+        self.router.add_api_route(
+            "/backend/statistics/sessions/{session_id}/",
+            self.get_session,
+            methods=["GET"],
+            summary="Running statistics of a session",
+            tags=["statistics"],
+        )
+        self.router.add_api_route(
+            "/backend/statistics/devices/",
+            self.get_devices,
+            methods=["GET"],
+            summary="Running statistics of the CEMs and RMs",
+            tags=["statistics"],
+        )
+        self.router.add_api_route(
+            "/backend/statistics/devices/{device_type}/{device_id}/",
+            self.get_device,
+            methods=["GET"],
+            summary="Running statistics of a CEM or RM",
+            tags=["statistics"],
+        )
+
+    async def get_sessions(
+        self,
+        state: Optional[Literal["open", "closed"]] = Query(
+            None, description="Session state filter"
+        ),
+        cem_id: Optional[str] = Query(None, description="CEM ID filter"),
+        rm_id: Optional[str] = Query(None, description="RM ID filter"),
+    ) -> list[dict]:
+        return [
+            session.as_dict()
+            for session in list(self.session_statistics.sessions.values())
+            if (state is None or session.state == state)
+            and (cem_id is None or session.cem_id == cem_id)
+            and (rm_id is None or session.rm_id == rm_id)
+        ]
+
+    async def get_session(self, session_id: uuid.UUID) -> dict:
+        session = self.session_statistics.get_session(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Unknown session.")
+        return session.as_dict()
+
+    async def get_devices(
+        self,
+        device_type: Optional[S2OriginType] = Query(
+            None, description="CEM or RM filter"
+        ),
+    ) -> list[dict]:
+        return [
+            device.as_dict()
+            for device in list(self.session_statistics.devices.values())
+            if device_type is None or device.device_type == device_type
+        ]
+
+    async def get_device(self, device_type: S2OriginType, device_id: str) -> dict:
+        device = self.session_statistics.get_device(device_type, device_id)
+        if device is None:
+            raise HTTPException(status_code=404, detail="Unknown device.")
+        return device.as_dict()
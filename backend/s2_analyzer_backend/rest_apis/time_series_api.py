@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+import logging
+from typing import TYPE_CHECKING, Optional
+import uuid
+
+from fastapi import APIRouter, HTTPException, Query
+
+if TYPE_CHECKING:
+    from s2_analyzer_backend.config import Config
+    from s2_analyzer_backend.message_processor.time_series import (
+        TimeSeriesProcessor,
+    )
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TimeSeriesAPI:
+    """
+    TimeSeriesAPI serves the time series of the numeric values of the S2 messages of a session, downsampled to the
+    number of points a chart needs.
+
+    Attributes:
+        router (APIRouter): The FastAPI router for handling API routes.
+        time_series (TimeSeriesProcessor): The message processor which extracts and stores the time series.
+        max_points (int): Default maximum number of points per response.
+    """
+
+    router: APIRouter
+
+    def __init__(self, time_series: "TimeSeriesProcessor", config: "Config") -> None:
+        super().__init__()
+
+        self.router = APIRouter()
+        self.time_series = time_series
+        self.max_points = config.time_series.max_points
+
+        self.router.add_api_route(
+            "/backend/sessions/{session_id}/time-series/",
+            self.get_series,
+            methods=["GET"],
+            summary="List the time series of a session",
+            tags=["time series"],
+        )
+        self.router.add_api_route(
+            "/backend/sessions/{session_id}/time-series/{series}/",
+            self.get_points,
+            methods=["GET"],
+            summary="Points of a time series",
+            description="Returns the points of the series between start and end, raw or as min/max/avg per 1 "
+            "second, 1 minute or 15 minutes: the finest resolution that stays within max_points.",
+            tags=["time series"],
+        )
+
+    async def get_series(self, session_id: uuid.UUID) -> list[dict]:
+        return self.time_series.get_series(session_id)
+
+    async def get_points(
+        self,
+        session_id: uuid.UUID,
+        series: str,
+        start: Optional[datetime] = Query(
+            None, description="Start of the range. The first value when omitted."
+        ),
+        end: Optional[datetime] = Query(
+            None,
+            description="End of the range (exclusive). The last value when omitted.",
+        ),
+        max_points: Optional[int] = Query(
+            None, gt=0, description="Maximum number of points."
+        ),
+    ):
+        if start is None or end is None:
+            known = {
+                entry["series"]: entry
+                for entry in self.time_series.get_series(session_id)
+            }
+            if series not in known:
+                raise HTTPException(status_code=404, detail="Unknown series.")
+            start = start or known[series]["first"]
+            end = end or known[series]["last"] + timedelta(microseconds=1)
+
+        return self.time_series.get_points(
+            session_id, series, start, end, max_points or self.max_points
+        )
@@ -0,0 +1,110 @@
+from collections import Counter
+import logging
+import sys
+import threading
+import time
+from types import FrameType
+from typing import Optional
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.005  # seconds
+# The profiler stops by itself after this long, so that a forgotten profile does not run forever.
+MAX_DURATION = 300.0  # seconds
+
+
+def _folded_stack(frame: FrameType, thread_name: str) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """
+    In-process sampling profiler. A thread takes the stacks of the other threads every `interval` seconds.
+
+    The result is in the folded stack format (`frame;frame;frame count` per line) which is accepted by flamegraph.pl,
+    speedscope and most other flame graph tools.
+    """
+
+    def __init__(self) -> None:
+        self.interval = DEFAULT_INTERVAL
+        self.started_at: Optional[float] = None
+        self.samples = 0
+        self._stacks: Counter[str] = Counter()
+        self._thread_ids: Optional[set[int]] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(
+        self,
+        interval: float = DEFAULT_INTERVAL,
+        thread_ids: Optional[set[int]] = None,
+    ) -> None:
+        """Starts sampling the given threads, or all threads if None. Discards the result of a previous profile."""
+        if self.running:
+            raise RuntimeError("The profiler is already running.")
+        self.interval = interval
+        self.started_at = time.monotonic()
+        self.samples = 0
+        self._stacks = Counter()
+        self._thread_ids = thread_ids
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._sample, name="s2-analyzer-profiler", daemon=True
+        )
+        self._thread.start()
+        LOGGER.info("Started the sampling profiler with an interval of %s", interval)
+
+    def stop(self) -> str:
+        """Stops sampling and returns the folded stacks."""
+        if self._thread is None:
+            raise RuntimeError("The profiler is not running.")
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        LOGGER.info("Stopped the sampling profiler after %s samples", self.samples)
+        return self.folded_stacks()
+
+    def folded_stacks(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self._stacks.most_common()
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": self.samples,
+            "duration": (
+                time.monotonic() - self.started_at if self.started_at else 0.0
+            ),
+        }
+
+    def _sample(self) -> None:
+        own_thread_id = threading.get_ident()
+        deadline = time.monotonic() + MAX_DURATION
+        while not self._stop_event.wait(self.interval):
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id or (
+                    self._thread_ids is not None and thread_id not in self._thread_ids
+                ):
+                    continue
+                thread_name = thread_names.get(thread_id, str(thread_id))
+                self._stacks[_folded_stack(frame, thread_name)] += 1
+            self.samples += 1
+            if time.monotonic() > deadline:
+                LOGGER.warning(
+                    "The sampling profiler stopped after the maximum duration of %s seconds",
+                    MAX_DURATION,
+                )
+                break
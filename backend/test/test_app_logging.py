@@ -0,0 +1,42 @@
+import logging
+from types import SimpleNamespace
+
+from s2_analyzer_backend import app_logging
+from s2_analyzer_backend.app_logging import RateLimitFilter
+
+
+def _record(lineno: int = 1, level: int = logging.INFO) -> logging.LogRecord:
+    return logging.LogRecord("test", level, __file__, lineno, "message", (), None)
+
+
+def _passed(rate_limit: RateLimitFilter, records: list) -> list:
+    return [record for record in records if rate_limit.filter(record)]
+
+
+def test_statement_is_limited_after_a_burst_and_counts_the_suppressed(monkeypatch):
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(
+        app_logging, "time", SimpleNamespace(monotonic=lambda: clock.now)
+    )
+    rate_limit = RateLimitFilter(per_second=2, burst=3)
+
+    assert len(_passed(rate_limit, [_record() for _ in range(10)])) == 3
+    # Other statements have their own budget.
+    assert len(_passed(rate_limit, [_record(lineno=2)])) == 1
+
+    clock.now += 1.0
+    passed = _passed(rate_limit, [_record() for _ in range(3)])
+    assert [record.suppressed for record in passed] == [7, 0]
+
+
+def test_errors_are_never_suppressed(monkeypatch):
+    monkeypatch.setattr(app_logging, "time", SimpleNamespace(monotonic=lambda: 0.0))
+    rate_limit = RateLimitFilter(per_second=1, burst=1)
+
+    assert (
+        len(_passed(rate_limit, [_record(level=logging.ERROR) for _ in range(5)])) == 5
+    )
+    assert len(_passed(rate_limit, [_record() for _ in range(5)])) == 1
+    assert (
+        len(_passed(RateLimitFilter(per_second=0), [_record() for _ in range(5)])) == 5
+    )
@@ -0,0 +1,58 @@
+import asyncio
+
+from s2_analyzer_backend.async_application import AsyncApplication, AsyncApplications
+
+
+class _Application(AsyncApplication):
+    def __init__(self, fail_drain: bool = False, fail_stop: bool = False):
+        super().__init__()
+        self.fail_drain = fail_drain
+        self.fail_stop = fail_stop
+        self.stopped = False
+
+    def get_name(self):
+        return "Test Application"
+
+    async def main_task(self, loop):
+        while self._running:
+            await asyncio.sleep(0.01)
+
+    async def drain(self, timeout):
+        if self.fail_drain:
+            raise RuntimeError("drain failed")
+        return None
+
+    def stop(self):
+        self.stopped = True
+        if self.fail_stop:
+            raise RuntimeError("stop failed")
+
+
+def _run_and_stop(*applications: AsyncApplication) -> AsyncApplications:
+    apps = AsyncApplications()
+    apps.shutdown_timeout = 1.0
+    for application in applications:
+        apps.add_and_start_application(application)
+    apps.loop.call_later(0.05, apps.stop)
+    # Returns only once the event loop is stopped.
+    apps.run_all()
+    return apps
+
+
+def test_stop_all_stops_the_loop_when_stop_raises():
+    failing = _Application(fail_stop=True)
+    other = _Application()
+
+    apps = _run_and_stop(failing, other)
+
+    assert not apps.applications
+    assert failing.stopped and other.stopped
+
+
+def test_stop_all_stops_the_application_when_drain_raises():
+    failing = _Application(fail_drain=True)
+
+    apps = _run_and_stop(failing)
+
+    assert not apps.applications
+    assert failing.stopped
@@ -0,0 +1,168 @@
+import asyncio
+import json
+from types import SimpleNamespace
+import uuid
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import pytest
+
+from s2_analyzer_backend.config import Config
+from s2_analyzer_backend.rest_apis import bulk
+from s2_analyzer_backend.rest_apis.debugger_api import DebuggerAPI
+from s2_analyzer_backend.rest_apis.man_in_middle_api_router import (
+    ManInTheMiddleAPI,
+)
+
+NDJSON = {"content-type": "application/x-ndjson"}
+
+
+def _valid_message() -> dict:
+    return {"message_type": "Handshake", "message_id": str(uuid.uuid4()), "role": "RM"}
+
+
+def _invalid_message() -> dict:
+    return {"message_type": "Handshake", "message_id": str(uuid.uuid4())}
+
+
+def _ndjson(items: list) -> str:
+    return "\n".join(json.dumps(item) for item in items)
+
+
+@pytest.fixture
+def injected() -> list:
+    return []
+
+
+@pytest.fixture
+def client(injected) -> TestClient:
+    async def inject_message(origin_id, dest_id, message):
+        if dest_id != "cem":
+            raise ValueError(f"There is no connection from {origin_id} to {dest_id}.")
+        injected.append(message["message_id"])
+
+    config = Config(http_listen_address="127.0.0.1", http_port=8001)
+    app = FastAPI()
+    app.include_router(DebuggerAPI(None, None, config).router)
+    app.include_router(
+        ManInTheMiddleAPI(SimpleNamespace(inject_message=inject_message), config).router
+    )
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("ndjson", [False, True])
+def test_messages_are_validated_in_order(client, monkeypatch, ndjson):
+    monkeypatch.setattr(bulk, "CHUNK_SIZE", 2)
+    messages = [_valid_message(), _invalid_message(), "not an object", _valid_message()]
+
+    if ndjson:
+        response = client.post(
+            "/backend/validate-message/bulk/", content=_ndjson(messages), headers=NDJSON
+        )
+    else:
+        response = client.post("/backend/validate-message/bulk/", json=messages)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["valid"], body["invalid"]) == (2, 2)
+    assert [result["index"] for result in body["results"]] == [0, 1, 2, 3]
+    assert [result["valid"] for result in body["results"]] == [True, False, False, True]
+    assert [result["message_type"] for result in body["results"]] == [
+        "Handshake",
+        "Handshake",
+        None,
+        "Handshake",
+    ]
+    assert body["results"][1]["errors"]
+
+
+def test_body_which_is_not_an_array_is_refused(client):
+    response = client.post("/backend/validate-message/bulk/", json=_valid_message())
+
+    assert response.status_code == 400
+
+
+def test_validations_are_not_left_running_after_a_malformed_line(client, monkeypatch):
+    monkeypatch.setattr(bulk, "CHUNK_SIZE", 1)
+    validations = []
+
+    def validate_chunk(messages):
+        validation = asyncio.get_running_loop().create_future()
+        validations.append(validation)
+        return validation
+
+    monkeypatch.setattr(bulk, "validate_chunk", validate_chunk)
+
+    response = client.post(
+        "/backend/validate-message/bulk/",
+        content=_ndjson([_valid_message(), _valid_message()]) + "\n{not json\n{}",
+        headers=NDJSON,
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Invalid JSON")
+    # The validations of the lines before the malformed one were started, and are cancelled with the request.
+    assert len(validations) == 2
+    assert all(validation.cancelled() for validation in validations)
+
+
+@pytest.mark.parametrize("ndjson", [False, True])
+def test_messages_are_injected_in_order_and_failures_are_reported(
+    client, injected, ndjson
+):
+    bodies = [
+        {"origin_id": "rm", "dest_id": "cem", "message": _valid_message()},
+        {"origin_id": "rm", "dest_id": "cem", "message": _invalid_message()},
+        {"origin_id": "rm", "dest_id": "other-cem", "message": _valid_message()},
+        {"origin_id": "rm"},
+        {"origin_id": "rm", "dest_id": "cem", "message": _valid_message()},
+    ]
+
+    if ndjson:
+        response = client.post(
+            "/backend/inject/bulk/", content=_ndjson(bodies), headers=NDJSON
+        )
+    else:
+        response = client.post("/backend/inject/bulk/", json=bodies)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["injected"], body["failed"]) == (2, 3)
+    assert injected == [
+        bodies[0]["message"]["message_id"],
+        bodies[4]["message"]["message_id"],
+    ]
+    results = body["results"]
+    assert [result["injected"] for result in results] == [
+        True,
+        False,
+        False,
+        False,
+        True,
+    ]
+    assert results[1]["errors"]
+    assert [error["type"] for error in results[2]["errors"]] == ["injection_error"]
+    assert {error["loc"][0] for error in results[3]["errors"]} == {"dest_id", "message"}
+
+
+def test_invalid_messages_are_injected_without_validation(client, injected):
+    bodies = [{"origin_id": "rm", "dest_id": "cem", "message": _invalid_message()}]
+
+    response = client.post("/backend/inject/bulk/?validate=false", json=bodies)
+
+    assert response.json()["injected"] == 1
+    assert injected == [bodies[0]["message"]["message_id"]]
+
+
+def test_injection_is_paced_at_the_rate(client, injected):
+    bodies = [
+        {"origin_id": "rm", "dest_id": "cem", "message": _valid_message()}
+        for _ in range(5)
+    ]
+
+    response = client.post("/backend/inject/bulk/?rate=20", json=bodies)
+
+    # The first message is injected at once, the others every 1/20 second.
+    assert response.json()["injected"] == 5
+    assert response.json()["duration"] >= 4 / 20
+    assert len(injected) == 5
@@ -0,0 +1,180 @@
+import asyncio
+from datetime import datetime
+import json
+import uuid
+
+import pytest
+from sqlmodel import Session, create_engine, select
+
+from s2_analyzer_backend.config import IngestConfig
+from s2_analyzer_backend.message_processor.database import (
+    Communication,
+    create_db_and_tables,
+)
+from s2_analyzer_backend.message_processor.message_processor import (
+    MessageStorageProcessor,
+)
+from s2_analyzer_backend.message_processor.message_type import MessageType
+from s2_analyzer_backend.replay.capture_ingest import (
+    CaptureIngest,
+    CaptureIngestRequest,
+    IngestState,
+    resolve_capture_path,
+)
+
+OTHER_SESSION = uuid.uuid4()
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    create_db_and_tables(engine)
+    yield engine
+    engine.dispose()
+
+
+def _line(minute: int, **fields) -> str:
+    return json.dumps(
+        {
+            "origin": "RM",
+            "message": {
+                "message_type": "FRBC.StorageStatus",
+                "message_id": str(uuid.uuid4()),
+                "present_fill_level": 0.5,
+            },
+            "timestamp": f"2024-01-01T12:{minute:02}:00",
+            **fields,
+        }
+    )
+
+
+def _write_capture(tmp_path) -> None:
+    lines = [_line(minute) for minute in range(4)]
+    # A session of other devices, which ends before the last line of the capture.
+    lines.insert(
+        1,
+        _line(10, session_id=str(OTHER_SESSION), cem_id="other-cem", rm_id="other-rm"),
+    )
+    lines.insert(2, "not json")
+    (tmp_path / "captures").mkdir()
+    (tmp_path / "captures" / "site.ndjson").write_text("\n".join(lines) + "\n")
+
+
+def _ingest(engine, tmp_path, resume: bool = True) -> CaptureIngest:
+    return CaptureIngest(
+        CaptureIngestRequest(path="site.ndjson", resume=resume, batch_size=2),
+        IngestConfig(directory=str(tmp_path / "captures")),
+        MessageStorageProcessor(engine),
+    )
+
+
+def _stored(engine) -> list[Communication]:
+    with Session(engine) as session:
+        return session.exec(select(Communication).order_by(Communication.id)).all()
+
+
+async def test_import_ends_every_session_with_its_own_devices_and_time(
+    engine, tmp_path
+):
+    _write_capture(tmp_path)
+    ingest = _ingest(engine, tmp_path)
+
+    await ingest.main_task(asyncio.get_running_loop())
+
+    status = ingest.status()
+    assert status.state == IngestState.FINISHED
+    assert (status.lines, status.stored, status.malformed) == (6, 5, 1)
+    ended = {
+        communication.session_id: communication
+        for communication in _stored(engine)
+        if communication.message_type == MessageType.SESSION_ENDED
+    }
+    assert set(ended) == {ingest.session_id, OTHER_SESSION}
+    other = ended[OTHER_SESSION]
+    assert (other.cem_id, other.rm_id) == ("other-cem", "other-rm")
+    assert other.timestamp == datetime(2024, 1, 1, 12, 10)
+    main = ended[ingest.session_id]
+    assert (main.cem_id, main.rm_id) == ("capture", "capture")
+    assert main.timestamp == datetime(2024, 1, 1, 12, 3)
+
+
+async def test_stopped_import_resumes_after_the_last_stored_batch(engine, tmp_path):
+    _write_capture(tmp_path)
+    crashed = _ingest(engine, tmp_path)
+    store_batch = crashed._store_batch
+
+    def store_first_batch(batch):
+        if crashed.stored_bytes:
+            raise OSError("disk full")
+        store_batch(batch)
+
+    crashed._store_batch = store_first_batch
+    with pytest.raises(OSError):
+        await crashed.main_task(asyncio.get_running_loop())
+    assert crashed.status().state == IngestState.FAILED
+    # The first batch holds the start of the session and its first message.
+    assert crashed.stored == 1
+
+    resumed = _ingest(engine, tmp_path)
+    assert resumed.session_id == crashed.session_id
+    assert resumed.status().resumed_from == crashed.stored_bytes
+    await resumed.main_task(asyncio.get_running_loop())
+
+    stored = _stored(engine)
+    assert [communication.message_type for communication in stored].count(
+        MessageType.S2
+    ) == 5
+    assert (resumed.status().lines, resumed.status().stored) == (6, 5)
+    # Every session is started and ended once, also when it started before the import was resumed.
+    for message_type in (MessageType.SESSION_STARTED, MessageType.SESSION_ENDED):
+        assert sorted(
+            str(communication.session_id)
+            for communication in stored
+            if communication.message_type == message_type
+        ) == sorted([str(resumed.session_id), str(OTHER_SESSION)])
+    other_end = next(
+        communication
+        for communication in stored
+        if communication.message_type == MessageType.SESSION_ENDED
+        and communication.session_id == OTHER_SESSION
+    )
+    assert other_end.cem_id == "other-cem"
+
+    # A finished import is not stored again, unless resuming is disabled.
+    finished = _ingest(engine, tmp_path)
+    await finished.main_task(asyncio.get_running_loop())
+    assert finished.status().state == IngestState.FINISHED
+    assert len(_stored(engine)) == len(stored)
+    assert _ingest(engine, tmp_path, resume=False).stored == 0
+
+
+@pytest.mark.parametrize(
+    "path", ["../history.db", "/etc/passwd", "nested/../../history.db"]
+)
+def test_capture_path_must_be_inside_the_capture_directory(tmp_path, path):
+    (tmp_path / "captures" / "nested").mkdir(parents=True)
+    (tmp_path / "history.db").write_text("")
+
+    with pytest.raises(ValueError):
+        resolve_capture_path(str(tmp_path / "captures"), path)
+
+
+def test_capture_path_through_a_symlink_out_of_the_directory_is_refused(tmp_path):
+    (tmp_path / "captures").mkdir()
+    (tmp_path / "secret.ndjson").write_text("")
+    (tmp_path / "captures" / "link.ndjson").symlink_to(tmp_path / "secret.ndjson")
+
+    with pytest.raises(ValueError):
+        resolve_capture_path(str(tmp_path / "captures"), "link.ndjson")
+
+
+def test_capture_path_inside_the_directory_is_resolved(tmp_path):
+    (tmp_path / "captures" / "site").mkdir(parents=True)
+    (tmp_path / "captures" / "site" / "a.ndjson").write_text("")
+
+    assert (
+        resolve_capture_path(str(tmp_path / "captures"), "site/../site/a.ndjson")
+        == (tmp_path / "captures" / "site" / "a.ndjson").resolve()
+    )
+    with pytest.raises(FileNotFoundError):
+        resolve_capture_path(str(tmp_path / "captures"), "missing.ndjson")
@@ -0,0 +1,328 @@
+import asyncio
+from datetime import datetime, timedelta
+import uuid
+
+import pytest
+
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+from s2_analyzer_backend.message_processor.conformance import (
+    ConformanceProcessor,
+    ConformanceRule,
+)
+from s2_analyzer_backend.message_processor.message import Message
+from s2_analyzer_backend.message_processor.message_type import MessageType
+
+CEM = S2OriginType.CEM
+RM = S2OriginType.RM
+START = datetime(2024, 1, 1, 12, 0, 0)
+
+SYSTEM_DESCRIPTION = {
+    "message_type": "FRBC.SystemDescription",
+    "actuators": [{"id": "Actuator-1", "operation_modes": [{"id": "Mode-1"}]}],
+}
+
+
+class _Session:
+    """Sends the messages of a session through the processor, one second apart by default."""
+
+    def __init__(self, processor: ConformanceProcessor):
+        self.processor = processor
+        self.session_id = uuid.uuid4()
+        self.now = START
+
+    async def _process(self, message_type: MessageType, origin, msg=None) -> None:
+        await self.processor.process_message(
+            Message(
+                session_id=self.session_id,
+                cem_id="cem",
+                rm_id="rm",
+                origin=origin,
+                message_type=message_type,
+                msg=msg,
+                timestamp=self.now,
+            ),
+            asyncio.get_running_loop(),
+        )
+
+    async def start(self) -> None:
+        await self._process(MessageType.SESSION_STARTED, CEM)
+
+    async def send(self, origin, msg: dict, after: float = 1.0) -> str:
+        self.now += timedelta(seconds=after)
+        msg = {"message_id": str(uuid.uuid4()), **msg}
+        await self._process(MessageType.S2, origin, msg)
+        return msg["message_id"]
+
+    async def acknowledge(self, origin, subject_id: str, status: str = "OK") -> None:
+        await self.send(
+            origin,
+            {
+                "message_type": "ReceptionStatus",
+                "subject_message_id": subject_id,
+                "status": status,
+            },
+            after=0.1,
+        )
+
+    async def exchange(self, origin, msg: dict) -> str:
+        """Sends the message and its ReceptionStatus from the other device."""
+        message_id = await self.send(origin, msg)
+        await self.acknowledge(origin.reverse(), message_id)
+        return message_id
+
+    async def handshake(self) -> None:
+        for origin in (CEM, RM):
+            await self.exchange(origin, {"message_type": "Handshake"})
+
+    async def end(self, after: float = 1.0) -> None:
+        self.now += timedelta(seconds=after)
+        await self._process(MessageType.SESSION_ENDED, CEM)
+
+    @property
+    def conformance(self):
+        return self.processor.sessions[self.session_id]
+
+    def rules(self) -> list[ConformanceRule]:
+        return [violation.rule for violation in self.conformance.violations]
+
+
+@pytest.fixture
+async def session() -> _Session:
+    session = _Session(ConformanceProcessor(reception_status_timeout=5.0))
+    await session.start()
+    return session
+
+
+async def test_conforming_session_has_no_violations(session):
+    await session.handshake()
+    await session.exchange(
+        RM,
+        {
+            "message_type": "ResourceManagerDetails",
+            "available_control_types": ["FILL_RATE_BASED_CONTROL"],
+        },
+    )
+    await session.exchange(
+        CEM,
+        {
+            "message_type": "SelectControlType",
+            "control_type": "FILL_RATE_BASED_CONTROL",
+        },
+    )
+    await session.exchange(RM, SYSTEM_DESCRIPTION)
+    await session.exchange(
+        CEM,
+        {
+            "message_type": "FRBC.Instruction",
+            "id": "Instruction-1",
+            "actuator_id": "actuator-1",
+            "operation_mode": "MODE-1",
+        },
+    )
+    await session.exchange(
+        RM,
+        {"message_type": "InstructionStatusUpdate", "instruction_id": "instruction-1"},
+    )
+    await session.end()
+
+    assert session.rules() == []
+    assert session.conformance.state == "closed"
+    assert session.conformance.outstanding == set()
+
+
+async def test_message_before_the_handshake_is_flagged_once(session):
+    await session.exchange(RM, {"message_type": "PowerMeasurement"})
+    await session.exchange(RM, {"message_type": "PowerMeasurement"})
+
+    assert session.rules() == [ConformanceRule.HANDSHAKE_FIRST]
+
+
+async def test_message_of_the_other_role_is_flagged(session):
+    await session.handshake()
+    await session.exchange(RM, {"message_type": "SelectControlType"})
+
+    assert session.rules() == [ConformanceRule.WRONG_DIRECTION]
+
+
+async def test_reused_outstanding_message_id_is_flagged(session):
+    await session.handshake()
+    message_id = await session.send(RM, {"message_type": "PowerMeasurement"})
+    await session.send(
+        RM, {"message_type": "PowerMeasurement", "message_id": message_id.upper()}
+    )
+
+    assert session.rules() == [ConformanceRule.DUPLICATE_MESSAGE_ID]
+
+
+async def test_reception_status_of_an_unknown_message_is_flagged(session):
+    await session.handshake()
+    await session.acknowledge(CEM, str(uuid.uuid4()))
+
+    assert session.rules() == [ConformanceRule.RECEPTION_STATUS_UNKNOWN_SUBJECT]
+
+
+async def test_rejected_message_is_flagged(session):
+    await session.handshake()
+    message_id = await session.send(RM, {"message_type": "PowerMeasurement"})
+    await session.acknowledge(CEM, message_id, status="INVALID_CONTENT")
+
+    assert session.rules() == [ConformanceRule.RECEPTION_STATUS_NOT_OK]
+    assert session.conformance.outstanding == set()
+
+
+async def test_selecting_an_unavailable_control_type_is_flagged(session):
+    await session.handshake()
+    await session.exchange(
+        RM,
+        {
+            "message_type": "ResourceManagerDetails",
+            "available_control_types": ["FILL_RATE_BASED_CONTROL"],
+        },
+    )
+    await session.exchange(
+        CEM, {"message_type": "SelectControlType", "control_type": "NO_SELECTION"}
+    )
+    await session.exchange(
+        CEM,
+        {
+            "message_type": "SelectControlType",
+            "control_type": "POWER_PROFILE_BASED_CONTROL",
+        },
+    )
+
+    assert session.rules() == [ConformanceRule.CONTROL_TYPE_NOT_AVAILABLE]
+
+
+async def test_message_of_an_unselected_control_type_is_flagged(session):
+    await session.handshake()
+    await session.exchange(RM, {"message_type": "FRBC.StorageStatus"})
+
+    assert session.rules() == [ConformanceRule.CONTROL_TYPE_NOT_SELECTED]
+
+
+async def test_references_outside_the_system_description_are_flagged(session):
+    await session.handshake()
+    await session.exchange(
+        CEM,
+        {
+            "message_type": "SelectControlType",
+            "control_type": "FILL_RATE_BASED_CONTROL",
+        },
+    )
+    actuator_status = {
+        "message_type": "FRBC.ActuatorStatus",
+        "actuator_id": "actuator-1",
+        "active_operation_mode_id": "mode-1",
+    }
+    await session.exchange(RM, actuator_status)
+    await session.exchange(RM, SYSTEM_DESCRIPTION)
+    await session.exchange(RM, actuator_status)
+    await session.exchange(RM, {**actuator_status, "actuator_id": "actuator-2"})
+    await session.exchange(
+        RM, {**actuator_status, "active_operation_mode_id": "mode-2"}
+    )
+
+    assert session.rules() == [ConformanceRule.UNKNOWN_SYSTEM_DESCRIPTION_REFERENCE] * 3
+    details = [violation.detail for violation in session.conformance.violations]
+    assert "before any FRBC.SystemDescription" in details[0]
+    assert "actuator-2" in details[1]
+    assert "mode-2" in details[2]
+
+
+async def test_status_update_of_an_unknown_instruction_is_flagged(session):
+    await session.handshake()
+    await session.exchange(
+        RM, {"message_type": "InstructionStatusUpdate", "instruction_id": "unknown"}
+    )
+
+    assert session.rules() == [ConformanceRule.UNKNOWN_INSTRUCTION]
+
+
+async def test_missing_reception_statuses_expire_in_deadline_order(session):
+    await session.handshake()
+    first = await session.send(RM, {"message_type": "PowerMeasurement"})
+    second = await session.send(RM, {"message_type": "PowerMeasurement"})
+    third = await session.send(RM, {"message_type": "PowerMeasurement"})
+    await session.acknowledge(CEM, second)
+
+    # Past the deadline of the first message only.
+    await session.send(CEM, {"message_type": "Handshake"}, after=3.5)
+    assert [violation.message_id for violation in session.conformance.violations] == [
+        first
+    ]
+    violation = session.conformance.violations[0]
+    assert violation.rule == ConformanceRule.RECEPTION_STATUS_MISSING
+    # Flagged at the deadline, not at the time of the later message.
+    assert violation.timestamp == START + timedelta(seconds=8.2)
+
+    await session.send(CEM, {"message_type": "Handshake"}, after=2.0)
+    assert [violation.message_id for violation in session.conformance.violations] == [
+        first,
+        third,
+    ]
+
+
+async def test_messages_of_another_session_expire_the_reception_statuses(session):
+    await session.handshake()
+    message_id = await session.send(RM, {"message_type": "PowerMeasurement"})
+
+    other = _Session(session.processor)
+    other.now = session.now + timedelta(seconds=6)
+    await other.start()
+
+    assert [violation.message_id for violation in session.conformance.violations] == [
+        message_id
+    ]
+
+
+async def test_too_many_outstanding_messages_are_flagged_once_until_acknowledged():
+    session = _Session(ConformanceProcessor(max_outstanding=2))
+    await session.start()
+    await session.handshake()
+
+    tracked = [
+        await session.send(RM, {"message_type": "PowerMeasurement"}, after=0.1)
+        for _ in range(2)
+    ]
+    untracked = await session.send(RM, {"message_type": "PowerMeasurement"}, after=0.1)
+    await session.send(RM, {"message_type": "PowerMeasurement"}, after=0.1)
+    assert session.rules() == [ConformanceRule.TOO_MANY_OUTSTANDING]
+
+    # The ReceptionStatus of an untracked message is not flagged while overflowed.
+    await session.acknowledge(CEM, untracked)
+    for message_id in tracked:
+        await session.acknowledge(CEM, message_id)
+    assert session.rules() == [ConformanceRule.TOO_MANY_OUTSTANDING]
+    assert not session.conformance.overflowed
+
+    # Tracking resumes once all outstanding messages are acknowledged.
+    await session.send(RM, {"message_type": "PowerMeasurement"}, after=0.1)
+    await session.acknowledge(CEM, str(uuid.uuid4()))
+    assert session.rules() == [
+        ConformanceRule.TOO_MANY_OUTSTANDING,
+        ConformanceRule.RECEPTION_STATUS_UNKNOWN_SUBJECT,
+    ]
+
+
+async def test_outstanding_messages_are_flagged_when_the_session_ends(session):
+    await session.handshake()
+    outstanding = {
+        await session.send(RM, {"message_type": "PowerMeasurement"}, after=0.1)
+        for _ in range(3)
+    }
+
+    await session.end(after=0.1)
+
+    violations = list(session.conformance.violations)
+    assert {violation.message_id for violation in violations} == outstanding
+    assert all(
+        violation.rule == ConformanceRule.RECEPTION_STATUS_MISSING
+        and "session ended" in violation.detail
+        for violation in violations
+    )
+    assert session.conformance.outstanding == set()
+    assert not session.processor._outstanding
+
+    # Nothing is flagged again once their deadlines pass.
+    session.processor._expire(session.now + timedelta(minutes=1))
+    assert len(session.conformance.violations) == 3
@@ -0,0 +1,192 @@
+import asyncio
+import json
+from types import SimpleNamespace
+import uuid
+
+import pytest
+
+from s2_analyzer_backend.async_application import APPLICATIONS
+from s2_analyzer_backend.config import Config, WebsocketConfig
+from s2_analyzer_backend.device_connection.connection import (
+    DebuggerFrontendWebsocketConnection,
+    S2Connection,
+    next_batch,
+)
+from s2_analyzer_backend.device_connection.envelope import Envelope
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+from s2_analyzer_backend.message_processor.message import Message
+from s2_analyzer_backend.rest_apis.debugger_api import DebuggerAPI
+
+
+class _Websocket:
+    client = "frontend"
+
+    def __init__(self):
+        self.frames: list[str] = []
+
+    async def accept(self) -> None:
+        pass
+
+    async def send_text(self, text: str) -> None:
+        self.frames.append(text)
+
+
+class _Adapter:
+    def __init__(self):
+        self.frames: list[str] = []
+
+    async def send(self, message_str: str) -> None:
+        self.frames.append(message_str)
+
+
+def _message(number: int) -> Message:
+    return Message(
+        session_id=uuid.uuid4(),
+        cem_id="cem",
+        rm_id="rm",
+        origin=S2OriginType.RM,
+        msg={"message_type": "PowerMeasurement", "number": number},
+    )
+
+
+async def _send_queued(connection) -> None:
+    """Runs the sender of the connection until everything queued is sent."""
+    connection._running = True
+    sender = asyncio.create_task(connection.sender())
+    await asyncio.wait_for(connection._queue.join(), 1)
+    connection._running = False
+    sender.cancel()
+
+
+async def _queue(*items) -> asyncio.Queue:
+    queue = asyncio.Queue()
+    for item in items:
+        await queue.put(item)
+    return queue
+
+
+async def test_batch_drains_the_queue_up_to_the_max_batch_size():
+    queue = await _queue(*range(5))
+
+    assert await next_batch(queue, 3, 0.0) == [0, 1, 2]
+    assert await next_batch(queue, 3, 0.0) == [3, 4]
+
+
+async def test_batch_waits_at_most_the_max_batch_delay_for_more_items():
+    queue = await _queue(0)
+
+    async def put_later(item, delay):
+        await asyncio.sleep(delay)
+        await queue.put(item)
+
+    asyncio.create_task(put_later(1, 0.01))
+    late = asyncio.create_task(put_later(2, 0.5))
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    assert await next_batch(queue, 10, 0.1) == [0, 1]
+    assert 0.1 <= loop.time() - start < 0.5
+    late.cancel()
+
+
+async def test_batch_waits_for_the_first_item():
+    queue = asyncio.Queue()
+    batch = asyncio.create_task(next_batch(queue, 10, 0.0))
+    await asyncio.sleep(0.01)
+    assert not batch.done()
+
+    await queue.put(0)
+    assert await batch == [0]
+
+
+@pytest.mark.parametrize(
+    "max_batch_size, frames", [(1, [[0], [1], [2]]), (10, [[0, 1, 2]])]
+)
+async def test_frontend_receives_a_frame_per_message_unless_batching(
+    max_batch_size, frames
+):
+    websocket = _Websocket()
+    connection = DebuggerFrontendWebsocketConnection(
+        websocket, None, None, max_batch_size=max_batch_size
+    )
+    for number in range(3):
+        await connection.enqueue_message(_message(number))
+
+    await _send_queued(connection)
+
+    sent = [json.loads(frame) for frame in websocket.frames]
+    if max_batch_size == 1:
+        # A single message is sent as is, not in an array.
+        sent = [[message] for message in sent]
+    assert [[message["msg"]["number"] for message in frame] for frame in sent] == frames
+    assert connection.stats.frames_sent == len(frames)
+    assert connection.stats.messages_sent == 3
+
+
+@pytest.mark.parametrize("batch, max_batch_size", [(False, 1), (True, 50)])
+async def test_debugger_frontend_only_batches_when_asked(
+    monkeypatch, batch, max_batch_size
+):
+    connections = []
+
+    async def add_connection(connection):
+        connections.append(connection)
+
+    async def wait_till_done_async(self, **kwargs):
+        pass
+
+    monkeypatch.setattr(APPLICATIONS, "add_and_start_application", lambda app: None)
+    monkeypatch.setattr(
+        DebuggerFrontendWebsocketConnection,
+        "wait_till_done_async",
+        wait_till_done_async,
+    )
+    api = DebuggerAPI(
+        SimpleNamespace(add_connection=add_connection),
+        None,
+        Config(
+            http_listen_address="127.0.0.1",
+            http_port=8001,
+            websocket=WebsocketConfig(max_batch_size=50),
+        ),
+    )
+
+    await api.receive_new_debugger_frontend_connection(
+        _Websocket(),
+        session_id=None,
+        cem_id=None,
+        rm_id=None,
+        include_session_history=False,
+        batch=batch,
+        history_filter=None,
+    )
+
+    (connection,) = connections
+    assert connection.max_batch_size == max_batch_size
+    assert connection.batching == batch
+
+
+async def test_device_receives_a_frame_per_envelope_also_when_drained_together():
+    adapter = _Adapter()
+    forwarded = []
+    router = SimpleNamespace(
+        record_forwarded=lambda dest, envelope: forwarded.append(envelope)
+    )
+    connection = S2Connection(
+        adapter, "cem", "rm", S2OriginType.CEM, router, max_batch_size=10
+    )
+    envelopes = [
+        Envelope(None, connection, {"message_type": "PowerMeasurement", "number": n})
+        for n in range(3)
+    ]
+    for envelope in envelopes:
+        await connection.receive_envelope(envelope)
+
+    await _send_queued(connection)
+
+    assert [json.loads(frame) for frame in adapter.frames] == [
+        envelope.msg for envelope in envelopes
+    ]
+    assert forwarded == envelopes
+    assert connection.stats.frames_sent == 3
+    assert connection.stats.largest_batch == 1
@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+import uuid
+
+from s2_analyzer_backend.device_connection.connection_registry import (
+    ConnectionRegistry,
+)
+
+
+def _connection(origin_id: str = "cem", dest_id: str = "rm") -> SimpleNamespace:
+    return SimpleNamespace(
+        origin_id=origin_id, dest_id=dest_id, cem_id="cem", rm_id="rm"
+    )
+
+
+def test_stale_connection_does_not_remove_its_replacement():
+    registry = ConnectionRegistry()
+    stale, replacement = _connection(), _connection()
+    stale_session, session_id = uuid.uuid4(), uuid.uuid4()
+    registry.add(stale, stale_session)
+    registry.add(replacement, session_id)
+
+    assert registry.remove(("cem", "rm"), stale) is None
+    assert registry.get("cem", "rm").connection is replacement
+    assert registry.session_ids() == [session_id]
+    assert [entry.connection for entry in registry.by_cem_id("cem")] == [replacement]
+
+    assert registry.remove(("cem", "rm"), replacement).session_id == session_id
+    assert len(registry) == 0
+    assert registry.session_ids() == []
+    assert registry.by_cem_id("cem") == registry.by_rm_id("rm") == []
+
+
+def test_removing_a_pair_keeps_the_other_connections_of_the_session():
+    registry = ConnectionRegistry()
+    session_id = uuid.uuid4()
+    to_rm, to_cem = _connection("cem", "rm"), _connection("rm", "cem")
+    registry.add(to_rm, session_id)
+    registry.add(to_cem, session_id)
+
+    registry.remove(("cem", "rm"))
+
+    assert ("cem", "rm") not in registry
+    for entries in (
+        registry.by_session_id(session_id),
+        registry.by_cem_id("cem"),
+        registry.by_rm_id("rm"),
+    ):
+        assert [entry.connection for entry in entries] == [to_cem]
+    assert registry.remove(("cem", "rm")) is None
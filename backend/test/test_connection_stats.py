@@ -0,0 +1,67 @@
+from s2_analyzer_backend.config import SlowConsumerConfig
+from s2_analyzer_backend.device_connection.connection_stats import (
+    SLOW_CONSUMER_EVENTS,
+    SlowConsumerAction,
+    SlowConsumerGuard,
+)
+
+
+def _guard(action: SlowConsumerAction, disconnects: list) -> SlowConsumerGuard:
+    return SlowConsumerGuard(
+        "connection",
+        SlowConsumerConfig(max_queue_depth=4, max_lag=60.0, sample_rate=2),
+        action,
+        lambda: disconnects.append(True),
+    )
+
+
+def _offer(guard: SlowConsumerGuard, count: int) -> list[bool]:
+    """Offers `count` messages to the guard and queues the admitted ones."""
+    admitted = []
+    for _ in range(count):
+        admitted.append(guard.admit())
+        if admitted[-1]:
+            guard.record_enqueue()
+    return admitted
+
+
+def test_sampling_continues_until_the_queue_is_half_empty():
+    guard = _guard(SlowConsumerAction.SAMPLE, [])
+    events = len(SLOW_CONSUMER_EVENTS)
+
+    assert _offer(guard, 5) == [True] * 5
+    assert not guard.lagging
+    # Lagging from the sixth message on, of which every second is delivered.
+    assert _offer(guard, 5) == [True, False, True, False, True]
+    assert guard.lagging
+    assert guard.dropped == 2
+    assert len(SLOW_CONSUMER_EVENTS) == events + 1
+
+    # Below the threshold, but not half empty yet.
+    guard.record_dequeue(5)
+    assert guard.queue_depth == 3
+    assert _offer(guard, 2) == [False, True]
+    assert guard.lagging
+
+    guard.record_dequeue(2)
+    assert _offer(guard, 1) == [True]
+    assert not guard.lagging
+    assert len(SLOW_CONSUMER_EVENTS) == events + 1
+
+
+def test_lagging_connection_is_disconnected_once():
+    disconnects = []
+    guard = _guard(SlowConsumerAction.DISCONNECT, disconnects)
+
+    assert _offer(guard, 8) == [True] * 5 + [False] * 3
+    assert disconnects == [True]
+
+
+def test_without_a_config_nothing_is_dropped():
+    guard = SlowConsumerGuard(
+        "connection", None, SlowConsumerAction.DISCONNECT, lambda: None
+    )
+
+    assert all(_offer(guard, 100))
+    assert not guard.lagging
+    assert guard.as_dict()["queue_depth"] == 100
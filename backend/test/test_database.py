@@ -0,0 +1,172 @@
+from datetime import datetime
+import sqlite3
+import uuid
+
+import pytest
+from sqlalchemy import inspect, text
+from sqlmodel import Session, create_engine, select
+
+from s2_analyzer_backend.message_processor import database
+from s2_analyzer_backend.message_processor.database import (
+    Communication,
+    ValidationErrorCount,
+    create_db_and_tables,
+    load_validation_errors,
+)
+
+SESSION_ID = uuid.uuid4()
+
+# The tables as created by the versions before the validation errors were interned and the messages compressed.
+BASELINE_SCHEMA = """
+CREATE TABLE communication (
+    session_id CHAR(32) NOT NULL,
+    cem_id VARCHAR NOT NULL,
+    rm_id VARCHAR NOT NULL,
+    origin VARCHAR NOT NULL,
+    message_type VARCHAR(14) NOT NULL,
+    s2_msg_type VARCHAR,
+    timestamp DATETIME NOT NULL,
+    id INTEGER NOT NULL,
+    s2_msg VARCHAR,
+    PRIMARY KEY (id)
+);
+CREATE TABLE validationerror (
+    error_details VARCHAR,
+    type VARCHAR NOT NULL,
+    loc VARCHAR NOT NULL,
+    msg VARCHAR NOT NULL,
+    id INTEGER NOT NULL,
+    communication_id INTEGER,
+    PRIMARY KEY (id),
+    FOREIGN KEY(communication_id) REFERENCES communication (id)
+);
+"""
+
+
+@pytest.fixture
+def baseline_engine(tmp_path):
+    """An engine of a database stored by the baseline version, with three messages and their validation errors."""
+    path = tmp_path / "history.db"
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.executemany(
+        "INSERT INTO communication VALUES (?, 'cem', 'rm', 'RM', 'S2', ?, ?, ?, ?)",
+        [
+            (
+                SESSION_ID.hex,
+                "FRBC.StorageStatus",
+                f"2024-01-01 {hour}:30:00.000000",
+                communication_id,
+                f'{{"message_type": "FRBC.StorageStatus", "message_id": "id-{communication_id}"}}',
+            )
+            for communication_id, hour in [(1, 12), (2, 12), (3, 13)]
+        ],
+    )
+    connection.executemany(
+        "INSERT INTO validationerror VALUES (NULL, ?, ?, ?, ?, ?)",
+        [
+            ("missing", "present_fill_level", "Field required", 10, 1),
+            ("missing", "present_fill_level", "Field required", 11, 2),
+            (
+                "float_type",
+                "present_fill_level",
+                "Input should be a valid number",
+                12,
+                2,
+            ),
+            ("missing", "present_fill_level", "Field required", 13, 3),
+        ],
+    )
+    connection.commit()
+    connection.close()
+
+    engine = create_engine(f"sqlite:///{path}")
+    yield engine
+    engine.dispose()
+
+
+def test_engine_uses_the_write_ahead_log_and_incremental_vacuum(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'history.db'}")
+    database.get_engine.cache_clear()
+    try:
+        engine = database.get_engine()
+        create_db_and_tables(engine)
+        with engine.connect() as connection:
+            assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            # 2 is INCREMENTAL.
+            assert connection.execute(text("PRAGMA auto_vacuum")).scalar() == 2
+            assert (
+                connection.execute(text("PRAGMA busy_timeout")).scalar()
+                == database.SQLITE_BUSY_TIMEOUT
+            )
+        engine.dispose()
+    finally:
+        database.get_engine.cache_clear()
+
+
+def test_validation_errors_of_a_baseline_database_are_interned(baseline_engine):
+    create_db_and_tables(baseline_engine)
+    # Migrating is only done once.
+    create_db_and_tables(baseline_engine)
+
+    assert not inspect(baseline_engine).has_table(
+        database.LEGACY_VALIDATION_ERROR_TABLE
+    )
+    with Session(baseline_engine) as session:
+        communications = session.exec(
+            select(Communication)
+            .order_by(Communication.id)
+            .options(load_validation_errors())
+        ).all()
+        errors = [
+            [
+                (error.id, error.signature.msg)
+                for error in communication.validation_errors
+            ]
+            for communication in communications
+        ]
+        signature_ids = {
+            error.signature.msg: error.signature_id
+            for communication in communications
+            for error in communication.validation_errors
+        }
+        counts = {
+            (count.signature_id, count.hour): count.count
+            for count in session.exec(select(ValidationErrorCount)).all()
+        }
+        assert communications[0].get_s2_msg()["message_id"] == "id-1"
+
+    # The ids of the errors are kept.
+    assert errors == [
+        [(10, "Field required")],
+        [(11, "Field required"), (12, "Input should be a valid number")],
+        [(13, "Field required")],
+    ]
+    assert counts == {
+        (signature_ids["Field required"], datetime(2024, 1, 1, 12)): 2,
+        (signature_ids["Input should be a valid number"], datetime(2024, 1, 1, 12)): 1,
+        (signature_ids["Field required"], datetime(2024, 1, 1, 13)): 1,
+    }
+
+
+def _search(engine, match: str) -> list[int]:
+    with engine.connect() as connection:
+        return list(
+            connection.execute(
+                text(
+                    f"SELECT rowid FROM {database.MESSAGE_SEARCH_TABLE} "
+                    f"WHERE {database.MESSAGE_SEARCH_TABLE} MATCH :match ORDER BY rowid"
+                ),
+                {"match": match},
+            ).scalars()
+        )
+
+
+def test_messages_of_a_baseline_database_are_indexed_once(baseline_engine):
+    create_db_and_tables(baseline_engine)
+    create_db_and_tables(baseline_engine)
+
+    assert _search(baseline_engine, 'message : "id-2"') == [2]
+    assert _search(baseline_engine, 'message : "FRBC.StorageStatus"') == [1, 2, 3]
+    assert _search(baseline_engine, 'errors : "valid number"') == [2]
+    assert _search(baseline_engine, 'errors : "Field required"') == [1, 2, 3]
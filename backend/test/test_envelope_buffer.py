@@ -0,0 +1,104 @@
+import json
+
+from s2_analyzer_backend.device_connection.envelope_buffer import (
+    DiskEnvelopeBuffer,
+    MemoryEnvelopeBuffer,
+)
+
+KEY = ("cem", "rm")
+
+
+def _message(number: int) -> dict:
+    return {"message_type": "FRBC.StorageStatus", "present_fill_level": number}
+
+
+async def test_disk_buffer_delivers_in_order_after_a_restart(tmp_path):
+    buffer = DiskEnvelopeBuffer(str(tmp_path))
+    for number in range(3):
+        buffer.append(KEY, _message(number))
+    await buffer.flush()
+
+    restarted = DiskEnvelopeBuffer(str(tmp_path))
+    consumed = await restarted.consume(KEY)
+
+    assert [msg["present_fill_level"] for msg in consumed] == [0, 1, 2]
+    assert not list(tmp_path.glob("*.log"))
+
+
+async def test_disk_buffer_drops_the_oldest_messages_when_full(tmp_path):
+    record_size = len(json.dumps({"t": 0.0, "m": _message(0)})) + 10
+    buffer = DiskEnvelopeBuffer(str(tmp_path), max_bytes=4 * record_size)
+    for number in range(10):
+        buffer.append(KEY, _message(number))
+    await buffer.flush()
+
+    consumed = [msg["present_fill_level"] for msg in await buffer.consume(KEY)]
+
+    assert consumed[-1] == 9
+    assert consumed == sorted(consumed)
+    assert len(consumed) < 10
+
+
+async def test_disk_buffer_skips_expired_messages(tmp_path):
+    buffer = DiskEnvelopeBuffer(str(tmp_path), ttl=-1.0)
+    buffer.append(KEY, _message(0))
+    await buffer.flush()
+
+    assert await buffer.consume(KEY) == []
+
+
+async def test_disk_buffer_skips_a_record_torn_by_a_crash(tmp_path):
+    buffer = DiskEnvelopeBuffer(str(tmp_path))
+    for number in range(3):
+        buffer.append(KEY, _message(number))
+    await buffer.flush()
+    (log_path,) = tmp_path.glob("*.log")
+    with open(log_path, "rb+") as log:
+        log.truncate(log_path.stat().st_size - 10)
+
+    restarted = DiskEnvelopeBuffer(str(tmp_path))
+    # Appended after the torn record, which must not corrupt it.
+    restarted.append(KEY, _message(3))
+    consumed = await restarted.consume(KEY)
+
+    assert [msg["present_fill_level"] for msg in consumed] == [0, 1, 3]
+    assert restarted.malformed_records == 1
+    assert not list(tmp_path.glob("*.log"))
+
+
+async def test_disk_buffer_compacts_a_log_with_a_torn_record(tmp_path):
+    record_size = len(json.dumps({"t": 0.0, "m": _message(0)})) + 10
+    buffer = DiskEnvelopeBuffer(str(tmp_path), max_bytes=4 * record_size)
+    buffer.append(KEY, _message(0))
+    await buffer.flush()
+    (log_path,) = tmp_path.glob("*.log")
+    with open(log_path, "ab") as log:
+        log.write(b'{"t": 1.0, "m": {"message_type"')
+
+    restarted = DiskEnvelopeBuffer(str(tmp_path), max_bytes=4 * record_size)
+    for number in range(1, 10):
+        restarted.append(KEY, _message(number))
+    consumed = [msg["present_fill_level"] for msg in await restarted.consume(KEY)]
+
+    assert consumed[-1] == 9
+    assert consumed == sorted(consumed)
+    assert restarted.malformed_records >= 1
+
+
+async def test_memory_buffer_drops_the_oldest_messages_when_full():
+    size = len(json.dumps(_message(0)))
+    buffer = MemoryEnvelopeBuffer(max_bytes=2 * size)
+    for number in range(3):
+        buffer.append(KEY, _message(number))
+
+    assert [msg["present_fill_level"] for msg in await buffer.consume(KEY)] == [1, 2]
+    assert await buffer.consume(KEY) == []
+
+
+async def test_memory_buffer_forgets_the_messages_of_an_ended_session():
+    buffer = MemoryEnvelopeBuffer()
+    buffer.append(KEY, _message(0))
+
+    buffer.session_ended(KEY)
+
+    assert await buffer.consume(KEY) == []
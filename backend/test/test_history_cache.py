@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+import uuid
+
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+from s2_analyzer_backend.endpoints.history_cache import (
+    CacheScope,
+    HistoryResponseCache,
+    etag_matches,
+)
+from s2_analyzer_backend.message_processor.message import Message
+from s2_analyzer_backend.message_processor.message_type import MessageType
+
+PAST = datetime.now() - timedelta(days=2)
+PAST_WINDOW = CacheScope(start=PAST - timedelta(hours=1), end=PAST)
+
+
+def _message(
+    session_id: uuid.UUID,
+    message_type: MessageType = MessageType.S2,
+    timestamp: "datetime | None" = None,
+) -> Message:
+    return Message(
+        session_id=session_id,
+        cem_id="cem",
+        rm_id="rm",
+        origin=S2OriginType.RM,
+        message_type=message_type,
+        timestamp=timestamp or datetime.now(),
+    )
+
+
+def _put(cache: HistoryResponseCache, key, body: bytes, scope: CacheScope):
+    with cache.computing(scope) as computation:
+        return cache.put(key, body, computation)
+
+
+def test_least_recently_used_responses_are_evicted_beyond_max_bytes():
+    cache = HistoryResponseCache(max_bytes=100)
+    session_id = uuid.uuid4()
+    for key in range(3):
+        _put(cache, key, b"x" * 40, CacheScope(session_id=session_id))
+
+    assert cache.get(0) is None
+    assert cache.get(1) is not None
+    assert cache.stats()["bytes"] == 80
+    assert cache.stats()["evictions"] == 1
+
+
+def test_response_larger_than_the_cache_is_not_cached():
+    cache = HistoryResponseCache(max_bytes=10)
+
+    response = _put(cache, "big", b"x" * 11, CacheScope())
+
+    assert cache.get("big") is None
+    assert etag_matches(response.etag, response.etag)
+
+
+def test_storing_messages_only_evicts_the_responses_of_their_session():
+    cache = HistoryResponseCache()
+    stored_session, other_session = uuid.uuid4(), uuid.uuid4()
+    _put(cache, "stored", b"a", CacheScope(session_id=stored_session))
+    _put(cache, "other", b"b", CacheScope(session_id=other_session))
+    _put(cache, "past", b"c", PAST_WINDOW)
+    _put(cache, "all", b"d", CacheScope())
+
+    cache.stored([_message(stored_session)])
+
+    assert cache.get("stored") is None
+    assert cache.get("other") is not None
+    assert cache.get("past") is not None
+    assert cache.get("all") is None
+    assert not cache.is_closed(stored_session)
+
+
+def test_messages_imported_into_a_past_window_evict_it():
+    cache = HistoryResponseCache()
+    _put(cache, "past", b"c", PAST_WINDOW)
+
+    cache.stored([_message(uuid.uuid4(), timestamp=PAST - timedelta(minutes=5))])
+
+    assert cache.get("past") is None
+
+
+def test_deleting_the_messages_of_all_sessions_evicts_the_overlapping_responses():
+    cache = HistoryResponseCache()
+    session_id = uuid.uuid4()
+    _put(cache, "session", b"a", CacheScope(session_id=session_id))
+    _put(cache, "past", b"c", PAST_WINDOW)
+
+    cache.invalidate(None, datetime.now() - timedelta(hours=1), datetime.now())
+
+    assert cache.get("session") is None
+    assert cache.get("past") is not None
+    assert cache.stats()["entries"] == 1
+
+
+def test_response_computed_while_its_messages_are_stored_is_not_cached():
+    cache = HistoryResponseCache()
+    session_id = uuid.uuid4()
+
+    with cache.computing(CacheScope(session_id=session_id)) as computation:
+        cache.stored([_message(session_id, MessageType.SESSION_ENDED)])
+        cache.put("session", b"stale", computation)
+
+    assert cache.get("session") is None
+    assert cache.is_closed(session_id)
+
+
+def test_response_computed_while_other_sessions_are_stored_is_cached():
+    cache = HistoryResponseCache()
+    session_id = uuid.uuid4()
+
+    with cache.computing(CacheScope(session_id=session_id)) as computation:
+        for _ in range(5000):
+            cache.stored([_message(uuid.uuid4())])
+        cache.put("session", b"body", computation)
+
+    assert cache.get("session") is not None
+
+
+def test_etag_matches_weak_and_listed_tags():
+    assert etag_matches('W/"1", "2"', '"1"')
+    assert etag_matches("*", '"1"')
+    assert not etag_matches('"2"', '"1"')
+    assert not etag_matches(None, '"1"')
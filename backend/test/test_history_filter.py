@@ -0,0 +1,42 @@
+import sqlite3
+
+from s2_analyzer_backend.endpoints.history_filter import build_search_query
+
+
+def _matching(texts: list[str], match: str) -> list[str]:
+    connection = sqlite3.connect(":memory:")
+    try:
+        connection.execute("CREATE VIRTUAL TABLE search USING fts5(message, errors)")
+        connection.executemany(
+            "INSERT INTO search(message, errors) VALUES (?, '')",
+            [(text,) for text in texts],
+        )
+        rows = connection.execute(
+            "SELECT message FROM search WHERE search MATCH ? ORDER BY rowid", (match,)
+        )
+        return [message for (message,) in rows]
+    finally:
+        connection.close()
+
+
+def test_every_word_is_quoted():
+    assert build_search_query('FRBC.Instruction say "hi"') == (
+        '"FRBC.Instruction" AND "say" AND """hi"""'
+    )
+    assert build_search_query("actuator-1", "errors") == 'errors : "actuator-1"'
+    assert build_search_query("   ") == ""
+
+
+def test_punctuation_and_operators_match_literally():
+    texts = [
+        '{"message_type": "FRBC.Instruction", "actuator_id": "actuator-1"}',
+        '{"message_type": "FRBC.StorageStatus", "note": "NOT OR"}',
+        '{"message_type": "Handshake", "role": "CEM"}',
+    ]
+
+    assert _matching(texts, build_search_query("FRBC.Instruction actuator-1")) == [
+        texts[0]
+    ]
+    assert _matching(texts, build_search_query("NOT")) == [texts[1]]
+    assert _matching(texts, build_search_query('role":')) == [texts[2]]
+    assert _matching(texts, build_search_query("handshake", "errors")) == []
@@ -0,0 +1,246 @@
+import asyncio
+from datetime import date, datetime, time, timedelta
+import uuid
+
+import pytest
+from sqlalchemy import text
+from sqlmodel import Session, create_engine, select
+
+from s2_analyzer_backend.config import RetentionConfig
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+from s2_analyzer_backend.message_processor import database
+from s2_analyzer_backend.message_processor.database import (
+    Communication,
+    MessageBody,
+    MessageField,
+    TimeSeriesPoint,
+    ValidationError,
+    create_db_and_tables,
+)
+from s2_analyzer_backend.message_processor.history_maintenance import (
+    HistoryMaintenance,
+)
+from s2_analyzer_backend.message_processor.message import (
+    Message,
+    MessageValidationDetails,
+)
+from s2_analyzer_backend.message_processor.message_index import MessageIndex
+from s2_analyzer_backend.message_processor.message_processor import (
+    MessageStorageProcessor,
+)
+from s2_analyzer_backend.message_processor.message_type import MessageType
+
+SESSION_ID = uuid.uuid4()
+# Ten days ago, past the default retention of the tests.
+OLD = datetime.combine(date.today() - timedelta(days=10), time(12))
+# A day ago, only past the retention of the FRBC.StorageStatus messages.
+RECENT = datetime.now() - timedelta(days=1)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    create_db_and_tables(engine)
+    yield engine
+    engine.dispose()
+
+
+def _maintenance(engine, **config) -> HistoryMaintenance:
+    return HistoryMaintenance(
+        engine,
+        RetentionConfig(
+            max_age_days=5,
+            max_age_days_per_type={"FRBC.StorageStatus": 0.5},
+            batch_size=2,
+            batch_pause=0,
+            **config,
+        ),
+    )
+
+
+def _message(
+    timestamp: datetime,
+    s2_msg_type: str = "FRBC.StorageStatus",
+    fill_level: float = 0.5,
+    invalid: bool = False,
+) -> tuple[str, Message]:
+    message_id = str(uuid.uuid4())
+    return message_id, Message(
+        session_id=SESSION_ID,
+        cem_id="cem",
+        rm_id="rm",
+        origin=S2OriginType.RM,
+        timestamp=timestamp,
+        s2_msg_type=s2_msg_type,
+        msg={
+            "message_type": s2_msg_type,
+            "message_id": message_id,
+            "present_fill_level": fill_level,
+        },
+        s2_validation_error=(
+            MessageValidationDetails(msg="Field required", errors=None)
+            if invalid
+            else None
+        ),
+    )
+
+
+def _store(engine, messages: list[Message]) -> None:
+    MessageStorageProcessor(engine, message_index=MessageIndex(["message_id"])).store(
+        messages
+    )
+
+
+def _search(engine, message_id: str) -> list[int]:
+    with engine.connect() as connection:
+        return list(
+            connection.execute(
+                text(
+                    f"SELECT rowid FROM {database.MESSAGE_SEARCH_TABLE} "
+                    f"WHERE {database.MESSAGE_SEARCH_TABLE} MATCH :match"
+                ),
+                {"match": f'message : "{message_id}"'},
+            ).scalars()
+        )
+
+
+def _rows(engine, model) -> list:
+    with Session(engine) as session:
+        return list(session.exec(select(model)))
+
+
+async def test_messages_past_the_retention_of_their_type_are_summarized_and_deleted(
+    engine,
+):
+    # The same body, kept while a message which is not deleted refers to it.
+    shared_id, shared = _message(OLD, fill_level=0.1)
+    old = [
+        shared,
+        _message(OLD + timedelta(minutes=1), invalid=True)[1],
+        _message(OLD + timedelta(minutes=2))[1],
+    ]
+    survivor_id, survivor = _message(datetime.now(), fill_level=0.1)
+    kept_id, kept = _message(RECENT, s2_msg_type="PowerMeasurement")
+    session_started = Message(
+        session_id=SESSION_ID,
+        cem_id="cem",
+        rm_id="rm",
+        origin=S2OriginType.CEM,
+        message_type=MessageType.SESSION_STARTED,
+        timestamp=OLD,
+    )
+    _store(
+        engine,
+        [
+            session_started,
+            *old,
+            _message(RECENT)[1],
+            _message(OLD, s2_msg_type="PowerMeasurement")[1],
+            kept,
+            survivor,
+        ],
+    )
+
+    report = await _maintenance(engine).run(asyncio.get_running_loop())
+
+    assert report.error is None
+    # The StorageStatus of a day ago is past the retention of its type, the PowerMeasurement is not.
+    assert report.deleted_messages == {
+        "FRBC.StorageStatus": 4,
+        "PowerMeasurement": 1,
+        "": 1,
+    }
+    assert report.deleted_validation_errors == 1
+    remaining = _rows(engine, Communication)
+    assert sorted(comm.s2_message_id for comm in remaining) == sorted(
+        [survivor_id, kept_id]
+    )
+    assert _rows(engine, ValidationError) == []
+
+    # The old messages are counted per day, also when they are deleted in more than one batch.
+    summaries = {
+        (summary.s2_msg_type, summary.day): summary
+        for summary in _maintenance(engine).get_summaries(SESSION_ID)
+    }
+    assert set(summaries) == {
+        ("FRBC.StorageStatus", OLD.date()),
+        ("FRBC.StorageStatus", RECENT.date()),
+        ("PowerMeasurement", OLD.date()),
+        ("", OLD.date()),
+    }
+    old_status = summaries[("FRBC.StorageStatus", OLD.date())]
+    assert (old_status.count, old_status.invalid_count) == (3, 1)
+    assert (old_status.first_timestamp, old_status.last_timestamp) == (
+        OLD,
+        OLD + timedelta(minutes=2),
+    )
+    assert summaries[("", OLD.date())].message_type == MessageType.SESSION_STARTED
+
+    # Only the bodies, indexed fields and search index entries of the remaining messages are left.
+    assert {body.hash for body in _rows(engine, MessageBody)} == {
+        comm.body_hash for comm in remaining
+    }
+    # The deleted StorageStatus messages of 0.5 shared a body, the other bodies are still referred to.
+    assert report.deleted_message_bodies == 1
+    assert sorted(field.value for field in _rows(engine, MessageField)) == sorted(
+        [survivor_id, kept_id]
+    )
+    assert _search(engine, shared_id) == []
+    assert [
+        comm.id for comm in remaining if comm.s2_message_id == survivor_id
+    ] == _search(engine, survivor_id)
+
+
+async def test_summaries_of_later_runs_add_to_the_counts(engine):
+    _store(engine, [_message(OLD)[1], _message(OLD + timedelta(hours=1))[1]])
+    await _maintenance(engine).run(asyncio.get_running_loop())
+    _store(engine, [_message(OLD - timedelta(hours=1))[1]])
+    await _maintenance(engine).run(asyncio.get_running_loop())
+
+    (summary,) = _maintenance(engine).get_summaries(SESSION_ID, "FRBC.StorageStatus")
+    assert summary.count == 3
+    assert (summary.first_timestamp, summary.last_timestamp) == (
+        OLD - timedelta(hours=1),
+        OLD + timedelta(hours=1),
+    )
+
+
+async def test_messages_are_kept_without_a_retention(engine):
+    _store(engine, [_message(OLD)[1]])
+    maintenance = HistoryMaintenance(engine, RetentionConfig())
+
+    report = await maintenance.run(asyncio.get_running_loop())
+
+    assert report.deleted_messages == {}
+    assert len(_rows(engine, Communication)) == 1
+
+
+async def test_only_the_old_time_series_points_finer_than_a_minute_are_deleted(
+    engine,
+):
+    with Session(engine) as session:
+        for bucket_start in (OLD, datetime.now()):
+            for resolution in (0, 1, 60, 900):
+                session.add(
+                    TimeSeriesPoint(
+                        session_id=SESSION_ID,
+                        series="frbc.fill_level",
+                        resolution=resolution,
+                        bucket_start=bucket_start,
+                        value_count=1,
+                        value_min=0.5,
+                        value_max=0.5,
+                        value_sum=0.5,
+                    )
+                )
+        session.commit()
+
+    report = await _maintenance(engine, time_series_raw_max_age_days=5).run(
+        asyncio.get_running_loop()
+    )
+
+    assert report.deleted_time_series_points == 2
+    assert sorted(
+        (point.bucket_start == OLD, point.resolution)
+        for point in _rows(engine, TimeSeriesPoint)
+    ) == [(False, 0), (False, 1), (False, 60), (False, 900), (True, 60), (True, 900)]
@@ -0,0 +1,113 @@
+import pytest
+from sqlmodel import Session, create_engine, select
+
+from s2_analyzer_backend.message_processor.database import (
+    MessageBody,
+    MessageBodyDictionary,
+    create_db_and_tables,
+)
+from s2_analyzer_backend.message_processor.message_body import (
+    MessageBodyStore,
+    canonical_body,
+)
+
+S2_MSG_TYPE = "FRBC.StorageStatus"
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    create_db_and_tables(engine)
+    yield engine
+    engine.dispose()
+
+
+def _message(number: int, message_id: str = "id") -> dict:
+    return {
+        "message_type": S2_MSG_TYPE,
+        "message_id": message_id,
+        "present_fill_level": number,
+    }
+
+
+def _store(engine, store: MessageBodyStore, messages: list[dict]) -> list[str]:
+    with Session(engine) as session:
+        hashes = [store.add(session, msg, S2_MSG_TYPE)[0] for msg in messages]
+        store.write(session)
+        session.commit()
+    store.committed()
+    return hashes
+
+
+def _bodies(engine) -> dict[str, tuple]:
+    """The decoded message and dictionary id of the stored bodies, by hash."""
+    with Session(engine) as session:
+        return {
+            body.hash: (body.decode(), body.dictionary_id)
+            for body in session.exec(select(MessageBody)).all()
+        }
+
+
+def test_messages_which_only_differ_in_their_message_id_share_a_body(engine):
+    store = MessageBodyStore(dictionary_samples=0)
+
+    hashes = _store(engine, store, [_message(1, "a"), _message(1, "b"), _message(2)])
+
+    assert hashes[0] == hashes[1] != hashes[2]
+    assert canonical_body(_message(1, "a"))[1] == "a"
+    bodies = _bodies(engine)
+    assert len(bodies) == 2
+    assert bodies[hashes[0]] == (
+        {"message_type": S2_MSG_TYPE, "present_fill_level": 1},
+        None,
+    )
+
+
+def test_bodies_are_compressed_with_the_dictionary_of_their_type(engine):
+    store = MessageBodyStore(dictionary_samples=2)
+
+    hashes = _store(engine, store, [_message(number) for number in range(4)])
+
+    bodies = _bodies(engine)
+    assert [bodies[body_hash][0]["present_fill_level"] for body_hash in hashes] == [
+        0,
+        1,
+        2,
+        3,
+    ]
+    dictionary_ids = [bodies[body_hash][1] for body_hash in hashes]
+    # The dictionary is made of the first two bodies, so only the first is compressed without it.
+    assert dictionary_ids[0] is None
+    assert dictionary_ids[1] is not None
+    assert dictionary_ids[1:] == [dictionary_ids[1]] * 3
+
+    # A later run uses the stored dictionary.
+    restarted = MessageBodyStore(dictionary_samples=2)
+    (body_hash,) = _store(engine, restarted, [_message(4)])
+    assert _bodies(engine)[body_hash] == (
+        {"message_type": S2_MSG_TYPE, "present_fill_level": 4},
+        dictionary_ids[1],
+    )
+
+
+def test_bodies_and_dictionaries_of_a_rolled_back_transaction_are_stored_again(
+    engine,
+):
+    store = MessageBodyStore(dictionary_samples=1)
+    with Session(engine) as session:
+        store.add(session, _message(1), S2_MSG_TYPE)
+        store.write(session)
+        session.rollback()
+    store.rolled_back()
+
+    (body_hash,) = _store(engine, store, [_message(1)])
+
+    with Session(engine) as session:
+        dictionaries = session.exec(select(MessageBodyDictionary.id)).all()
+    assert _bodies(engine) == {
+        body_hash: (
+            {"message_type": S2_MSG_TYPE, "present_fill_level": 1},
+            dictionaries[0],
+        )
+    }
+    assert len(dictionaries) == 1
@@ -0,0 +1,49 @@
+from s2_analyzer_backend.message_processor.message_index import MessageIndex
+
+SYSTEM_DESCRIPTION = {
+    "message_type": "FRBC.SystemDescription",
+    "actuators": [
+        {"id": "a1", "operation_modes": [{"id": "m1"}, {"id": "m2"}]},
+        {"id": "a2", "operation_modes": [{"id": "m1"}], "supports": [True, False]},
+        {"operation_modes": None},
+    ],
+    "storage": {"provides_leakage_behaviour": False, "fill_level_label": None},
+}
+
+
+def test_paths_through_lists_yield_the_value_of_every_element():
+    index = MessageIndex(
+        [
+            "actuators.id",
+            "actuators.operation_modes.id",
+            "actuators.supports",
+            "actuators",
+            "storage.provides_leakage_behaviour",
+            "storage.fill_level_label",
+            "storage.unknown",
+            "message_type.id",
+        ]
+    )
+
+    assert index.extract(SYSTEM_DESCRIPTION) == [
+        ("actuators.id", "a1"),
+        ("actuators.id", "a2"),
+        # Each value once per message.
+        ("actuators.operation_modes.id", "m1"),
+        ("actuators.operation_modes.id", "m2"),
+        ("actuators.supports", "true"),
+        ("actuators.supports", "false"),
+        ("storage.provides_leakage_behaviour", "false"),
+    ]
+
+
+def test_values_of_a_list_of_lists_are_indexed():
+    index = MessageIndex(["values"])
+
+    assert index.extract({"values": [[1, 2], [3], "x"]}) == [
+        ("values", "1"),
+        ("values", "2"),
+        ("values", "3"),
+        ("values", "x"),
+    ]
+    assert index.extract(["values"]) == []
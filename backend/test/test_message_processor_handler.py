@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import uuid
+
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+from s2_analyzer_backend.message_processor.message import Message
+from s2_analyzer_backend.message_processor.message_processor import (
+    MessageProcessor,
+    MessageProcessorHandler,
+    MessageStorageProcessor,
+)
+
+
+class _RecordingProcessor(MessageProcessor):
+    def __init__(self, block: bool = False):
+        self.block = block
+        self.messages: list[Message] = []
+
+    async def process_message(self, message, loop):
+        if self.block:
+            await asyncio.Event().wait()
+        self.messages.append(message)
+        return message
+
+
+def _message(number: int) -> Message:
+    return Message(
+        session_id=uuid.uuid4(),
+        cem_id="cem",
+        rm_id="rm",
+        origin=S2OriginType.CEM,
+        msg={"number": number},
+    )
+
+
+def _start(handler: MessageProcessorHandler) -> None:
+    handler.create_and_schedule_main_task(asyncio.get_running_loop())
+
+
+async def test_drain_processes_the_queued_messages(tmp_path):
+    processor = _RecordingProcessor()
+    handler = MessageProcessorHandler(str(tmp_path / "backlog.jsonl"))
+    handler.add_message_processor(processor)
+    _start(handler)
+    for number in range(3):
+        handler.add_message_to_process(_message(number))
+
+    report = await handler.drain(1.0)
+
+    assert report == {"processed": 3, "persisted": 0, "dropped": 0}
+    assert [message.msg["number"] for message in processor.messages] == [0, 1, 2]
+    assert not (tmp_path / "backlog.jsonl").exists()
+    handler.stop()
+
+
+async def test_drain_persists_the_message_in_flight_and_the_queue(tmp_path):
+    backlog_path = str(tmp_path / "backlog.jsonl")
+    handler = MessageProcessorHandler(backlog_path)
+    handler.add_message_processor(_RecordingProcessor(block=True))
+    _start(handler)
+    for number in range(3):
+        handler.add_message_to_process(_message(number))
+    await asyncio.sleep(0.01)
+
+    report = await handler.drain(0.05)
+
+    assert report == {"processed": 0, "persisted": 3, "dropped": 0}
+    assert handler.get_main_task().done()
+
+    processor = _RecordingProcessor()
+    restarted = MessageProcessorHandler(backlog_path)
+    restarted.add_message_processor(processor)
+    _start(restarted)
+    await asyncio.sleep(0.01)
+    await asyncio.wait_for(restarted.drain(1.0), 1.0)
+
+    assert [message.msg["number"] for message in processor.messages] == [0, 1, 2]
+    restarted.stop()
+
+
+async def test_drain_without_backlog_drops_the_unprocessed_messages():
+    handler = MessageProcessorHandler()
+    handler.add_message_processor(_RecordingProcessor(block=True))
+    _start(handler)
+    for number in range(2):
+        handler.add_message_to_process(_message(number))
+    await asyncio.sleep(0.01)
+
+    report = await handler.drain(0.05)
+
+    assert report == {"processed": 0, "persisted": 0, "dropped": 2}
+
+
+async def test_drain_persists_the_messages_of_a_storage_flush_which_hangs(tmp_path):
+    backlog_path = str(tmp_path / "backlog.jsonl")
+    released = threading.Event()
+    storage = MessageStorageProcessor(engine=None)
+    storage.store = lambda messages: released.wait()
+    processor = _RecordingProcessor()
+    handler = MessageProcessorHandler(backlog_path)
+    handler.add_message_processor(storage)
+    handler.add_message_processor(processor)
+    _start(handler)
+    for number in range(3):
+        handler.add_message_to_process(_message(number))
+    await asyncio.sleep(0.01)
+
+    try:
+        report = await asyncio.wait_for(handler.drain(0.2), 0.5)
+    finally:
+        released.set()
+
+    # Processed before the drain, but not stored.
+    assert len(processor.messages) == 3
+    assert report == {"processed": 0, "persisted": 3, "dropped": 0}
+    assert storage._writer is None or storage._writer.cancelling()
+    with open(backlog_path, encoding="utf-8") as backlog:
+        assert [
+            Message.model_validate_json(line).msg["number"] for line in backlog
+        ] == [0, 1, 2]
+    handler.stop()
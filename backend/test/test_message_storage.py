@@ -0,0 +1,99 @@
+import asyncio
+import sqlite3
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, func
+from sqlmodel import Session, select
+
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+from s2_analyzer_backend.message_processor.database import (
+    Communication,
+    create_db_and_tables,
+)
+from s2_analyzer_backend.message_processor.message import Message
+from s2_analyzer_backend.message_processor.message_processor import (
+    MessageStorageProcessor,
+)
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = tmp_path / "history.db"
+    engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 0.05})
+    create_db_and_tables(engine)
+    yield path, engine
+    engine.dispose()
+
+
+def _message(number: int) -> Message:
+    return Message(
+        session_id=uuid.uuid4(),
+        cem_id="cem",
+        rm_id="rm",
+        origin=S2OriginType.CEM,
+        s2_msg_type="FRBC.StorageStatus",
+        msg={
+            "message_type": "FRBC.StorageStatus",
+            "message_id": str(uuid.uuid4()),
+            "present_fill_level": number,
+        },
+    )
+
+
+def _stored(engine) -> int:
+    with Session(engine) as session:
+        return session.exec(select(func.count()).select_from(Communication)).one()
+
+
+async def test_messages_are_stored_in_batches(database):
+    _, engine = database
+    storage = MessageStorageProcessor(engine, batch_size=2)
+    loop = asyncio.get_running_loop()
+
+    for number in range(5):
+        await storage.process_message(_message(number), loop)
+    await storage.flush()
+
+    assert _stored(engine) == 5
+    assert storage._writer is None
+
+
+async def test_locked_database_is_retried_off_the_event_loop(database, monkeypatch):
+    path, engine = database
+    monkeypatch.setattr(MessageStorageProcessor, "RETRY_PAUSE", 0.05)
+    storage = MessageStorageProcessor(engine)
+    loop = asyncio.get_running_loop()
+
+    lock = sqlite3.connect(path, isolation_level=None)
+    lock.execute("BEGIN IMMEDIATE")
+    loop.call_later(0.15, lock.rollback)
+
+    start = loop.time()
+    await storage.process_message(_message(1), loop)
+    assert loop.time() - start < 0.05
+
+    await storage.flush()
+    lock.close()
+    assert _stored(engine) == 1
+
+
+async def test_batch_is_dropped_after_the_last_attempt(database, monkeypatch):
+    path, engine = database
+    monkeypatch.setattr(MessageStorageProcessor, "RETRY_PAUSE", 0.01)
+    monkeypatch.setattr(MessageStorageProcessor, "MAX_ATTEMPTS", 2)
+    storage = MessageStorageProcessor(engine)
+    loop = asyncio.get_running_loop()
+
+    lock = sqlite3.connect(path, isolation_level=None)
+    lock.execute("BEGIN IMMEDIATE")
+    await storage.process_message(_message(1), loop)
+    await storage.flush()
+    lock.rollback()
+    lock.close()
+
+    assert _stored(engine) == 0
+    # The pipeline continues with the next messages.
+    await storage.process_message(_message(2), loop)
+    await storage.flush()
+    assert _stored(engine) == 1
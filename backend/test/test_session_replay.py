@@ -0,0 +1,197 @@
+import asyncio
+from datetime import datetime, timedelta
+import threading
+from types import SimpleNamespace
+import uuid
+
+import pytest
+from sqlmodel import create_engine
+
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+from s2_analyzer_backend.device_connection.router import MessageRouter
+from s2_analyzer_backend.message_processor.database import create_db_and_tables
+from s2_analyzer_backend.message_processor.message import Message
+from s2_analyzer_backend.message_processor.message_processor import (
+    MessageStorageProcessor,
+)
+from s2_analyzer_backend.message_processor.message_type import MessageType
+from s2_analyzer_backend.replay import session_replay
+from s2_analyzer_backend.replay.session_replay import (
+    ReplayPacing,
+    ReplayState,
+    ReplayTarget,
+    SessionReplay,
+    SessionReplayRequest,
+)
+
+SESSION_ID = uuid.uuid4()
+START = datetime(2024, 1, 1, 12, 0, 0)
+CEM = S2OriginType.CEM
+RM = S2OriginType.RM
+# The origin of each recorded message, one second apart.
+RECORDED = [CEM, RM, RM, CEM]
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    create_db_and_tables(engine)
+    messages = [
+        Message(
+            session_id=SESSION_ID,
+            cem_id="cem",
+            rm_id="rm",
+            origin=CEM,
+            message_type=MessageType.SESSION_STARTED,
+            timestamp=START,
+        )
+    ]
+    for number, origin in enumerate(RECORDED):
+        messages.append(
+            Message(
+                session_id=SESSION_ID,
+                cem_id="cem",
+                rm_id="rm",
+                origin=origin,
+                timestamp=START + timedelta(seconds=number),
+                s2_msg_type="PowerMeasurement",
+                msg={
+                    "message_type": "PowerMeasurement",
+                    "message_id": str(uuid.uuid4()),
+                    "number": number,
+                },
+            )
+        )
+    MessageStorageProcessor(engine).store(messages)
+    yield engine
+    engine.dispose()
+
+
+class _Handler:
+    pending_messages = 0
+
+    def __init__(self):
+        self.messages: list[Message] = []
+
+    def add_message_to_process(self, message: Message) -> None:
+        self.messages.append(message)
+
+
+def _router(connected: bool = True) -> SimpleNamespace:
+    router = SimpleNamespace(msg_processor_handler=_Handler(), injected=[])
+
+    async def inject_message(origin_id, dest_id, msg):
+        if not connected:
+            raise ValueError(f"There is no connection from {origin_id} to {dest_id}.")
+        router.injected.append((origin_id, dest_id, msg["number"]))
+
+    router.inject_message = inject_message
+    return router
+
+
+async def _replay(engine, router, **request) -> SessionReplay:
+    replay = SessionReplay(
+        SessionReplayRequest(session_id=SESSION_ID, **request), router, engine
+    )
+    await replay.main_task(asyncio.get_running_loop())
+    return replay
+
+
+async def test_session_is_replayed_into_the_pipeline_as_a_new_session(engine):
+    router = _router()
+    replay = SessionReplay(SessionReplayRequest(session_id=SESSION_ID), router, engine)
+    read_batch = replay._read_batch
+    threads = []
+
+    def read_batch_in_thread(after_id):
+        threads.append(threading.current_thread())
+        return read_batch(after_id)
+
+    replay._read_batch = read_batch_in_thread
+    await replay.main_task(asyncio.get_running_loop())
+
+    status = replay.status()
+    assert status.state == ReplayState.FINISHED
+    assert (status.replayed, status.skipped, status.failed) == (4, 1, 0)
+    # The history is read in the executor.
+    assert threads and threading.main_thread() not in threads
+    messages = router.msg_processor_handler.messages
+    assert {message.session_id for message in messages} == {replay.replay_session_id}
+    assert replay.replay_session_id != SESSION_ID
+    assert [message.message_type for message in messages] == [
+        MessageType.SESSION_STARTED,
+        *[MessageType.S2] * 4,
+        MessageType.SESSION_ENDED,
+    ]
+    assert [message.origin for message in messages[1:-1]] == RECORDED
+    assert [message.msg["number"] for message in messages[1:-1]] == [0, 1, 2, 3]
+
+
+async def test_only_the_requested_origins_are_replayed(engine):
+    router = _router()
+
+    replay = await _replay(engine, router, target=ReplayTarget.LIVE, origins=[RM])
+
+    assert (replay.replayed, replay.skipped) == (2, 3)
+    assert router.injected == [("rm", "cem", 1), ("rm", "cem", 2)]
+
+
+async def test_live_replay_counts_the_messages_which_could_not_be_injected(engine):
+    replay = await _replay(
+        engine, _router(connected=False), target=ReplayTarget.LIVE, cem_id="other"
+    )
+
+    assert replay.state == ReplayState.FINISHED
+    assert (replay.replayed, replay.failed) == (0, 4)
+
+
+async def test_timed_replay_keeps_the_recorded_time_divided_by_the_speed(
+    engine, monkeypatch
+):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(session_replay.asyncio, "sleep", sleep)
+    await _replay(engine, _router(), pacing=ReplayPacing.TIMED, speed=4)
+
+    # Measured from the start of the replay, which only takes the time of reading the history as nothing sleeps.
+    assert delays == pytest.approx([0.25, 0.5, 0.75], abs=0.05)
+
+
+async def test_message_is_injected_into_the_destination_when_its_origin_is_not_connected():
+    handler = _Handler()
+    router = MessageRouter(handler)
+    session_id = uuid.uuid4()
+    received = []
+
+    async def receive_envelope(envelope):
+        received.append(envelope)
+
+    cem = SimpleNamespace(
+        origin_id="cem",
+        dest_id="rm",
+        cem_id="cem",
+        rm_id="rm",
+        s2_origin_type=CEM,
+        receive_envelope=receive_envelope,
+    )
+    router.connections.add(cem, session_id)
+    msg = {"message_type": "PowerMeasurement", "message_id": str(uuid.uuid4())}
+
+    # On behalf of the RM, which is not connected.
+    await router.inject_message("rm", "cem", msg)
+
+    assert [
+        (envelope.origin, envelope.dest, envelope.msg) for envelope in received
+    ] == [(None, cem, msg)]
+    assert [
+        (message.session_id, message.origin, message.message_type, message.msg)
+        for message in handler.messages
+    ] == [
+        (session_id, RM, MessageType.MSG_INJECTED, None),
+        (session_id, RM, MessageType.S2, msg),
+    ]
+    with pytest.raises(ValueError):
+        await router.inject_message("rm", "other-cem", msg)
@@ -0,0 +1,84 @@
+import asyncio
+import random
+import uuid
+
+import pytest
+
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+from s2_analyzer_backend.message_processor.message import Message
+from s2_analyzer_backend.message_processor.session_statistics import (
+    QuantileSketch,
+    SessionStatisticsProcessor,
+)
+
+
+def _message(session_id: uuid.UUID, size: "int | None") -> Message:
+    return Message(
+        session_id=session_id,
+        cem_id="cem",
+        rm_id="rm",
+        origin=S2OriginType.CEM,
+        msg={"message_type": "FRBC.StorageStatus", "present_fill_level": 0.5},
+        s2_msg_type="FRBC.StorageStatus",
+        size=size,
+    )
+
+
+async def test_bytes_are_the_sizes_of_the_received_frames():
+    statistics = SessionStatisticsProcessor()
+    session_id = uuid.uuid4()
+    loop = asyncio.get_running_loop()
+
+    await statistics.process_message(_message(session_id, 120), loop)
+    await statistics.process_message(_message(session_id, 80), loop)
+    # Injected, not received in a frame.
+    await statistics.process_message(_message(session_id, None), loop)
+
+    session = statistics.get_session(session_id)
+    assert session.directions[S2OriginType.CEM].messages == 3
+    assert session.directions[S2OriginType.CEM].bytes == 200
+    assert statistics.get_device(S2OriginType.CEM, "cem").bytes_sent == 200
+
+
+def _exact_quantile(values: list[float], q: float) -> float:
+    return sorted(values)[int(q * (len(values) - 1))]
+
+
+def test_quantiles_are_within_the_relative_accuracy():
+    generator = random.Random(1)
+    # Spans fewer buckets than the maximum.
+    values = [generator.lognormvariate(0, 1) for _ in range(10000)]
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    for q in (0.0, 0.01, 0.5, 0.9, 0.99, 1.0):
+        assert sketch.quantile(q) == pytest.approx(_exact_quantile(values, q), rel=0.01)
+    assert sketch.as_dict()["count"] == 10000
+    assert sketch.as_dict()["max"] == max(values)
+
+
+def test_zero_values_are_counted_apart():
+    sketch = QuantileSketch()
+    for value in [0.0] * 3 + [2.0]:
+        sketch.add(value)
+
+    assert sketch.quantile(0.5) == 0.0
+    assert sketch.quantile(1.0) == pytest.approx(2.0, rel=0.01)
+    assert QuantileSketch().quantile(0.5) is None
+
+
+def test_collapsing_only_loses_the_accuracy_of_the_lowest_values():
+    # Every value in its own bucket.
+    values = [1.1**exponent for exponent in range(100)]
+    sketch = QuantileSketch(relative_accuracy=0.01, max_buckets=20)
+    for value in values:
+        sketch.add(value)
+
+    assert len(sketch.buckets) <= 20
+    assert sum(sketch.buckets.values()) == 100
+    for q in (0.9, 0.99, 1.0):
+        assert sketch.quantile(q) == pytest.approx(_exact_quantile(values, q), rel=0.01)
+    # The lowest values are merged into a higher bucket.
+    assert sketch.quantile(0.0) > 1.0
+    assert sketch.quantile(0.0) <= sketch.quantile(0.9)
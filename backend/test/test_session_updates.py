@@ -0,0 +1,146 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+import uuid
+
+from s2_analyzer_backend.config import SlowConsumerConfig
+from s2_analyzer_backend.device_connection.connection import (
+    SessionUpdatesWebsocketConnection,
+)
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+from s2_analyzer_backend.message_processor.message import Message
+from s2_analyzer_backend.message_processor.message_processor import (
+    SessionUpdateMessageProcessor,
+)
+from s2_analyzer_backend.message_processor.message_type import MessageType
+
+
+class _DeltaConnection:
+    delta = True
+    _running = True
+
+    def __init__(self):
+        self.frames = []
+
+    async def enqueue_message(self, frame):
+        self.frames.append(frame)
+
+
+async def _process(
+    processor: SessionUpdateMessageProcessor,
+    session_id: uuid.UUID,
+    message_type: MessageType,
+) -> None:
+    """Processes the message and sends the frame of the delta protocol right away."""
+    await processor.process_message(
+        Message(
+            session_id=session_id,
+            cem_id="cem",
+            rm_id="rm",
+            origin=S2OriginType.CEM,
+            message_type=message_type,
+            timestamp=datetime.now(),
+        ),
+        asyncio.get_running_loop(),
+    )
+    if processor._flush_task is not None:
+        await processor._flush_task
+
+
+def _session_states(frame) -> dict:
+    return {session.session_id: session.state for session in frame.sessions}
+
+
+async def test_lagging_delta_connection_is_disconnected_once():
+    connection = SessionUpdatesWebsocketConnection(
+        SimpleNamespace(client="frontend"),
+        slow_consumer_config=SlowConsumerConfig(max_queue_depth=1),
+        delta=True,
+    )
+    connection._loop = asyncio.get_running_loop()
+    stops = []
+    connection.stop = lambda: stops.append(True)
+
+    for frame in range(5):
+        await connection.enqueue_message(frame)
+    await asyncio.sleep(0)
+
+    # The frames are never skipped, the queue holds all frames up to the disconnect.
+    assert connection._queue.qsize() == 2
+    assert stops == [True]
+
+
+async def test_delta_connection_is_not_disconnected_when_lagging_is_ignored():
+    connection = SessionUpdatesWebsocketConnection(
+        SimpleNamespace(client="frontend"),
+        slow_consumer_config=SlowConsumerConfig(
+            max_queue_depth=1, frontend_action="ignore"
+        ),
+        delta=True,
+    )
+
+    for frame in range(5):
+        await connection.enqueue_message(frame)
+
+    assert connection._queue.qsize() == 5
+
+
+async def test_delta_sequence_only_advances_on_session_changes():
+    processor = SessionUpdateMessageProcessor(coalesce_interval=0)
+    connection = _DeltaConnection()
+    await processor.add_connection(connection)
+    session_id = uuid.uuid4()
+
+    await _process(processor, session_id, MessageType.SESSION_STARTED)
+    await _process(processor, session_id, MessageType.S2)
+    await _process(processor, session_id, MessageType.SESSION_ENDED)
+
+    assert [frame.seq for frame in connection.frames] == [0, 1, 1, 2]
+    assert connection.frames[0].snapshot
+    assert _session_states(connection.frames[1]) == {session_id: "open"}
+    assert connection.frames[2].sessions == []
+    assert _session_states(connection.frames[3]) == {session_id: "closed"}
+
+
+async def test_delta_connection_resumes_with_the_changes_it_missed():
+    processor = SessionUpdateMessageProcessor(coalesce_interval=0)
+    closed, opened = uuid.uuid4(), uuid.uuid4()
+    await _process(processor, closed, MessageType.SESSION_STARTED)
+    await _process(processor, opened, MessageType.SESSION_STARTED)
+    await _process(processor, closed, MessageType.SESSION_ENDED)
+
+    missed = processor._resume_frame(processor.epoch, 1)
+    current = processor._resume_frame(processor.epoch, 3)
+
+    assert not missed.snapshot
+    assert missed.seq == 3
+    assert _session_states(missed) == {opened: "open", closed: "closed"}
+    assert not current.snapshot
+    assert current.sessions == []
+
+
+async def test_delta_connection_receives_a_snapshot_when_it_cannot_resume():
+    processor = SessionUpdateMessageProcessor(coalesce_interval=0, journal_size=2)
+    closed, opened = uuid.uuid4(), uuid.uuid4()
+    await _process(processor, closed, MessageType.SESSION_STARTED)
+    await _process(processor, opened, MessageType.SESSION_STARTED)
+    await _process(processor, closed, MessageType.SESSION_ENDED)
+
+    resumable = processor._resume_frame(processor.epoch, 1)
+    for epoch, since in [
+        # The analyzer restarted.
+        (uuid.uuid4().hex, 1),
+        # First connection.
+        (None, None),
+        (processor.epoch, None),
+        # No longer in the journal.
+        (processor.epoch, 0),
+        # Not sent yet.
+        (processor.epoch, 4),
+    ]:
+        frame = processor._resume_frame(epoch, since)
+        assert frame.snapshot
+        assert frame.epoch == processor.epoch
+        assert frame.seq == 3
+        assert _session_states(frame) == {opened: "open"}
+    assert not resumable.snapshot
@@ -0,0 +1,195 @@
+import asyncio
+from datetime import datetime, timedelta
+import uuid
+
+import pytest
+from s2python.frbc import FRBCStorageStatus
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, create_engine, select
+
+from s2_analyzer_backend.device_connection.origin_type import S2OriginType
+from s2_analyzer_backend.message_processor.database import (
+    TimeSeriesPoint,
+    create_db_and_tables,
+)
+from s2_analyzer_backend.message_processor.message import Message
+from s2_analyzer_backend.message_processor.message_type import MessageType
+from s2_analyzer_backend.message_processor.time_series import (
+    RAW,
+    TimeSeriesProcessor,
+)
+
+SESSION_ID = uuid.uuid4()
+SERIES = "frbc.fill_level"
+START = datetime(2024, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    create_db_and_tables(engine)
+    yield engine
+    engine.dispose()
+
+
+async def _process(
+    processor: TimeSeriesProcessor, seconds: float, fill_level: float
+) -> None:
+    await processor.process_message(
+        Message(
+            session_id=SESSION_ID,
+            cem_id="cem",
+            rm_id="rm",
+            origin=S2OriginType.RM,
+            message_type=MessageType.S2,
+            s2_msg=FRBCStorageStatus(
+                message_id=uuid.uuid4(), present_fill_level=fill_level
+            ),
+            timestamp=START + timedelta(seconds=seconds),
+        ),
+        asyncio.get_running_loop(),
+    )
+
+
+def _points(processor: TimeSeriesProcessor, max_points: int, seconds: int = 120):
+    return processor.get_points(
+        SESSION_ID, SERIES, START, START + timedelta(seconds=seconds), max_points
+    )
+
+
+def _stored_rows(engine) -> int:
+    with Session(engine) as session:
+        return len(session.exec(select(TimeSeriesPoint)).all())
+
+
+async def _process_values(processor: TimeSeriesProcessor) -> None:
+    for seconds, fill_level in ((0.1, 0.2), (0.5, 0.6), (1.2, 0.4), (90, 0.8)):
+        await _process(processor, seconds, fill_level)
+
+
+async def test_values_are_rolled_up_into_the_buckets_of_each_resolution(engine):
+    processor = TimeSeriesProcessor(engine, flush_interval=3600)
+    await _process_values(processor)
+
+    for stored in (False, True):
+        if stored:
+            await processor.flush()
+            assert _stored_rows(engine) > 0
+        raw = _points(processor, max_points=4)
+        assert raw["resolution"] == RAW
+        assert [point["max"] for point in raw["points"]] == [0.2, 0.6, 0.4, 0.8]
+
+        seconds = _points(processor, max_points=2, seconds=2)
+        assert seconds["resolution"] == 1
+        assert [
+            (point["timestamp"], point["count"]) for point in seconds["points"]
+        ] == [(START, 2), (START + timedelta(seconds=1), 1)]
+
+        minutes = _points(processor, max_points=2)
+        assert minutes["resolution"] == 60
+        first, second = minutes["points"]
+        assert (first["timestamp"], first["count"]) == (START, 3)
+        assert (first["min"], first["max"]) == (0.2, 0.6)
+        assert first["avg"] == pytest.approx(0.4)
+        assert (second["timestamp"], second["count"]) == (
+            START + timedelta(minutes=1),
+            1,
+        )
+
+        # The coarsest rollup is used when even that has more buckets than asked for.
+        assert _points(processor, max_points=1, seconds=3600)["resolution"] == 900
+
+
+async def test_late_value_is_merged_into_its_bucket(engine):
+    processor = TimeSeriesProcessor(engine, flush_interval=3600)
+    await _process_values(processor)
+    # Arrives after a value of the next minute opened a later bucket.
+    await _process(processor, 30, 1.0)
+
+    for stored in (False, True):
+        if stored:
+            await processor.flush()
+        first, _ = _points(processor, max_points=2)["points"]
+        assert (first["timestamp"], first["count"]) == (START, 4)
+        assert (first["min"], first["max"]) == (0.2, 1.0)
+        assert processor.get_series(SESSION_ID) == [
+            {
+                "series": SERIES,
+                "count": 5,
+                "first": START + timedelta(seconds=0.1),
+                "last": START + timedelta(seconds=90),
+            }
+        ]
+
+
+async def test_points_older_than_the_raw_max_age_come_from_the_retained_rollups(
+    engine,
+):
+    processor = TimeSeriesProcessor(
+        engine, flush_interval=3600, raw_max_age=timedelta(days=1)
+    )
+    await _process_values(processor)
+    await processor.flush()
+
+    points = _points(processor, max_points=1000)
+    assert points["resolution"] == 60
+    assert [point["count"] for point in points["points"]] == [3, 1]
+
+
+async def test_rows_which_could_not_be_written_are_written_with_the_next_batch(
+    engine,
+):
+    processor = TimeSeriesProcessor(engine, flush_size=1, flush_interval=0)
+    write = processor._write
+    failures = []
+
+    def write_after_a_failure(buckets):
+        if not failures:
+            failures.append(len(buckets))
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        write(buckets)
+
+    processor._write = write_after_a_failure
+    await _process(processor, 0.1, 0.2)
+    await _process(processor, 0.5, 0.6)
+    assert failures == [1]
+
+    await processor.flush()
+    assert _stored_rows(engine) == 2 + 3
+    assert [point["max"] for point in _points(processor, 4)["points"]] == [0.2, 0.6]
+
+
+async def test_rows_are_dropped_after_the_last_attempt(engine, monkeypatch):
+    monkeypatch.setattr(
+        "s2_analyzer_backend.message_processor.message_processor."
+        "MessageStorageProcessor.RETRY_PAUSE",
+        0,
+    )
+    processor = TimeSeriesProcessor(engine, flush_interval=3600)
+
+    def locked(buckets):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    processor._write = locked
+    await _process_values(processor)
+    await processor.flush()
+
+    assert processor._pending == []
+    assert _points(processor, 4)["points"] == []
+
+
+async def test_committed_rows_are_not_counted_twice(engine):
+    processor = TimeSeriesProcessor(engine, flush_interval=3600)
+    await _process_values(processor)
+    processor._writing, processor._pending = processor._pending, []
+
+    # Queried after the commit in the executor, before the write returns on the loop.
+    processor._write(processor._writing)
+
+    assert processor._writing == []
+    assert [point["count"] for point in _points(processor, 4)["points"]] == [
+        1,
+        1,
+        1,
+        1,
+    ]